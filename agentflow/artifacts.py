@@ -0,0 +1,130 @@
+"""
+This module provides a store for function results that are passed by reference. Instead of sending a large result to the LLM, and having the LLM type it out again as an argument to the next function, the result is kept in the store and the LLM sees a short handle, such as @result:get_url:1. Handles in a function call's arguments are replaced with their results before the function is executed.
+"""
+
+import re
+import threading
+from typing import Any, Dict, Optional
+
+HANDLE = re.compile(r"@result:(\w+):(\d+)")
+REFERENCE = re.compile(
+    r"The result \(\d+ characters\) is stored as (@result:\w+:\d+)\. "
+)
+PREVIEW_LENGTH = 200
+
+
+class ArtifactStore:
+    """
+    This class is responsible for keeping the function results of a flow run and resolving their handles.
+
+    :param results: Results from an earlier run to start with, by handle.
+    :type results: Dict[str, str], optional
+    """
+
+    def __init__(self, results: Optional[Dict[str, str]] = None):
+        self._results: Dict[str, str] = dict(results or {})
+        self._counts: Dict[str, int] = {}
+        for handle in self._results:
+            name, number = HANDLE.fullmatch(handle).groups()
+            self._counts[name] = max(self._counts.get(name, 0), int(number))
+        self._lock = threading.Lock()
+
+    def put(self, name: str, content: str) -> str:
+        """
+        Stores a function's result.
+
+        :param name: The name of the function.
+        :type name: str
+        :param content: The result.
+        :type content: str
+        :return: The handle of the result, such as @result:get_url:1.
+        :rtype: str
+        """
+        with self._lock:
+            number = self._counts.get(name, 0) + 1
+            self._counts[name] = number
+            handle = f"@result:{name}:{number}"
+            self._results[handle] = content
+        return handle
+
+    def get(self, handle: str) -> Optional[str]:
+        """
+        Returns the result of a handle.
+
+        :param handle: The handle.
+        :type handle: str
+        :return: The result, or None if there is no such handle.
+        :rtype: Optional[str]
+        """
+        with self._lock:
+            return self._results.get(handle)
+
+    def reference(self, name: str, content: str) -> str:
+        """
+        Stores a function's result and returns the message the LLM sees instead of it: the handle, the result's length and its beginning.
+
+        :param name: The name of the function.
+        :type name: str
+        :param content: The result.
+        :type content: str
+        :return: The message.
+        :rtype: str
+        """
+        handle = self.put(name, content)
+        preview = content[:PREVIEW_LENGTH]
+        if len(content) > PREVIEW_LENGTH:
+            preview += "..."
+        return (
+            f"The result ({len(content)} characters) is stored as {handle}. "
+            f"To pass it to a function, use {handle} as the argument instead of "
+            f"repeating it. It starts: {preview}"
+        )
+
+    def dereference(self, content: str) -> str:
+        """
+        Returns the result that a message made by reference stands for.
+
+        :param content: The content of a function message.
+        :type content: str
+        :return: The result, or the content itself if it is not a reference or its handle is unknown.
+        :rtype: str
+        """
+        match = REFERENCE.match(content)
+        result = self.get(match.group(1)) if match else None
+        return content if result is None else result
+
+    def resolve(self, value: Any) -> Any:
+        """
+        Replaces the handles in a value with their results. Strings, and the strings in lists and dicts, are resolved. Unknown handles are left as they are.
+
+        :param value: The value, such as a function call's arguments.
+        :type value: Any
+        :return: The resolved value.
+        :rtype: Any
+        """
+        if isinstance(value, str):
+            if "@result:" not in value:
+                return value
+            return HANDLE.sub(self._replace, value)
+        if isinstance(value, dict):
+            return {key: self.resolve(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(item) for item in value]
+        return value
+
+    def _replace(self, match: "re.Match[str]") -> str:
+        result = self.get(match.group())
+        return match.group() if result is None else result
+
+    def to_dict(self) -> Dict[str, str]:
+        """
+        Returns the stored results by handle.
+
+        :return: The results.
+        :rtype: Dict[str, str]
+        """
+        with self._lock:
+            return dict(self._results)
+
+    def __len__(self) -> int:
+        return len(self._results)
@@ -0,0 +1,257 @@
+"""
+This module provides budgets for the tokens and cost of LLM requests. Budgets can be set per task, per flow and per batch of flows. The budgets in effect are checked before each request is sent: when a request would exceed one, it either fails fast or is sent to a cheaper model instead.
+"""
+
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from agentflow.tokens import CHARS_PER_TOKEN, estimate_cost
+
+ON_EXCEED = ("fail", "downgrade")
+
+_active_budgets: ContextVar[Tuple["Budget", ...]] = ContextVar(
+    "agentflow_budgets", default=()
+)
+
+
+class BudgetExceeded(RuntimeError):
+    """
+    Raised when a request would exceed a budget that fails fast.
+    """
+
+
+class Budget:
+    """
+    This class is responsible for tracking the usage of a task, flow or batch against optional token and cost limits. While a budget is in effect, so is its parent, if any, so a flow's budget can count towards its batch's.
+
+    :param max_tokens: The maximum number of prompt and completion tokens.
+    :type max_tokens: int, optional
+    :param max_cost: The maximum cost in USD.
+    :type max_cost: float, optional
+    :param on_exceed: What to do with a request that would exceed the budget: "fail" to raise BudgetExceeded, or "downgrade" to send it to the downgrade model.
+    :type on_exceed: str, optional
+    :param downgrade_model: The model to downgrade to.
+    :type downgrade_model: str, optional
+    :param parent: The budget that is also in effect while this one is.
+    :type parent: Budget, optional
+    :param name: The name of the budget, used in errors.
+    :type name: str, optional
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        max_cost: Optional[float] = None,
+        on_exceed: str = "fail",
+        downgrade_model: str = "gpt-3.5-turbo",
+        parent: Optional["Budget"] = None,
+        name: str = "budget",
+    ):
+        if on_exceed not in ON_EXCEED:
+            raise ValueError(f"on_exceed must be one of {ON_EXCEED}, not {on_exceed}.")
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.on_exceed = on_exceed
+        self.downgrade_model = downgrade_model
+        self.parent = parent
+        self.name = name
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.by_model: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], **kwargs: Any) -> "Budget":
+        """
+        Creates a budget from its definition in a flow, such as {"max_cost": 1.0, "on_exceed": "downgrade"}.
+
+        :param data: The definition.
+        :type data: Dict[str, Any]
+        :param kwargs: Other arguments for the budget, such as its parent.
+        :type kwargs: Any
+        :return: The budget.
+        :rtype: Budget
+        """
+        return cls(**data, **kwargs)
+
+    @property
+    def total_tokens(self) -> int:
+        """
+        Returns the number of prompt and completion tokens used.
+        """
+        return self.prompt_tokens + self.completion_tokens
+
+    def exceeded_by(self, tokens: int, cost: float) -> Optional[str]:
+        """
+        Checks whether more usage would exceed the budget.
+
+        :param tokens: The additional tokens.
+        :type tokens: int
+        :param cost: The additional cost in USD.
+        :type cost: float
+        :return: A description of the exceeded limit, or None if the usage fits.
+        :rtype: Optional[str]
+        """
+        with self._lock:
+            if (
+                self.max_tokens is not None
+                and self.total_tokens + tokens > self.max_tokens
+            ):
+                used = self.total_tokens
+                return f"{self.name} of {self.max_tokens} tokens ({used} used)"
+            if self.max_cost is not None and self.cost + cost > self.max_cost:
+                return f"{self.name} of ${self.max_cost} (${self.cost:.4f} used)"
+        return None
+
+    def record(
+        self, model: str, prompt_tokens: int, completion_tokens: int, cost: float
+    ) -> None:
+        """
+        Records the usage of a request.
+
+        :param model: The model that served the request.
+        :type model: str
+        :param prompt_tokens: The number of prompt tokens.
+        :type prompt_tokens: int
+        :param completion_tokens: The number of completion tokens.
+        :type completion_tokens: int
+        :param cost: The cost in USD.
+        :type cost: float
+        """
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += cost
+            model_usage = self.by_model.setdefault(
+                model,
+                {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0},
+            )
+            model_usage["calls"] += 1
+            model_usage["prompt_tokens"] += prompt_tokens
+            model_usage["completion_tokens"] += completion_tokens
+            model_usage["cost"] += cost
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the usage and limits of the budget.
+
+        :return: The usage in total and by model, with the limits.
+        :rtype: Dict[str, Any]
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.total_tokens,
+                "cost": self.cost,
+                "max_tokens": self.max_tokens,
+                "max_cost": self.max_cost,
+                "by_model": {
+                    model: dict(usage) for model, usage in self.by_model.items()
+                },
+            }
+
+
+@contextmanager
+def use_budgets(*budgets: Optional[Budget]) -> Iterator[None]:
+    """
+    Puts budgets in effect for the requests made in the block, in addition to the budgets already in effect.
+
+    :param budgets: The budgets. None values are ignored.
+    :type budgets: Optional[Budget]
+    """
+    token = _active_budgets.set(
+        _active_budgets.get() + tuple(budget for budget in budgets if budget)
+    )
+    try:
+        yield
+    finally:
+        _active_budgets.reset(token)
+
+
+def active_budgets() -> List[Budget]:
+    """
+    Returns the budgets in effect with their parents, without duplicates.
+
+    :return: The budgets.
+    :rtype: List[Budget]
+    """
+    budgets: List[Budget] = []
+    for budget in _active_budgets.get():
+        while budget is not None:
+            if not any(budget is seen for seen in budgets):
+                budgets.append(budget)
+            budget = budget.parent
+    return budgets
+
+
+def enforce(model: str, prompt_tokens: int, completion_tokens: int) -> str:
+    """
+    Checks a request against the budgets in effect, downgrading its model if a budget allows it.
+
+    :param model: The model the request is for.
+    :type model: str
+    :param prompt_tokens: The estimated prompt tokens of the request.
+    :type prompt_tokens: int
+    :param completion_tokens: The most completion tokens the request can use.
+    :type completion_tokens: int
+    :raises BudgetExceeded: If the request would exceed a budget, even after downgrading.
+    :return: The model to send the request to.
+    :rtype: str
+    """
+    tokens = prompt_tokens + completion_tokens
+    for budget in active_budgets():
+        exceeded = budget.exceeded_by(
+            tokens, estimate_cost(model, prompt_tokens, completion_tokens)
+        )
+        if (
+            exceeded
+            and budget.on_exceed == "downgrade"
+            and model != budget.downgrade_model
+        ):
+            model = budget.downgrade_model
+            exceeded = budget.exceeded_by(
+                tokens, estimate_cost(model, prompt_tokens, completion_tokens)
+            )
+        if exceeded:
+            raise BudgetExceeded(f"Request to {model} would exceed the {exceeded}.")
+    return model
+
+
+def record_usage(
+    model: str, usage: Any, prompt_tokens: int, content: Union[str, int]
+) -> Dict[str, Any]:
+    """
+    Records the usage of a request in the budgets in effect. The usage reported by the API is used when there is one, and estimates otherwise.
+
+    :param model: The model that served the request.
+    :type model: str
+    :param usage: The usage from the response, if any.
+    :type usage: Any
+    :param prompt_tokens: The estimated prompt tokens, used if there is no usage.
+    :type prompt_tokens: int
+    :param content: The text of the response, or its number of characters, used to estimate completion tokens if there is no usage.
+    :type content: Union[str, int]
+    :return: The prompt tokens, completion tokens and cost of the request.
+    :rtype: Dict[str, Any]
+    """
+    if usage is not None:
+        prompt_tokens = usage["prompt_tokens"]
+        completion_tokens = usage["completion_tokens"]
+    else:
+        length = content if isinstance(content, int) else len(content)
+        completion_tokens = length // CHARS_PER_TOKEN
+    cost = estimate_cost(model, prompt_tokens, completion_tokens)
+    for budget in active_budgets():
+        budget.record(model, prompt_tokens, completion_tokens, cost)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost": cost,
+    }
@@ -0,0 +1,513 @@
+"""
+This module provides a bulk mode for running many flows through a batch endpoint, such as OpenAI's Batch API, which is cheaper and has separate rate limits but answers in minutes or hours rather than seconds.
+
+Each flow runs as usual, but its LLM requests are queued instead of sent. Once every running flow is waiting for a response, the queued requests are written to a single JSON Lines file and submitted as one batch. When the batch is done, each response goes back to its flow, which processes it and moves on to its next task. So each step of all the flows costs one batch.
+
+Backends are pluggable. OpenAIBatchBackend submits to OpenAI, and FileBatchBackend is a stand-in that keeps batches in a local directory, for tests and for running batches with other tools.
+"""
+
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import openai
+from openai.api_requestor import APIRequestor
+from openai.util import convert_to_openai_object
+from tenacity import wait_none
+
+from agentflow.endpoints import Endpoint, EndpointPool
+from agentflow.flow import Flow
+from agentflow.llm import LLM, api_error
+from agentflow.serialization import dumps, encode_request
+
+CHAT_COMPLETIONS = "/v1/chat/completions"
+
+
+class BatchFailed(RuntimeError):
+    """
+    Raised when a whole batch fails, expires or is cancelled.
+    """
+
+
+class BaseBatchBackend(ABC):
+    """
+    This abstract base class defines the interface for batch backends. Input and output files use the JSON Lines format of OpenAI's Batch API: each input line has a custom_id, a method, a url and a body, and each output line has the custom_id with a response, holding a status_code and a body, or an error.
+    """
+
+    @abstractmethod
+    def submit(self, input_path: str) -> str:
+        """
+        Submits a batch.
+
+        :param input_path: The path to the batch's input file. It may be deleted once this returns.
+        :type input_path: str
+        :return: The ID of the batch.
+        :rtype: str
+        """
+
+    @abstractmethod
+    def is_done(self, batch_id: str) -> bool:
+        """
+        Checks whether a batch is done.
+
+        :param batch_id: The ID of the batch.
+        :type batch_id: str
+        :raises BatchFailed: If the batch failed, expired or was cancelled.
+        :return: Whether the batch's results are ready.
+        :rtype: bool
+        """
+
+    @abstractmethod
+    def results(self, batch_id: str) -> Iterator[dict]:
+        """
+        Reads the output lines of a batch that is done.
+
+        :param batch_id: The ID of the batch.
+        :type batch_id: str
+        :return: The output lines.
+        :rtype: Iterator[dict]
+        """
+
+
+class FileBatchBackend(BaseBatchBackend):
+    """
+    This class is responsible for keeping batches in a local directory. Each batch gets a subdirectory with its input.jsonl, and is done once output.jsonl appears next to it, or failed if error.txt does.
+
+    With a responder, the backend answers its own batches: each request body is passed to the responder, which returns the response body or raises an error. Without one, another process is expected to write the output files.
+
+    :param directory: The directory to keep batches in.
+    :type directory: str
+    :param responder: A function that answers a request body with a response body.
+    :type responder: Callable[[dict], dict], optional
+    :param delay: The number of seconds before a batch is answered by the responder.
+    :type delay: float
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        responder: Optional[Callable[[dict], dict]] = None,
+        delay: float = 0.0,
+    ):
+        self.directory = directory
+        self.responder = responder
+        self.delay = delay
+        self._submitted: Dict[str, float] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def submit(self, input_path: str) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex[:16]}"
+        os.makedirs(os.path.join(self.directory, batch_id))
+        shutil.copyfile(
+            input_path, os.path.join(self.directory, batch_id, "input.jsonl")
+        )
+        self._submitted[batch_id] = time.monotonic()
+        return batch_id
+
+    def is_done(self, batch_id: str) -> bool:
+        batch_path = os.path.join(self.directory, batch_id)
+        error_path = os.path.join(batch_path, "error.txt")
+        if os.path.exists(error_path):
+            with open(error_path, "r") as file:
+                raise BatchFailed(f"Batch {batch_id} failed: {file.read().strip()}")
+        output_path = os.path.join(batch_path, "output.jsonl")
+        if os.path.exists(output_path):
+            return True
+        submitted = self._submitted.get(batch_id)
+        if self.responder is None or submitted is None:
+            return False
+        if time.monotonic() - submitted < self.delay:
+            return False
+        self._answer(batch_path)
+        return True
+
+    def results(self, batch_id: str) -> Iterator[dict]:
+        with open(os.path.join(self.directory, batch_id, "output.jsonl"), "r") as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _answer(self, batch_path: str) -> None:
+        """
+        Answers a batch with the responder and writes its output file.
+
+        :param batch_path: The directory of the batch.
+        :type batch_path: str
+        """
+        temporary_path = os.path.join(batch_path, "output.jsonl.tmp")
+        with open(os.path.join(batch_path, "input.jsonl"), "r") as input_file, open(
+            temporary_path, "w"
+        ) as output_file:
+            for line in filter(str.strip, input_file):
+                request = json.loads(line)
+                try:
+                    response = {
+                        "status_code": 200,
+                        "body": self.responder(request["body"]),
+                    }
+                except Exception as e:
+                    status = getattr(e, "http_status", None) or 500
+                    response = {
+                        "status_code": status,
+                        "body": {
+                            "error": {"message": str(e), "type": type(e).__name__}
+                        },
+                    }
+                output = {
+                    "id": f"response_{uuid.uuid4().hex[:16]}",
+                    "custom_id": request["custom_id"],
+                    "response": response,
+                    "error": None,
+                }
+                output_file.write(json.dumps(output) + "\n")
+        os.replace(temporary_path, os.path.join(batch_path, "output.jsonl"))
+
+
+class OpenAIBatchBackend(BaseBatchBackend):
+    """
+    This class is responsible for running batches through OpenAI's Batch API. Input files are uploaded, and the output and error files are downloaded once the batch completes.
+
+    :param endpoint: The endpoint whose key and base URL to use. Defaults to the first endpoint configured in the environment.
+    :type endpoint: Endpoint, optional
+    :param completion_window: The time frame within which the batch should be processed.
+    :type completion_window: str
+    """
+
+    def __init__(
+        self, endpoint: Optional[Endpoint] = None, completion_window: str = "24h"
+    ):
+        self.endpoint = endpoint or LLM.get_default_endpoints().endpoints[0]
+        self.completion_window = completion_window
+        self._batches: Dict[str, dict] = {}
+
+    def _request(self, method: str, url: str, params: Optional[dict] = None) -> Any:
+        """
+        Sends a request to the API.
+
+        :param method: The HTTP method.
+        :type method: str
+        :param url: The URL, relative to the base URL.
+        :type url: str
+        :param params: The request's parameters.
+        :type params: dict, optional
+        :return: The response.
+        :rtype: Any
+        """
+        requestor = APIRequestor(
+            key=self.endpoint.get_api_key(), api_base=self.endpoint.get_api_base()
+        )
+        response, _, _ = requestor.request(method, url, params)
+        return response.data
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as file:
+            uploaded = openai.File.create(
+                file=file,
+                purpose="batch",
+                api_key=self.endpoint.get_api_key(),
+                api_base=self.endpoint.get_api_base(),
+            )
+        batch = self._request(
+            "post",
+            "/batches",
+            {
+                "input_file_id": uploaded["id"],
+                "endpoint": CHAT_COMPLETIONS,
+                "completion_window": self.completion_window,
+            },
+        )
+        self._batches[batch["id"]] = batch
+        return batch["id"]
+
+    def is_done(self, batch_id: str) -> bool:
+        batch = self._request("get", f"/batches/{batch_id}")
+        self._batches[batch_id] = batch
+        if batch["status"] in ("failed", "expired", "cancelled"):
+            raise BatchFailed(
+                f"Batch {batch_id} {batch['status']}: {batch.get('errors')}"
+            )
+        return batch["status"] == "completed"
+
+    def results(self, batch_id: str) -> Iterator[dict]:
+        batch = self._batches[batch_id]
+        for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+            if not file_id:
+                continue
+            content = openai.File.download(
+                file_id,
+                api_key=self.endpoint.get_api_key(),
+                api_base=self.endpoint.get_api_base(),
+            )
+            for line in content.decode().splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+
+class BulkLLM(LLM):
+    """
+    This class inherits from the LLM class. Instead of sending requests, it queues them with a bulk runner and waits for their batch.
+
+    Budgets, the semantic cache and retries work as for the LLM class, but retries don't wait, as each one waits for a batch anyway. Deadlines and hedging don't apply. Streamed requests get their whole response in one chunk.
+
+    :param runner: The bulk runner that batches the requests.
+    :type runner: BulkRunner
+    :param flow_id: The ID of the flow whose requests these are.
+    :type flow_id: int
+    :param endpoints: The endpoints of the flow's LLM.
+    :type endpoints: EndpointPool, optional
+    """
+
+    retry_wait = wait_none()
+
+    def __init__(
+        self,
+        runner: "BulkRunner",
+        flow_id: int,
+        endpoints: Optional[EndpointPool] = None,
+    ):
+        super().__init__(endpoints)
+        self.runner = runner
+        self.flow_id = flow_id
+
+    def _attempt(
+        self, openai_args: Dict[str, Any], deadline: Optional[float], hedge: bool
+    ) -> Any:
+        return self._create(openai_args)
+
+    def _create(self, openai_args: Dict[str, Any]) -> Any:
+        stream = bool(openai_args.get("stream"))
+        body = {key: value for key, value in openai_args.items() if key != "stream"}
+        response = self.runner.request(self.flow_id, body).result()
+        if not stream:
+            return response
+        delta = response.choices[0].message.to_dict_recursive()
+        return iter(
+            [convert_to_openai_object({"choices": [{"index": 0, "delta": delta}]})]
+        )
+
+
+class BulkRunner:
+    """
+    This class is responsible for running flows in bulk mode: each flow runs in its own thread, and their LLM requests are collected into batches.
+
+    A batch is submitted once every running flow is waiting for a response and no new request has arrived for linger seconds, or once it reaches max_batch_size requests.
+
+    :param backend: The batch backend.
+    :type backend: BaseBatchBackend
+    :param poll_interval: The number of seconds between checks of whether a batch is done.
+    :type poll_interval: float
+    :param linger: The number of seconds to wait for more requests before submitting a batch.
+    :type linger: float
+    :param max_batch_size: The maximum number of requests in a batch.
+    :type max_batch_size: int
+    :param max_flows: The maximum number of flows to run at once. The others start as flows finish.
+    :type max_flows: int
+    """
+
+    def __init__(
+        self,
+        backend: BaseBatchBackend,
+        poll_interval: float = 30.0,
+        linger: float = 0.1,
+        max_batch_size: int = 50000,
+        max_flows: int = 1000,
+    ):
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.linger = linger
+        self.max_batch_size = max_batch_size
+        self.max_flows = max_flows
+        self._condition = threading.Condition()
+        self._pending: Dict[str, tuple] = {}
+        self._waiting: Dict[int, int] = {}
+        self._running = 0
+        self._last_request = 0.0
+        self._ids = itertools.count(1)
+        self._metrics = {"batches": 0, "requests": 0, "largest_batch": 0}
+
+    def run(self, flows: List[Flow]) -> List[Flow]:
+        """
+        Runs flows in bulk mode until all of them have finished. Flows that fail keep their error in their error attribute.
+
+        :param flows: The flows.
+        :type flows: List[Flow]
+        :return: The flows.
+        :rtype: List[Flow]
+        """
+        queue = list(enumerate(flows))
+        queue.reverse()
+        threads = []
+        while True:
+            with self._condition:
+                while queue and self._running < self.max_flows:
+                    flow_id, flow = queue.pop()
+                    flow.llm = BulkLLM(self, flow_id, flow.llm.endpoints)
+                    self._running += 1
+                    thread = threading.Thread(
+                        target=self._run_flow,
+                        args=(flow_id, flow),
+                        name=f"agentflow-bulk-{flow_id}",
+                        daemon=True,
+                    )
+                    thread.start()
+                    threads.append(thread)
+                if not self._running and not queue:
+                    break
+                batch = self._collect()
+            if batch:
+                self._run_batch(batch)
+        for thread in threads:
+            thread.join()
+        return flows
+
+    def request(self, flow_id: int, body: Dict[str, Any]) -> Future:
+        """
+        Queues a request for the next batch.
+
+        :param flow_id: The ID of the flow making the request.
+        :type flow_id: int
+        :param body: The arguments of the request.
+        :type body: Dict[str, Any]
+        :return: A future for the response.
+        :rtype: Future
+        """
+        future = Future()
+        custom_id = f"request-{flow_id}-{next(self._ids)}"
+        line = b"".join(
+            [
+                b'{"custom_id":',
+                dumps(custom_id),
+                b',"method":"POST","url":',
+                dumps(CHAT_COMPLETIONS),
+                b',"body":',
+                encode_request(body),
+                b"}\n",
+            ]
+        )
+        with self._condition:
+            self._pending[custom_id] = (flow_id, line, future)
+            self._waiting[flow_id] = self._waiting.get(flow_id, 0) + 1
+            self._last_request = time.monotonic()
+            self._condition.notify_all()
+        return future
+
+    def get_metrics(self) -> Dict[str, int]:
+        """
+        Returns the number of batches and requests submitted and the size of the largest batch.
+
+        :return: The metrics.
+        :rtype: Dict[str, int]
+        """
+        with self._condition:
+            return dict(self._metrics)
+
+    def _run_flow(self, flow_id: int, flow: Flow) -> None:
+        """
+        Runs a flow and marks it as finished.
+
+        :param flow_id: The ID of the flow.
+        :type flow_id: int
+        :param flow: The flow.
+        :type flow: Flow
+        """
+        try:
+            flow.run()
+        except Exception as e:
+            logging.error(e)
+            flow.error = e
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._condition.notify_all()
+
+    def _collect(self) -> Dict[str, tuple]:
+        """
+        Waits until a batch is ready, or a flow has finished, and takes the batch's requests. Must be called with the condition held.
+
+        :return: The requests of the batch by custom ID, or an empty dict if a flow has finished.
+        :rtype: Dict[str, tuple]
+        """
+        running = self._running
+        while True:
+            if self._running != running:
+                return {}
+            all_waiting = self._pending and len(self._waiting) >= self._running
+            if len(self._pending) >= self.max_batch_size:
+                break
+            if all_waiting:
+                remaining = self._last_request + self.linger - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            else:
+                self._condition.wait()
+        custom_ids = list(self._pending)[: self.max_batch_size]
+        batch = {custom_id: self._pending.pop(custom_id) for custom_id in custom_ids}
+        for flow_id, _, _ in batch.values():
+            self._waiting[flow_id] -= 1
+            if not self._waiting[flow_id]:
+                del self._waiting[flow_id]
+        return batch
+
+    def _run_batch(self, batch: Dict[str, tuple]) -> None:
+        """
+        Submits a batch, waits for it and gives each response to its flow.
+
+        :param batch: The requests of the batch by custom ID.
+        :type batch: Dict[str, tuple]
+        """
+        with self._condition:
+            self._metrics["batches"] += 1
+            self._metrics["requests"] += len(batch)
+            self._metrics["largest_batch"] = max(
+                self._metrics["largest_batch"], len(batch)
+            )
+        try:
+            with tempfile.NamedTemporaryFile(
+                "wb", suffix=".jsonl", delete=False
+            ) as file:
+                for _, line, _ in batch.values():
+                    file.write(line)
+            try:
+                batch_id = self.backend.submit(file.name)
+            finally:
+                os.remove(file.name)
+            logging.info(f"Submitted batch {batch_id} of {len(batch)} requests.")
+            while not self.backend.is_done(batch_id):
+                time.sleep(self.poll_interval)
+            for output in self.backend.results(batch_id):
+                request = batch.pop(output["custom_id"], None)
+                if request is not None:
+                    self._resolve(request[2], output)
+            error = BatchFailed(f"Batch {batch_id} has no result for the request.")
+        except Exception as e:
+            error = e
+        for _, _, future in batch.values():
+            future.set_exception(error)
+
+    @staticmethod
+    def _resolve(future: Future, output: dict) -> None:
+        """
+        Gives a response, or its error, to the flow waiting for it.
+
+        :param future: The future of the request.
+        :type future: Future
+        :param output: The request's output line.
+        :type output: dict
+        """
+        response = output.get("response") or {}
+        status = response.get("status_code")
+        if status == 200:
+            future.set_result(convert_to_openai_object(response["body"]))
+            return
+        body = response.get("body") or {"error": output.get("error") or {}}
+        future.set_exception(api_error(status or 500, json.dumps(body)))
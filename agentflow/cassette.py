@@ -0,0 +1,251 @@
+"""
+This module provides a recorder and a replayer for the HTTP requests made while running flows, such as LLM calls and URL fetches. A recording, or cassette, holds each request's method, URL and body hash with the response and how long it took, so a flow can be rerun offline, instantly or with its original latencies.
+
+Both patch requests.Session.request, which every request made through requests goes through, and turn the HTTP disk cache off, so every fetch is recorded and a replay doesn't depend on what the cache holds. Authentication headers are not part of a request's key and are not saved.
+"""
+
+import base64
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from datetime import timedelta
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from agentflow.function import Function
+
+# Response headers that describe the body as it was sent, not as it is saved.
+TRANSPORT_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+_original_request = requests.Session.request
+_request_signature = inspect.signature(_original_request)
+_active_lock = threading.Lock()
+
+
+class UnrecordedRequest(LookupError):
+    """
+    Raised when a replayed flow makes a request that the cassette doesn't hold.
+    """
+
+
+def request_key(session: requests.Session, *args: Any, **kwargs: Any) -> Tuple:
+    """
+    Returns the key of a request: its method, its URL with query parameters and the hash of its body.
+
+    :param session: The session making the request.
+    :type session: requests.Session
+    :param args: The positional arguments of requests.Session.request.
+    :type args: Any
+    :param kwargs: The keyword arguments of requests.Session.request.
+    :type kwargs: Any
+    :return: The key, and the prepared request.
+    :rtype: Tuple
+    """
+    arguments = _request_signature.bind(session, *args, **kwargs).arguments
+    prepared = requests.Request(
+        method=arguments["method"].upper(),
+        url=arguments["url"],
+        params=arguments.get("params"),
+        data=arguments.get("data") or {},
+        json=arguments.get("json"),
+    ).prepare()
+    body = prepared.body or b""
+    if isinstance(body, str):
+        body = body.encode()
+    key = (prepared.method, prepared.url, hashlib.sha256(body).hexdigest())
+    return key, prepared
+
+
+class _Cassette(ABC):
+    """
+    This abstract base class patches requests while a recording or replay is active. Subclasses define how each request is handled.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._use_process_pool = Function.use_process_pool
+        self._http_cache: Optional[str] = None
+
+    def __enter__(self):
+        if not _active_lock.acquire(blocking=False):
+            raise RuntimeError("Another recording or replay is already active.")
+        # Functions in worker processes wouldn't go through the patch.
+        self._use_process_pool = Function.use_process_pool
+        Function.use_process_pool = False
+        # Responses served from the disk cache wouldn't go through the patch.
+        self._http_cache = os.environ.get("AGENTFLOW_HTTP_CACHE")
+        os.environ["AGENTFLOW_HTTP_CACHE"] = "off"
+        cassette = self
+
+        def request(session, *args, **kwargs):
+            return cassette._request(session, *args, **kwargs)
+
+        requests.Session.request = request
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        requests.Session.request = _original_request
+        Function.use_process_pool = self._use_process_pool
+        if self._http_cache is None:
+            os.environ.pop("AGENTFLOW_HTTP_CACHE", None)
+        else:
+            os.environ["AGENTFLOW_HTTP_CACHE"] = self._http_cache
+        _active_lock.release()
+
+    @abstractmethod
+    def _request(self, session: requests.Session, *args: Any, **kwargs: Any):
+        """
+        Handles a request made while the cassette is active.
+
+        :param session: The session making the request.
+        :type session: requests.Session
+        :param args: The positional arguments of requests.Session.request.
+        :type args: Any
+        :param kwargs: The keyword arguments of requests.Session.request.
+        :type kwargs: Any
+        :return: The response.
+        :rtype: requests.Response
+        """
+        pass
+
+
+class Recorder(_Cassette):
+    """
+    This class is responsible for recording the requests made while it is active, and saving them to a cassette file when it exits.
+
+    .. code-block:: python
+
+        with Recorder("cassette.json"):
+            Flow("summarize_url", {"url": url}).run()
+
+    :param path: The path of the cassette file to write.
+    :type path: str
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.interactions: List[Dict[str, Any]] = []
+        self._start = time.perf_counter()
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return super().__enter__()
+
+    def __exit__(self, *exc_info) -> None:
+        super().__exit__(*exc_info)
+        with open(self.path, "w") as file:
+            json.dump({"version": 1, "interactions": self.interactions}, file, indent=2)
+
+    def _request(self, session: requests.Session, *args: Any, **kwargs: Any):
+        """
+        Sends a request and records it with its response or error.
+        """
+        (method, url, body_hash), _ = request_key(session, *args, **kwargs)
+        interaction = {
+            "method": method,
+            "url": url,
+            "body_hash": body_hash,
+            "started": time.perf_counter() - self._start,
+        }
+        start = time.perf_counter()
+        try:
+            response = _original_request(session, *args, **kwargs)
+            content = response.content
+        except requests.exceptions.RequestException as e:
+            interaction["latency"] = time.perf_counter() - start
+            interaction["error"] = {"type": type(e).__name__, "message": str(e)}
+            self._add(interaction)
+            raise
+        interaction["latency"] = time.perf_counter() - start
+        interaction["status"] = response.status_code
+        interaction["reason"] = response.reason
+        interaction["headers"] = {
+            name: value
+            for name, value in response.headers.items()
+            if name.lower() not in TRANSPORT_HEADERS
+        }
+        try:
+            interaction["body"] = content.decode()
+        except UnicodeDecodeError:
+            interaction["body_base64"] = base64.b64encode(content).decode()
+        self._add(interaction)
+        return response
+
+    def _add(self, interaction: Dict[str, Any]) -> None:
+        with self._lock:
+            self.interactions.append(interaction)
+
+
+class Replayer(_Cassette):
+    """
+    This class is responsible for answering requests from a cassette file while it is active, without using the network. Identical requests are answered in the order they were recorded, and the last answer is reused once they run out.
+
+    :param path: The path of the cassette file to read.
+    :type path: str
+    :param realtime: Whether to wait for each request's recorded latency before answering. Defaults to answering at once.
+    :type realtime: bool, optional
+    """
+
+    def __init__(self, path: str, realtime: bool = False):
+        super().__init__(path)
+        self.realtime = realtime
+        with open(path, "r") as file:
+            interactions = json.load(file)["interactions"]
+        self._interactions: Dict[Tuple, Deque[Dict[str, Any]]] = defaultdict(deque)
+        for interaction in interactions:
+            key = (interaction["method"], interaction["url"], interaction["body_hash"])
+            self._interactions[key].append(interaction)
+
+    def _request(self, session: requests.Session, *args: Any, **kwargs: Any):
+        """
+        Answers a request with its recorded response or error.
+
+        :raises UnrecordedRequest: If the cassette holds no such request.
+        """
+        key, prepared = request_key(session, *args, **kwargs)
+        with self._lock:
+            recorded = self._interactions.get(key)
+            if not recorded:
+                raise UnrecordedRequest(f"No recorded response for {key[0]} {key[1]}.")
+            interaction = recorded.popleft() if len(recorded) > 1 else recorded[0]
+        if self.realtime:
+            time.sleep(interaction["latency"])
+        if "error" in interaction:
+            error = getattr(
+                requests.exceptions,
+                interaction["error"]["type"],
+                requests.exceptions.RequestException,
+            )
+            raise error(interaction["error"]["message"], request=prepared)
+        return self._build_response(interaction, prepared)
+
+    @staticmethod
+    def _build_response(
+        interaction: Dict[str, Any], prepared: requests.PreparedRequest
+    ) -> requests.Response:
+        """
+        Builds a response from a recorded interaction.
+        """
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.reason = interaction.get("reason")
+        response.headers = CaseInsensitiveDict(interaction["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        if "body_base64" in interaction:
+            response._content = base64.b64decode(interaction["body_base64"])
+        else:
+            response._content = interaction["body"].encode()
+        response._content_consumed = True
+        response.url = prepared.url
+        response.request = prepared
+        response.elapsed = timedelta(seconds=interaction["latency"])
+        return response
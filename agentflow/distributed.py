@@ -0,0 +1,669 @@
+"""
+This module provides a coordinator and workers for running flows across machines. The coordinator enqueues flow runs in a broker, and workers on any machine lease them, run them with their own connections and push back checkpoints and results.
+
+Delivery is at least once: a job whose worker stops renewing its lease is leased again, and resumes from its last checkpoint. Jobs are keyed by an idempotency key, so submitting the same run twice enqueues it once, and only the worker holding a job's lease can record its result.
+
+SQLite brokers work for workers on one machine or on a shared disk. Redis brokers, which need the redis package, work across machines.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from agentflow.flow import Flow
+from agentflow.prefix import dumps_canonical
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - depends on the environment
+    redis = None
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class Lease:
+    """
+    This dataclass holds a job leased by a worker.
+
+    :param job_id: The ID of the job, which is its idempotency key.
+    :param payload: What to run, such as {"flow": name, "variables": {...}}.
+    :param attempts: The number of times the job has been leased, including this one.
+    :param checkpoint: The last checkpoint saved by a previous attempt, if any.
+    """
+
+    job_id: str
+    payload: Dict[str, Any]
+    attempts: int
+    checkpoint: Optional[Dict[str, Any]] = None
+
+
+class BaseBroker(ABC):
+    """
+    This abstract base class defines the interface for brokers.
+
+    :param max_attempts: The number of times a job is leased before it is marked as failed.
+    :type max_attempts: int
+    """
+
+    def __init__(self, max_attempts: int = 3):
+        self.max_attempts = max_attempts
+
+    @abstractmethod
+    def enqueue(self, job_id: str, payload: Dict[str, Any]) -> bool:
+        """
+        Adds a job to the queue, unless a job with the same ID exists.
+
+        :param job_id: The ID of the job.
+        :type job_id: str
+        :param payload: What to run.
+        :type payload: Dict[str, Any]
+        :return: Whether the job was added.
+        :rtype: bool
+        """
+
+    @abstractmethod
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Lease]:
+        """
+        Leases the oldest queued job, or a running job whose lease has expired.
+
+        :param worker_id: The ID of the worker.
+        :type worker_id: str
+        :param lease_seconds: How long the lease lasts unless it is renewed.
+        :type lease_seconds: float
+        :return: The lease, or None if there is no job to run.
+        :rtype: Optional[Lease]
+        """
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """
+        Renews a lease.
+
+        :return: Whether the worker still holds the lease.
+        :rtype: bool
+        """
+
+    @abstractmethod
+    def checkpoint(self, job_id: str, worker_id: str, data: Dict[str, Any]) -> bool:
+        """
+        Saves a job's progress, so a later attempt can resume from it.
+
+        :return: Whether the worker still holds the lease.
+        :rtype: bool
+        """
+
+    @abstractmethod
+    def complete(self, job_id: str, worker_id: str, result: Any) -> bool:
+        """
+        Records a job's result.
+
+        :return: Whether the worker still held the lease, so the result was recorded.
+        :rtype: bool
+        """
+
+    @abstractmethod
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        """
+        Records a failed attempt. The job is queued again unless it has used all its attempts.
+
+        :return: Whether the worker still held the lease.
+        :rtype: bool
+        """
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns a job's status, attempts, result and error.
+
+        :return: The job, or None if there is no such job.
+        :rtype: Optional[Dict[str, Any]]
+        """
+
+
+class SQLiteBroker(BaseBroker):
+    """
+    This class is responsible for keeping jobs in a SQLite database. Processes that share the database file share the queue.
+
+    :param path: The path to the database file.
+    :type path: str
+    :param max_attempts: The number of times a job is leased before it is marked as failed.
+    :type max_attempts: int
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3):
+        super().__init__(max_attempts)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_expires REAL,
+                checkpoint TEXT,
+                result TEXT,
+                error TEXT,
+                created REAL NOT NULL
+            )
+            """)
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)"
+        )
+
+    def _execute(self, query: str, *parameters: Any) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connection.execute(query, parameters)
+
+    def _update_leased(
+        self, job_id: str, worker_id: str, assignments: str, *parameters: Any
+    ) -> bool:
+        """
+        Updates a job if the worker holds its lease.
+        """
+        cursor = self._execute(
+            f"UPDATE jobs SET {assignments} WHERE id = ? AND worker = ? AND status = ?",
+            *parameters,
+            job_id,
+            worker_id,
+            RUNNING,
+        )
+        return cursor.rowcount == 1
+
+    def enqueue(self, job_id: str, payload: Dict[str, Any]) -> bool:
+        cursor = self._execute(
+            "INSERT OR IGNORE INTO jobs (id, payload, status, created) VALUES (?, ?, ?, ?)",
+            job_id,
+            json.dumps(payload),
+            QUEUED,
+            time.time(),
+        )
+        return cursor.rowcount == 1
+
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Lease]:
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    row = self._connection.execute(
+                        """
+                        SELECT id, payload, attempts, checkpoint FROM jobs
+                        WHERE status = ? OR (status = ? AND lease_expires < ?)
+                        ORDER BY created LIMIT 1
+                        """,
+                        (QUEUED, RUNNING, now),
+                    ).fetchone()
+                    if row is None:
+                        self._connection.execute("COMMIT")
+                        return None
+                    job_id, payload, attempts, checkpoint = row
+                    if attempts >= self.max_attempts:
+                        self._connection.execute(
+                            "UPDATE jobs SET status = ?, error = ? WHERE id = ?",
+                            (
+                                FAILED,
+                                f"Lease expired after {attempts} attempts.",
+                                job_id,
+                            ),
+                        )
+                        continue
+                    self._connection.execute(
+                        """
+                        UPDATE jobs SET status = ?, worker = ?, lease_expires = ?,
+                        attempts = attempts + 1 WHERE id = ?
+                        """,
+                        (RUNNING, worker_id, now + lease_seconds, job_id),
+                    )
+                    self._connection.execute("COMMIT")
+                    return Lease(
+                        job_id,
+                        json.loads(payload),
+                        attempts + 1,
+                        json.loads(checkpoint) if checkpoint else None,
+                    )
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        return self._update_leased(
+            job_id, worker_id, "lease_expires = ?", time.time() + lease_seconds
+        )
+
+    def checkpoint(self, job_id: str, worker_id: str, data: Dict[str, Any]) -> bool:
+        return self._update_leased(
+            job_id, worker_id, "checkpoint = ?", json.dumps(data)
+        )
+
+    def complete(self, job_id: str, worker_id: str, result: Any) -> bool:
+        return self._update_leased(
+            job_id, worker_id, "status = ?, result = ?", DONE, json.dumps(result)
+        )
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        return self._update_leased(
+            job_id,
+            worker_id,
+            "status = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?",
+            self.max_attempts,
+            FAILED,
+            QUEUED,
+            error,
+        )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._execute(
+            "SELECT status, attempts, result, error FROM jobs WHERE id = ?", job_id
+        ).fetchone()
+        if row is None:
+            return None
+        status, attempts, result, error = row
+        return {
+            "id": job_id,
+            "status": status,
+            "attempts": attempts,
+            "result": json.loads(result) if result else None,
+            "error": error,
+        }
+
+
+class RedisBroker(BaseBroker):
+    """
+    This class is responsible for keeping jobs in Redis, or a Redis-compatible server, so workers on any machine can share the queue. It needs the redis package.
+
+    :param url: The URL of the server, such as redis://localhost:6379/0.
+    :type url: str
+    :param max_attempts: The number of times a job is leased before it is marked as failed.
+    :type max_attempts: int
+    :param prefix: The prefix of the keys used by the broker.
+    :type prefix: str
+    """
+
+    def __init__(self, url: str, max_attempts: int = 3, prefix: str = "agentflow"):
+        if redis is None:
+            raise ImportError("RedisBroker needs the redis package.")
+        super().__init__(max_attempts)
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._queue = f"{prefix}:queue"
+        self._leases = f"{prefix}:leases"
+        self._prefix = prefix
+
+    def _key(self, job_id: str) -> str:
+        return f"{self._prefix}:job:{job_id}"
+
+    def _update_leased(
+        self, job_id: str, worker_id: str, fields: Dict[str, Any], **leases: float
+    ) -> bool:
+        """
+        Updates a job if the worker holds its lease, and its entry in the leases if given.
+        """
+        key = self._key(job_id)
+        with self._client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.hmget(key, "worker", "status") != [worker_id, RUNNING]:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.hset(key, mapping=fields)
+                if leases:
+                    pipe.zadd(self._leases, {job_id: leases["expires"]})
+                elif fields.get("status") != RUNNING:
+                    pipe.zrem(self._leases, job_id)
+                if fields.get("status") == QUEUED:
+                    pipe.lpush(self._queue, job_id)
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    def enqueue(self, job_id: str, payload: Dict[str, Any]) -> bool:
+        key = self._key(job_id)
+        if not self._client.hsetnx(key, "status", QUEUED):
+            return False
+        pipe = self._client.pipeline()
+        pipe.hset(key, mapping={"payload": json.dumps(payload), "attempts": 0})
+        pipe.lpush(self._queue, job_id)
+        pipe.execute()
+        return True
+
+    def _requeue_expired(self) -> None:
+        """
+        Queues jobs whose lease has expired again, or fails them if they have used all their attempts. Each job is checked and requeued in one transaction, which is dropped if its worker renews the lease or records a result in between.
+        """
+        for job_id in self._client.zrangebyscore(self._leases, 0, time.time()):
+            key = self._key(job_id)
+            with self._client.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    status, attempts = pipe.hmget(key, "status", "attempts")
+                    expires = pipe.zscore(self._leases, job_id)
+                    if status != RUNNING or expires is None or expires > time.time():
+                        pipe.unwatch()
+                        continue
+                    attempts = int(attempts or 0)
+                    pipe.multi()
+                    pipe.zrem(self._leases, job_id)
+                    if attempts >= self.max_attempts:
+                        pipe.hset(
+                            key,
+                            mapping={
+                                "status": FAILED,
+                                "error": f"Lease expired after {attempts} attempts.",
+                            },
+                        )
+                    else:
+                        pipe.hset(key, "status", QUEUED)
+                        pipe.lpush(self._queue, job_id)
+                    pipe.execute()
+                except redis.WatchError:
+                    continue
+
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Lease]:
+        """
+        Leases the oldest queued job. The job is popped from the queue and leased in one transaction, so a worker that stops in between leaves it queued. Entries of jobs that are no longer queued are dropped.
+        """
+        self._requeue_expired()
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self._queue)
+                    job_id = pipe.lindex(self._queue, -1)
+                    if job_id is None:
+                        pipe.unwatch()
+                        return None
+                    key = self._key(job_id)
+                    pipe.watch(key)
+                    status, payload, checkpoint = pipe.hmget(
+                        key, "status", "payload", "checkpoint"
+                    )
+                    pipe.multi()
+                    pipe.rpop(self._queue)
+                    if status != QUEUED:
+                        pipe.execute()
+                        continue
+                    pipe.hincrby(key, "attempts", 1)
+                    pipe.hset(key, mapping={"status": RUNNING, "worker": worker_id})
+                    pipe.zadd(self._leases, {job_id: time.time() + lease_seconds})
+                    _, attempts, _, _ = pipe.execute()
+                except redis.WatchError:
+                    continue
+                return Lease(
+                    job_id,
+                    json.loads(payload),
+                    attempts,
+                    json.loads(checkpoint) if checkpoint else None,
+                )
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        return self._update_leased(
+            job_id, worker_id, {"status": RUNNING}, expires=time.time() + lease_seconds
+        )
+
+    def checkpoint(self, job_id: str, worker_id: str, data: Dict[str, Any]) -> bool:
+        return self._update_leased(
+            job_id, worker_id, {"status": RUNNING, "checkpoint": json.dumps(data)}
+        )
+
+    def complete(self, job_id: str, worker_id: str, result: Any) -> bool:
+        return self._update_leased(
+            job_id, worker_id, {"status": DONE, "result": json.dumps(result)}
+        )
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        attempts = int(self._client.hget(self._key(job_id), "attempts") or 0)
+        status = FAILED if attempts >= self.max_attempts else QUEUED
+        return self._update_leased(
+            job_id, worker_id, {"status": status, "error": error}
+        )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._client.hgetall(self._key(job_id))
+        if not job:
+            return None
+        return {
+            "id": job_id,
+            "status": job["status"],
+            "attempts": int(job.get("attempts", 0)),
+            "result": json.loads(job["result"]) if job.get("result") else None,
+            "error": job.get("error"),
+        }
+
+
+def get_broker(url: str, max_attempts: int = 3) -> BaseBroker:
+    """
+    Returns a broker for a URL: sqlite:///path/to/file.db or redis://host:port/db.
+
+    :param url: The URL of the broker.
+    :type url: str
+    :param max_attempts: The number of times a job is leased before it is marked as failed.
+    :type max_attempts: int
+    :raises ValueError: If the URL's scheme is not supported.
+    :return: The broker.
+    :rtype: BaseBroker
+    """
+    if url.startswith("sqlite:///"):
+        return SQLiteBroker(url[len("sqlite:///") :], max_attempts)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(url, max_attempts)
+    raise ValueError(f"Unsupported broker URL: {url}.")
+
+
+def job_key(payload: Dict[str, Any]) -> str:
+    """
+    Returns the default idempotency key of a job: the hash of its payload.
+
+    :param payload: What to run.
+    :type payload: Dict[str, Any]
+    :return: The key.
+    :rtype: str
+    """
+    return hashlib.sha256(dumps_canonical(payload).encode()).hexdigest()
+
+
+class Coordinator:
+    """
+    This class is responsible for submitting flow runs to a broker and waiting for their results.
+
+    :param broker: The broker.
+    :type broker: BaseBroker
+    """
+
+    def __init__(self, broker: BaseBroker):
+        self.broker = broker
+
+    def submit(
+        self,
+        flow_name: str,
+        variables: dict = None,
+        key: str = None,
+        flows_path: str = None,
+    ) -> str:
+        """
+        Submits a flow run. Submitting a run with the key of an existing job doesn't add it again.
+
+        :param flow_name: The name of the flow.
+        :type flow_name: str
+        :param variables: Variables to be used in the flow.
+        :type variables: dict, optional
+        :param key: The idempotency key of the run. Defaults to a hash of the flow name, variables and flows path.
+        :type key: str, optional
+        :param flows_path: The base path to the flows directory on the workers.
+        :type flows_path: str, optional
+        :return: The ID of the job.
+        :rtype: str
+        """
+        payload = {"flow": flow_name, "variables": variables or {}}
+        if flows_path:
+            payload["flows_path"] = flows_path
+        job_id = key or job_key(payload)
+        self.broker.enqueue(job_id, payload)
+        return job_id
+
+    def wait(
+        self,
+        job_ids: List[str],
+        timeout: Optional[float] = None,
+        poll_interval: float = 1.0,
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Waits until jobs are done or failed.
+
+        :param job_ids: The IDs of the jobs.
+        :type job_ids: List[str]
+        :param timeout: The maximum number of seconds to wait. If not set, waits until all jobs finish.
+        :type timeout: float, optional
+        :param poll_interval: The number of seconds between checks.
+        :type poll_interval: float
+        :return: The jobs by ID. Jobs that haven't finished by the timeout are queued or running.
+        :rtype: Dict[str, Dict[str, Any]]
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            jobs = {job_id: self.broker.get(job_id) for job_id in job_ids}
+            finished = all(
+                job and job["status"] in (DONE, FAILED) for job in jobs.values()
+            )
+            if finished or (deadline is not None and time.monotonic() >= deadline):
+                return jobs
+            time.sleep(poll_interval)
+
+
+def run_flow_job(
+    payload: Dict[str, Any],
+    checkpoint: Optional[Dict[str, Any]],
+    save_checkpoint: Callable[[Dict[str, Any]], None],
+) -> Dict[str, Any]:
+    """
+    Runs the flow of a job, resuming from its checkpoint, in the output directory of the earlier attempt, and saving one after each task.
+
+    :param payload: The job's payload, with "flow" and optionally "variables" and "flows_path".
+    :type payload: Dict[str, Any]
+    :param checkpoint: The last checkpoint of the job, if any.
+    :type checkpoint: Optional[Dict[str, Any]]
+    :param save_checkpoint: Saves a checkpoint of the job.
+    :type save_checkpoint: Callable[[Dict[str, Any]], None]
+    :raises Exception: The error that stopped the flow, if any.
+    :return: The output folder and the last answer of the flow.
+    :rtype: Dict[str, Any]
+    """
+    flow = Flow(payload["flow"], payload.get("variables"), payload.get("flows_path"))
+    flow.run(checkpoint=checkpoint, on_checkpoint=save_checkpoint)
+    if flow.error is not None:
+        raise flow.error
+    answers = [m.content for m in flow.messages if m.role == "assistant" and m.content]
+    return {
+        "output_path": flow.output.output_path,
+        "answer": answers[-1] if answers else None,
+    }
+
+
+class Worker:
+    """
+    This class is responsible for leasing jobs from a broker and running them, renewing each job's lease while it runs.
+
+    :param broker: The broker.
+    :type broker: BaseBroker
+    :param worker_id: The ID of the worker. Defaults to the host name, process ID and a random suffix.
+    :type worker_id: str, optional
+    :param lease_seconds: How long a lease lasts without being renewed. It is renewed every third of this.
+    :type lease_seconds: float
+    :param runner: Runs a job's payload given its checkpoint and a callable to save checkpoints, and returns its result. Defaults to running a flow.
+    :type runner: Callable, optional
+    """
+
+    def __init__(
+        self,
+        broker: BaseBroker,
+        worker_id: str = None,
+        lease_seconds: float = 60.0,
+        runner: Callable[..., Any] = None,
+    ):
+        self.broker = broker
+        self.worker_id = worker_id or (
+            f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        )
+        self.lease_seconds = lease_seconds
+        self.runner = runner or run_flow_job
+
+    def run(
+        self,
+        stop_when_idle: bool = False,
+        poll_interval: float = 1.0,
+        max_jobs: Optional[int] = None,
+    ) -> int:
+        """
+        Leases and runs jobs until stopped.
+
+        :param stop_when_idle: Whether to stop when there are no jobs to run.
+        :type stop_when_idle: bool
+        :param poll_interval: The number of seconds to wait when there are no jobs to run.
+        :type poll_interval: float
+        :param max_jobs: The number of jobs to run before stopping, if any.
+        :type max_jobs: int, optional
+        :return: The number of jobs run.
+        :rtype: int
+        """
+        processed = 0
+        while max_jobs is None or processed < max_jobs:
+            lease = self.broker.lease(self.worker_id, self.lease_seconds)
+            if lease is None:
+                if stop_when_idle:
+                    break
+                time.sleep(poll_interval)
+                continue
+            self.process(lease)
+            processed += 1
+        return processed
+
+    def process(self, lease: Lease) -> None:
+        """
+        Runs a leased job and records its result or error.
+
+        :param lease: The lease of the job.
+        :type lease: Lease
+        """
+        stop = threading.Event()
+
+        def renew() -> None:
+            while not stop.wait(self.lease_seconds / 3):
+                if not self.broker.heartbeat(
+                    lease.job_id, self.worker_id, self.lease_seconds
+                ):
+                    logging.warning(f"Lost the lease of job {lease.job_id}.")
+                    return
+
+        def save_checkpoint(data: Dict[str, Any]) -> None:
+            self.broker.checkpoint(lease.job_id, self.worker_id, data)
+
+        heartbeat = threading.Thread(target=renew, daemon=True)
+        heartbeat.start()
+        try:
+            result = self.runner(lease.payload, lease.checkpoint, save_checkpoint)
+        except Exception as e:
+            logging.error(f"Job {lease.job_id} failed: {e}")
+            self.broker.fail(lease.job_id, self.worker_id, repr(e))
+            return
+        finally:
+            stop.set()
+            heartbeat.join()
+        self.broker.complete(lease.job_id, self.worker_id, result)
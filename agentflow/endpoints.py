@@ -0,0 +1,332 @@
+"""
+This module provides a pool of API endpoints, each a key and a base URL, that LLM requests are balanced across. Each request goes to the healthy endpoint with the fewest requests in flight for its weight. Endpoints that keep failing with rate limits or server errors are taken out of rotation for a while, then tried again with a single request.
+
+Pools are configured with the AGENTFLOW_ENDPOINTS environment variable, which holds a JSON list of endpoints or the path to a JSON file with one:
+
+.. code-block:: json
+
+    [
+        {"api_key_env": "OPENAI_API_KEY_1", "weight": 2},
+        {"api_key_env": "OPENAI_API_KEY_2", "api_base": "https://proxy.example.com/v1"}
+    ]
+
+Alternatively, OPENAI_API_KEYS holds a comma-separated list of keys for the default base URL. Without either, the pool has a single endpoint that uses the OpenAI module's key and base URL.
+"""
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set, TypeVar
+
+import openai
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+T = TypeVar("T")
+
+
+class EndpointsUnavailable(RuntimeError):
+    """
+    Raised when every endpoint in a pool is out of rotation.
+    """
+
+
+@dataclass(eq=False)
+class Endpoint:
+    """
+    This dataclass holds an API endpoint and its health.
+
+    :param name: The name of the endpoint, used in metrics and logs.
+    :type name: str
+    :param api_key: The API key. If not set, the OpenAI module's key or OPENAI_API_KEY is used.
+    :type api_key: str, optional
+    :param api_base: The base URL of the API. If not set, the OpenAI module's base URL is used.
+    :type api_base: str, optional
+    :param weight: The share of requests the endpoint can take relative to the others, such as its rate limit.
+    :type weight: float
+    """
+
+    name: str
+    api_key: Optional[str] = None
+    api_base: Optional[str] = None
+    weight: float = 1.0
+    state: str = CLOSED
+    outstanding: int = 0
+    requests: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    trips: int = 0
+    open_until: float = 0.0
+
+    def get_api_key(self) -> Optional[str]:
+        """
+        Returns the API key to send requests with.
+
+        :return: The API key.
+        :rtype: Optional[str]
+        """
+        return self.api_key or openai.api_key or os.getenv("OPENAI_API_KEY")
+
+    def get_api_base(self) -> str:
+        """
+        Returns the base URL to send requests to.
+
+        :return: The base URL.
+        :rtype: str
+        """
+        return self.api_base or openai.api_base
+
+
+def is_health_failure(error: BaseException) -> bool:
+    """
+    Returns whether an error counts against an endpoint's health: rate limits, server errors, timeouts and connection errors. Errors caused by the request itself, such as invalid arguments, don't.
+
+    :param error: The error.
+    :type error: BaseException
+    :return: Whether the error counts against the endpoint.
+    :rtype: bool
+    """
+    if isinstance(error, (openai.error.Timeout, openai.error.APIConnectionError)):
+        return True
+    status = getattr(error, "http_status", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """
+    Returns the number of seconds an error's Retry-After header asks to wait, if any.
+    """
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class EndpointPool:
+    """
+    This class is responsible for balancing requests across endpoints and tracking their health. It is thread-safe.
+
+    An endpoint's circuit opens after failure_threshold consecutive failures, for cooldown seconds or as long as the last error's Retry-After header asks. Each time it opens again without a success in between, the cooldown doubles, up to max_cooldown. Once the cooldown has passed, one request is let through: if it succeeds, the circuit closes.
+
+    :param endpoints: The endpoints.
+    :type endpoints: List[Endpoint]
+    :param failure_threshold: The number of consecutive failures that open an endpoint's circuit.
+    :type failure_threshold: int
+    :param cooldown: The number of seconds an endpoint is out of rotation the first time its circuit opens.
+    :type cooldown: float
+    :param max_cooldown: The maximum number of seconds an endpoint is out of rotation.
+    :type max_cooldown: float
+    :raises ValueError: If there are no endpoints or a weight is not positive.
+    """
+
+    def __init__(
+        self,
+        endpoints: List[Endpoint],
+        failure_threshold: int = 3,
+        cooldown: float = 10.0,
+        max_cooldown: float = 300.0,
+    ):
+        if not endpoints:
+            raise ValueError("An endpoint pool needs at least one endpoint.")
+        if any(endpoint.weight <= 0 for endpoint in endpoints):
+            raise ValueError("Endpoint weights must be positive.")
+        self.endpoints = endpoints
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_list(cls, definitions: List[Dict[str, Any]], **kwargs) -> "EndpointPool":
+        """
+        Creates a pool from a list of endpoint definitions. Each definition has an api_key, or the name of an environment variable holding it as api_key_env, and optionally an api_base, a weight and a name.
+
+        :param definitions: The endpoint definitions.
+        :type definitions: List[Dict[str, Any]]
+        :raises ValueError: If an api_key_env variable is not set.
+        :return: The pool.
+        :rtype: EndpointPool
+        """
+        endpoints = []
+        for number, definition in enumerate(definitions, 1):
+            definition = dict(definition)
+            api_key_env = definition.pop("api_key_env", None)
+            if api_key_env:
+                definition["api_key"] = os.getenv(api_key_env)
+                if not definition["api_key"]:
+                    raise ValueError(f"Environment variable {api_key_env} is not set.")
+            definition.setdefault("name", f"endpoint-{number}")
+            endpoints.append(Endpoint(**definition))
+        return cls(endpoints, **kwargs)
+
+    @classmethod
+    def from_environment(cls) -> "EndpointPool":
+        """
+        Creates a pool from the AGENTFLOW_ENDPOINTS or OPENAI_API_KEYS environment variables, or with a single endpoint that uses the OpenAI module's settings if neither is set.
+
+        :return: The pool.
+        :rtype: EndpointPool
+        """
+        endpoints = os.getenv("AGENTFLOW_ENDPOINTS", "").strip()
+        if endpoints:
+            if not endpoints.startswith("["):
+                with open(endpoints, "r") as file:
+                    endpoints = file.read()
+            return cls.from_list(json.loads(endpoints))
+        keys = [key.strip() for key in os.getenv("OPENAI_API_KEYS", "").split(",")]
+        keys = [key for key in keys if key]
+        if keys:
+            return cls.from_list([{"api_key": key} for key in keys])
+        return cls([Endpoint("default")])
+
+    def acquire(self, exclude: Optional[Set[Endpoint]] = None) -> Endpoint:
+        """
+        Chooses an endpoint for a request and counts the request as in flight. Release the endpoint when the request is done.
+
+        The endpoint with the fewest requests in flight relative to its weight is chosen, among those whose circuit is closed or is ready to be tried again.
+
+        :param exclude: Endpoints not to choose, such as those already tried for the request.
+        :type exclude: Set[Endpoint], optional
+        :raises EndpointsUnavailable: If every endpoint is out of rotation or excluded.
+        :return: The endpoint.
+        :rtype: Endpoint
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                endpoint
+                for endpoint in self.endpoints
+                if (not exclude or endpoint not in exclude)
+                and self._is_available(endpoint, now)
+            ]
+            if not candidates:
+                raise EndpointsUnavailable(
+                    "No API endpoint is available: all are rate limited or failing."
+                )
+            endpoint = min(
+                candidates,
+                key=lambda endpoint: (
+                    (endpoint.outstanding + 1) / endpoint.weight,
+                    endpoint.requests / endpoint.weight,
+                ),
+            )
+            if endpoint.state == OPEN:
+                endpoint.state = HALF_OPEN
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(
+        self, endpoint: Endpoint, error: Optional[BaseException] = None
+    ) -> bool:
+        """
+        Marks a request as done and updates the endpoint's health.
+
+        :param endpoint: The endpoint the request was sent to.
+        :type endpoint: Endpoint
+        :param error: The error the request failed with, if any.
+        :type error: BaseException, optional
+        :return: Whether the error counted against the endpoint's health.
+        :rtype: bool
+        """
+        failed = error is not None and is_health_failure(error)
+        with self._lock:
+            endpoint.outstanding -= 1
+            if not failed:
+                endpoint.state = CLOSED
+                endpoint.consecutive_failures = 0
+                endpoint.trips = 0
+                return False
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if (
+                endpoint.state == HALF_OPEN
+                or endpoint.consecutive_failures >= self.failure_threshold
+            ):
+                cooldown = min(self.cooldown * 2**endpoint.trips, self.max_cooldown)
+                cooldown = max(cooldown, _retry_after(error) or 0)
+                endpoint.state = OPEN
+                endpoint.open_until = time.monotonic() + cooldown
+                endpoint.trips += 1
+            return True
+
+    def send(self, request: Callable[[Endpoint], T]) -> T:
+        """
+        Sends a single request to an acquired endpoint and releases it, with the request's error if it fails. Requests other than chat completions, such as images and embeddings, use this to get an endpoint's key and base URL.
+
+        :param request: Sends the request to the endpoint it is given.
+        :type request: Callable[[Endpoint], T]
+        :raises EndpointsUnavailable: If every endpoint is out of rotation.
+        :return: The response.
+        :rtype: T
+        """
+        endpoint = self.acquire()
+        try:
+            response = request(endpoint)
+        except Exception as e:
+            self.release(endpoint, e)
+            raise
+        self.release(endpoint)
+        return response
+
+    def available(self, exclude: Optional[Set[Endpoint]] = None) -> bool:
+        """
+        Returns whether an endpoint could be acquired now.
+
+        :param exclude: Endpoints not to count.
+        :type exclude: Set[Endpoint], optional
+        :return: Whether an endpoint is available.
+        :rtype: bool
+        """
+        now = time.monotonic()
+        with self._lock:
+            return any(
+                (not exclude or endpoint not in exclude)
+                and self._is_available(endpoint, now)
+                for endpoint in self.endpoints
+            )
+
+    @staticmethod
+    def _is_available(endpoint: Endpoint, now: float) -> bool:
+        """
+        Returns whether an endpoint can take a request: its circuit is closed, or it is open and its cooldown has passed. Half-open endpoints only take the one request that tests them.
+        """
+        if endpoint.state == CLOSED:
+            return True
+        if endpoint.state == OPEN:
+            return now >= endpoint.open_until
+        return False
+
+    def get_api_bases(self) -> List[str]:
+        """
+        Returns the distinct base URLs of the endpoints.
+
+        :return: The base URLs.
+        :rtype: List[str]
+        """
+        return list(
+            dict.fromkeys(endpoint.get_api_base() for endpoint in self.endpoints)
+        )
+
+    def get_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the requests, failures, requests in flight and circuit state of each endpoint.
+
+        :return: The metrics, by endpoint name.
+        :rtype: Dict[str, Dict[str, Any]]
+        """
+        with self._lock:
+            return {
+                endpoint.name: {
+                    "requests": endpoint.requests,
+                    "failures": endpoint.failures,
+                    "outstanding": endpoint.outstanding,
+                    "state": endpoint.state,
+                }
+                for endpoint in self.endpoints
+            }
@@ -1,16 +1,58 @@
 """
 This module defines the Flow and Task classes which are used to load and execute a series of tasks defined in a JSON file.
 Each task is processed by the LLM (Large Language Model) and the results are saved in a JSON file.
+Flows can also loop over items and branch on conditions with the ForEach and Condition classes, which the engine runs without extra LLM turns.
 """
 
 import json
 import logging
 import os
-import re
-
-from agentflow.function import Function
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from agentflow.artifacts import ArtifactStore
+from agentflow.budget import Budget, use_budgets
+from agentflow.endpoints import EndpointPool
+from agentflow.function import Function, format_error
 from agentflow.llm import LLM, Settings
+from agentflow.message import Conversation
+from agentflow.metrics import FLOWS, FLOWS_IN_FLIGHT, TASKS
 from agentflow.output import Output
+from agentflow.prefix import Prefix
+from agentflow.router import Router
+from agentflow.selectors import get_selector
+from agentflow.template import compile_template
+from agentflow.trace import Trace
+
+_flow_specs: Dict[str, Tuple[int, dict]] = {}
+_flow_specs_lock = threading.Lock()
+
+
+def load_flow_spec(file_path: str) -> dict:
+    """
+    Loads a flow's JSON definition. Definitions are parsed once and kept until their file changes, so flows that run often don't pay for parsing each time. The returned dict is shared and must not be modified.
+
+    :param file_path: The path to the flow's JSON file.
+    :type file_path: str
+    :raises FileNotFoundError: If the JSON file does not exist.
+    :return: The flow's definition.
+    :rtype: dict
+    """
+    try:
+        modified = os.stat(file_path).st_mtime_ns
+    except FileNotFoundError:
+        raise FileNotFoundError(f"File not found: {file_path}.") from None
+    with _flow_specs_lock:
+        cached = _flow_specs.get(file_path)
+    if cached is not None and cached[0] == modified:
+        return cached[1]
+    with open(file_path, "r") as file:
+        data = json.load(file)
+    with _flow_specs_lock:
+        _flow_specs[file_path] = (modified, data)
+    return data
 
 
 class Task:
@@ -28,6 +70,72 @@ class Task:
         self.settings = settings if settings else Settings()
 
 
+class ForEach:
+    """
+    Represents tasks to be run once for each item of a list. Each iteration starts from the system message rather than the shared history, and iterations run concurrently.
+
+    :param source: Where the items come from: {"variable": name} or {"function_result": function name}. Items are read as a JSON list or, failing that, as non-empty lines.
+    :type source: dict
+    :param name: The variable that holds the current item in the tasks' actions.
+    :type name: str
+    :param tasks: The tasks to run for each item.
+    :type tasks: list
+    :param concurrency: The maximum number of iterations to run at once.
+    :type concurrency: int, optional
+    """
+
+    def __init__(self, source: dict, name: str, tasks: list, concurrency: int = 4):
+        self.source = source
+        self.name = name
+        self.tasks = tasks
+        self.concurrency = concurrency
+
+
+class Condition:
+    """
+    Represents tasks to be run only if a predicate holds.
+
+    :param predicate: The predicate: {"variable": name} or {"function_result": function name}, with one of "equals", "not_equals", "contains" or "not_contains". Without an operator, the predicate holds if the value is not empty.
+    :type predicate: dict
+    :param tasks: The tasks to run if the predicate holds.
+    :type tasks: list
+    :param else_tasks: The tasks to run otherwise.
+    :type else_tasks: list, optional
+    """
+
+    OPERATORS = {
+        "equals": lambda value, operand: value == operand,
+        "not_equals": lambda value, operand: value != operand,
+        "contains": lambda value, operand: operand in value,
+        "not_contains": lambda value, operand: operand not in value,
+    }
+
+    def __init__(self, predicate: dict, tasks: list, else_tasks: list = None):
+        operators = set(predicate) & set(self.OPERATORS)
+        if len(operators) > 1:
+            raise ValueError(f"Conditions take one operator, not: {operators}.")
+        self.predicate = predicate
+        self.tasks = tasks
+        self.else_tasks = else_tasks or []
+
+    def holds(self, value: str) -> bool:
+        """
+        Check whether the predicate holds for a value.
+
+        :param value: The value of the predicate's variable or function result.
+        :type value: str
+        :return: Whether the predicate holds.
+        :rtype: bool
+        """
+        for operator, check in self.OPERATORS.items():
+            if operator in self.predicate:
+                return check(value, self.predicate[operator])
+        return bool(value)
+
+
+Node = Union[Task, ForEach, Condition]
+
+
 class Flow:
     """
     Represents a flow of tasks loaded from a JSON file.
@@ -38,17 +146,34 @@ class Flow:
     :type variables: dict, optional
     :param flows_path: The base path to the flows directory. If not set, will be agentflow/flows.
     :type flows_path: str, optional
+    :param budget: A budget shared with other flows, such as those of a batch, that the flow's usage also counts towards.
+    :type budget: Budget, optional
+    :param endpoints: The API endpoints to send the flow's requests to. If not set, those configured in the environment are used.
+    :type endpoints: EndpointPool, optional
     """
 
-    def __init__(self, name: str, variables: dict = None, flows_path: str = None):
+    def __init__(
+        self,
+        name: str,
+        variables: dict = None,
+        flows_path: str = None,
+        budget: Budget = None,
+        endpoints: EndpointPool = None,
+    ):
         self.name = name
         self.flows_path = flows_path or os.path.join(os.path.dirname(__file__), "flows")
+        self.variables = variables or {}
         self._load_flow(name)
-        self._validate_and_format_messages(variables or {})
+        self.budget.parent = budget
+        self._validate_and_format_messages(self.variables)
         self.output = Output(name)
+        self.prefix = Prefix(self.system_message, self._get_functions())
         self.messages = self._get_initial_messages()
-        self.functions = self._get_functions()
-        self.llm = LLM()
+        self.functions = self.prefix.functions
+        self.trace = Trace()
+        self.llm = LLM(endpoints)
+        self.error: Optional[Exception] = None
+        self.artifacts = ArtifactStore()
 
     def _load_flow(self, name: str) -> None:
         """
@@ -59,19 +184,73 @@ class Flow:
         :raises FileNotFoundError: If the JSON file does not exist.
         """
 
-        file_path = f"{self.flows_path}/{name}.json"
+        data = load_flow_spec(f"{self.flows_path}/{name}.json")
 
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File not found: {file_path}.")
+        self.system_message = data.get("system_message")
+        self.router = Router(data.get("routes"))
+        self.budget = Budget.from_dict(data.get("budget", {}), name="flow budget")
+        self.tasks = self._load_tasks(data.get("tasks", []))
 
-        with open(file_path, "r") as file:
-            data = json.load(file)
+    def _load_tasks(self, tasks: list) -> List[Node]:
+        """
+        Load tasks, loops and conditions from their JSON definitions.
 
-        self.system_message = data.get("system_message")
-        self.tasks = [
-            Task(task["action"], Settings(**task.get("settings", {})))
-            for task in data.get("tasks", [])
-        ]
+        :param tasks: The JSON definitions.
+        :type tasks: list
+        :raises ValueError: If a task's selector is unknown, or a streamed task asks for several candidates.
+        :return: The loaded tasks.
+        :rtype: List[Node]
+        """
+        nodes = []
+        for task in tasks:
+            if "for_each" in task:
+                nodes.append(
+                    ForEach(
+                        task["for_each"],
+                        task["as"],
+                        self._load_tasks(task["tasks"]),
+                        task.get("concurrency", 4),
+                    )
+                )
+            elif "if" in task:
+                nodes.append(
+                    Condition(
+                        task["if"],
+                        self._load_tasks(task["tasks"]),
+                        self._load_tasks(task.get("else", [])),
+                    )
+                )
+            else:
+                settings = Settings(**task.get("settings", {}))
+                if settings.selector is not None:
+                    get_selector(settings.selector)
+                if settings.stream and (settings.n or 1) > 1:
+                    raise ValueError(
+                        f"Task {task['action']!r} can't stream and get {settings.n} candidates."
+                    )
+                nodes.append(Task(task["action"], settings))
+        return nodes
+
+    def _iter_tasks(
+        self, nodes: List[Node], in_loop: bool = False
+    ) -> Iterator[Tuple[Task, bool]]:
+        """
+        Iterate over all tasks, including those in loops and conditions.
+
+        :param nodes: The tasks, loops and conditions.
+        :type nodes: List[Node]
+        :param in_loop: Whether the nodes are inside a loop.
+        :type in_loop: bool
+        :return: Each task, and whether it is inside a loop.
+        :rtype: Iterator[Tuple[Task, bool]]
+        """
+        for node in nodes:
+            if isinstance(node, Task):
+                yield node, in_loop
+            elif isinstance(node, ForEach):
+                yield from self._iter_tasks(node.tasks, True)
+            else:
+                yield from self._iter_tasks(node.tasks + node.else_tasks, in_loop)
 
     def _validate_and_format_messages(self, variables: dict) -> None:
         """
@@ -81,14 +260,8 @@ class Flow:
         :type variables: dict
         :raises ValueError: If there are extra or missing variables.
         """
-        all_messages = [self.system_message] + [task.action for task in self.tasks]
-        all_variables = set(
-            match.group(1)
-            for message in all_messages
-            if message
-            for match in re.finditer(
-                r"{([^{}]+)}", message.replace("{{", "").replace("}}", "")
-            )
+        all_variables = self._get_variables(
+            [self.system_message] if self.system_message else [], self.tasks, set()
         )
 
         extra_variables = set(variables.keys()) - all_variables
@@ -101,17 +274,51 @@ class Flow:
 
         self._format_messages(variables)
 
+    def _get_variables(
+        self, messages: List[str], nodes: List[Node], loop_names: set
+    ) -> set:
+        """
+        Get the variables used by messages and tasks, leaving out the items of enclosing loops.
+
+        :param messages: Messages outside of the tasks, such as the system message.
+        :type messages: List[str]
+        :param nodes: The tasks, loops and conditions.
+        :type nodes: List[Node]
+        :param loop_names: The names of the items of enclosing loops.
+        :type loop_names: set
+        :return: The names of the variables.
+        :rtype: set
+        """
+        variables = (
+            set().union(*(compile_template(message).variables for message in messages))
+            - loop_names
+        )
+        for node in nodes:
+            if isinstance(node, Task):
+                variables |= self._get_variables([node.action], [], loop_names)
+            elif isinstance(node, ForEach):
+                variables |= {node.source.get("variable")} - {None} - loop_names
+                variables |= self._get_variables(
+                    [], node.tasks, loop_names | {node.name}
+                )
+            else:
+                variables |= {node.predicate.get("variable")} - {None} - loop_names
+                variables |= self._get_variables(
+                    [], node.tasks + node.else_tasks, loop_names
+                )
+        return variables
+
     def _format_messages(self, variables: dict) -> None:
         """
-        Format messages with provided variables.
+        Format messages with provided variables. Tasks inside loops are formatted for each item when they run.
 
         :param variables: Variables to be used in the flow.
         :type variables: dict
         """
         if self.system_message:
             self.system_message = self._format_message(self.system_message, variables)
-        for task in self.tasks:
-            if task.action:
+        for task, in_loop in self._iter_tasks(self.tasks):
+            if task.action and not in_loop:
                 task.action = self._format_message(task.action, variables)
 
     @staticmethod
@@ -126,110 +333,453 @@ class Flow:
         :return: The formatted message.
         :rtype: str
         """
-        return message.format(**variables).replace("{{", "{").replace("}}", "}")
+        return compile_template(message).render(variables)
 
-    def run(self):
+    def run(
+        self,
+        checkpoint: Optional[dict] = None,
+        on_checkpoint: Optional[Callable[[dict], None]] = None,
+    ):
         """
         Run the flow.
 
-        The flow is processed by the LLM and the results are saved in a JSON file.
+        The flow is processed by the LLM and the results are saved in a JSON file. If a task fails, the error is kept in the flow's error attribute.
+
+        :param checkpoint: A checkpoint of an earlier run of the flow to resume from. Its finished tasks are skipped, and its output directory is used again.
+        :type checkpoint: dict, optional
+        :param on_checkpoint: Called with a checkpoint after each top-level task finishes, such as {"tasks_done": 1, "messages": [...], "artifacts": {...}, "output_path": "..."}.
+        :type on_checkpoint: Callable[[dict], None], optional
         """
 
         print(f"Running flow: {self.name}.")
+        FLOWS_IN_FLIGHT.inc()
+        try:
+            self._run(checkpoint, on_checkpoint)
+        finally:
+            FLOWS_IN_FLIGHT.dec()
+            FLOWS.inc(status="failed" if self.error else "done")
+
+    def _run(
+        self,
+        checkpoint: Optional[dict],
+        on_checkpoint: Optional[Callable[[dict], None]],
+    ) -> None:
+        """
+        Run the flow's tasks and save its results.
 
-        for task in self.tasks:
+        :param checkpoint: A checkpoint of an earlier run of the flow to resume from.
+        :type checkpoint: dict, optional
+        :param on_checkpoint: Called with a checkpoint after each top-level task finishes.
+        :type on_checkpoint: Callable[[dict], None], optional
+        """
+        tasks_done = 0
+        if checkpoint:
+            tasks_done = checkpoint["tasks_done"]
+            self.messages = Conversation(checkpoint["messages"])
+            self.artifacts = ArtifactStore(checkpoint.get("artifacts"))
+            if checkpoint.get("output_path"):
+                self._resume_output(checkpoint["output_path"])
+
+        for task in self.tasks[tasks_done:]:
             pre_task_messages_length = len(self.messages)
             try:
-                self._process_task(task)
+                self._process_node(task, self.messages)
                 logging.info(self.messages[pre_task_messages_length:])
             except Exception as e:
                 logging.error(e)
+                self.error = e
+                self.output.save("usage.json", self.budget.to_dict())
                 return
-
-        self.output.save("messages.json", self.messages)
+            tasks_done += 1
+            if on_checkpoint is not None:
+                on_checkpoint(
+                    {
+                        "tasks_done": tasks_done,
+                        "messages": self.messages.to_dicts(),
+                        "artifacts": self.artifacts.to_dict(),
+                        "output_path": self.output.output_path,
+                    }
+                )
+
+        self.output.save("messages.json", self.messages.to_dicts())
+        self.output.save("usage.json", self.budget.to_dict())
+        self.output.save("trace.json", self.trace.records)
+        if self.router.routes:
+            self.output.save("routes.json", self.router.get_metrics())
+        if any(
+            task.settings.semantic_cache is not None
+            for task, _ in self._iter_tasks(self.tasks)
+        ):
+            self.output.save(
+                "semantic_cache.json", self.llm.semantic_cache.get_metrics()
+            )
         print(f"Output folder: {self.output.output_path}")
 
-    def _get_initial_messages(self) -> list:
+    def _resume_output(self, output_path: str) -> None:
+        """
+        Write to the output directory of the run being resumed, which its messages refer to, instead of a new one.
+
+        :param output_path: The output directory of the run.
+        :type output_path: str
+        """
+        if output_path == self.output.output_path:
+            return
+        try:
+            os.rmdir(self.output.output_path)
+        except OSError:
+            pass
+        self.output = Output(self.name, output_path)
+
+    def _get_initial_messages(self) -> Conversation:
         """
         Get initial system and user messages.
 
-        :return: A list of initial messages.
-        :rtype: list
+        :return: A conversation with the initial messages.
+        :rtype: Conversation
         """
-        messages = []
+        messages = Conversation()
         if self.system_message:
             messages.append({"role": "system", "content": self.system_message})
         return messages
 
     def _get_functions(self) -> list:
         """
-        Get function definitions for tasks with function calls.
+        Get function definitions for tasks with function calls. The prefix puts them in a canonical order.
         """
         return [
             Function(task.settings.function_call, self.output).definition
-            for task in self.tasks
+            for task, _ in self._iter_tasks(self.tasks)
             if task.settings.function_call is not None
         ]
 
-    def _process_task(self, task: Task):
+    def _process_node(
+        self, node: Node, messages: Conversation, scope: Optional[dict] = None
+    ) -> None:
+        """
+        Process a task, loop or condition.
+
+        :param node: The task, loop or condition to be processed.
+        :type node: Node
+        :param messages: The messages of the scope the node runs in.
+        :type messages: Conversation
+        :param scope: The items of enclosing loops by name, or None outside of loops.
+        :type scope: dict, optional
         """
-        Process a single task.
+        if isinstance(node, ForEach):
+            self._process_for_each(node, messages, scope)
+        elif isinstance(node, Condition):
+            value = self._get_value(node.predicate, messages, scope)
+            for child in node.tasks if node.holds(value) else node.else_tasks:
+                self._process_node(child, messages, scope)
+        elif scope is None:
+            self._process_task(node, messages)
+        else:
+            action = self._format_message(node.action, {**self.variables, **scope})
+            self._process_task(Task(action, node.settings), messages)
+
+    def _process_for_each(
+        self, loop: ForEach, messages: Conversation, scope: Optional[dict]
+    ) -> None:
+        """
+        Process a loop. Each iteration runs on a copy of the initial messages, and the last answer of each iteration is added to the messages of the enclosing scope.
+
+        :param loop: The loop to be processed.
+        :type loop: ForEach
+        :param messages: The messages of the scope the loop runs in.
+        :type messages: Conversation
+        :param scope: The items of enclosing loops by name, or None outside of loops.
+        :type scope: dict, optional
+        """
+        items = self._get_items(self._get_value(loop.source, messages, scope))
+
+        def iterate(item: str) -> str:
+            iteration_messages = self._get_initial_messages()
+            for child in loop.tasks:
+                self._process_node(
+                    child, iteration_messages, {**(scope or {}), loop.name: item}
+                )
+            logging.info(iteration_messages[1 if self.system_message else 0 :])
+            answers = [m.content for m in iteration_messages if m.role == "assistant"]
+            return next((answer for answer in reversed(answers) if answer), "")
+
+        with ThreadPoolExecutor(max_workers=max(loop.concurrency, 1)) as executor:
+            answers = list(executor.map(iterate, items))
+        messages.append(
+            {
+                "role": "assistant",
+                "content": "\n".join(
+                    f"{loop.name}={item}: {answer}"
+                    for item, answer in zip(items, answers)
+                ),
+            }
+        )
+
+    def _get_value(
+        self, reference: dict, messages: Conversation, scope: Optional[dict]
+    ) -> Union[str, list]:
+        """
+        Get the value a loop or condition refers to: a variable, or the latest result of a function in the scope's messages. A result passed by reference is looked up in the flow's artifacts.
+
+        :param reference: {"variable": name} or {"function_result": function name}.
+        :type reference: dict
+        :param messages: The messages of the scope.
+        :type messages: Conversation
+        :param scope: The items of enclosing loops by name, or None outside of loops.
+        :type scope: dict, optional
+        :raises ValueError: If the reference has neither a variable nor a function result.
+        :return: The value, or an empty string if the function has no result.
+        :rtype: Union[str, list]
+        """
+        if "variable" in reference:
+            return {**self.variables, **(scope or {})}[reference["variable"]]
+        if "function_result" in reference:
+            content = next(
+                (
+                    message.content or ""
+                    for message in reversed(messages)
+                    if message.role == "function"
+                    and message.name == reference["function_result"]
+                ),
+                "",
+            )
+            return self.artifacts.dereference(content)
+        raise ValueError(f"Expected a variable or function_result in: {reference}.")
+
+    @staticmethod
+    def _get_items(value: Union[str, list]) -> list:
+        """
+        Get the items of a value: the value itself if it is a list, its items if it is a JSON list, or its non-empty lines.
+
+        :param value: The value.
+        :type value: Union[str, list]
+        :return: The items, with non-string items serialized as JSON.
+        :rtype: list
+        """
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        if not isinstance(value, list):
+            value = [line.strip() for line in str(value).splitlines() if line.strip()]
+        return [item if isinstance(item, str) else json.dumps(item) for item in value]
+
+    def _process_task(self, task: Task, messages: Conversation) -> None:
+        """
+        Process a single task. Its requests count towards the flow's budget and, if the task's settings have one, the task's own budget.
 
         :param task: The task to be processed.
         :type task: Task
+        :param messages: The messages of the scope the task runs in.
+        :type messages: Conversation
+        """
+        task_budget = None
+        if task.settings.token_budget or task.settings.cost_budget:
+            task_budget = Budget(
+                task.settings.token_budget,
+                task.settings.cost_budget,
+                self.budget.on_exceed,
+                self.budget.downgrade_model,
+                name="task budget",
+            )
+        with use_budgets(self.budget, task_budget):
+            self._process_task_in_budget(task, messages)
+        TASKS.inc()
+
+    def _process_task_in_budget(self, task: Task, messages: Conversation) -> None:
         """
-        self.messages.append({"role": "user", "content": task.action})
+        Process a single task once its budgets are in effect.
 
-        task.settings.function_call = (
-            "none"
-            if task.settings.function_call is None
-            else {"name": task.settings.function_call}
+        :param task: The task to be processed.
+        :type task: Task
+        :param messages: The messages of the scope the task runs in.
+        :type messages: Conversation
+        """
+        messages.append({"role": "user", "content": task.action})
+
+        settings = replace(
+            task.settings,
+            function_call=(
+                "none"
+                if task.settings.function_call is None
+                else {"name": task.settings.function_call}
+            ),
         )
 
-        message = self.llm.respond(task.settings, self.messages, self.functions)
+        if settings.stream and task.settings.function_call is not None:
+            self._process_streamed_function_call(settings, messages)
+            return
+
+        message = self._respond(settings, messages)
 
         if message.content:
-            self._process_message(message)
+            self._process_message(message, messages)
         elif message.function_call:
-            self._process_function_call(message, task)
+            self._process_function_call(message, settings, messages)
 
-    def _process_message(self, message) -> None:
+    def _process_message(self, message, messages: Conversation) -> None:
         """
         Process a message from the assistant.
 
         :param message: The message from the assistant.
         :type message: Message
+        :param messages: The messages of the scope the task runs in.
+        :type messages: Conversation
         """
-        self.messages.append({"role": "assistant", "content": message.content})
+        messages.append({"role": "assistant", "content": message.content})
 
-    def _process_function_call(self, message, task: Task) -> None:
+    def _process_function_call(
+        self, message, settings: Settings, messages: Conversation
+    ) -> None:
         """
-        Process a function call from the assistant.
+        Process a function call from the assistant. If the function fails or times out, the assistant gets the error as the function's result.
 
         :param message: The message from the assistant.
         :type message: Message
-        :param task: The task to be processed.
-        :type task: Task
+        :param settings: The settings of the task.
+        :type settings: Settings
+        :param messages: The messages of the scope the task runs in.
+        :type messages: Conversation
+        """
+        function = self._get_function(message.function_call.name, settings)
+        try:
+            function_content = function.execute(message.function_call.arguments)
+        except Exception as e:
+            function_content = self._function_error(message.function_call.name, e)
+        self._process_function_result(
+            message.function_call.name,
+            message.function_call.arguments,
+            function_content,
+            settings,
+            messages,
+        )
+
+    def _process_streamed_function_call(
+        self, settings: Settings, messages: Conversation
+    ) -> None:
+        """
+        Process a task whose function call is streamed. The function runs on the arguments as they arrive, so it can write large arguments out without holding them, and the follow-up request is sent as soon as it returns. The function call is recorded with a note of where such arguments were written in their place. If the function fails or times out, the assistant gets the error as the function's result; if the stream fails, the task does.
+
+        :param settings: The settings of the task.
+        :type settings: Settings
+        :param messages: The messages of the scope the task runs in.
+        :type messages: Conversation
         """
-        self.messages.append(
+        with self.trace.call(
+            model=settings.model,
+            messages=len(messages),
+            prefix_hash=self.prefix.hash,
+            prefix_hit=self.prefix.record_call(),
+            streamed=True,
+        ):
+            response = self.llm.respond_stream(settings, messages, self.functions)
+            if response.function_name is None:
+                messages.append({"role": "assistant", "content": response.read()})
+                return
+            function = self._get_function(response.function_name, settings)
+            try:
+                function_content = function.execute_stream(
+                    response.fragments(keep=False)
+                )
+            except Exception as e:
+                if response.error is not None:
+                    raise
+                function_content = self._function_error(response.function_name, e)
+            response.skip()
+        self._process_function_result(
+            response.function_name,
+            function.streamed_arguments,
+            function_content,
+            settings,
+            messages,
+        )
+
+    def _get_function(self, name: str, settings: Settings) -> Function:
+        """
+        Get a function to execute for a task, with the task's timeout and isolation.
+
+        :param name: The name of the function.
+        :type name: str
+        :param settings: The settings of the task.
+        :type settings: Settings
+        :return: The function.
+        :rtype: Function
+        """
+        return Function(
+            name,
+            self.output,
+            self.artifacts,
+            timeout=settings.function_timeout,
+            isolated=settings.isolate_function,
+        )
+
+    @staticmethod
+    def _function_error(name: str, error: Exception) -> str:
+        """
+        Log a function's error and get the result the assistant sees instead of the function's.
+
+        :param name: The name of the function.
+        :type name: str
+        :param error: The error.
+        :type error: Exception
+        :return: The error in JSON format.
+        :rtype: str
+        """
+        logging.warning(f"Function {name} failed: {error!r}")
+        return format_error(error)
+
+    def _process_function_result(
+        self,
+        name: str,
+        arguments: str,
+        function_content: str,
+        settings: Settings,
+        messages: Conversation,
+    ) -> None:
+        """
+        Add a function call and its result to the messages, and get the assistant's response to the result. If the task passes results by reference, the result is stored in the flow's artifacts and the messages only get its handle.
+
+        :param name: The name of the function.
+        :type name: str
+        :param arguments: The arguments of the function call, in JSON format.
+        :type arguments: str
+        :param function_content: The result of the function.
+        :type function_content: str
+        :param settings: The settings of the task.
+        :type settings: Settings
+        :param messages: The messages of the scope the task runs in.
+        :type messages: Conversation
+        """
+        messages.append(
             {
                 "role": "assistant",
-                "content": message.content,
-                "function_call": {
-                    "name": message.function_call.name,
-                    "arguments": message.function_call.arguments,
-                },
+                "content": None,
+                "function_call": {"name": name, "arguments": arguments},
             }
         )
-        function = Function(message.function_call.name, self.output)
-        function_content = function.execute(message.function_call.arguments)
-        self.messages.append(
-            {
-                "role": "function",
-                "content": function_content,
-                "name": message.function_call.name,
-            }
+        if settings.by_reference:
+            function_content = self.artifacts.reference(name, function_content)
+        messages.append({"role": "function", "content": function_content, "name": name})
+        message = self._respond(
+            replace(settings, function_call="none", stream=False), messages
         )
-        task.settings.function_call = "none"
-        message = self.llm.respond(task.settings, self.messages, self.functions)
-        self._process_message(message)
+        self._process_message(message, messages)
+
+    def _respond(self, settings: Settings, messages: Conversation):
+        """
+        Get a response from the model chosen for the task by the flow's routes, and trace the call with the hash of the prompt prefix that was sent.
+
+        :param settings: The settings of the task.
+        :type settings: Settings
+        :param messages: The messages to send.
+        :type messages: Conversation
+        :return: The message from the assistant.
+        :rtype: Message
+        """
+        with self.trace.call(
+            model=settings.model,
+            messages=len(messages),
+            prefix_hash=self.prefix.hash,
+            prefix_hit=self.prefix.record_call(),
+        ):
+            return self.router.respond(self.llm, settings, messages, self.functions)
@@ -1,19 +1,54 @@
 """
 This module provides classes for managing functions. It includes an abstract base class for functions and a class for managing function instances.
+
+Functions that declare themselves CPU-bound are executed in a shared pool of processes so they do not hold the GIL of the process running the flow. Functions can also declare a timeout, and ask to run each call in a process of their own.
 """
 
+import asyncio
+import contextvars
 import importlib
+import inspect
 import json
+import multiprocessing
+import os
+import pkgutil
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing.connection import Connection
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+    TypeVar,
+)
 
+from agentflow.artifacts import ArtifactStore
+from agentflow.metrics import FUNCTION_ERRORS, FUNCTION_SECONDS
 from agentflow.output import Output
+from agentflow.streaming import ArgumentParser
+
+T = TypeVar("T")
 
 
 class BaseFunction(ABC):
     """
     This abstract base class defines the interface for functions.
+
+    Subclasses whose work is mostly CPU-bound, such as parsing, should set cpu_bound to True so they are executed in the shared process pool. Their arguments, results and output object must be picklable. Subclasses that wait on the network and then do CPU-bound work should instead pass just that work to run_cpu_bound, so slow hosts don't hold pool workers.
+
+    Subclasses that wait on other services should set timeout to the seconds a call may take. Threads can't be stopped, so functions that run in the flow's process and do long work should check cancelled() between steps and return early; a thread that doesn't check it keeps running after the call has timed out, and holds what it uses until it finishes. Async functions, whose execute is a coroutine, are cancelled instead. CPU-bound functions with a timeout run each call in a new process, which is killed if it times out. Subclasses that are untrusted, or that leak memory or state, should set isolated to True so each call runs in a new process, which is killed if it times out. Their arguments, results and output object must be picklable too.
     """
 
+    cpu_bound = False
+    timeout: Optional[float] = None
+    isolated = False
+
     def __init__(self, output: Output):
         """
         Initializes the BaseFunction object with an output object.
@@ -45,13 +80,87 @@ class BaseFunction(ABC):
         """
         pass
 
+    def cancelled(self) -> bool:
+        """
+        Returns whether the call running in this thread has timed out, and should stop.
+
+        :return: Whether the call has timed out.
+        :rtype: bool
+        """
+        event = getattr(_cancellation, "event", None)
+        return event is not None and event.is_set()
+
+    def open_stream(self, name: str, arguments: Dict[str, Any]) -> Optional[TextIO]:
+        """
+        Returns a file to write a string argument to as it is streamed, or None to receive the argument whole. The file's name is the path it is written to. Functions that can use large arguments before they are complete override this, and execute_streamed if they don't need the argument read back.
+
+        :param name: The name of the argument.
+        :type name: str
+        :param arguments: The arguments that were complete before this one started.
+        :type arguments: Dict[str, Any]
+        :return: The file, or None.
+        :rtype: Optional[TextIO]
+        """
+        return None
+
+    def execute_streamed(
+        self, arguments: Dict[str, Any], streamed: Dict[str, str]
+    ) -> str:
+        """
+        Executes the function once its arguments have been streamed. By default, the streamed arguments are read back from their files and the function is executed with all of its arguments.
+
+        :param arguments: The arguments that were received whole.
+        :type arguments: Dict[str, Any]
+        :param streamed: The paths of the files the streamed arguments were written to from open_stream, which are closed, by the names of the arguments.
+        :type streamed: Dict[str, str]
+        :return: The result of the function execution.
+        :rtype: str
+        """
+        arguments = dict(arguments)
+        for name, path in streamed.items():
+            with open(path) as file:
+                arguments[name] = file.read()
+        return self.execute(**arguments)
+
+
+class FunctionTimeout(TimeoutError):
+    """
+    Raised when a function call does not finish within its timeout.
+    """
+
+
+def format_error(error: Exception) -> str:
+    """
+    Returns the result the LLM sees for a function call that failed, in place of the function's result.
+
+    :param error: The error the call failed with.
+    :type error: Exception
+    :return: The error's type and message in JSON format.
+    :rtype: str
+    """
+    return json.dumps({"error": type(error).__name__, "message": str(error)})
+
+
+_cancellation = threading.local()
+
 
 class Function:
     """
     This class is responsible for managing function instances.
+
+    Set use_process_pool to False to execute CPU-bound functions in the calling process.
     """
 
-    def __init__(self, function_name: str, output: Output):
+    use_process_pool = True
+
+    def __init__(
+        self,
+        function_name: str,
+        output: Output,
+        artifacts: Optional[ArtifactStore] = None,
+        timeout: Optional[float] = None,
+        isolated: bool = False,
+    ):
         """
         Initializes the Function object by importing the function module and creating an instance of the function class.
 
@@ -59,11 +168,22 @@ class Function:
         :type function_name: str
         :param output: The output object.
         :type output: Output
+        :param artifacts: The store of the flow's results passed by reference. Handles in the arguments are replaced with their results.
+        :type artifacts: ArtifactStore, optional
+        :param timeout: The seconds a call may take, in place of the function's own timeout.
+        :type timeout: float, optional
+        :param isolated: Whether to run each call in a new process, even if the function doesn't ask for it.
+        :type isolated: bool, optional
         """
+        self.function_name = function_name
+        self.artifacts = artifacts
         self.module = importlib.import_module(f"agentflow.functions.{function_name}")
         function_class_name = function_name.replace("_", " ").title().replace(" ", "")
         self.function_class = getattr(self.module, function_class_name)
         self.instance = self.function_class(output)
+        self.timeout = timeout if timeout is not None else self.instance.timeout
+        self.isolated = isolated or self.instance.isolated
+        self.streamed_arguments: Optional[str] = None
 
     @property
     def definition(self) -> dict:
@@ -79,10 +199,368 @@ class Function:
         """
         Executes the function instance with the given arguments.
 
+        Isolated functions run in a new process, CPU-bound functions in the shared process pool and others in the calling process. CPU-bound functions with a timeout run in a new process too, as a worker of the pool can't be killed without breaking the pool. A call that outlasts the timeout raises FunctionTimeout as soon as it expires: its process is killed, an async function is cancelled and other calls are asked to stop through cancelled(). A thread that doesn't check cancelled() keeps running until it finishes, as threads can't be stopped.
+
         :param args_json: The arguments in JSON format as a string.
         :type args_json: str
+        :raises FunctionTimeout: If the call does not finish within the timeout.
         :return: The result of the function execution.
         :rtype: str
         """
-        args_dict = json.loads(args_json)
-        return self.instance.execute(**args_dict)
+        return self._measure(lambda: self._execute(args_json))
+
+    def _execute(self, args_json: str) -> str:
+        """
+        Executes the function instance with the given arguments, where the function asks to run.
+        """
+        if self.artifacts is not None and "@result:" in args_json:
+            args_json = json.dumps(self.artifacts.resolve(json.loads(args_json)))
+        if self._in_new_process():
+            return _execute_isolated(
+                self.function_name, self.instance.output, args_json, self.timeout
+            )
+        if self.instance.cpu_bound and self.use_process_pool:
+            return (
+                get_process_pool()
+                .submit(
+                    _execute_in_process,
+                    self.function_name,
+                    self.instance.output,
+                    args_json,
+                )
+                .result()
+            )
+        return self._call(self.instance.execute, **json.loads(args_json))
+
+    def _in_new_process(self) -> bool:
+        """
+        Returns whether calls run in a new process: those of isolated functions, and of CPU-bound functions with a timeout, so the process can be killed when it expires.
+        """
+        return self.isolated or (
+            self.instance.cpu_bound
+            and self.use_process_pool
+            and self.timeout is not None
+        )
+
+    def execute_stream(self, fragments: Iterable[str]) -> str:
+        """
+        Executes the function instance with arguments that are streamed. String arguments the function opens a stream for are written as they arrive, without resolving handles or holding them; the others are collected. Isolated functions, and CPU-bound functions in the process pool, receive their arguments whole. The timeout applies once the arguments are complete.
+
+        The arguments to record for the call, with each streamed argument replaced by a note of where it was written, are kept in streamed_arguments, even if the call fails.
+
+        :param fragments: The fragments of the arguments in JSON format.
+        :type fragments: Iterable[str]
+        :raises ValueError: If the arguments are not a valid JSON object.
+        :raises FunctionTimeout: If the call does not finish within the timeout.
+        :return: The result of the function execution.
+        :rtype: str
+        """
+        if self._in_new_process() or (
+            self.instance.cpu_bound and self.use_process_pool
+        ):
+            self.streamed_arguments = "".join(fragments)
+            return self.execute(self.streamed_arguments)
+
+        parser = ArgumentParser()
+        arguments: Dict[str, Any] = {}
+        streams: Dict[str, TextIO] = {}
+        lengths: Dict[str, int] = {}
+        parts: Dict[str, List[str]] = {}
+        try:
+            for fragment in fragments:
+                for event, name, value in parser.feed(fragment):
+                    if event == "start":
+                        stream = self.instance.open_stream(name, arguments)
+                        if stream is None:
+                            parts[name] = []
+                        else:
+                            streams[name] = stream
+                            lengths[name] = 0
+                    elif event == "chunk" and name in streams:
+                        streams[name].write(value)
+                        lengths[name] += len(value)
+                    elif event == "chunk":
+                        parts[name].append(value)
+                    elif event == "end" and name in streams:
+                        streams[name].close()
+                    elif event == "end":
+                        arguments[name] = "".join(parts.pop(name))
+                    else:
+                        arguments[name] = value
+            parser.close()
+        finally:
+            for stream in streams.values():
+                stream.close()
+            self.streamed_arguments = json.dumps(
+                {
+                    **arguments,
+                    **{
+                        name: f"[{lengths[name]} characters streamed to {stream.name}]"
+                        for name, stream in streams.items()
+                    },
+                }
+            )
+        if self.artifacts is not None:
+            arguments = self.artifacts.resolve(arguments)
+        if streams:
+            paths = {name: stream.name for name, stream in streams.items()}
+            return self._measure(
+                lambda: self._call(self.instance.execute_streamed, arguments, paths)
+            )
+        return self._measure(lambda: self._call(self.instance.execute, **arguments))
+
+    def _measure(self, execute: Callable[[], str]) -> str:
+        """
+        Runs an execution of the function, recording its time and, if it fails, why.
+
+        :param execute: The execution.
+        :type execute: Callable[[], str]
+        :return: The result of the function execution.
+        :rtype: str
+        """
+        try:
+            with FUNCTION_SECONDS.time(function=self.function_name):
+                return execute()
+        except FunctionTimeout:
+            FUNCTION_ERRORS.inc(function=self.function_name, reason="timeout")
+            raise
+        except Exception:
+            FUNCTION_ERRORS.inc(function=self.function_name, reason="error")
+            raise
+
+    def _call(self, method: Callable[..., Any], *args: Any, **kwargs: Any) -> str:
+        """
+        Calls a method of the function instance in the calling process, within the timeout. A coroutine is run until it finishes, or cancelled when the timeout expires. Other methods run in a thread of their own when there is a timeout, so the caller can return when it expires, and the thread's cancelled() is set. The thread is not reclaimed until the method returns.
+
+        :param method: The method.
+        :type method: Callable[..., Any]
+        :param args: The positional arguments.
+        :param kwargs: The keyword arguments.
+        :raises FunctionTimeout: If the call does not finish within the timeout.
+        :return: The result of the method.
+        :rtype: str
+        """
+        if inspect.iscoroutinefunction(method):
+            return asyncio.run(self._await(method(*args, **kwargs)))
+        if self.timeout is None:
+            return method(*args, **kwargs)
+
+        event = threading.Event()
+        outcome: Dict[str, Any] = {}
+
+        def run() -> None:
+            _cancellation.event = event
+            try:
+                outcome["result"] = method(*args, **kwargs)
+            except Exception as e:
+                outcome["error"] = e
+
+        thread = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(run,),
+            name=f"function-{self.function_name}",
+            daemon=True,
+        )
+        thread.start()
+        thread.join(self.timeout)
+        if thread.is_alive():
+            event.set()
+            raise self._timeout_error()
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome["result"]
+
+    async def _await(self, coroutine: Any) -> str:
+        """
+        Awaits a coroutine of the function instance, cancelling it if it does not finish within the timeout.
+        """
+        task = asyncio.ensure_future(coroutine)
+        done, _ = await asyncio.wait({task}, timeout=self.timeout)
+        if not done:
+            task.cancel()
+            await asyncio.wait({task})
+            raise self._timeout_error()
+        return task.result()
+
+    def _timeout_error(self) -> FunctionTimeout:
+        """
+        Returns the error for a call that did not finish within the timeout.
+        """
+        return FunctionTimeout(
+            f"{self.function_name} did not finish within {self.timeout} seconds."
+        )
+
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+_process_instances: Dict[Tuple[str, str], Function] = {}
+
+
+def get_process_pool(max_workers: int = None) -> ProcessPoolExecutor:
+    """
+    Returns the process pool shared by CPU-bound functions, creating and warming it if needed. Each worker imports all function modules when it starts.
+
+    :param max_workers: The number of processes. Defaults to the number of CPUs. Ignored if the pool already exists.
+    :type max_workers: int, optional
+    :return: The process pool.
+    :rtype: ProcessPoolExecutor
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            max_workers = max_workers or os.cpu_count() or 1
+            _process_pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=import_functions,
+            )
+            # Start every worker now rather than on the first function calls.
+            wait([_process_pool.submit(os.getpid) for _ in range(max_workers)])
+        return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    """
+    Shuts down the shared process pool. It is recreated on the next call to get_process_pool.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown()
+            _process_pool = None
+
+
+def run_cpu_bound(step: Callable[..., T], *args: Any) -> T:
+    """
+    Runs a CPU-bound step of a function, such as parsing a page it has fetched, in the shared process pool. The step runs in the calling process if Function.use_process_pool is False, or if the caller is itself a worker or isolated process. Steps should be short, as a step keeps its worker until it finishes even if the call it is part of times out.
+
+    :param step: The step, which must be picklable, such as a module-level function.
+    :type step: Callable[..., T]
+    :param args: The arguments of the step, which must be picklable.
+    :return: The result of the step.
+    :rtype: T
+    """
+    if not Function.use_process_pool or multiprocessing.parent_process() is not None:
+        return step(*args)
+    return get_process_pool().submit(step, *args).result()
+
+
+def import_functions() -> None:
+    """
+    Imports all function modules, so workers are ready before their first call.
+    """
+    package = importlib.import_module("agentflow.functions")
+    for module in pkgutil.iter_modules(package.__path__):
+        importlib.import_module(f"agentflow.functions.{module.name}")
+
+
+def _execute_in_process(function_name: str, output: Output, args_json: str) -> str:
+    """
+    Executes a function in a worker process. Function instances are reused across calls for the same output directory.
+
+    :param function_name: The name of the function.
+    :type function_name: str
+    :param output: The output object of the flow.
+    :type output: Output
+    :param args_json: The arguments in JSON format as a string.
+    :type args_json: str
+    :return: The result of the function execution.
+    :rtype: str
+    """
+    key = (function_name, output.output_path)
+    if key not in _process_instances:
+        if len(_process_instances) >= 128:
+            _process_instances.pop(next(iter(_process_instances)))
+        _process_instances[key] = Function(function_name, output)
+    function = _process_instances[key]
+    return _complete(function.instance.execute(**json.loads(args_json)))
+
+
+def _execute_isolated(
+    function_name: str, output: Output, args_json: str, timeout: Optional[float]
+) -> str:
+    """
+    Executes a function in a new process, which is killed if it does not finish within the timeout.
+
+    :param function_name: The name of the function.
+    :type function_name: str
+    :param output: The output object of the flow.
+    :type output: Output
+    :param args_json: The arguments in JSON format as a string.
+    :type args_json: str
+    :param timeout: The seconds the call may take, or None to wait until it finishes.
+    :type timeout: float, optional
+    :raises FunctionTimeout: If the call does not finish within the timeout.
+    :raises RuntimeError: If the process exits without a result, such as when it crashes.
+    :return: The result of the function execution.
+    :rtype: str
+    """
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_execute_and_send,
+        args=(sender, function_name, output, args_json),
+        daemon=True,
+    )
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            raise FunctionTimeout(
+                f"{function_name} did not finish within {timeout} seconds."
+            )
+        try:
+            succeeded, value = receiver.recv()
+        except EOFError:
+            process.join()
+            raise RuntimeError(
+                f"{function_name} exited with code {process.exitcode} without a result."
+            ) from None
+    finally:
+        receiver.close()
+        if process.is_alive():
+            process.kill()
+        process.join()
+    if not succeeded:
+        raise value
+    return value
+
+
+def _execute_and_send(
+    connection: Connection, function_name: str, output: Output, args_json: str
+) -> None:
+    """
+    Executes a function in an isolated process and sends whether it succeeded, with its result or error, to the parent.
+
+    :param connection: The connection to the parent.
+    :type connection: Connection
+    :param function_name: The name of the function.
+    :type function_name: str
+    :param output: The output object of the flow.
+    :type output: Output
+    :param args_json: The arguments in JSON format as a string.
+    :type args_json: str
+    """
+    try:
+        instance = Function(function_name, output).instance
+        outcome = (True, _complete(instance.execute(**json.loads(args_json))))
+    except Exception as e:
+        outcome = (False, e)
+    try:
+        connection.send(outcome)
+    except Exception:
+        # The result or error could not be pickled.
+        connection.send((False, RuntimeError(repr(outcome[1]))))
+    connection.close()
+
+
+def _complete(result: Any) -> Any:
+    """
+    Runs the coroutine an async function returns until it finishes. Other results are returned as they are.
+
+    :param result: The result of the function's execute method.
+    :type result: Any
+    :return: The result.
+    :rtype: Any
+    """
+    return asyncio.run(result) if inspect.iscoroutine(result) else result
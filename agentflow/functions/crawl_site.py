@@ -0,0 +1,249 @@
+"""
+This module contains a class for crawling a website. Pages are fetched concurrently, within limits per host, and their text is saved to the output directory as each one arrives. The function returns an index of the saved pages rather than their contents.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urldefrag, urlencode, urljoin, urlsplit, urlunsplit
+
+from bs4 import BeautifulSoup
+from requests.structures import CaseInsensitiveDict
+
+from agentflow.function import BaseFunction
+from agentflow.functions.get_url import USER_AGENT
+from agentflow.http_cache import fetch
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str, base: Optional[str] = None) -> Optional[str]:
+    """
+    Normalizes a URL so that different spellings of the same page are crawled once: it is made absolute, its fragment is removed, its scheme and host are lower-cased, default ports are dropped, an empty path becomes / and query parameters are sorted.
+
+    :param url: The URL, which may be relative.
+    :type url: str
+    :param base: The URL of the page the URL was found on.
+    :type base: str, optional
+    :return: The normalized URL, or None if it is not an HTTP or HTTPS URL.
+    :rtype: Optional[str]
+    """
+    url, _ = urldefrag(urljoin(base, url.strip()) if base else url.strip())
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+    host = parts.hostname.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        return None
+    if port and port != DEFAULT_PORTS[scheme]:
+        host = f"{host}:{port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+class HostLimiter:
+    """
+    This class is responsible for politeness towards each host: at most max_per_host requests to a host at once, and at least delay seconds between the starts of its requests.
+
+    :param max_per_host: The maximum number of concurrent requests to a host.
+    :type max_per_host: int
+    :param delay: The minimum number of seconds between requests to a host.
+    :type delay: float
+    """
+
+    def __init__(self, max_per_host: int, delay: float):
+        self.delay = delay
+        self._semaphores = defaultdict(lambda: threading.Semaphore(max_per_host))
+        self._next_start: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def acquire(self, host: str) -> None:
+        """
+        Waits until a request to a host may start.
+
+        :param host: The host.
+        :type host: str
+        """
+        with self._lock:
+            semaphore = self._semaphores[host]
+        semaphore.acquire()
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start[host])
+            self._next_start[host] = start + self.delay
+        time.sleep(start - now)
+
+    def release(self, host: str) -> None:
+        """
+        Marks a request to a host as finished.
+
+        :param host: The host.
+        :type host: str
+        """
+        with self._lock:
+            semaphore = self._semaphores[host]
+        semaphore.release()
+
+
+class CrawlSite(BaseFunction):
+    """
+    This class inherits from the BaseFunction class. It defines a function for crawling a website from a seed URL, breadth first.
+
+    Pages are fetched through the HTTP cache by up to max_workers threads, with at most max_per_host requests to a host at once and delay seconds between them. If the call times out, pages that haven't started are not fetched.
+    """
+
+    max_workers = 16
+    max_per_host = 4
+    delay = 0.05
+    max_page_limit = 1000
+    directory = "crawl"
+
+    def get_definition(self) -> dict:
+        """
+        Returns a dictionary that defines the function. It includes the function's name, description, and parameters.
+
+        :return: A dictionary that defines the function.
+        :rtype: dict
+        """
+        return {
+            "name": "crawl_site",
+            "description": "Crawl a website from a URL, following links. Saves the text of each page to a file and returns an index of the files, not their contents.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "url": {
+                        "type": "string",
+                        "description": "The URL to start crawling from.",
+                    },
+                    "depth": {
+                        "type": "integer",
+                        "default": 2,
+                        "description": "How many links away from the URL to follow. 0 only fetches the URL.",
+                    },
+                    "max_pages": {
+                        "type": "integer",
+                        "default": 50,
+                        "description": "The maximum number of pages to fetch.",
+                    },
+                    "same_domain": {
+                        "type": "boolean",
+                        "default": True,
+                        "description": "Whether to only follow links to the URL's host.",
+                    },
+                },
+                "required": ["url"],
+            },
+        }
+
+    def execute(
+        self, url: str, depth: int = 2, max_pages: int = 50, same_domain: bool = True
+    ) -> str:
+        """
+        Crawls a website and saves the text of each page to the crawl directory of the output directory.
+
+        :param url: The URL to start crawling from.
+        :type url: str
+        :param depth: How many links away from the URL to follow.
+        :type depth: int
+        :param max_pages: The maximum number of pages to fetch.
+        :type max_pages: int
+        :param same_domain: Whether to only follow links to the URL's host.
+        :type same_domain: bool
+        :raises ValueError: If the URL is not an HTTP or HTTPS URL.
+        :return: The index of the crawl in JSON format: for each page, its URL, title, depth and file, or its error.
+        :rtype: str
+        """
+        seed = normalize_url(url)
+        if seed is None:
+            raise ValueError(f"Cannot crawl {url}.")
+        max_pages = max(1, min(max_pages, self.max_page_limit))
+        os.makedirs(
+            os.path.join(self.output.output_path, self.directory), exist_ok=True
+        )
+        limiter = HostLimiter(self.max_per_host, self.delay)
+        seed_host = urlsplit(seed).netloc
+        seen: Set[str] = {seed}
+        pages: List[dict] = []
+        running: Dict[Future, Tuple[str, int]] = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running[executor.submit(self._crawl_page, seed, 1, limiter)] = (seed, 0)
+            while running:
+                if self.cancelled():
+                    for future in running:
+                        future.cancel()
+                    break
+                done, _ = wait(running, timeout=1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page_url, page_depth = running.pop(future)
+                    page, links = future.result()
+                    pages.append({"url": page_url, "depth": page_depth, **page})
+                    if page_depth >= depth:
+                        continue
+                    for link in links:
+                        if len(seen) >= max_pages:
+                            break
+                        if link in seen or (
+                            same_domain and urlsplit(link).netloc != seed_host
+                        ):
+                            continue
+                        seen.add(link)
+                        child = executor.submit(
+                            self._crawl_page, link, len(seen), limiter
+                        )
+                        running[child] = (link, page_depth + 1)
+
+        pages.sort(key=lambda page: (page["depth"], page["url"]))
+        index = {"directory": self.directory, "pages": pages}
+        self.output.save(os.path.join(self.directory, "index.json"), index)
+        return json.dumps(index)
+
+    def _crawl_page(
+        self, url: str, number: int, limiter: HostLimiter
+    ) -> Tuple[dict, List[str]]:
+        """
+        Fetches a page, saves its text and returns its entry in the index with its links.
+
+        :param url: The URL of the page.
+        :type url: str
+        :param number: The number of the page, used for its file name.
+        :type number: int
+        :param limiter: The limiter of requests per host.
+        :type limiter: HostLimiter
+        :return: The page's entry in the index, and the normalized URLs it links to.
+        :rtype: Tuple[dict, List[str]]
+        """
+        host = urlsplit(url).netloc
+        limiter.acquire(host)
+        try:
+            response = fetch(url, headers={"User-Agent": USER_AGENT})
+        except Exception as e:
+            return {"error": str(e)}, []
+        finally:
+            limiter.release(host)
+        if response.status_code != 200:
+            return {"error": f"HTTP status code {response.status_code}"}, []
+        content_type = CaseInsensitiveDict(response.headers).get(
+            "Content-Type", "text/html"
+        )
+        if "html" not in content_type and not content_type.startswith("text/"):
+            return {"error": f"Skipped content type {content_type}"}, []
+
+        soup = BeautifulSoup(response.text, "html.parser")
+        title = soup.title.get_text(strip=True) if soup.title else ""
+        links = []
+        for anchor in soup.find_all("a", href=True):
+            link = normalize_url(anchor["href"], url)
+            if link is not None:
+                links.append(link)
+        text = soup.get_text()
+        file_name = os.path.join(self.directory, f"{number:04d}.txt")
+        self.output.save(file_name, text)
+        return {"title": title, "file": file_name, "characters": len(text)}, links
@@ -9,6 +9,8 @@ import openai
 import requests
 
 from agentflow.function import BaseFunction
+from agentflow.http_cache import FETCH_TIMEOUT
+from agentflow.llm import LLM
 
 
 class CreateImage(BaseFunction):
@@ -71,7 +73,7 @@ class CreateImage(BaseFunction):
 
     def _create_image(self, prompt: str, n: int, size: str) -> str:
         """
-        Creates an image from a description using OpenAI's API.
+        Creates an image from a description using OpenAI's API, at one of the default endpoints.
 
         :param prompt: The prompt that describes the image.
         :type prompt: str
@@ -82,7 +84,15 @@ class CreateImage(BaseFunction):
         :return: The URL of the image.
         :rtype: str
         """
-        response = openai.Image.create(prompt=prompt, n=n, size=size)
+        response = LLM.get_default_endpoints().send(
+            lambda endpoint: openai.Image.create(
+                prompt=prompt,
+                n=n,
+                size=size,
+                api_key=endpoint.get_api_key(),
+                api_base=endpoint.get_api_base(),
+            )
+        )
         return response["data"][0]["url"]
 
     def _download_and_save_image(self, image_url: str, image_path: str) -> None:
@@ -94,6 +104,6 @@ class CreateImage(BaseFunction):
         :param image_path: The path to the image.
         :type image_path: str
         """
-        image_data = requests.get(image_url).content
+        image_data = requests.get(image_url, timeout=FETCH_TIMEOUT).content
         with open(image_path, "wb") as handler:
             handler.write(image_data)
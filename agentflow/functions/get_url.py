@@ -1,14 +1,20 @@
-import requests
 from bs4 import BeautifulSoup
 
-from agentflow.function import BaseFunction
+from agentflow.function import BaseFunction, run_cpu_bound
+from agentflow.http_cache import fetch
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
 
 
 class GetUrl(BaseFunction):
     """
     This class inherits from the BaseFunction class. It defines a function for fetching the contents of a URL.
+
+    The page is fetched in the calling process, and only converting HTML to text, which holds the GIL, runs in the shared process pool. Pages and their text are fetched through the HTTP cache, so unchanged pages are neither downloaded nor parsed again. Connections and reads time out as set by FETCH_TIMEOUT in agentflow.http_cache, and a whole call after timeout seconds, so a slow host can't hold up the flow.
     """
 
+    timeout = 60
+
     def get_definition(self) -> dict:
         """
         Returns a dictionary that defines the function. It includes the function's name, description, and parameters.
@@ -45,20 +51,31 @@ class GetUrl(BaseFunction):
         :type url: str
         :param format: The format of the returned content. If 'html', the full HTML will be returned. If 'text', only the text will be returned.
         :type format: str
+        :raises Exception: If the response's status code is not 200.
         :return: The contents of the URL.
         :rtype: str
         """
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
-        }
-        response = requests.get(url, headers=headers)
+        response = fetch(url, headers={"User-Agent": USER_AGENT})
         if response.status_code == 200:
             if format == "html":
                 return response.text
             elif format == "text":
-                soup = BeautifulSoup(response.text, "html.parser")
-                return soup.get_text()
+                return response.derive(
+                    "text", lambda html: run_cpu_bound(html_to_text, html)
+                )
         else:
             raise Exception(
                 f"Failed to fetch URL. HTTP status code: {response.status_code}"
             )
+
+
+def html_to_text(html: str) -> str:
+    """
+    Converts HTML to its text.
+
+    :param html: The HTML.
+    :type html: str
+    :return: The text.
+    :rtype: str
+    """
+    return BeautifulSoup(html, "html.parser").get_text()
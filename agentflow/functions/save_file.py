@@ -2,6 +2,9 @@
 This module contains a class for saving a file to the output directory. The file's name and contents are provided as parameters.
 """
 
+import os
+from typing import Any, Dict, Optional, TextIO
+
 from agentflow.function import BaseFunction
 
 
@@ -48,3 +51,33 @@ class SaveFile(BaseFunction):
         :rtype: str
         """
         return self.output.save(file_name, file_contents)
+
+    def open_stream(self, name: str, arguments: Dict[str, Any]) -> Optional[TextIO]:
+        """
+        Opens the file for the contents as they are streamed, if its name has already arrived.
+
+        :param name: The name of the argument.
+        :type name: str
+        :param arguments: The arguments that were complete before this one started.
+        :type arguments: Dict[str, Any]
+        :return: The open file, or None.
+        :rtype: Optional[TextIO]
+        """
+        if name == "file_contents" and "file_name" in arguments:
+            return self.output.open(arguments["file_name"])
+        return None
+
+    def execute_streamed(
+        self, arguments: Dict[str, Any], streamed: Dict[str, str]
+    ) -> str:
+        """
+        Returns the path to the file, whose contents were written as they were streamed.
+
+        :param arguments: The arguments that were received whole.
+        :type arguments: Dict[str, Any]
+        :param streamed: The paths of the files of the streamed arguments, by their names.
+        :type streamed: Dict[str, str]
+        :return: The path to the saved file.
+        :rtype: str
+        """
+        return os.path.join(self.output.output_path, arguments["file_name"])
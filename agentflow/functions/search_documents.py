@@ -0,0 +1,80 @@
+"""
+This module contains a class for searching a local document index, built with index_documents.py, for the passages most relevant to a query.
+"""
+
+import os
+
+from agentflow.function import BaseFunction
+from agentflow.retrieval import open_index
+
+
+class SearchDocuments(BaseFunction):
+    """
+    This class inherits from the BaseFunction class. It defines a function for searching local documents. Only the top passages are returned, so only they are added to the messages.
+
+    Indexes are directories in indexes_path, which is agentflow/indexes unless the AGENTFLOW_INDEXES environment variable is set.
+    """
+
+    indexes_path = os.getenv(
+        "AGENTFLOW_INDEXES", os.path.join(os.path.dirname(__file__), "..", "indexes")
+    )
+    max_k = 20
+
+    def get_definition(self) -> dict:
+        """
+        Returns a dictionary that defines the function. It includes the function's name, description, and parameters.
+
+        :return: A dictionary that defines the function.
+        :rtype: dict
+        """
+        return {
+            "name": "search_documents",
+            "description": "Search local documents for the passages most relevant to a query.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "What to search for.",
+                    },
+                    "k": {
+                        "type": "integer",
+                        "default": 5,
+                        "description": "The number of passages to return.",
+                    },
+                    "index": {
+                        "type": "string",
+                        "default": "default",
+                        "description": "The name of the document index to search.",
+                    },
+                },
+                "required": ["query"],
+            },
+        }
+
+    def execute(self, query: str, k: int = 5, index: str = "default") -> str:
+        """
+        Searches a document index and returns the most relevant passages.
+
+        :param query: What to search for.
+        :type query: str
+        :param k: The number of passages to return.
+        :type k: int
+        :param index: The name of the document index to search.
+        :type index: str
+        :raises ValueError: If the name of the index holds a path separator or "..".
+        :raises FileNotFoundError: If there is no such index.
+        :return: The passages, most relevant first, each with its source and score.
+        :rtype: str
+        """
+        if not index or "/" in index or "\\" in index or ".." in index:
+            raise ValueError(f"Invalid index name: {index!r}.")
+        results = open_index(os.path.join(self.indexes_path, index)).search(
+            query, max(1, min(k, self.max_k))
+        )
+        if not results:
+            return "No passages found."
+        return "\n\n".join(
+            f"[{number}] {result['source']} (score {result['score']:.3f})\n{result['text']}"
+            for number, result in enumerate(results, 1)
+        )
@@ -2,11 +2,8 @@
 This module contains a class for summarizing text.
 """
 
-import os
 from typing import Dict, List, Tuple
 
-import openai
-
 from agentflow.function import BaseFunction
 from agentflow.llm import LLM, Settings
 from agentflow.output import Output
@@ -22,7 +19,6 @@ class SummarizeText(BaseFunction):
         Initializes the SummarizeText object.
         """
         super().__init__(output)
-        openai.api_key = os.getenv("OPENAI_API_KEY")
         self.default_instructions = (
             "Return a summary that succinctly captures its main points."
         )
@@ -0,0 +1,414 @@
+"""
+This module provides an on-disk HTTP cache for fetching URLs. It follows the caching rules of RFC 9111 for a private cache: responses are reused while Cache-Control, Expires or, failing those, Last-Modified say they are fresh, and stale responses are revalidated with If-None-Match and If-Modified-Since, so unchanged pages cost a 304 instead of a download.
+
+Text derived from a response, such as HTML converted to plain text, can be cached next to it, so a hit skips both the network and the parsing. Derived text is dropped when the response changes.
+
+The cache is in agentflow/cache/http by default. Set the AGENTFLOW_HTTP_CACHE environment variable to another directory, or to "off" to disable it.
+"""
+
+import email.utils
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple, Union
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+HEURISTIC_FRACTION = 0.1
+MAX_HEURISTIC_AGE = 24 * 60 * 60
+# Headers that a 304 response must not change in the stored response.
+STORED_ONLY_HEADERS = {"content-length", "content-encoding", "transfer-encoding"}
+
+# Seconds to wait for a connection, and for each read from it.
+FETCH_TIMEOUT = (5, 30)
+
+_default_cache: Optional["HttpCache"] = None
+_default_cache_lock = threading.Lock()
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """
+    Parses a Cache-Control header into its directives.
+
+    :param value: The header's value, if any.
+    :type value: Optional[str]
+    :return: The directives in lower case, with their arguments or None.
+    :rtype: Dict[str, Optional[str]]
+    """
+    directives: Dict[str, Optional[str]] = {}
+    for directive in (value or "").split(","):
+        name, _, argument = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') or None
+    return directives
+
+
+def parse_date(value: Optional[str]) -> Optional[float]:
+    """
+    Parses an HTTP date.
+
+    :param value: The date, if any.
+    :type value: Optional[str]
+    :return: The date as a timestamp, or None if it is missing or invalid.
+    :rtype: Optional[float]
+    """
+    if not value:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _seconds(value: Optional[str]) -> Optional[int]:
+    return int(value) if value and re.fullmatch(r"\d+", value) else None
+
+
+@dataclass
+class CachedResponse:
+    """
+    This dataclass holds a response, whether it came from the network or the cache.
+
+    :param url: The URL that was fetched.
+    :param status_code: The HTTP status code.
+    :param text: The body of the response.
+    :param headers: The headers of the response.
+    :param from_cache: Whether the body came from the cache, with or without revalidation.
+    :param revalidated: Whether the cached body was confirmed by a 304 response.
+    """
+
+    url: str
+    status_code: int
+    text: str
+    headers: Dict[str, str] = field(default_factory=dict)
+    from_cache: bool = False
+    revalidated: bool = False
+    cache: Optional["HttpCache"] = field(default=None, repr=False)
+
+    def derive(self, name: str, transform: Callable[[str], str]) -> str:
+        """
+        Returns text derived from the body, such as its plain text, from the cache if it was derived before.
+
+        :param name: The name of the derived text, such as "text".
+        :type name: str
+        :param transform: Derives the text from the body.
+        :type transform: Callable[[str], str]
+        :return: The derived text.
+        :rtype: str
+        """
+        if self.cache is None:
+            return transform(self.text)
+        return self.cache.derive(self.url, name, self.text, transform)
+
+
+class HttpCache:
+    """
+    This class is responsible for fetching URLs through a cache on disk. Entries are written atomically, so processes can share a directory.
+
+    :param directory: The directory of the cache.
+    :type directory: str
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url: str, suffix: str = "json") -> str:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], f"{key}.{suffix}")
+
+    def _read(self, path: str) -> Optional[str]:
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path: str, content: str) -> None:
+        """
+        Writes a file atomically.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+                file.write(content)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def _remove(self, url: str) -> None:
+        """
+        Removes an entry and its derived texts.
+        """
+        entry_path = self._path(url)
+        prefix = os.path.basename(entry_path)[: -len("json")]
+        directory = os.path.dirname(entry_path)
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            if name.startswith(prefix):
+                try:
+                    os.unlink(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def freshness_lifetime(headers: CaseInsensitiveDict) -> float:
+        """
+        Returns how long a response is fresh for: its max-age, its Expires date relative to its Date, or a tenth of the time since it was last modified, up to a day.
+
+        :param headers: The headers of the response.
+        :type headers: CaseInsensitiveDict
+        :return: The lifetime in seconds.
+        :rtype: float
+        """
+        directives = parse_cache_control(headers.get("Cache-Control"))
+        max_age = _seconds(directives.get("max-age"))
+        if max_age is not None:
+            return max_age
+        date = parse_date(headers.get("Date"))
+        if "Expires" in headers:
+            expires = parse_date(headers["Expires"])
+            return 0 if expires is None or date is None else expires - date
+        last_modified = parse_date(headers.get("Last-Modified"))
+        if date is not None and last_modified is not None:
+            return min((date - last_modified) * HEURISTIC_FRACTION, MAX_HEURISTIC_AGE)
+        return 0
+
+    @staticmethod
+    def current_age(headers: CaseInsensitiveDict, stored: float) -> float:
+        """
+        Returns the age of a stored response.
+
+        :param headers: The headers of the response.
+        :type headers: CaseInsensitiveDict
+        :param stored: When the response was received.
+        :type stored: float
+        :return: The age in seconds.
+        :rtype: float
+        """
+        date = parse_date(headers.get("Date")) or stored
+        initial_age = max(stored - date, _seconds(headers.get("Age")) or 0, 0)
+        return initial_age + time.time() - stored
+
+    @staticmethod
+    def _storable(response: requests.Response, headers: CaseInsensitiveDict) -> bool:
+        """
+        Checks whether a response may be stored and is worth storing: it must be complete, not forbid storing and be either fresh for a while or revalidatable.
+        """
+        directives = parse_cache_control(headers.get("Cache-Control"))
+        if response.status_code != 200 or "no-store" in directives:
+            return False
+        if headers.get("Vary", "").strip() == "*":
+            return False
+        return bool(
+            headers.get("ETag")
+            or headers.get("Last-Modified")
+            or HttpCache.freshness_lifetime(headers) > 0
+        )
+
+    @staticmethod
+    def _vary(headers: CaseInsensitiveDict, request_headers: Dict[str, str]) -> dict:
+        """
+        Returns the request headers that the response varies on.
+        """
+        request_headers = CaseInsensitiveDict(request_headers)
+        names = [name.strip() for name in headers.get("Vary", "").split(",")]
+        return {name.lower(): request_headers.get(name) for name in names if name}
+
+    def get(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Union[float, Tuple[float, float]] = FETCH_TIMEOUT,
+    ) -> CachedResponse:
+        """
+        Fetches a URL with a GET request, answering from the cache when the stored response is fresh and revalidating it when it is stale.
+
+        :param url: The URL.
+        :type url: str
+        :param headers: The request headers.
+        :type headers: Dict[str, str], optional
+        :param timeout: Seconds to wait for a connection and for each read, as for requests.
+        :type timeout: Union[float, Tuple[float, float]], optional
+        :return: The response.
+        :rtype: CachedResponse
+        """
+        headers = dict(headers or {})
+        entry = self._load(url, headers)
+        if entry is not None:
+            stored_headers = CaseInsensitiveDict(entry["headers"])
+            directives = parse_cache_control(stored_headers.get("Cache-Control"))
+            if "no-cache" not in directives and self.freshness_lifetime(
+                stored_headers
+            ) > self.current_age(stored_headers, entry["stored"]):
+                with self._lock:
+                    self.hits += 1
+                return self._response(entry, from_cache=True)
+            if stored_headers.get("ETag"):
+                headers["If-None-Match"] = stored_headers["ETag"]
+            if stored_headers.get("Last-Modified"):
+                headers["If-Modified-Since"] = stored_headers["Last-Modified"]
+
+        response = requests.get(url, headers=headers, timeout=timeout)
+        if entry is not None and response.status_code == 304:
+            entry["headers"].update(
+                (name, value)
+                for name, value in CaseInsensitiveDict(response.headers).items()
+                if name.lower() not in STORED_ONLY_HEADERS
+            )
+            entry["stored"] = time.time()
+            self._write(self._path(url), json.dumps(entry))
+            with self._lock:
+                self.revalidations += 1
+            return self._response(entry, from_cache=True, revalidated=True)
+
+        with self._lock:
+            self.misses += 1
+        response_headers = CaseInsensitiveDict(response.headers)
+        if not self._storable(response, response_headers):
+            if "no-store" in parse_cache_control(response_headers.get("Cache-Control")):
+                self._remove(url)
+            return CachedResponse(
+                url, response.status_code, response.text, dict(response_headers)
+            )
+        entry = {
+            "url": url,
+            "status_code": response.status_code,
+            "headers": dict(response_headers),
+            "vary": self._vary(response_headers, headers),
+            "stored": time.time(),
+            "text": response.text,
+        }
+        self._remove(url)
+        self._write(self._path(url), json.dumps(entry))
+        return self._response(entry)
+
+    def _load(self, url: str, headers: Dict[str, str]) -> Optional[dict]:
+        """
+        Loads the stored response for a URL, if it matches the request headers it varies on.
+        """
+        content = self._read(self._path(url))
+        if content is None:
+            return None
+        try:
+            entry = json.loads(content)
+        except json.JSONDecodeError:
+            return None
+        request_headers = CaseInsensitiveDict(headers)
+        for name, value in entry.get("vary", {}).items():
+            if request_headers.get(name) != value:
+                return None
+        return entry
+
+    def _response(
+        self, entry: dict, from_cache: bool = False, revalidated: bool = False
+    ) -> CachedResponse:
+        return CachedResponse(
+            entry["url"],
+            entry["status_code"],
+            entry["text"],
+            entry["headers"],
+            from_cache,
+            revalidated,
+            self,
+        )
+
+    def derive(
+        self, url: str, name: str, text: str, transform: Callable[[str], str]
+    ) -> str:
+        """
+        Returns text derived from a stored body, deriving and storing it if needed.
+
+        :param url: The URL of the body.
+        :type url: str
+        :param name: The name of the derived text.
+        :type name: str
+        :param text: The body.
+        :type text: str
+        :param transform: Derives the text from the body.
+        :type transform: Callable[[str], str]
+        :return: The derived text.
+        :rtype: str
+        """
+        digest = hashlib.sha256(text.encode()).hexdigest()[:16]
+        path = self._path(url, f"{name}.{digest}.txt")
+        derived = self._read(path)
+        if derived is None:
+            derived = transform(text)
+            self._write(path, derived)
+        return derived
+
+    def get_metrics(self) -> Dict[str, int]:
+        """
+        Returns the numbers of hits, revalidations and misses.
+
+        :return: The metrics.
+        :rtype: Dict[str, int]
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "revalidations": self.revalidations,
+                "misses": self.misses,
+            }
+
+
+def get_default_cache() -> Optional[HttpCache]:
+    """
+    Returns the cache shared by functions in this process, creating it if needed.
+
+    :return: The cache, or None if AGENTFLOW_HTTP_CACHE is "off".
+    :rtype: Optional[HttpCache]
+    """
+    global _default_cache
+    directory = os.getenv(
+        "AGENTFLOW_HTTP_CACHE",
+        os.path.join(os.path.dirname(__file__), "cache", "http"),
+    )
+    if directory == "off":
+        return None
+    with _default_cache_lock:
+        if _default_cache is None or _default_cache.directory != directory:
+            _default_cache = HttpCache(directory)
+        return _default_cache
+
+
+def fetch(
+    url: str,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Union[float, Tuple[float, float]] = FETCH_TIMEOUT,
+) -> CachedResponse:
+    """
+    Fetches a URL through the default cache, or directly if it is disabled.
+
+    :param url: The URL.
+    :type url: str
+    :param headers: The request headers.
+    :type headers: Dict[str, str], optional
+    :param timeout: Seconds to wait for a connection and for each read, as for requests.
+    :type timeout: Union[float, Tuple[float, float]], optional
+    :return: The response.
+    :rtype: CachedResponse
+    """
+    cache = get_default_cache()
+    if cache is not None:
+        return cache.get(url, headers, timeout)
+    response = requests.get(url, headers=headers, timeout=timeout)
+    return CachedResponse(
+        url, response.status_code, response.text, dict(response.headers)
+    )
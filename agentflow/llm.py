@@ -2,19 +2,53 @@
 This module provides a class for interacting with OpenAI's LLMs. It includes a dataclass for settings and a class for managing the interaction.
 """
 
+import json
+import logging
 import os
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field, fields
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import openai
+import requests
 from dotenv import load_dotenv
-from tenacity import retry, wait_exponential
+from openai.util import convert_to_openai_object
+from tenacity import Retrying, stop_after_attempt, stop_after_delay, wait_exponential
+
+from agentflow.budget import active_budgets, enforce, record_usage
+from agentflow.endpoints import Endpoint, EndpointPool
+from agentflow.message import Conversation, to_dicts
+from agentflow.metrics import LLM_RETRIES, LLM_SECONDS
+from agentflow.selectors import get_selector
+from agentflow.semantic_cache import SemanticCache
+from agentflow.serialization import encode_request
+from agentflow.streaming import StreamedResponse
+from agentflow.tokens import estimate_tokens
+from agentflow.trace import accumulate, annotate
+
+REQUEST_TIMEOUT = 600  # Seconds, as in the OpenAI client
 
 
 @dataclass
 class Settings:
     """
     This dataclass holds the settings for interacting with OpenAI's LLMs.
+
+    Fields marked as local in their metadata configure Agentflow itself and are not sent to the API.
     """
 
     model: str = os.getenv("OPENAI_DEFAULT_MODEL", "gpt-4")
@@ -24,42 +58,689 @@ class Settings:
     max_tokens: Optional[int] = None
     presence_penalty: Optional[float] = None
     frequency_penalty: Optional[float] = None
+    n: Optional[int] = None
+    tags: Optional[List[str]] = field(default=None, metadata={"local": True})
+    latency_slo: Optional[float] = field(default=None, metadata={"local": True})
+    deadline: Optional[float] = field(default=None, metadata={"local": True})
+    max_attempts: Optional[int] = field(default=5, metadata={"local": True})
+    hedge: bool = field(default=False, metadata={"local": True})
+    semantic_cache: Optional[float] = field(default=None, metadata={"local": True})
+    stream: bool = field(default=False, metadata={"local": True})
+    token_budget: Optional[int] = field(default=None, metadata={"local": True})
+    cost_budget: Optional[float] = field(default=None, metadata={"local": True})
+    by_reference: bool = field(default=False, metadata={"local": True})
+    function_timeout: Optional[float] = field(default=None, metadata={"local": True})
+    isolate_function: bool = field(default=False, metadata={"local": True})
+    selector: Optional[Union[str, Dict[str, Any]]] = field(
+        default=None, metadata={"local": True}
+    )
+
+    def to_openai_args(self) -> Dict[str, Any]:
+        """
+        Returns the settings that should be sent to OpenAI's API.
+
+        :return: The non-local settings that have a value.
+        :rtype: Dict[str, Any]
+        """
+        return {
+            f.name: getattr(self, f.name)
+            for f in fields(self)
+            if not f.metadata.get("local") and getattr(self, f.name) is not None
+        }
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a request does not complete before the task's deadline.
+    """
+
+
+class LatencyTracker:
+    """
+    This class keeps a rolling window of recent request latencies for each model.
+
+    :param window: The number of latencies kept per model.
+    :type window: int
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, latency: float) -> None:
+        """
+        Records the latency of a completed request.
+
+        :param model: The model that served the request.
+        :type model: str
+        :param latency: The latency in seconds.
+        :type latency: float
+        """
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=self.window)).append(latency)
+
+    def percentile(
+        self, model: str, percentile: float, min_samples: int = 20
+    ) -> Optional[float]:
+        """
+        Returns a percentile of the recorded latencies.
+
+        :param model: The model to get the percentile for.
+        :type model: str
+        :param percentile: The percentile, between 0 and 1.
+        :type percentile: float
+        :param min_samples: The number of samples needed for a meaningful result.
+        :type min_samples: int
+        :return: The latency in seconds, or None if there are too few samples.
+        :rtype: Optional[float]
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(model, ()))
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(int(len(latencies) * percentile), len(latencies) - 1)]
 
 
 class LLM:
     """
     This class is responsible for managing the interaction with OpenAI's LLMs.
+
+    Requests are balanced across a pool of API endpoints. Latencies, the semantic cache, the HTTP session and the thread pool used for deadlines and hedged requests are shared by all instances, as is the pool configured in the environment.
+
+    :param endpoints: The endpoints to send requests to. If not set, the pool configured in the environment is used.
+    :type endpoints: EndpointPool, optional
     """
 
-    def __init__(self):
+    latencies = LatencyTracker()
+    semantic_cache = SemanticCache()
+    retry_wait = wait_exponential(multiplier=1, min=4, max=10)
+    hedge_percentile = 0.95
+    _single_choice_models: Set[str] = set()
+    _executor: Optional[ThreadPoolExecutor] = None
+    _executor_lock = threading.Lock()
+    _session: Optional[requests.Session] = None
+    _session_lock = threading.Lock()
+    _environment_loaded = False
+    _default_endpoints: Optional[EndpointPool] = None
+
+    def __init__(self, endpoints: Optional[EndpointPool] = None):
         """
-        Initializes the LLM object by loading the environment variables and setting the OpenAI API key.
+        Initializes the LLM object by loading the environment variables and choosing its endpoints. The API key is kept with the endpoints rather than set globally, so LLMs with different keys can be used in the same process.
         """
-        load_dotenv()
-        openai.api_key = os.getenv("OPENAI_API_KEY")
+        self.load_environment()
+        self.endpoints = endpoints or self.get_default_endpoints()
+
+    @classmethod
+    def load_environment(cls) -> None:
+        """
+        Loads the environment variables from the .env file. The file is only read the first time, not for every instance.
+        """
+        with cls._session_lock:
+            if not cls._environment_loaded:
+                load_dotenv()
+                cls._environment_loaded = True
+
+    @classmethod
+    def get_default_endpoints(cls) -> EndpointPool:
+        """
+        Returns the endpoint pool configured in the environment, creating it the first time.
+
+        :return: The endpoint pool.
+        :rtype: EndpointPool
+        """
+        cls.load_environment()
+        with cls._session_lock:
+            if cls._default_endpoints is None:
+                cls._default_endpoints = EndpointPool.from_environment()
+            return cls._default_endpoints
 
-    @retry(wait=wait_exponential(multiplier=1, min=4, max=10))
     def respond(
         self,
         settings: Settings,
-        messages: List[Dict[str, str]],
+        messages: Union[Conversation, List[Dict[str, str]]],
         functions: Optional[List[Dict[str, str]]] = None,
     ) -> Any:
         """
         Sends a request to OpenAI's LLM API and returns the response.
 
+        Failed requests are retried up to the settings' maximum number of attempts, and all attempts must finish before the settings' deadline. With hedging on, a duplicate request is sent if the first has not returned by the observed 95th percentile latency, and whichever finishes first is used. With a semantic cache threshold, a cached response to a similar enough request is returned instead of sending the request.
+
         :param settings: The settings for the interaction.
         :type settings: Settings
         :param messages: The messages to be processed by the language model.
-        :type messages: List[Dict[str, str]]
+        :type messages: Union[Conversation, List[Dict[str, str]]]
         :param functions: The functions to be processed by the language model.
         :type functions: Optional[List[Dict[str, str]]]
         :return: The response from the language model.
         :rtype: Any
         """
-        openai_args = {k: v for k, v in vars(settings).items() if v is not None}
+        openai_args = settings.to_openai_args()
+        openai_args["messages"] = messages
+        if functions:
+            openai_args["functions"] = functions
+        if settings.semantic_cache is None:
+            return self._send(settings, openai_args)
+
+        prompt = self.semantic_cache.prompt(openai_args)
+        cached = self.semantic_cache.lookup(prompt, settings.semantic_cache)
+        if cached is not None and not cached[1]:
+            return cached[0]
+        message = self._send(settings, openai_args)
+        self.semantic_cache.store(
+            prompt,
+            message,
+            cached[0] if cached else None,
+            settings.semantic_cache,
+        )
+        return message
+
+    def _send(self, settings: Settings, openai_args: Dict[str, Any]) -> Any:
+        """
+        Sends a request with retries, returning the response message.
+
+        The request is checked against the budgets in effect first, which may send it to a cheaper model, and its usage is recorded in them and in the trace. If the settings ask for n candidates, the settings' selector, or the majority selector by default, chooses which one is returned, and the number of candidates, the chosen one and the time spent choosing are added to the trace.
+
+        :param settings: The settings for the interaction.
+        :type settings: Settings
+        :param openai_args: The arguments for the request.
+        :type openai_args: Dict[str, Any]
+        :raises BudgetExceeded: If the request would exceed a budget that fails fast.
+        :return: The response message from the language model.
+        :rtype: Any
+        """
+        openai_args, prompt_tokens = self._apply_budgets(settings, openai_args)
+        deadline = time.monotonic() + settings.deadline if settings.deadline else None
+        retrying = self._get_retrying(settings)
+        if (settings.n or 1) > 1:
+            responses = self._sample(openai_args, settings.n, deadline, retrying)
+        else:
+            responses = [retrying(self._attempt, openai_args, deadline, settings.hedge)]
+        candidates = []
+        for response in responses:
+            messages = [choice.message for choice in response.choices]
+            candidates += messages
+            accumulate(
+                **record_usage(
+                    openai_args["model"],
+                    getattr(response, "usage", None),
+                    prompt_tokens,
+                    "".join(message.content or "" for message in messages),
+                )
+            )
+        if len(candidates) == 1:
+            return candidates[0]
+
+        start = time.perf_counter()
+        selector = get_selector(settings.selector or "majority")
+        selected = selector.select(candidates, openai_args["messages"], self)
+        annotate(candidates=len(candidates), selector=selector.name, selected=selected)
+        accumulate(selector_seconds=time.perf_counter() - start)
+        return candidates[selected]
+
+    def _sample(
+        self,
+        openai_args: Dict[str, Any],
+        n: int,
+        deadline: Optional[float],
+        retrying: Retrying,
+    ) -> List[Any]:
+        """
+        Gets n candidate responses to a request. They are asked for in one request, or, for models that return a single choice, in n concurrent requests. A model is known to return a single choice once it has returned fewer choices than asked for, or rejected n.
+
+        :param openai_args: The arguments for the request, including n.
+        :type openai_args: Dict[str, Any]
+        :param n: The number of candidates.
+        :type n: int
+        :param deadline: The monotonic time by which the requests must finish, if any.
+        :type deadline: Optional[float]
+        :param retrying: The retry policy.
+        :type retrying: Retrying
+        :return: The responses, which have n choices between them.
+        :rtype: List[Any]
+        """
+        responses = []
+        if openai_args["model"] not in self._single_choice_models:
+
+            def attempt() -> Any:
+                try:
+                    return self._attempt(openai_args, deadline, False)
+                except openai.error.InvalidRequestError as e:
+                    if e.param != "n":
+                        raise
+                    return None
+
+            response = retrying(attempt)
+            if response is not None:
+                if len(response.choices) >= n:
+                    return [response]
+                responses.append(response)
+                n -= len(response.choices)
+            self._single_choice_models.add(openai_args["model"])
+
+        single_args = {key: value for key, value in openai_args.items() if key != "n"}
+        if deadline is not None:
+            single_args["request_timeout"] = self._remaining(deadline)
+            if not single_args["request_timeout"]:
+                raise DeadlineExceeded("Deadline exceeded before the request was sent.")
+        futures = [
+            self._get_executor().submit(retrying, self._timed_create, single_args)
+            for _ in range(n)
+        ]
+        _, pending = wait(futures, timeout=self._remaining(deadline))
+        if pending:
+            self._cancel(pending)
+            raise DeadlineExceeded("Deadline exceeded waiting for candidates.")
+        return responses + [future.result() for future in futures]
+
+    def respond_stream(
+        self,
+        settings: Settings,
+        messages: Union[Conversation, List[Dict[str, str]]],
+        functions: Optional[List[Dict[str, str]]] = None,
+    ) -> StreamedResponse:
+        """
+        Sends a request to OpenAI's LLM API and returns the response as it is streamed, so function call arguments can be used before the response is complete.
+
+        Retries and the deadline apply to getting the response started, and the deadline also bounds the wait for each chunk. Streamed requests are not hedged or cached. Their usage is estimated once the response has been read.
+
+        :param settings: The settings for the interaction.
+        :type settings: Settings
+        :param messages: The messages to be processed by the language model.
+        :type messages: Union[Conversation, List[Dict[str, str]]]
+        :param functions: The functions to be processed by the language model.
+        :type functions: Optional[List[Dict[str, str]]]
+        :raises ValueError: If the settings ask for more than one candidate.
+        :raises BudgetExceeded: If the request would exceed a budget that fails fast.
+        :return: The streamed response.
+        :rtype: StreamedResponse
+        """
+        openai_args = settings.to_openai_args()
         openai_args["messages"] = messages
         if functions:
             openai_args["functions"] = functions
-        response = openai.ChatCompletion.create(**openai_args)
-        return response.choices[0].message
+        if (settings.n or 1) > 1:
+            raise ValueError("Streamed requests get a single candidate.")
+        openai_args, prompt_tokens = self._apply_budgets(settings, openai_args)
+        openai_args["stream"] = True
+        if settings.deadline:
+            openai_args["request_timeout"] = settings.deadline
+        chunks = self._get_retrying(settings)(self._create, openai_args)
+        model = openai_args["model"]
+        return StreamedResponse(
+            chunks,
+            lambda length: accumulate(
+                **record_usage(model, None, prompt_tokens, length)
+            ),
+        )
+
+    def _apply_budgets(
+        self, settings: Settings, openai_args: Dict[str, Any]
+    ) -> Tuple[Dict[str, Any], int]:
+        """
+        Checks a request against the budgets in effect, which may send it to a cheaper model.
+
+        :param settings: The settings for the interaction.
+        :type settings: Settings
+        :param openai_args: The arguments for the request.
+        :type openai_args: Dict[str, Any]
+        :raises BudgetExceeded: If the request would exceed a budget that fails fast.
+        :return: The arguments for the request, and its estimated prompt tokens.
+        :rtype: Tuple[Dict[str, Any], int]
+        """
+        prompt_tokens = estimate_tokens(
+            openai_args["messages"], openai_args.get("functions")
+        )
+        if active_budgets():
+            model = enforce(
+                openai_args["model"],
+                prompt_tokens,
+                (settings.max_tokens or 0) * (settings.n or 1),
+            )
+            if model != openai_args["model"]:
+                annotate(model=model, downgraded_from=openai_args["model"])
+                openai_args = {**openai_args, "model": model}
+        return openai_args, prompt_tokens
+
+    def _get_retrying(self, settings: Settings) -> Retrying:
+        """
+        Returns the retry policy for a request: up to the settings' maximum number of attempts, within the settings' deadline. Retries are counted in the metrics.
+
+        :param settings: The settings for the interaction.
+        :type settings: Settings
+        :return: The retry policy.
+        :rtype: Retrying
+        """
+        stop = stop_after_attempt(settings.max_attempts or 1)
+        if settings.deadline:
+            stop = stop | stop_after_delay(settings.deadline)
+        return Retrying(
+            stop=stop,
+            wait=self.retry_wait,
+            reraise=True,
+            before_sleep=lambda _: LLM_RETRIES.inc(model=settings.model),
+        )
+
+    def _attempt(
+        self, openai_args: Dict[str, Any], deadline: Optional[float], hedge: bool
+    ) -> Any:
+        """
+        Makes a single attempt at a request, enforcing the deadline and hedging if requested.
+
+        :param openai_args: The arguments for the request.
+        :type openai_args: Dict[str, Any]
+        :param deadline: The monotonic time by which the request must finish, if any.
+        :type deadline: Optional[float]
+        :param hedge: Whether to send a duplicate request when the first one is slow.
+        :type hedge: bool
+        :raises DeadlineExceeded: If the request does not finish before the deadline.
+        :return: The response from the language model.
+        :rtype: Any
+        """
+        hedge_delay = (
+            self.latencies.percentile(openai_args["model"], self.hedge_percentile)
+            if hedge
+            else None
+        )
+        if deadline is None and hedge_delay is None:
+            return self._timed_create(openai_args)
+
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded("Deadline exceeded before the request was sent.")
+            openai_args = {**openai_args, "request_timeout": remaining}
+
+        executor = self._get_executor()
+        pending = {executor.submit(self._timed_create, openai_args)}
+        if hedge_delay is not None:
+            done, _ = wait(pending, timeout=self._remaining(deadline, hedge_delay))
+            if not done and self._remaining(deadline) != 0:
+                pending.add(executor.submit(self._timed_create, openai_args))
+
+        error = None
+        while pending:
+            done, pending = wait(
+                pending, timeout=self._remaining(deadline), return_when=FIRST_COMPLETED
+            )
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    self._cancel(pending)
+                    return future.result()
+                error = future.exception()
+        self._cancel(pending)
+        raise error or DeadlineExceeded("Deadline exceeded waiting for a response.")
+
+    def _timed_create(self, openai_args: Dict[str, Any]) -> Any:
+        """
+        Sends a request and records its latency.
+
+        :param openai_args: The arguments for the request.
+        :type openai_args: Dict[str, Any]
+        :return: The response from the language model.
+        :rtype: Any
+        """
+        start = time.monotonic()
+        response = self._create(openai_args)
+        latency = time.monotonic() - start
+        self.latencies.record(openai_args["model"], latency)
+        LLM_SECONDS.observe(latency, model=openai_args["model"])
+        return response
+
+    def _create(self, openai_args: Dict[str, Any]) -> Any:
+        """
+        Sends a request to OpenAI's chat completion API through an endpoint of the pool.
+
+        If the endpoint is rate limited or failing, the request is sent again right away to another endpoint, until none is left. Other errors are raised. A streamed response keeps its endpoint until it has been read, and errors raised while reading it count against the endpoint's health.
+
+        :param openai_args: The arguments for the request.
+        :type openai_args: Dict[str, Any]
+        :raises EndpointsUnavailable: If every endpoint is out of rotation.
+        :return: The response from the language model.
+        :rtype: Any
+        """
+        tried = set()
+        while True:
+            endpoint = self.endpoints.acquire(exclude=tried)
+            try:
+                response = self._create_at(endpoint, openai_args)
+            except Exception as e:
+                failed = self.endpoints.release(endpoint, e)
+                tried.add(endpoint)
+                if not failed or not self.endpoints.available(exclude=tried):
+                    raise
+                logging.warning(f"Endpoint {endpoint.name} failed, trying another: {e}")
+                continue
+            if openai_args.get("stream"):
+                return self._release_after(endpoint, response)
+            self.endpoints.release(endpoint)
+            return response
+
+    def _release_after(
+        self, endpoint: Endpoint, chunks: Iterator[Any]
+    ) -> Iterator[Any]:
+        """
+        Yields the chunks of a streamed response and releases its endpoint once the stream ends, fails or is closed, with the error if it fails.
+
+        :param endpoint: The endpoint the request was sent to.
+        :type endpoint: Endpoint
+        :param chunks: The chunks of the response.
+        :type chunks: Iterator[Any]
+        :return: The chunks.
+        :rtype: Iterator[Any]
+        """
+        error = None
+        try:
+            yield from chunks
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.endpoints.release(endpoint, error)
+
+    def _create_at(self, endpoint: Endpoint, openai_args: Dict[str, Any]) -> Any:
+        """
+        Sends a request to OpenAI's chat completion API at an endpoint.
+
+        The request body is assembled from the cached encodings of the messages and functions rather than by serializing the whole request. Other API types, such as Azure, go through the OpenAI client. A failed response raises the error the OpenAI client raises for its status. If the arguments ask for a stream, the chunks of the response are returned as they arrive.
+
+        :param endpoint: The endpoint to send the request to.
+        :type endpoint: Endpoint
+        :param openai_args: The arguments for the request.
+        :type openai_args: Dict[str, Any]
+        :return: The response from the language model.
+        :rtype: Any
+        """
+        if openai.api_type != "open_ai":
+            client_args = {**openai_args, "messages": to_dicts(openai_args["messages"])}
+            if "functions" in client_args:
+                client_args["functions"] = list(client_args["functions"])
+            return openai.ChatCompletion.create(
+                api_key=endpoint.get_api_key(),
+                api_base=endpoint.get_api_base(),
+                **client_args,
+            )
+
+        api_key = endpoint.get_api_key()
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+        if openai.organization:
+            headers["OpenAI-Organization"] = openai.organization
+        stream = bool(openai_args.get("stream"))
+        try:
+            result = self._get_session().post(
+                f"{endpoint.get_api_base()}/chat/completions",
+                data=encode_request(openai_args),
+                headers=headers,
+                timeout=openai_args.get("request_timeout") or REQUEST_TIMEOUT,
+                stream=stream,
+            )
+        except requests.exceptions.Timeout as e:
+            raise openai.error.Timeout(f"Request timed out: {e}") from e
+        except requests.exceptions.RequestException as e:
+            raise openai.error.APIConnectionError(
+                f"Error communicating with OpenAI: {e}"
+            ) from e
+        if result.status_code != 200:
+            raise api_error(result.status_code, result.text, result.headers)
+        if stream:
+            return _read_stream(result, api_key)
+        try:
+            body = result.json()
+        except ValueError as e:
+            raise api_error(result.status_code, result.text, result.headers) from e
+        return convert_to_openai_object(body, api_key)
+
+    @staticmethod
+    def _remaining(
+        deadline: Optional[float], limit: Optional[float] = None
+    ) -> Optional[float]:
+        """
+        Returns the time left before the deadline, capped at the limit.
+
+        :param deadline: The monotonic deadline, if any.
+        :type deadline: Optional[float]
+        :param limit: An upper bound for the result, if any.
+        :type limit: Optional[float]
+        :return: The number of seconds left, or None if there is no bound.
+        :rtype: Optional[float]
+        """
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        if limit is None:
+            return remaining
+        return limit if remaining is None else min(limit, remaining)
+
+    @staticmethod
+    def _cancel(futures: set[Future]) -> None:
+        """
+        Cancels requests whose results are no longer needed. Requests that have already started are left to finish in the background and their results are discarded.
+
+        :param futures: The futures to cancel.
+        :type futures: set[Future]
+        """
+        for future in futures:
+            future.cancel()
+
+    @classmethod
+    def preconnect(cls, timeout: float = 5.0) -> bool:
+        """
+        Opens a connection to each base URL of the default endpoints before the first request, so that request doesn't wait for the connection and TLS handshake. The connections are kept alive in the shared session.
+
+        :param timeout: The number of seconds to wait for the API.
+        :type timeout: float
+        :return: Whether every connection was opened.
+        :rtype: bool
+        """
+        if openai.api_type != "open_ai":
+            return False
+        connected = True
+        for api_base in cls.get_default_endpoints().get_api_bases():
+            try:
+                cls._get_session().head(api_base, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                logging.warning(f"Could not connect to {api_base}: {e}")
+                connected = False
+        return connected
+
+    @classmethod
+    def _get_session(cls) -> requests.Session:
+        """
+        Returns the HTTP session shared by all instances, creating it if needed. Sharing it keeps connections to the API alive between calls.
+
+        :return: The HTTP session.
+        :rtype: requests.Session
+        """
+        with cls._session_lock:
+            if cls._session is None:
+                cls._session = requests.Session()
+            return cls._session
+
+    @classmethod
+    def _get_executor(cls) -> ThreadPoolExecutor:
+        """
+        Returns the thread pool shared by all instances, creating it if needed.
+
+        :return: The thread pool.
+        :rtype: ThreadPoolExecutor
+        """
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=32, thread_name_prefix="agentflow-llm"
+                )
+            return cls._executor
+
+
+def api_error(
+    status: int, text: str, headers: Optional[Mapping[str, str]] = None
+) -> openai.error.OpenAIError:
+    """
+    Returns the error for a failed API response, of the type the OpenAI client raises for its status, so retries and endpoint health treat it the same way.
+
+    :param status: The HTTP status of the response.
+    :type status: int
+    :param text: The body of the response.
+    :type text: str
+    :param headers: The headers of the response.
+    :type headers: Mapping[str, str], optional
+    :return: The error.
+    :rtype: openai.error.OpenAIError
+    """
+    try:
+        body = json.loads(text)
+    except ValueError:
+        body = None
+    data = body.get("error") if isinstance(body, dict) else None
+    if not isinstance(data, dict):
+        data = {"message": f"HTTP code {status} from API ({text})"}
+    message = data.get("message")
+    if status in (400, 404, 415):
+        return openai.error.InvalidRequestError(
+            message, data.get("param"), data.get("code"), text, status, body, headers
+        )
+    error_class = {
+        401: openai.error.AuthenticationError,
+        403: openai.error.PermissionError,
+        409: openai.error.TryAgain,
+        429: openai.error.RateLimitError,
+        503: openai.error.ServiceUnavailableError,
+    }.get(status, openai.error.APIError)
+    return error_class(message, text, status, body, headers)
+
+
+def _read_stream(response: requests.Response, api_key: Optional[str]) -> Iterator[Any]:
+    """
+    Yields the chunks of a streamed chat completion from its server-sent events, until the stream is done.
+
+    :param response: The response, which is closed once read.
+    :type response: requests.Response
+    :param api_key: The API key the request was sent with.
+    :type api_key: Optional[str]
+    :raises openai.error.OpenAIError: If the stream reports an error, or the connection fails.
+    :return: The chunks.
+    :rtype: Iterator[Any]
+    """
+    try:
+        for line in response.iter_lines():
+            if not line.startswith(b"data:"):
+                continue
+            data = line[len(b"data:") :].strip()
+            if data == b"[DONE]":
+                return
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                chunk = {"error": None}
+            if "error" in chunk:
+                raise api_error(response.status_code, data.decode(), response.headers)
+            yield convert_to_openai_object(chunk, api_key)
+    except requests.exceptions.RequestException as e:
+        raise openai.error.APIConnectionError(
+            f"Error communicating with OpenAI: {e}"
+        ) from e
+    finally:
+        response.close()
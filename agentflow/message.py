@@ -0,0 +1,316 @@
+"""
+This module provides compact classes for the messages of a flow. Messages use slots instead of dicts, repeated strings such as system messages are interned across flows, and large contents such as function results are spilled to disk. Dicts are only created when a request is serialized.
+"""
+
+import atexit
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import weakref
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+SPILL_THRESHOLD = 64 * 1024  # Characters
+
+_spill_directory: Optional[str] = None
+_spill_lock = threading.Lock()
+
+
+def _get_spill_directory() -> str:
+    """
+    Returns the directory for spilled contents, creating it if needed. It is removed when the process exits.
+
+    :return: The path to the directory.
+    :rtype: str
+    """
+    global _spill_directory
+    with _spill_lock:
+        if _spill_directory is None:
+            _spill_directory = tempfile.mkdtemp(prefix="agentflow-messages-")
+            atexit.register(shutil.rmtree, _spill_directory, ignore_errors=True)
+        return _spill_directory
+
+
+class SpilledText:
+    """
+    This class holds text that is stored in a file instead of in memory. The file is removed when the object is garbage collected.
+
+    :param text: The text to store.
+    :type text: str
+    """
+
+    __slots__ = ("path", "length", "__weakref__")
+
+    def __init__(self, text: str):
+        file_descriptor, self.path = tempfile.mkstemp(dir=_get_spill_directory())
+        with os.fdopen(file_descriptor, "wb") as file:
+            file.write(text.encode())
+        self.length = len(text)
+        weakref.finalize(self, _remove, self.path)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __str__(self) -> str:
+        """
+        Reads the text back through a memory map.
+
+        :return: The text.
+        :rtype: str
+        """
+        if not self.length:
+            return ""
+        with open(self.path, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:].decode()
+
+
+def _remove(path: str) -> None:
+    """
+    Removes a spilled file, ignoring files that are already gone.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class Message:
+    """
+    This class holds a single message. Items can be read like a dict, for example message["content"].
+
+    :param role: The role of the author of the message.
+    :type role: str
+    :param content: The content of the message.
+    :type content: str, optional
+    :param name: The name of the function, for function messages.
+    :type name: str, optional
+    :param function_call: The function call, with "name" and "arguments", for assistant messages.
+    :type function_call: dict, optional
+    :param spill_threshold: Contents longer than this many characters are spilled to disk. If not set, contents are kept in memory.
+    :type spill_threshold: int, optional
+    """
+
+    __slots__ = ("role", "_content", "name", "_function_call", "_encoded")
+
+    def __init__(
+        self,
+        role: str,
+        content: Optional[str] = None,
+        name: Optional[str] = None,
+        function_call: Optional[dict] = None,
+        spill_threshold: Optional[int] = None,
+    ):
+        self.role = sys.intern(role)
+        if content is not None and role == "system":
+            content = sys.intern(content)
+        elif content is not None and spill_threshold and len(content) > spill_threshold:
+            content = SpilledText(content)
+        self._content = content
+        self.name = sys.intern(name) if name else None
+        self._function_call = None
+        if function_call:
+            arguments = function_call["arguments"]
+            if spill_threshold and len(arguments) > spill_threshold:
+                arguments = SpilledText(arguments)
+            self._function_call = (sys.intern(function_call["name"]), arguments)
+        self._encoded: Optional[bytes] = None
+
+    @classmethod
+    def from_dict(
+        cls, message: Dict[str, Any], spill_threshold: Optional[int] = None
+    ) -> "Message":
+        """
+        Creates a message from a dict.
+
+        :param message: The message as a dict.
+        :type message: Dict[str, Any]
+        :param spill_threshold: Contents longer than this many characters are spilled to disk.
+        :type spill_threshold: int, optional
+        :return: The message.
+        :rtype: Message
+        """
+        return cls(
+            message["role"],
+            message.get("content"),
+            message.get("name"),
+            message.get("function_call"),
+            spill_threshold,
+        )
+
+    @property
+    def content(self) -> Optional[str]:
+        """
+        Returns the content of the message, reading it back from disk if it was spilled.
+        """
+        if isinstance(self._content, SpilledText):
+            return str(self._content)
+        return self._content
+
+    @property
+    def spilled(self) -> bool:
+        """
+        Returns whether the content or the function call's arguments were spilled to disk.
+        """
+        return isinstance(self._content, SpilledText) or (
+            self._function_call is not None
+            and isinstance(self._function_call[1], SpilledText)
+        )
+
+    @property
+    def content_length(self) -> int:
+        """
+        Returns the length of the content without reading spilled content back.
+        """
+        return len(self._content) if self._content else 0
+
+    @property
+    def function_call(self) -> Optional[Dict[str, str]]:
+        """
+        Returns the function call of the message, if any.
+        """
+        if self._function_call is None:
+            return None
+        return {
+            "name": self._function_call[0],
+            "arguments": str(self._function_call[1]),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the message as a dict, in the format of OpenAI's API.
+
+        :return: The message.
+        :rtype: Dict[str, Any]
+        """
+        message = {"role": self.role, "content": self.content}
+        if self.name is not None:
+            message["name"] = self.name
+        if self._function_call is not None:
+            message["function_call"] = self.function_call
+        return message
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Returns an item of the message, as for a dict.
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        if key == "name" and self.name is not None:
+            return self.name
+        if key == "function_call" and self._function_call is not None:
+            return self.function_call
+        raise KeyError(key)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, Message):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __repr__(self) -> str:
+        return f"Message({self.to_dict()!r})"
+
+
+class Conversation:
+    """
+    This class holds the messages of a flow.
+
+    :param messages: The initial messages, as messages or dicts.
+    :type messages: List[Union[Message, dict]], optional
+    :param spill_threshold: Contents longer than this many characters are spilled to disk. Set to None to keep all contents in memory.
+    :type spill_threshold: int, optional
+    """
+
+    __slots__ = ("_messages", "spill_threshold", "_encoded")
+
+    def __init__(
+        self,
+        messages: List[Union[Message, dict]] = None,
+        spill_threshold: Optional[int] = SPILL_THRESHOLD,
+    ):
+        self._messages: List[Message] = []
+        self.spill_threshold = spill_threshold
+        self._encoded: Optional[Tuple[int, List[Union[bytes, Message]]]] = None
+        for message in messages or []:
+            self.append(message)
+
+    def append(self, message: Union[Message, dict]) -> None:
+        """
+        Adds a message to the end of the conversation.
+
+        :param message: The message, as a message or a dict.
+        :type message: Union[Message, dict]
+        """
+        if not isinstance(message, Message):
+            message = Message.from_dict(message, self.spill_threshold)
+        self._messages.append(message)
+
+    def copy(self) -> "Conversation":
+        """
+        Returns a new conversation with the same messages. Messages are shared, not copied.
+
+        :return: The new conversation.
+        :rtype: Conversation
+        """
+        conversation = Conversation(spill_threshold=self.spill_threshold)
+        conversation._messages = list(self._messages)
+        return conversation
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """
+        Returns the messages as dicts, in the format of OpenAI's API.
+
+        :return: The messages.
+        :rtype: List[Dict[str, Any]]
+        """
+        return [message.to_dict() for message in self._messages]
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self._messages)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Message, List[Message]]:
+        return self._messages[index]
+
+    def __repr__(self) -> str:
+        return f"Conversation({self._messages!r})"
+
+
+def to_dicts(messages: Union[Conversation, List[Dict[str, Any]]]) -> List[dict]:
+    """
+    Returns messages as dicts, whether they are held in a conversation or are already dicts.
+
+    :param messages: The messages.
+    :type messages: Union[Conversation, List[Dict[str, Any]]]
+    :return: The messages as dicts.
+    :rtype: List[dict]
+    """
+    if isinstance(messages, Conversation):
+        return messages.to_dicts()
+    return messages
+
+
+def content_length(message: Union[Message, Dict[str, Any]]) -> int:
+    """
+    Returns the length of a message's content, without reading spilled content back.
+
+    :param message: The message, as a message or a dict.
+    :type message: Union[Message, Dict[str, Any]]
+    :return: The number of characters.
+    :rtype: int
+    """
+    if isinstance(message, Message):
+        return message.content_length
+    return len(message.get("content") or "")
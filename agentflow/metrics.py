@@ -0,0 +1,519 @@
+"""
+This module provides live metrics for running flows: counters, gauges and histograms in an in-process registry, which can be served in Prometheus' text format from a /metrics endpoint and summarized in the log.
+
+Updates don't take a lock. Each thread updates its own shard of a metric, which only that thread writes to, and reading a metric sums the shards. So instrumenting hot paths, such as every LLM request and function call, costs a dict update. When a thread ends, its shards are folded into the totals of the threads that ended before it, so short-lived threads don't make metrics grow.
+"""
+
+import logging
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+DURATION_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric(ABC):
+    """
+    This abstract base class is responsible for the shards of a metric and their labels. Use its subclasses.
+
+    :param name: The name of the metric.
+    :type name: str
+    :param help: A description of the metric.
+    :type help: str
+    :param labels: The names of the metric's labels.
+    :type labels: Sequence[str]
+    :param registry: The registry to add the metric to.
+    :type registry: Registry, optional
+    """
+
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        registry: Optional["Registry"] = None,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._shards: Dict[int, dict] = {}
+        self._retired: dict = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _shard(self) -> dict:
+        """
+        Returns the calling thread's shard, creating it on the thread's first update.
+        """
+        try:
+            return self._local.holder.shard
+        except AttributeError:
+            holder = self._local.holder = _ShardHolder()
+            with self._lock:
+                self._shards[id(holder.shard)] = holder.shard
+            # The holder is dropped with the thread's locals when the thread ends.
+            weakref.finalize(holder, self._retire, holder.shard).atexit = False
+            return holder.shard
+
+    def _retire(self, shard: dict) -> None:
+        """
+        Folds the shard of a thread that has ended into the retired totals.
+        """
+        with self._lock:
+            del self._shards[id(shard)]
+            retired = dict(self._retired)
+            self._merge(retired, shard)
+            # Readers may hold the previous totals, so they are replaced, not updated.
+            self._retired = retired
+
+    @abstractmethod
+    def _merge(self, totals: dict, shard: dict) -> None:
+        """
+        Adds a shard's values to totals, without changing values the totals already hold.
+        """
+        pass
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        """
+        Returns the values of the metric's labels, in order.
+        """
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _snapshots(self) -> List[dict]:
+        """
+        Returns the retired totals and copies of the shards of live threads. Copying a dict doesn't release the GIL, so each copy is consistent.
+        """
+        with self._lock:
+            return [self._retired] + [shard.copy() for shard in self._shards.values()]
+
+    def _format_labels(self, key: Tuple[str, ...], extra: str = "") -> str:
+        parts = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> List[str]:
+        """
+        Returns the metric in Prometheus' text format.
+
+        :return: The lines.
+        :rtype: List[str]
+        """
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class _ShardHolder:
+    """
+    Holds a thread's shard of a metric in the thread's locals, so the shard can be retired when the thread ends.
+    """
+
+    __slots__ = ("shard", "__weakref__")
+
+    def __init__(self):
+        self.shard: dict = {}
+
+
+class Counter(Metric):
+    """
+    This class is responsible for a count that only goes up, such as the number of requests.
+    """
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        Adds to the count.
+
+        :param amount: The amount to add.
+        :type amount: float
+        :param labels: The values of the metric's labels.
+        :type labels: str
+        """
+        shard = self._shard()
+        key = self._key(labels) if self.labels else ()
+        shard[key] = shard.get(key, 0) + amount
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        """
+        Returns the count for each combination of label values.
+
+        :return: The counts.
+        :rtype: Dict[Tuple[str, ...], float]
+        """
+        totals: Dict[Tuple[str, ...], float] = {}
+        for shard in self._snapshots():
+            self._merge(totals, shard)
+        return totals
+
+    def _merge(self, totals: dict, shard: dict) -> None:
+        for key, value in shard.items():
+            totals[key] = totals.get(key, 0) + value
+
+    def total(self) -> float:
+        """
+        Returns the count across all label values.
+
+        :return: The count.
+        :rtype: float
+        """
+        return sum(self.values().values())
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, value in sorted(self.values().items()):
+            lines.append(
+                f"{self.name}{self._format_labels(key)} {_format_number(value)}"
+            )
+        return lines
+
+
+class Gauge(Counter):
+    """
+    This class is responsible for a value that goes up and down, such as the number of flows in flight.
+    """
+
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        """
+        Subtracts from the value.
+
+        :param amount: The amount to subtract.
+        :type amount: float
+        :param labels: The values of the metric's labels.
+        :type labels: str
+        """
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """
+    This class is responsible for a distribution of observed values, such as latencies, counted in buckets.
+
+    :param buckets: The upper bounds of the buckets, in increasing order. A bucket for larger values is added.
+    :type buckets: Sequence[float]
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        registry: Optional["Registry"] = None,
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Records a value.
+
+        :param value: The value.
+        :type value: float
+        :param labels: The values of the metric's labels.
+        :type labels: str
+        """
+        shard = self._shard()
+        key = self._key(labels) if self.labels else ()
+        counts = shard.get(key)
+        if counts is None:
+            counts = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, **labels: str) -> "_Timer":
+        """
+        Returns a context manager that records how long its block takes, even if it raises an error.
+
+        :param labels: The values of the metric's labels.
+        :type labels: str
+        :return: The context manager.
+        :rtype: _Timer
+        """
+        return _Timer(self, labels)
+
+    def values(self) -> Dict[Tuple[str, ...], List[float]]:
+        """
+        Returns, for each combination of label values, the count in each bucket, the last being for values above all bounds, followed by the sum of the values.
+
+        :return: The counts and sums.
+        :rtype: Dict[Tuple[str, ...], List[float]]
+        """
+        totals: Dict[Tuple[str, ...], List[float]] = {}
+        for shard in self._snapshots():
+            self._merge(totals, shard)
+        return totals
+
+    def _merge(self, totals: dict, shard: dict) -> None:
+        for key, counts in shard.items():
+            total = totals.get(key) or [0] * len(counts)
+            totals[key] = [a + b for a, b in zip(total, list(counts))]
+
+    def quantile(self, quantile: float) -> Optional[float]:
+        """
+        Estimates a quantile across all label values as the upper bound of the bucket it falls in.
+
+        :param quantile: The quantile, between 0 and 1.
+        :type quantile: float
+        :return: The estimate, infinity if it is above all bounds, or None if nothing was observed.
+        :rtype: Optional[float]
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        for values in self.values().values():
+            for index, count in enumerate(values[:-1]):
+                counts[index] += count
+        observed = sum(counts)
+        if not observed:
+            return None
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            if cumulative >= quantile * observed:
+                return bound
+        return float("inf")
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, values in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values[:-1]):
+                cumulative += count
+                labels = self._format_labels(key, f'le="{_format_number(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = self._format_labels(key)
+            lines.append(f"{self.name}_sum{labels} {_format_number(values[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    """
+    Records the duration of a block in a histogram.
+    """
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    """
+    This class is responsible for a set of metrics that are exported together.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> None:
+        """
+        Adds a metric.
+
+        :param metric: The metric.
+        :type metric: Metric
+        :raises ValueError: If a metric with the same name is already registered.
+        """
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}.")
+            self._metrics[metric.name] = metric
+
+    def __iter__(self) -> Iterator[Metric]:
+        with self._lock:
+            return iter(list(self._metrics.values()))
+
+    def render(self) -> str:
+        """
+        Returns all metrics in Prometheus' text format.
+
+        :return: The metrics.
+        :rtype: str
+        """
+        return "".join(line + "\n" for metric in self for line in metric.render())
+
+
+REGISTRY = Registry()
+
+FLOWS_IN_FLIGHT = Gauge(
+    "agentflow_flows_in_flight", "Flows that are running.", registry=REGISTRY
+)
+FLOWS = Counter(
+    "agentflow_flows_total",
+    "Flows that have finished, by status.",
+    ["status"],
+    REGISTRY,
+)
+TASKS = Counter("agentflow_tasks_total", "Tasks that have finished.", registry=REGISTRY)
+LLM_SECONDS = Histogram(
+    "agentflow_llm_request_seconds",
+    "Latency of LLM requests, by model.",
+    ["model"],
+    REGISTRY,
+)
+LLM_RETRIES = Counter(
+    "agentflow_llm_retries_total",
+    "LLM requests that were retried, by model.",
+    ["model"],
+    REGISTRY,
+)
+FUNCTION_SECONDS = Histogram(
+    "agentflow_function_seconds",
+    "Execution time of functions, by function.",
+    ["function"],
+    REGISTRY,
+    DURATION_BUCKETS,
+)
+FUNCTION_ERRORS = Counter(
+    "agentflow_function_errors_total",
+    "Function calls that failed or timed out, by function and reason.",
+    ["function", "reason"],
+    REGISTRY,
+)
+OUTPUT_BYTES = Counter(
+    "agentflow_output_bytes_total",
+    "Bytes written to output files.",
+    registry=REGISTRY,
+)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves the metrics of the server's registry at /metrics.
+    """
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(
+    port: int, host: str = "127.0.0.1", registry: Registry = REGISTRY
+) -> ThreadingHTTPServer:
+    """
+    Serves metrics at http://host:port/metrics from a background thread.
+
+    :param port: The port to listen on. Use 0 for any free port.
+    :type port: int
+    :param host: The address to listen on.
+    :type host: str
+    :param registry: The registry whose metrics to serve.
+    :type registry: Registry
+    :return: The server. Call its shutdown method to stop it.
+    :rtype: ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.registry = registry
+    threading.Thread(
+        target=server.serve_forever, name="agentflow-metrics", daemon=True
+    ).start()
+    return server
+
+
+class SummaryReporter:
+    """
+    This class is responsible for logging a summary line of the default metrics at regular intervals, such as:
+
+    flows_in_flight=4 tasks_per_second=1.50 llm_p50=1.0s llm_p95=5.0s llm_retries=2 function_seconds=12.34 output_bytes=56789
+
+    :param interval: The number of seconds between lines.
+    :type interval: float
+    """
+
+    def __init__(self, interval: float = 10.0):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last = (time.monotonic(), TASKS.total())
+
+    def summary(self) -> str:
+        """
+        Returns the summary line, with tasks per second since the previous line.
+
+        :return: The summary.
+        :rtype: str
+        """
+        now, tasks = time.monotonic(), TASKS.total()
+        then, previous = self._last
+        self._last = (now, tasks)
+        rate = (tasks - previous) / (now - then) if now > then else 0.0
+        function_seconds = sum(
+            values[-1] for values in FUNCTION_SECONDS.values().values()
+        )
+
+        def quantile(value: Optional[float]) -> str:
+            return "-" if value is None else f"{_format_number(value)}s"
+
+        return (
+            f"flows_in_flight={_format_number(FLOWS_IN_FLIGHT.total())} "
+            f"tasks_per_second={rate:.2f} "
+            f"llm_p50={quantile(LLM_SECONDS.quantile(0.5))} "
+            f"llm_p95={quantile(LLM_SECONDS.quantile(0.95))} "
+            f"llm_retries={_format_number(LLM_RETRIES.total())} "
+            f"function_seconds={function_seconds:.2f} "
+            f"output_bytes={_format_number(OUTPUT_BYTES.total())}"
+        )
+
+    def start(self) -> "SummaryReporter":
+        """
+        Starts logging summaries from a background thread.
+
+        :return: The reporter.
+        :rtype: SummaryReporter
+        """
+        self._thread = threading.Thread(
+            target=self._run, name="agentflow-metrics-summary", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops logging summaries, after logging a last one.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        logging.info(f"Metrics: {self.summary()}")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            logging.info(f"Metrics: {self.summary()}")
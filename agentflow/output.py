@@ -5,7 +5,9 @@ This module provides a class for managing output files. It creates a unique dire
 import json
 import os
 from datetime import datetime
-from typing import Union
+from typing import Optional, TextIO, Union
+
+from agentflow.metrics import OUTPUT_BYTES
 
 
 class Output:
@@ -13,17 +15,33 @@ class Output:
     This class is responsible for managing output files. It creates a unique directory for each flow and provides a method to save files to that directory.
     """
 
-    def __init__(self, flow_name: str):
+    def __init__(self, flow_name: str, output_path: Optional[str] = None):
         """
-        Initializes the Output object with a unique directory for the flow.
+        Initializes the Output object with a unique directory for the flow. If another run of the flow started in the same second, a counter is added to the directory name.
 
         :param flow_name: The name of the flow.
         :type flow_name: str
+        :param output_path: The directory of an earlier run to keep using, such as one being resumed. It is created if it doesn't exist.
+        :type output_path: str, optional
         """
         self.base_path = os.path.join(os.path.dirname(__file__), "outputs")
         self.timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+        if output_path is not None:
+            self.output_path = output_path
+            os.makedirs(output_path, exist_ok=True)
+            return
         self.output_path = os.path.join(self.base_path, f"{flow_name}_{self.timestamp}")
-        os.makedirs(self.output_path, exist_ok=True)
+        os.makedirs(self.base_path, exist_ok=True)
+        suffix = 1
+        while True:
+            try:
+                os.mkdir(self.output_path)
+                break
+            except FileExistsError:
+                suffix += 1
+                self.output_path = os.path.join(
+                    self.base_path, f"{flow_name}_{self.timestamp}_{suffix}"
+                )
 
     def save(self, file_name: str, file_contents: Union[str, list, dict]) -> str:
         """
@@ -47,5 +65,17 @@ class Output:
 
         with open(file_path, mode) as f:
             f.write(data_to_write)
+            OUTPUT_BYTES.inc(f.tell())
 
         return file_path
+
+    def open(self, file_name: str) -> TextIO:
+        """
+        Opens a file in the flow's directory for writing, for contents that are written as they arrive.
+
+        :param file_name: The name of the file.
+        :type file_name: str
+        :return: The open file.
+        :rtype: TextIO
+        """
+        return open(os.path.join(self.output_path, file_name), "w")
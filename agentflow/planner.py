@@ -0,0 +1,612 @@
+"""
+This module provides a planner that estimates the requests, tokens, cost and wall time of running flows without calling the LLM. A flow is loaded and formatted as it would be for a run, then its tasks are walked in order, growing the messages that each request resends along with the flow's function definitions.
+
+The length of answers and function results, and the latency of requests, come from the traces and messages of earlier runs in the outputs folder when there are any, and from defaults otherwise. Plans don't account for the semantic cache, budget downgrades or cascade escalations, so they are an upper bound on the first two and a lower bound on the last.
+"""
+
+import glob
+import json
+import math
+import os
+import re
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from agentflow.artifacts import PREVIEW_LENGTH
+from agentflow.flow import Condition, Flow, ForEach, Node, Task
+from agentflow.llm import Settings
+from agentflow.prefix import canonicalize_functions
+from agentflow.serialization import encode_functions
+from agentflow.tokens import CHARS_PER_TOKEN, context_window, estimate_cost
+
+# Defaults for flows without earlier runs.
+DEFAULT_COMPLETION_TOKENS = 300
+DEFAULT_FUNCTION_RESULT_TOKENS = 500
+DEFAULT_LOOP_ITEMS = 10
+DEFAULT_REQUEST_SECONDS = 0.5
+DEFAULT_SECONDS_PER_TOKEN = 0.03
+
+# The length of a reference's message, without the result's preview.
+REFERENCE_CHARS = 200
+
+_RUN_FOLDER = re.compile(r"^(?P<flow>.+)_\d{4}(?:_\d{2}){5}(?:_\d+)?$")
+
+
+class History:
+    """
+    This class is responsible for the statistics of earlier runs that plans are based on: the latency and completion tokens of requests by flow and model, from each run's trace.json, and the length of function results by function, from its messages.json.
+    """
+
+    def __init__(self):
+        """
+        Initializes the History object with no runs.
+        """
+        # [requests, seconds, completion tokens] by (flow, model), and by (None, model) for all flows.
+        self.requests: Dict[Tuple[Optional[str], str], List[float]] = {}
+        # [results, characters] by function.
+        self.results: Dict[str, List[float]] = {}
+
+    @classmethod
+    def from_outputs(
+        cls, outputs_path: Optional[str] = None, max_runs: int = 100
+    ) -> "History":
+        """
+        Loads the statistics of the latest runs in an outputs folder. Runs without a trace, such as those that failed, are skipped.
+
+        :param outputs_path: The outputs folder. If not set, will be agentflow/outputs.
+        :type outputs_path: str, optional
+        :param max_runs: The most runs to load.
+        :type max_runs: int, optional
+        :return: The history.
+        :rtype: History
+        """
+        outputs_path = outputs_path or os.path.join(
+            os.path.dirname(__file__), "outputs"
+        )
+        history = cls()
+        trace_paths = sorted(
+            glob.glob(os.path.join(outputs_path, "*", "trace.json")),
+            key=os.path.getmtime,
+            reverse=True,
+        )
+        for trace_path in trace_paths[:max_runs]:
+            folder = os.path.dirname(trace_path)
+            match = _RUN_FOLDER.match(os.path.basename(folder))
+            messages_path = os.path.join(folder, "messages.json")
+            try:
+                with open(trace_path, "r") as file:
+                    history.add_trace(match["flow"] if match else None, json.load(file))
+                if os.path.exists(messages_path):
+                    with open(messages_path, "r") as file:
+                        history.add_messages(json.load(file))
+            except ValueError:
+                continue
+        return history
+
+    def add_trace(
+        self, flow_name: Optional[str], records: List[Dict[str, Any]]
+    ) -> None:
+        """
+        Adds the records of a run's trace. Failed calls and calls without usage are left out.
+
+        :param flow_name: The name of the flow that ran, if known.
+        :type flow_name: str, optional
+        :param records: The records.
+        :type records: List[Dict[str, Any]]
+        """
+        for record in records:
+            if "error" in record or "completion_tokens" not in record:
+                continue
+            for key in {(flow_name, record["model"]), (None, record["model"])}:
+                stats = self.requests.setdefault(key, [0, 0.0, 0.0])
+                stats[0] += 1
+                stats[1] += record["latency"]
+                stats[2] += record["completion_tokens"]
+
+    def add_messages(self, messages: List[Dict[str, Any]]) -> None:
+        """
+        Adds the function results in a run's messages.
+
+        :param messages: The messages.
+        :type messages: List[Dict[str, Any]]
+        """
+        for message in messages:
+            if message.get("role") == "function":
+                stats = self.results.setdefault(message.get("name"), [0, 0])
+                stats[0] += 1
+                stats[1] += len(message.get("content") or "")
+
+    def completion_tokens(self, flow_name: str, model: str) -> Optional[float]:
+        """
+        Returns the mean completion tokens of earlier requests to a model, by the flow if it has any and by all flows otherwise.
+
+        :param flow_name: The name of the flow.
+        :type flow_name: str
+        :param model: The name of the model.
+        :type model: str
+        :return: The mean completion tokens, or None without earlier requests.
+        :rtype: Optional[float]
+        """
+        stats = self._request_stats(flow_name, model)
+        return stats[2] / stats[0] if stats else None
+
+    def latency(
+        self, flow_name: str, model: str, completion_tokens: float
+    ) -> Optional[float]:
+        """
+        Returns the expected latency of a request: the mean latency of earlier requests to the model, adjusted for the difference between their mean completion tokens and the request's.
+
+        :param flow_name: The name of the flow.
+        :type flow_name: str
+        :param model: The name of the model.
+        :type model: str
+        :param completion_tokens: The completion tokens of the request.
+        :type completion_tokens: float
+        :return: The latency in seconds, or None without earlier requests.
+        :rtype: Optional[float]
+        """
+        stats = self._request_stats(flow_name, model)
+        if not stats:
+            return None
+        difference = completion_tokens - stats[2] / stats[0]
+        return max(
+            stats[1] / stats[0] + difference * DEFAULT_SECONDS_PER_TOKEN,
+            DEFAULT_REQUEST_SECONDS,
+        )
+
+    def result_chars(self, function_name: str) -> Optional[float]:
+        """
+        Returns the mean length of a function's earlier results.
+
+        :param function_name: The name of the function.
+        :type function_name: str
+        :return: The mean number of characters, or None without earlier results.
+        :rtype: Optional[float]
+        """
+        stats = self.results.get(function_name)
+        return stats[1] / stats[0] if stats else None
+
+    def _request_stats(self, flow_name: str, model: str) -> Optional[List[float]]:
+        """
+        Returns the statistics of earlier requests to a model, by the flow if it has any and by all flows otherwise.
+        """
+        return self.requests.get((flow_name, model)) or self.requests.get((None, model))
+
+
+@dataclass
+class Plan:
+    """
+    This dataclass holds the estimated usage of a flow, or of part of one. Seconds are wall time, so the iterations of a loop that run at once count once.
+
+    :param requests: The number of LLM requests.
+    :param prompt_tokens: The prompt tokens of all requests.
+    :param completion_tokens: The completion tokens of all requests, including every candidate of tasks that sample several.
+    :param cost: The cost in USD.
+    :param seconds: The time the LLM requests take.
+    :param max_prompt_tokens: The prompt tokens of the largest request.
+    :param tasks: A row for each task with the prompt tokens of its first request, so the growth of the prompt from task to task shows.
+    :param warnings: Problems the flow will run into, such as requests that won't fit in their model's context window.
+    :param assumptions: What the plan assumes that is only known when the flow runs, such as the number of items in a loop.
+    """
+
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    seconds: float = 0.0
+    max_prompt_tokens: int = 0
+    tasks: List[Dict[str, Any]] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+    assumptions: List[str] = field(default_factory=list)
+
+    def add(self, other: "Plan", times: int = 1, rounds: Optional[int] = None) -> None:
+        """
+        Adds the usage of part of a flow.
+
+        :param other: The plan of the part.
+        :type other: Plan
+        :param times: How many times the part runs.
+        :type times: int, optional
+        :param rounds: How many times the part runs one after the other, if less than times.
+        :type rounds: int, optional
+        """
+        self.requests += other.requests * times
+        self.prompt_tokens += other.prompt_tokens * times
+        self.completion_tokens += other.completion_tokens * times
+        self.cost += other.cost * times
+        self.seconds += other.seconds * (times if rounds is None else rounds)
+        self.max_prompt_tokens = max(self.max_prompt_tokens, other.max_prompt_tokens)
+        self.tasks += [{**task, "runs": task["runs"] * times} for task in other.tasks]
+        self.warnings += [w for w in other.warnings if w not in self.warnings]
+        self.assumptions += [a for a in other.assumptions if a not in self.assumptions]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the plan as a dict.
+
+        :return: The plan.
+        :rtype: Dict[str, Any]
+        """
+        return asdict(self)
+
+
+@dataclass
+class BatchPlan:
+    """
+    This dataclass holds the estimated usage of a batch of flows.
+
+    :param flows: The number of flows.
+    :param requests: The number of LLM requests.
+    :param prompt_tokens: The prompt tokens of all requests.
+    :param completion_tokens: The completion tokens of all requests.
+    :param cost: The cost in USD.
+    :param flow_seconds: The time of all flows added up.
+    :param seconds: The projected wall time of the batch at its concurrency and rate limit.
+    :param warnings: The warnings of the flows, and the flows that could not be planned, by line.
+    :param assumptions: The assumptions of the plans of each flow.
+    """
+
+    flows: int = 0
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    flow_seconds: float = 0.0
+    seconds: float = 0.0
+    warnings: List[str] = field(default_factory=list)
+    assumptions: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the plan as a dict.
+
+        :return: The plan.
+        :rtype: Dict[str, Any]
+        """
+        return asdict(self)
+
+
+class PlannedFlow(Flow):
+    """
+    This class is responsible for loading and formatting a flow as Flow does, without the output folder, LLM and other state that running it needs.
+
+    :param name: The name of the flow.
+    :type name: str
+    :param variables: Variables to be used in the flow. Defaults to an empty dictionary.
+    :type variables: dict, optional
+    :param flows_path: The base path to the flows directory. If not set, will be agentflow/flows.
+    :type flows_path: str, optional
+    :raises FileNotFoundError: If the flow's JSON file does not exist.
+    :raises ValueError: If there are extra or missing variables.
+    """
+
+    def __init__(self, name: str, variables: dict = None, flows_path: str = None):
+        self.name = name
+        self.flows_path = flows_path or os.path.join(os.path.dirname(__file__), "flows")
+        self.variables = variables or {}
+        self._load_flow(name)
+        self._validate_and_format_messages(self.variables)
+        self.output = None
+        self.functions = canonicalize_functions(self._get_functions())
+
+
+class Planner:
+    """
+    This class is responsible for planning flows: estimating the requests, tokens, cost and wall time of running them, and warning about requests that won't fit in their model's context window.
+
+    :param history: The statistics of earlier runs. If not set, they are loaded from agentflow/outputs.
+    :type history: History, optional
+    :param flows_path: The base path to the flows directory. If not set, will be agentflow/flows.
+    :type flows_path: str, optional
+    :param loop_items: The number of items assumed for loops whose items are only known when the flow runs.
+    :type loop_items: int, optional
+    """
+
+    def __init__(
+        self,
+        history: Optional[History] = None,
+        flows_path: Optional[str] = None,
+        loop_items: int = DEFAULT_LOOP_ITEMS,
+    ):
+        self.history = history if history is not None else History.from_outputs()
+        self.flows_path = flows_path
+        self.loop_items = loop_items
+
+    def plan(self, name: str, variables: dict = None) -> Plan:
+        """
+        Plans a flow.
+
+        :param name: The name of the flow.
+        :type name: str
+        :param variables: Variables to be used in the flow.
+        :type variables: dict, optional
+        :raises FileNotFoundError: If the flow's JSON file does not exist.
+        :raises ValueError: If there are extra or missing variables.
+        :return: The plan.
+        :rtype: Plan
+        """
+        flow = PlannedFlow(name, variables, self.flows_path)
+        functions_chars = len(encode_functions(flow.functions)) if flow.functions else 0
+        initial_chars = len(flow.system_message or "")
+        plan, _, _ = self._plan_nodes(
+            flow, flow.tasks, initial_chars, functions_chars, set(), ""
+        )
+        return plan
+
+    def plan_batch(
+        self,
+        jobs: Iterable[Tuple[str, dict]],
+        workers: int = 1,
+        requests_per_minute: Optional[float] = None,
+    ) -> BatchPlan:
+        """
+        Plans a batch of flows. Its wall time is the longest of: the time of all flows shared among the workers, the longest flow, and the time the rate limit allows its requests to take.
+
+        :param jobs: The name and variables of each flow.
+        :type jobs: Iterable[Tuple[str, dict]]
+        :param workers: The number of flows that run at once.
+        :type workers: int, optional
+        :param requests_per_minute: The LLM rate budget shared by all flows.
+        :type requests_per_minute: float, optional
+        :return: The plan.
+        :rtype: BatchPlan
+        """
+        batch = BatchPlan()
+        longest = 0.0
+        for line, (name, variables) in enumerate(jobs, 1):
+            try:
+                plan = self.plan(name, variables)
+            except (FileNotFoundError, ValueError) as e:
+                batch.warnings.append(f"Line {line} ({name}): not planned: {e}")
+                continue
+            batch.flows += 1
+            batch.requests += plan.requests
+            batch.prompt_tokens += plan.prompt_tokens
+            batch.completion_tokens += plan.completion_tokens
+            batch.cost += plan.cost
+            batch.flow_seconds += plan.seconds
+            longest = max(longest, plan.seconds)
+            batch.warnings += [f"Line {line} ({name}): {w}" for w in plan.warnings]
+            for assumption in plan.assumptions:
+                if f"{name}: {assumption}" not in batch.assumptions:
+                    batch.assumptions.append(f"{name}: {assumption}")
+        rate_limited = (
+            batch.requests / requests_per_minute * 60 if requests_per_minute else 0.0
+        )
+        batch.seconds = max(batch.flow_seconds / max(workers, 1), longest, rate_limited)
+        return batch
+
+    def _plan_nodes(
+        self,
+        flow: PlannedFlow,
+        nodes: List[Node],
+        chars: int,
+        functions_chars: int,
+        loop_names: set,
+        label: str,
+    ) -> Tuple[Plan, int, int]:
+        """
+        Plans tasks, loops and conditions that run one after the other on the same messages.
+
+        :param flow: The flow.
+        :type flow: PlannedFlow
+        :param nodes: The tasks, loops and conditions.
+        :type nodes: List[Node]
+        :param chars: The length of the messages before the nodes run.
+        :type chars: int
+        :param functions_chars: The length of the function definitions sent with each request.
+        :type functions_chars: int
+        :param loop_names: The names of the items of enclosing loops.
+        :type loop_names: set
+        :param label: The label of the enclosing node, such as "2.", to number tasks in warnings.
+        :type label: str
+        :return: The plan, the length of the messages after the nodes run and the length of the last answer.
+        :rtype: Tuple[Plan, int, int]
+        """
+        plan = Plan()
+        answer_chars = 0
+        for number, node in enumerate(nodes, 1):
+            node_label = f"{label}{number}"
+            if isinstance(node, Task):
+                part, chars, answer_chars = self._plan_task(
+                    flow, node, chars, functions_chars, node_label
+                )
+            elif isinstance(node, ForEach):
+                part, chars, answer_chars = self._plan_for_each(
+                    flow, node, chars, functions_chars, loop_names, node_label
+                )
+            else:
+                part, chars, answer_chars = self._plan_condition(
+                    flow, node, chars, functions_chars, loop_names, node_label
+                )
+            plan.add(part)
+        return plan, chars, answer_chars
+
+    def _plan_task(
+        self,
+        flow: PlannedFlow,
+        task: Task,
+        chars: int,
+        functions_chars: int,
+        label: str,
+    ) -> Tuple[Plan, int, int]:
+        """
+        Plans a task: its request and, if it calls a function, the function's result and the request that answers it.
+
+        :return: The plan, the length of the messages after the task runs and the length of its answer.
+        :rtype: Tuple[Plan, int, int]
+        """
+        plan = Plan()
+        chars += len(task.action)
+        prompt_tokens = (chars + functions_chars) // CHARS_PER_TOKEN
+        model, completion_tokens = self._plan_request(
+            flow, task.settings, chars + functions_chars, label, plan
+        )
+        chars += completion_tokens * CHARS_PER_TOKEN
+        if task.settings.function_call is not None:
+            result_chars = self.history.result_chars(task.settings.function_call)
+            if result_chars is None:
+                result_chars = DEFAULT_FUNCTION_RESULT_TOKENS * CHARS_PER_TOKEN
+            if task.settings.by_reference:
+                result_chars = min(result_chars, PREVIEW_LENGTH) + REFERENCE_CHARS
+            chars += int(result_chars)
+            _, completion_tokens = self._plan_request(
+                flow,
+                replace(task.settings, n=None),
+                chars + functions_chars,
+                label,
+                plan,
+            )
+            chars += completion_tokens * CHARS_PER_TOKEN
+        plan.tasks.append(
+            {
+                "task": label,
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "requests": plan.requests,
+                "cost": plan.cost,
+                "runs": 1,
+            }
+        )
+        return plan, chars, completion_tokens * CHARS_PER_TOKEN
+
+    def _plan_request(
+        self,
+        flow: PlannedFlow,
+        settings: Settings,
+        prompt_chars: int,
+        label: str,
+        plan: Plan,
+    ) -> Tuple[str, int]:
+        """
+        Plans a request and adds it to a plan, with a warning if it won't fit in its model's context window.
+
+        :param flow: The flow.
+        :type flow: PlannedFlow
+        :param settings: The settings of the task.
+        :type settings: Settings
+        :param prompt_chars: The length of the messages and function definitions.
+        :type prompt_chars: int
+        :param label: The label of the task.
+        :type label: str
+        :param plan: The plan to add the request to.
+        :type plan: Plan
+        :return: The model chosen for the request, and the completion tokens of its answer.
+        :rtype: Tuple[str, int]
+        """
+        prompt_tokens = prompt_chars // CHARS_PER_TOKEN
+        route = next(
+            (
+                route
+                for route in flow.router.routes
+                if route.matches(settings, prompt_tokens)
+            ),
+            None,
+        )
+        model = route.models[0] if route else settings.model
+        completion_tokens = self.history.completion_tokens(flow.name, model)
+        if completion_tokens is None:
+            completion_tokens = DEFAULT_COMPLETION_TOKENS
+        if settings.max_tokens is not None:
+            completion_tokens = min(completion_tokens, settings.max_tokens)
+        completion_tokens = round(completion_tokens)
+        seconds = self.history.latency(flow.name, model, completion_tokens)
+        if seconds is None:
+            seconds = (
+                DEFAULT_REQUEST_SECONDS + completion_tokens * DEFAULT_SECONDS_PER_TOKEN
+            )
+
+        window = context_window(model)
+        reserved = settings.max_tokens or completion_tokens
+        if window is not None and prompt_tokens + reserved > window:
+            plan.warnings.append(
+                f"Task {label}: {prompt_tokens} prompt tokens and {reserved} completion tokens overflow the {window}-token context window of {model}."
+            )
+
+        candidates = settings.n or 1
+        plan.requests += 1
+        plan.prompt_tokens += prompt_tokens
+        plan.completion_tokens += completion_tokens * candidates
+        plan.cost += estimate_cost(model, prompt_tokens, completion_tokens * candidates)
+        plan.seconds += seconds
+        plan.max_prompt_tokens = max(plan.max_prompt_tokens, prompt_tokens)
+        return model, completion_tokens
+
+    def _plan_for_each(
+        self,
+        flow: PlannedFlow,
+        loop: ForEach,
+        chars: int,
+        functions_chars: int,
+        loop_names: set,
+        label: str,
+    ) -> Tuple[Plan, int, int]:
+        """
+        Plans a loop. Each iteration starts from the system message, and iterations run in rounds of the loop's concurrency. The items of a variable are counted, and other loops are assumed to have the planner's loop_items.
+
+        :return: The plan, the length of the messages after the loop runs and the length of its answer.
+        :rtype: Tuple[Plan, int, int]
+        """
+        plan = Plan()
+        variable = loop.source.get("variable")
+        if variable is not None and variable not in loop_names:
+            items = Flow._get_items(flow.variables[variable])
+            count, items_chars = len(items), sum(map(len, items))
+        else:
+            count = self.loop_items
+            items_chars = 0
+            plan.assumptions.append(
+                f"Loop {label} has {count} items, which are only known when the flow runs."
+            )
+        iteration, _, answer_chars = self._plan_nodes(
+            flow,
+            loop.tasks,
+            len(flow.system_message or ""),
+            functions_chars,
+            loop_names | {loop.name},
+            f"{label}.",
+        )
+        plan.add(iteration, count, math.ceil(count / max(loop.concurrency, 1)))
+        answers_chars = items_chars + count * (len(loop.name) + 3 + answer_chars)
+        return plan, chars + answers_chars, answers_chars
+
+    def _plan_condition(
+        self,
+        flow: PlannedFlow,
+        condition: Condition,
+        chars: int,
+        functions_chars: int,
+        loop_names: set,
+        label: str,
+    ) -> Tuple[Plan, int, int]:
+        """
+        Plans a condition. A condition on a variable is checked, and for other conditions the costlier branch is planned.
+
+        :return: The plan, the length of the messages after the branch runs and the length of its last answer.
+        :rtype: Tuple[Plan, int, int]
+        """
+        variable = condition.predicate.get("variable")
+        branches = [
+            (condition.tasks, f"{label}."),
+            (condition.else_tasks, f"{label}.else."),
+        ]
+        if variable is not None and variable not in loop_names:
+            branches = [
+                (
+                    branches[0]
+                    if condition.holds(flow.variables[variable])
+                    else branches[1]
+                )
+            ]
+        plans = [
+            self._plan_nodes(flow, nodes, chars, functions_chars, loop_names, prefix)
+            for nodes, prefix in branches
+        ]
+        plan, chars, answer_chars = max(
+            plans, key=lambda planned: (planned[0].cost, planned[0].prompt_tokens)
+        )
+        if len(branches) > 1:
+            plan.assumptions.append(
+                f"Condition {label} takes its costlier branch, as it is only known when the flow runs."
+            )
+        return plan, chars, answer_chars
@@ -0,0 +1,112 @@
+"""
+This module provides a class for the prompt prefix of a flow: the system message and function definitions that are resent with every call. Keeping the prefix byte-for-byte identical across calls and flows lets the provider's prompt caching reuse it.
+"""
+
+import hashlib
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+_canonical_functions: Dict[str, Tuple[dict, ...]] = {}
+_canonical_lock = threading.Lock()
+
+
+def dumps_canonical(value: Any) -> str:
+    """
+    Serializes a value to JSON that is identical for equal values, whatever the order of their keys.
+
+    :param value: The value to serialize.
+    :type value: Any
+    :return: The JSON string.
+    :rtype: str
+    """
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def canonicalize_functions(functions: List[dict]) -> Tuple[dict, ...]:
+    """
+    Returns function definitions without duplicates, ordered by name, with their keys sorted. Equal lists return the same tuple, so flows share one copy.
+
+    :param functions: The function definitions.
+    :type functions: List[dict]
+    :return: The canonical function definitions.
+    :rtype: Tuple[dict, ...]
+    """
+    by_name = {function["name"]: function for function in functions}
+    key = dumps_canonical([by_name[name] for name in sorted(by_name)])
+    with _canonical_lock:
+        if key not in _canonical_functions:
+            _canonical_functions[key] = tuple(json.loads(key))
+        return _canonical_functions[key]
+
+
+class PrefixStats:
+    """
+    This class counts how often a call reuses a prefix that was already sent by this process, which is when provider-side prompt caching can hit.
+    """
+
+    def __init__(self):
+        """
+        Initializes the PrefixStats object with no calls.
+        """
+        self.calls = 0
+        self.hits = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def record(self, prefix_hash: str) -> bool:
+        """
+        Records a call that sent a prefix.
+
+        :param prefix_hash: The hash of the prefix.
+        :type prefix_hash: str
+        :return: Whether the prefix was sent before.
+        :rtype: bool
+        """
+        with self._lock:
+            hit = prefix_hash in self._seen
+            self._seen.add(prefix_hash)
+            self.calls += 1
+            self.hits += int(hit)
+            return hit
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Returns the share of calls that reused a prefix.
+        """
+        return self.hits / self.calls if self.calls else 0.0
+
+
+prefix_stats = PrefixStats()
+
+
+class Prefix:
+    """
+    This class holds the frozen prompt prefix of a flow.
+
+    :param system_message: The system message of the flow, if any.
+    :type system_message: str, optional
+    :param functions: The function definitions of the flow.
+    :type functions: List[dict], optional
+    """
+
+    def __init__(
+        self, system_message: Optional[str] = None, functions: List[dict] = None
+    ):
+        self.system_message = system_message
+        self.functions = canonicalize_functions(functions or [])
+        self.hash = hashlib.sha256(
+            dumps_canonical(
+                {"functions": self.functions, "system_message": system_message}
+            ).encode()
+        ).hexdigest()
+
+    def record_call(self) -> bool:
+        """
+        Records a call that sent this prefix.
+
+        :return: Whether the prefix was sent before by this process.
+        :rtype: bool
+        """
+        return prefix_stats.record(self.hash)
@@ -0,0 +1,449 @@
+"""
+This module provides local document retrieval. A corpus is split into chunks, each chunk is embedded, and the embeddings are saved as a float32 matrix on disk. Searching memory-maps the matrix, so an index opens in milliseconds whatever its size, and scores all chunks with vectorized dot products.
+
+An index is a directory holding:
+
+* meta.json: the embedder, the number of chunks and the source files.
+* embeddings.f32: the unit-length embeddings, one row per chunk.
+* chunks.txt and offsets.u64: the text of the chunks and where each one starts and ends.
+* sources.i32: the source file of each chunk.
+"""
+
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import openai
+
+from agentflow.functions.get_url import html_to_text
+from agentflow.llm import LLM
+
+EXTENSIONS = (".txt", ".md", ".rst", ".html", ".htm")
+BLOCK_ROWS = 1 << 16
+
+_TOKEN = re.compile(r"\w+")
+
+
+class BaseEmbedder(ABC):
+    """
+    This abstract base class defines the interface for embedders.
+
+    :param dimensions: The number of dimensions of the embeddings.
+    :type dimensions: int
+    """
+
+    name = "base"
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embeds texts.
+
+        :param texts: The texts.
+        :type texts: List[str]
+        :return: The unit-length embeddings, as a float32 matrix with one row per text.
+        :rtype: np.ndarray
+        """
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the embedder's name and settings, which are saved with an index so it is searched with the same embedder.
+
+        :return: The embedder's definition.
+        :rtype: Dict[str, Any]
+        """
+        return {"name": self.name, "dimensions": self.dimensions}
+
+
+class HashingEmbedder(BaseEmbedder):
+    """
+    This class is responsible for embedding texts offline as signed, hashed counts of their words and word pairs. It needs no model or network, and texts that share words get similar embeddings.
+
+    :param dimensions: The number of dimensions of the embeddings.
+    :type dimensions: int
+    """
+
+    name = "hashing"
+
+    def __init__(self, dimensions: int = 256):
+        super().__init__(dimensions)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _TOKEN.findall(text.casefold())
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            if not features:
+                continue
+            hashes = np.fromiter(
+                (zlib.crc32(feature.encode()) for feature in features),
+                dtype=np.uint32,
+                count=len(features),
+            )
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(matrix[row], hashes % self.dimensions, signs)
+        return _normalize(matrix)
+
+
+class OpenAIEmbedder(BaseEmbedder):
+    """
+    This class is responsible for embedding texts with OpenAI's embeddings API.
+
+    :param model: The embedding model.
+    :type model: str
+    :param dimensions: The number of dimensions of the model's embeddings.
+    :type dimensions: int
+    :param batch_size: The number of texts per request.
+    :type batch_size: int
+    """
+
+    name = "openai"
+
+    def __init__(
+        self,
+        model: str = "text-embedding-ada-002",
+        dimensions: int = 1536,
+        batch_size: int = 512,
+    ):
+        super().__init__(dimensions)
+        self.model = model
+        self.batch_size = batch_size
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        endpoints = LLM.get_default_endpoints()
+        rows = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start : start + self.batch_size]
+            response = endpoints.send(
+                lambda endpoint: openai.Embedding.create(
+                    model=self.model,
+                    input=batch,
+                    api_key=endpoint.get_api_key(),
+                    api_base=endpoint.get_api_base(),
+                )
+            )
+            rows += [item["embedding"] for item in response["data"]]
+        return _normalize(np.array(rows, dtype=np.float32).reshape(-1, self.dimensions))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**super().to_dict(), "model": self.model}
+
+
+EMBEDDERS = {"hashing": HashingEmbedder, "openai": OpenAIEmbedder}
+
+
+def get_embedder(definition: Dict[str, Any]) -> BaseEmbedder:
+    """
+    Creates an embedder from its definition, such as {"name": "hashing", "dimensions": 256}.
+
+    :param definition: The definition.
+    :type definition: Dict[str, Any]
+    :raises ValueError: If there is no embedder with the name.
+    :return: The embedder.
+    :rtype: BaseEmbedder
+    """
+    settings = dict(definition)
+    name = settings.pop("name")
+    if name not in EMBEDDERS:
+        raise ValueError(f"Unknown embedder: {name}.")
+    return EMBEDDERS[name](**settings)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
+    """
+    Splits text into chunks of about chunk_size characters that overlap by about overlap characters. Chunks start and end at whitespace where possible.
+
+    :param text: The text.
+    :type text: str
+    :param chunk_size: The maximum number of characters in a chunk.
+    :type chunk_size: int
+    :param overlap: The number of characters repeated from the end of the previous chunk.
+    :type overlap: int
+    :return: The chunks, without surrounding whitespace.
+    :rtype: List[str]
+    """
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            space = text.rfind(" ", start + chunk_size // 2, end)
+            end = space if space != -1 else end
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        space = text.find(" ", end - overlap, end)
+        start = max(space + 1 if space != -1 else end - overlap, start + 1)
+    return chunks
+
+
+def read_corpus(corpus_path: str) -> Iterator[Tuple[str, str]]:
+    """
+    Reads the text files of a corpus, converting HTML to text.
+
+    :param corpus_path: The directory of the corpus.
+    :type corpus_path: str
+    :return: The path of each file relative to the corpus, with its text.
+    :rtype: Iterator[Tuple[str, str]]
+    """
+    for directory, _, names in sorted(os.walk(corpus_path)):
+        for name in sorted(names):
+            if not name.lower().endswith(EXTENSIONS):
+                continue
+            path = os.path.join(directory, name)
+            with open(path, "r", encoding="utf-8", errors="replace") as file:
+                text = file.read()
+            if name.lower().endswith((".html", ".htm")):
+                text = html_to_text(text)
+            yield os.path.relpath(path, corpus_path), text
+
+
+def build_index(
+    documents: Iterable[Tuple[str, str]],
+    index_path: str,
+    embedder: Optional[BaseEmbedder] = None,
+    chunk_size: int = 1000,
+    overlap: int = 200,
+    batch_size: int = 1024,
+) -> int:
+    """
+    Builds an index from documents. Chunks are embedded and written in batches, so the corpus doesn't need to fit in memory.
+
+    The index is written to a sibling directory and then moved into place, so processes that have the previous index open keep reading its files, which are never truncated, until they open the new one.
+
+    :param documents: The source and text of each document.
+    :type documents: Iterable[Tuple[str, str]]
+    :param index_path: The directory to write the index to.
+    :type index_path: str
+    :param embedder: The embedder. Defaults to a HashingEmbedder.
+    :type embedder: BaseEmbedder, optional
+    :param chunk_size: The maximum number of characters in a chunk.
+    :type chunk_size: int
+    :param overlap: The number of characters repeated between chunks.
+    :type overlap: int
+    :param batch_size: The number of chunks embedded at once.
+    :type batch_size: int
+    :return: The number of chunks.
+    :rtype: int
+    """
+    embedder = embedder or HashingEmbedder()
+    index_path = os.path.abspath(index_path)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    building_path = f"{index_path}.{uuid.uuid4().hex}.building"
+    os.mkdir(building_path)
+    try:
+        count = _write_index(
+            documents, building_path, embedder, chunk_size, overlap, batch_size
+        )
+        _replace_directory(building_path, index_path)
+    except BaseException:
+        shutil.rmtree(building_path, ignore_errors=True)
+        raise
+    return count
+
+
+def _write_index(
+    documents: Iterable[Tuple[str, str]],
+    index_path: str,
+    embedder: BaseEmbedder,
+    chunk_size: int,
+    overlap: int,
+    batch_size: int,
+) -> int:
+    """
+    Writes the files of an index to a new directory.
+
+    :return: The number of chunks.
+    :rtype: int
+    """
+    sources: List[str] = []
+    count = 0
+    offset = 0
+    with open(os.path.join(index_path, "embeddings.f32"), "wb") as embeddings, open(
+        os.path.join(index_path, "chunks.txt"), "wb"
+    ) as chunks_file, open(
+        os.path.join(index_path, "offsets.u64"), "wb"
+    ) as offsets, open(
+        os.path.join(index_path, "sources.i32"), "wb"
+    ) as source_ids:
+        np.array([0], dtype=np.uint64).tofile(offsets)
+        batch: List[Tuple[int, str]] = []
+
+        def flush() -> None:
+            nonlocal offset
+            embedder.embed([text for _, text in batch]).astype(np.float32).tofile(
+                embeddings
+            )
+            ends = []
+            for _, text in batch:
+                encoded = text.encode()
+                chunks_file.write(encoded)
+                offset += len(encoded)
+                ends.append(offset)
+            np.array(ends, dtype=np.uint64).tofile(offsets)
+            np.array([source for source, _ in batch], dtype=np.int32).tofile(source_ids)
+            batch.clear()
+
+        for source, text in documents:
+            sources.append(source)
+            for chunk in chunk_text(text, chunk_size, overlap):
+                batch.append((len(sources) - 1, chunk))
+                count += 1
+                if len(batch) >= batch_size:
+                    flush()
+        if batch:
+            flush()
+
+    with open(os.path.join(index_path, "meta.json"), "w") as file:
+        json.dump(
+            {"embedder": embedder.to_dict(), "count": count, "sources": sources}, file
+        )
+    return count
+
+
+def _replace_directory(source: str, destination: str) -> None:
+    """
+    Moves a directory into place, replacing the directory there if there is one. Its files are removed rather than overwritten, so memory maps of them stay valid.
+
+    :param source: The directory to move.
+    :type source: str
+    :param destination: The path to move it to.
+    :type destination: str
+    """
+    if not os.path.exists(destination):
+        os.replace(source, destination)
+        return
+    retired = f"{destination}.{uuid.uuid4().hex}.retired"
+    os.replace(destination, retired)
+    os.replace(source, destination)
+    shutil.rmtree(retired, ignore_errors=True)
+
+
+class VectorIndex:
+    """
+    This class is responsible for searching an index. Its files are memory-mapped, so only the pages that are read are loaded.
+
+    :param index_path: The directory of the index.
+    :type index_path: str
+    :raises FileNotFoundError: If there is no index in the directory.
+    """
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        meta_path = os.path.join(index_path, "meta.json")
+        self.modified = os.stat(meta_path).st_mtime_ns
+        with open(meta_path, "r") as file:
+            meta = json.load(file)
+        self.embedder = get_embedder(meta["embedder"])
+        self.count = meta["count"]
+        self.sources = meta["sources"]
+        self.embeddings = self._map("embeddings.f32", np.float32)
+        if self.count:
+            self.embeddings = self.embeddings.reshape(
+                self.count, self.embedder.dimensions
+            )
+        self.offsets = self._map("offsets.u64", np.uint64)
+        self.source_ids = self._map("sources.i32", np.int32)
+        self.chunks = self._map("chunks.txt", np.uint8)
+
+    def _map(self, name: str, dtype: type) -> np.ndarray:
+        path = os.path.join(self.index_path, name)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Finds the chunks most similar to a query.
+
+        :param query: The query.
+        :type query: str
+        :param k: The number of chunks to return.
+        :type k: int
+        :return: The chunks, most similar first, with their source and cosine similarity.
+        :rtype: List[Dict[str, Any]]
+        """
+        k = min(k, self.count)
+        if k <= 0:
+            return []
+        vector = self.embedder.embed([query])[0]
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, self.count, BLOCK_ROWS):
+            scores = self.embeddings[start : start + BLOCK_ROWS] @ vector
+            if len(scores) > k:
+                top = np.argpartition(scores, -k)[-k:]
+            else:
+                top = np.arange(len(scores))
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_scores) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        order = np.argsort(-best_scores)
+        return [
+            {
+                "source": self.sources[self.source_ids[row]],
+                "score": float(best_scores[position]),
+                "text": self.chunk(int(row)),
+            }
+            for position, row in ((i, best_rows[i]) for i in order)
+        ]
+
+    def chunk(self, row: int) -> str:
+        """
+        Returns the text of a chunk.
+
+        :param row: The number of the chunk.
+        :type row: int
+        :return: The text.
+        :rtype: str
+        """
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return bytes(self.chunks[start:end]).decode()
+
+
+_indexes: Dict[str, VectorIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def open_index(index_path: str) -> VectorIndex:
+    """
+    Returns an index, opening it the first time and whenever it has been rebuilt. While a rebuilt index is being moved into place, the index that was open is returned.
+
+    :param index_path: The directory of the index.
+    :type index_path: str
+    :return: The index.
+    :rtype: VectorIndex
+    """
+    try:
+        modified = os.stat(os.path.join(index_path, "meta.json")).st_mtime_ns
+    except FileNotFoundError:
+        # The index may be in the middle of being replaced by a rebuild.
+        with _indexes_lock:
+            if index_path in _indexes:
+                return _indexes[index_path]
+        raise
+    with _indexes_lock:
+        index = _indexes.get(index_path)
+        if index is None or index.modified != modified:
+            index = VectorIndex(index_path)
+            _indexes[index_path] = index
+        return index
@@ -0,0 +1,256 @@
+"""
+This module provides classes for routing tasks to models using declarative rules. A route can also define a cascade of models, where a fast model answers first and stronger models are only called when a validator rejects the answer.
+"""
+
+import json
+import threading
+import time
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any, Callable, Dict, List, Optional
+
+from agentflow.llm import LLM, Settings
+from agentflow.tokens import CHARS_PER_TOKEN, estimate_cost, estimate_tokens
+from agentflow.trace import annotate
+
+
+def _is_not_empty(message: Any) -> bool:
+    """
+    Accepts messages that have content or a function call.
+
+    :param message: The message from the assistant.
+    :type message: Any
+    :return: Whether the message is accepted.
+    :rtype: bool
+    """
+    return bool(message.content or getattr(message, "function_call", None))
+
+
+def _is_json(message: Any) -> bool:
+    """
+    Accepts messages whose content, or function call arguments, are valid JSON.
+
+    :param message: The message from the assistant.
+    :type message: Any
+    :return: Whether the message is accepted.
+    :rtype: bool
+    """
+    function_call = getattr(message, "function_call", None)
+    text = function_call.arguments if function_call else message.content
+    try:
+        json.loads(text or "")
+    except ValueError:
+        return False
+    return True
+
+
+VALIDATORS: Dict[str, Callable[[Any], bool]] = {
+    "non_empty": _is_not_empty,
+    "json": _is_json,
+}
+
+
+@dataclass
+class Route:
+    """
+    This dataclass holds a routing rule. A task matches the rule when every condition that is set on the rule holds.
+
+    :param name: The name of the route, used for metrics.
+    :param models: The models to try in order. Later models are only called when the validator rejects an answer.
+    :param max_prompt_tokens: Matches tasks whose estimated prompt is at most this many tokens.
+    :param tags: Matches tasks that have at least one of these tags.
+    :param max_latency_slo: Matches tasks whose latency SLO, in seconds, is at most this value.
+    :param validator: The name of the validator that decides whether to escalate to the next model.
+    """
+
+    name: str
+    models: List[str]
+    max_prompt_tokens: Optional[int] = None
+    tags: Optional[List[str]] = None
+    max_latency_slo: Optional[float] = None
+    validator: Optional[str] = None
+
+    def matches(self, settings: Settings, prompt_tokens: int) -> bool:
+        """
+        Checks whether a task matches the route.
+
+        :param settings: The settings of the task.
+        :type settings: Settings
+        :param prompt_tokens: The estimated number of prompt tokens.
+        :type prompt_tokens: int
+        :return: Whether the task matches.
+        :rtype: bool
+        """
+        if (
+            self.max_prompt_tokens is not None
+            and prompt_tokens > self.max_prompt_tokens
+        ):
+            return False
+        if self.tags is not None and not set(self.tags) & set(settings.tags or []):
+            return False
+        if self.max_latency_slo is not None and (
+            settings.latency_slo is None or settings.latency_slo > self.max_latency_slo
+        ):
+            return False
+        return True
+
+
+@dataclass
+class RouteMetrics:
+    """
+    This dataclass holds latency and cost metrics for a route. Token counts and costs are estimates.
+    """
+
+    calls: int = 0
+    rejections: int = 0
+    escalations: int = 0
+    total_latency: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    models: Dict[str, int] = field(default_factory=dict)
+
+
+class Router:
+    """
+    This class is responsible for choosing the model for each task and for running cascades.
+
+    :param routes: Route definitions, as loaded from the "routes" list of a flow. The first matching route is used.
+    :type routes: List[dict], optional
+    :param validators: Additional validators by name. Each takes the assistant message and returns whether it is accepted.
+    :type validators: Dict[str, Callable[[Any], bool]], optional
+    :raises ValueError: If a route has no models or an unknown validator.
+    """
+
+    def __init__(
+        self,
+        routes: List[dict] = None,
+        validators: Dict[str, Callable[[Any], bool]] = None,
+    ):
+        self.routes = [Route(**route) for route in routes or []]
+        self.validators = {**VALIDATORS, **(validators or {})}
+        for route in self.routes:
+            if not route.models:
+                raise ValueError(f"Route {route.name} has no models.")
+            if route.validator and route.validator not in self.validators:
+                raise ValueError(f"Unknown validator: {route.validator}.")
+        self.metrics = {route.name: RouteMetrics() for route in self.routes}
+        self._lock = threading.Lock()
+
+    def select(
+        self,
+        settings: Settings,
+        messages: List[Dict[str, str]],
+        functions: Optional[List[dict]] = None,
+    ) -> Optional[Route]:
+        """
+        Selects the route for a task.
+
+        :param settings: The settings of the task.
+        :type settings: Settings
+        :param messages: The messages to be sent to the language model.
+        :type messages: List[Dict[str, str]]
+        :param functions: The function definitions to be sent with the messages.
+        :type functions: Optional[List[dict]]
+        :return: The first matching route, or None if no route matches.
+        :rtype: Optional[Route]
+        """
+        if not self.routes:
+            return None
+        prompt_tokens = estimate_tokens(messages, functions)
+        return next(
+            (route for route in self.routes if route.matches(settings, prompt_tokens)),
+            None,
+        )
+
+    def respond(
+        self,
+        llm: LLM,
+        settings: Settings,
+        messages: List[Dict[str, str]],
+        functions: Optional[List[dict]] = None,
+    ) -> Any:
+        """
+        Gets a response for a task from the model chosen by the matching route, escalating through the route's cascade when the validator rejects an answer. Tasks that match no route use their own settings.
+
+        :param llm: The LLM used to send requests.
+        :type llm: LLM
+        :param settings: The settings of the task.
+        :type settings: Settings
+        :param messages: The messages to be sent to the language model.
+        :type messages: List[Dict[str, str]]
+        :param functions: The function definitions to be sent with the messages.
+        :type functions: Optional[List[dict]]
+        :return: The response from the language model.
+        :rtype: Any
+        """
+        route = self.select(settings, messages, functions)
+        if route is None:
+            return llm.respond(settings, messages, functions)
+
+        validator = self.validators.get(route.validator) if route.validator else None
+        prompt_tokens = estimate_tokens(messages, functions)
+        for index, model in enumerate(route.models):
+            annotate(route=route.name, model=model, escalations=index)
+            start = time.perf_counter()
+            message = llm.respond(replace(settings, model=model), messages, functions)
+            accepted = validator is None or validator(message)
+            is_last = index == len(route.models) - 1
+            self._record(
+                route,
+                model,
+                time.perf_counter() - start,
+                prompt_tokens,
+                self._completion_tokens(message),
+                escalated=not accepted and not is_last,
+                rejected=not accepted,
+            )
+            if accepted or is_last:
+                return message
+
+    def get_metrics(self) -> Dict[str, dict]:
+        """
+        Returns the metrics for each route.
+
+        :return: The metrics by route name.
+        :rtype: Dict[str, dict]
+        """
+        with self._lock:
+            return {name: asdict(metrics) for name, metrics in self.metrics.items()}
+
+    def _record(
+        self,
+        route: Route,
+        model: str,
+        latency: float,
+        prompt_tokens: int,
+        completion_tokens: int,
+        escalated: bool,
+        rejected: bool,
+    ) -> None:
+        """
+        Records the metrics of a single call made for a route.
+        """
+        with self._lock:
+            metrics = self.metrics[route.name]
+            metrics.calls += 1
+            metrics.rejections += int(rejected)
+            metrics.escalations += int(escalated)
+            metrics.total_latency += latency
+            metrics.prompt_tokens += prompt_tokens
+            metrics.completion_tokens += completion_tokens
+            metrics.cost += estimate_cost(model, prompt_tokens, completion_tokens)
+            metrics.models[model] = metrics.models.get(model, 0) + 1
+
+    @staticmethod
+    def _completion_tokens(message: Any) -> int:
+        """
+        Estimates the number of tokens in a response.
+
+        :param message: The message from the assistant.
+        :type message: Any
+        :return: The estimated number of tokens.
+        :rtype: int
+        """
+        function_call = getattr(message, "function_call", None)
+        text = function_call.arguments if function_call else message.content
+        return len(text or "") // CHARS_PER_TOKEN
@@ -0,0 +1,348 @@
+"""
+This module provides a scheduler for running many flows from different tenants through a shared LLM rate budget. Jobs are run by priority, tenants get weighted fair shares of the rate budget, and each tenant can be capped to a number of concurrent flows.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional
+
+from agentflow.budget import Budget
+from agentflow.flow import Flow
+from agentflow.planner import History, Planner
+
+
+@dataclass
+class Job:
+    """
+    This dataclass holds a flow run submitted to the scheduler.
+
+    :param flow_name: The name of the flow.
+    :param variables: Variables to be used in the flow.
+    :param tenant: The tenant that submitted the job.
+    :param priority: Jobs with higher priority run first.
+    :param cost: The number of LLM requests the job is expected to make. If not set, it is estimated from the flow.
+    :param flows_path: The base path to the flows directory.
+    :param budget: A budget shared with other jobs, such as those of a batch, that the flow's usage counts towards.
+    """
+
+    flow_name: str
+    variables: dict = field(default_factory=dict)
+    tenant: str = "default"
+    priority: int = 0
+    cost: Optional[float] = None
+    flows_path: Optional[str] = None
+    budget: Optional[Budget] = field(default=None, repr=False)
+    submitted_at: Optional[float] = field(default=None, init=False)
+    started_at: Optional[float] = field(default=None, init=False)
+    finished_at: Optional[float] = field(default=None, init=False)
+    error: Optional[BaseException] = field(default=None, init=False)
+    done: threading.Event = field(
+        default_factory=threading.Event, init=False, repr=False
+    )
+
+    @property
+    def wait_time(self) -> Optional[float]:
+        """
+        Returns how long the job waited in the queue, in seconds.
+        """
+        if self.started_at is None:
+            return None
+        return self.started_at - self.submitted_at
+
+
+@dataclass
+class _Tenant:
+    """
+    This dataclass holds the scheduling state of a tenant.
+    """
+
+    weight: float = 1.0
+    limit: Optional[int] = None
+    queue: list = field(default_factory=list)
+    running: int = 0
+    virtual_time: float = 0.0
+    completed: int = 0
+    failed: int = 0
+    wait_times: Deque[float] = field(default_factory=lambda: deque(maxlen=1000))
+
+
+def estimate_requests(
+    flow_name: str, flows_path: str = None, variables: dict = None
+) -> int:
+    """
+    Estimates the number of LLM requests a flow makes, as its plan does: one per task and one for the follow-up to each function call, with the tasks of loops counted once per item.
+
+    :param flow_name: The name of the flow.
+    :type flow_name: str
+    :param flows_path: The base path to the flows directory. If not set, will be agentflow/flows.
+    :type flows_path: str, optional
+    :param variables: Variables to be used in the flow, which loops may run over.
+    :type variables: dict, optional
+    :raises FileNotFoundError: If the flow's JSON file does not exist.
+    :return: The estimated number of requests, or 1 if the variables don't fit the flow, which then fails when it runs.
+    :rtype: int
+    """
+    try:
+        plan = Planner(History(), flows_path).plan(flow_name, variables)
+    except ValueError:
+        return 1
+    return plan.requests
+
+
+def run_flow(job: Job) -> None:
+    """
+    Runs the flow for a job. Flows keep the error they fail with rather than raising it, so it is raised here for the job to be counted as failed.
+
+    :param job: The job to run.
+    :type job: Job
+    :raises Exception: The error the flow failed with, if any.
+    """
+    flow = Flow(job.flow_name, job.variables, job.flows_path, job.budget)
+    flow.run()
+    if flow.error is not None:
+        raise flow.error
+
+
+class Scheduler:
+    """
+    This class is responsible for queueing flow jobs and running them on a pool of workers.
+
+    The highest priority waiting job always runs first. Among tenants whose next job has that priority, the tenant that has used the least of its weighted share of the rate budget goes next.
+
+    :param max_workers: The number of flows that can run at once.
+    :type max_workers: int
+    :param tenant_limits: The maximum number of concurrent flows per tenant.
+    :type tenant_limits: Dict[str, int], optional
+    :param tenant_weights: The share of the rate budget per tenant, relative to a default weight of 1.
+    :type tenant_weights: Dict[str, float], optional
+    :param requests_per_minute: The LLM rate budget shared by all tenants. If not set, jobs are not rate limited.
+    :type requests_per_minute: float, optional
+    :param runner: The callable that runs a job. Defaults to running the job's flow.
+    :type runner: Callable[[Job], None], optional
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        tenant_limits: Dict[str, int] = None,
+        tenant_weights: Dict[str, float] = None,
+        requests_per_minute: float = None,
+        runner: Callable[[Job], None] = None,
+    ):
+        self.max_workers = max_workers
+        self.tenant_limits = tenant_limits or {}
+        self.tenant_weights = tenant_weights or {}
+        self.requests_per_minute = requests_per_minute
+        self.runner = runner or run_flow
+        self.tenants: Dict[str, _Tenant] = {}
+        self._running = 0
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._budget = float(requests_per_minute or 0)
+        self._budget_updated_at = time.monotonic()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def start(self) -> "Scheduler":
+        """
+        Starts the workers and the dispatcher.
+
+        :return: The scheduler.
+        :rtype: Scheduler
+        """
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="agentflow-job"
+        )
+        self._dispatcher = threading.Thread(
+            target=self._dispatch, name="agentflow-dispatcher", daemon=True
+        )
+        self._dispatcher.start()
+        return self
+
+    def submit(self, job: Job) -> Job:
+        """
+        Queues a job.
+
+        :param job: The job to queue.
+        :type job: Job
+        :return: The job, whose done event is set when it finishes.
+        :rtype: Job
+        """
+        if job.cost is None:
+            job.cost = estimate_requests(job.flow_name, job.flows_path, job.variables)
+        job.submitted_at = time.monotonic()
+        with self._condition:
+            tenant = self._get_tenant(job.tenant)
+            if not tenant.queue and not tenant.running:
+                # A tenant that was idle does not get credit for the time it was idle.
+                tenant.virtual_time = max(tenant.virtual_time, self._min_virtual_time())
+            heapq.heappush(tenant.queue, (-job.priority, next(self._sequence), job))
+            self._condition.notify_all()
+        return job
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stops the scheduler.
+
+        :param wait: Whether to run the queued jobs before stopping.
+        :type wait: bool
+        """
+        with self._condition:
+            if wait:
+                self._condition.wait_for(
+                    lambda: not self._running
+                    and not any(t.queue for t in self.tenants.values())
+                )
+            self._stopping = True
+            self._condition.notify_all()
+        self._dispatcher.join()
+        self._executor.shutdown(wait=wait)
+
+    def run(self, jobs: List[Job]) -> List[Job]:
+        """
+        Runs a batch of jobs and waits for them to finish.
+
+        :param jobs: The jobs to run.
+        :type jobs: List[Job]
+        :return: The finished jobs.
+        :rtype: List[Job]
+        """
+        self.start()
+        for job in jobs:
+            self.submit(job)
+        self.shutdown()
+        return jobs
+
+    def get_metrics(self) -> Dict[str, dict]:
+        """
+        Returns queue depth, running jobs and wait times per tenant. Wait times cover each tenant's last 1,000 jobs.
+
+        :return: The metrics by tenant.
+        :rtype: Dict[str, dict]
+        """
+        with self._condition:
+            return {
+                name: {
+                    "queued": len(tenant.queue),
+                    "running": tenant.running,
+                    "completed": tenant.completed,
+                    "failed": tenant.failed,
+                    "mean_wait": (
+                        sum(tenant.wait_times) / len(tenant.wait_times)
+                        if tenant.wait_times
+                        else 0.0
+                    ),
+                    "max_wait": max(tenant.wait_times, default=0.0),
+                }
+                for name, tenant in self.tenants.items()
+            }
+
+    def _get_tenant(self, name: str) -> _Tenant:
+        """
+        Returns the state of a tenant, creating it if needed.
+        """
+        if name not in self.tenants:
+            self.tenants[name] = _Tenant(
+                weight=self.tenant_weights.get(name, 1.0),
+                limit=self.tenant_limits.get(name),
+            )
+        return self.tenants[name]
+
+    def _min_virtual_time(self) -> float:
+        """
+        Returns the lowest virtual time among tenants with queued or running jobs.
+        """
+        active = [
+            tenant.virtual_time
+            for tenant in self.tenants.values()
+            if tenant.queue or tenant.running
+        ]
+        return min(active, default=0.0)
+
+    def _next_job(self) -> Optional[Job]:
+        """
+        Returns the next job to run without removing it from its queue, or None if no tenant can run a job.
+        """
+        if self._running >= self.max_workers:
+            return None
+        eligible = [
+            tenant
+            for tenant in self.tenants.values()
+            if tenant.queue and (tenant.limit is None or tenant.running < tenant.limit)
+        ]
+        if not eligible:
+            return None
+        priority = min(tenant.queue[0][0] for tenant in eligible)
+        tenant = min(
+            (tenant for tenant in eligible if tenant.queue[0][0] == priority),
+            key=lambda tenant: tenant.virtual_time,
+        )
+        return tenant.queue[0][2]
+
+    def _budget_wait(self, cost: float) -> float:
+        """
+        Refills the rate budget and returns how long to wait before it covers the cost.
+        """
+        if not self.requests_per_minute:
+            return 0.0
+        now = time.monotonic()
+        rate = self.requests_per_minute / 60
+        self._budget = min(
+            self._budget + (now - self._budget_updated_at) * rate,
+            self.requests_per_minute,
+        )
+        self._budget_updated_at = now
+        # A job costing more than a minute of budget waits for a full budget.
+        cost = min(cost, self.requests_per_minute)
+        return max(cost - self._budget, 0.0) / rate
+
+    def _dispatch(self) -> None:
+        """
+        Starts queued jobs as workers, tenant limits and the rate budget allow.
+        """
+        with self._condition:
+            while not self._stopping:
+                job = self._next_job()
+                if job is None:
+                    self._condition.wait()
+                    continue
+                delay = self._budget_wait(job.cost)
+                if delay > 0:
+                    self._condition.wait(timeout=delay)
+                    continue
+                if self.requests_per_minute:
+                    self._budget -= min(job.cost, self.requests_per_minute)
+                tenant = self.tenants[job.tenant]
+                heapq.heappop(tenant.queue)
+                tenant.running += 1
+                tenant.virtual_time += job.cost / tenant.weight
+                self._running += 1
+                job.started_at = time.monotonic()
+                tenant.wait_times.append(job.wait_time)
+                self._executor.submit(self._run_job, job)
+
+    def _run_job(self, job: Job) -> None:
+        """
+        Runs a job on a worker and updates the tenant's state when it finishes.
+        """
+        try:
+            self.runner(job)
+        except Exception as e:
+            logging.error(e)
+            job.error = e
+        job.finished_at = time.monotonic()
+        with self._condition:
+            tenant = self.tenants[job.tenant]
+            tenant.running -= 1
+            tenant.completed += int(job.error is None)
+            tenant.failed += int(job.error is not None)
+            self._running -= 1
+            self._condition.notify_all()
+        job.done.set()
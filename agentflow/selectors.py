@@ -0,0 +1,204 @@
+"""
+This module provides selectors, which choose the best of several candidate responses to the same request. Tasks get candidates by setting n in their settings, and choose between them with a selector:
+
+* first: the first candidate.
+* longest: the candidate with the longest content or function call arguments.
+* majority: the most common candidate, ignoring case and whitespace. Ties go to the earliest candidate.
+* validator: the candidate that a Python function, given as "module:function", scores highest. The function takes a candidate's text and returns a bool or a number.
+* judge: the candidate that a model, usually a cheaper one, says is best.
+
+Selectors are given by name, such as "longest", or as a dict with a name and options, such as {"name": "judge", "model": "gpt-3.5-turbo"}.
+"""
+
+import importlib
+import re
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Type, Union
+
+
+def candidate_text(message: Any) -> str:
+    """
+    Returns the text of a candidate message: its content, or its function call's arguments.
+
+    :param message: The message.
+    :type message: Any
+    :return: The text.
+    :rtype: str
+    """
+    if getattr(message, "content", None):
+        return message.content
+    function_call = getattr(message, "function_call", None)
+    return getattr(function_call, "arguments", None) or ""
+
+
+class BaseSelector(ABC):
+    """
+    This abstract base class defines the interface for selectors.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def select(self, candidates: List[Any], messages: List[Any], llm: Any) -> int:
+        """
+        Chooses the best candidate.
+
+        :param candidates: The candidate messages.
+        :type candidates: List[Any]
+        :param messages: The messages the candidates respond to.
+        :type messages: List[Any]
+        :param llm: The LLM that produced the candidates, for selectors that ask a model.
+        :type llm: LLM
+        :return: The index of the chosen candidate.
+        :rtype: int
+        """
+
+
+class FirstSelector(BaseSelector):
+    """
+    This class is responsible for choosing the first candidate.
+    """
+
+    name = "first"
+
+    def select(self, candidates: List[Any], messages: List[Any], llm: Any) -> int:
+        return 0
+
+
+class LongestSelector(BaseSelector):
+    """
+    This class is responsible for choosing the longest candidate.
+    """
+
+    name = "longest"
+
+    def select(self, candidates: List[Any], messages: List[Any], llm: Any) -> int:
+        lengths = [len(candidate_text(candidate)) for candidate in candidates]
+        return lengths.index(max(lengths))
+
+
+class MajoritySelector(BaseSelector):
+    """
+    This class is responsible for choosing the most common candidate, ignoring case and whitespace. It suits tasks with short answers, such as labels or numbers.
+    """
+
+    name = "majority"
+
+    def select(self, candidates: List[Any], messages: List[Any], llm: Any) -> int:
+        keys = [
+            " ".join(candidate_text(candidate).casefold().split())
+            for candidate in candidates
+        ]
+        counts = Counter(keys)
+        return max(range(len(keys)), key=lambda index: (counts[keys[index]], -index))
+
+
+class ValidatorSelector(BaseSelector):
+    """
+    This class is responsible for choosing the candidate that a validator scores highest. Ties go to the earliest candidate, and candidates the validator raises an error for are ranked last.
+
+    :param function: The validator, or its import path as "module:function".
+    :type function: Union[str, Callable[[str], Union[bool, float]]]
+    :raises ValueError: If the import path is not of the form "module:function".
+    """
+
+    name = "validator"
+
+    def __init__(self, function: Union[str, Callable[[str], Union[bool, float]]]):
+        if isinstance(function, str):
+            module_name, _, attribute = function.partition(":")
+            if not module_name or not attribute:
+                raise ValueError(
+                    f"Expected a validator as module:function: {function}."
+                )
+            function = getattr(importlib.import_module(module_name), attribute)
+        self.function = function
+
+    def select(self, candidates: List[Any], messages: List[Any], llm: Any) -> int:
+        scores = []
+        for candidate in candidates:
+            try:
+                scores.append(float(self.function(candidate_text(candidate))))
+            except Exception:
+                scores.append(float("-inf"))
+        return scores.index(max(scores))
+
+
+class JudgeSelector(BaseSelector):
+    """
+    This class is responsible for asking a model which candidate is best. If its answer isn't the number of a candidate, the first candidate is chosen.
+
+    :param model: The model that judges the candidates.
+    :type model: str
+    :param criteria: What makes a candidate best.
+    :type criteria: str, optional
+    """
+
+    name = "judge"
+
+    def __init__(self, model: str = "gpt-3.5-turbo", criteria: Optional[str] = None):
+        self.model = model
+        self.criteria = criteria or "The most correct, complete and helpful answer."
+
+    def select(self, candidates: List[Any], messages: List[Any], llm: Any) -> int:
+        # Imported here because agentflow.llm imports this module.
+        from agentflow.llm import Settings
+
+        request = next(
+            (
+                message["content"]
+                for message in reversed(messages)
+                if message["role"] == "user"
+            ),
+            "",
+        )
+        parts = [f"Request:\n{request}", f"Criteria: {self.criteria}"]
+        parts += [
+            f"Candidate {number}:\n{candidate_text(candidate)}"
+            for number, candidate in enumerate(candidates, 1)
+        ]
+        judgment = llm.respond(
+            Settings(model=self.model, temperature=0, max_tokens=5),
+            [
+                {
+                    "role": "system",
+                    "content": "You compare candidate responses to a request. Reply with the number of the best candidate only.",
+                },
+                {"role": "user", "content": "\n\n".join(parts)},
+            ],
+        )
+        match = re.search(r"\d+", judgment.content or "")
+        number = int(match.group()) if match else 0
+        return number - 1 if 1 <= number <= len(candidates) else 0
+
+
+SELECTORS: Dict[str, Type[BaseSelector]] = {
+    selector.name: selector
+    for selector in (
+        FirstSelector,
+        LongestSelector,
+        MajoritySelector,
+        ValidatorSelector,
+        JudgeSelector,
+    )
+}
+
+
+def get_selector(definition: Union[str, Dict[str, Any]]) -> BaseSelector:
+    """
+    Creates a selector from its name, or from a dict with its name and options.
+
+    :param definition: The selector's definition, such as "longest" or {"name": "judge", "model": "gpt-3.5-turbo"}.
+    :type definition: Union[str, Dict[str, Any]]
+    :raises ValueError: If there is no selector with the name.
+    :return: The selector.
+    :rtype: BaseSelector
+    """
+    if isinstance(definition, str):
+        definition = {"name": definition}
+    options = dict(definition)
+    name = options.pop("name", None)
+    if name not in SELECTORS:
+        raise ValueError(f"Unknown selector: {name}.")
+    return SELECTORS[name](**options)
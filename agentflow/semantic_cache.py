@@ -0,0 +1,283 @@
+"""
+This module provides a semantic cache for LLM responses. Prompts are normalized and embedded locally as hashed character n-gram vectors, so requests that differ only trivially, for example in whitespace, casing or a query parameter, can reuse an earlier response when their cosine similarity is above a task's threshold.
+
+A prompt has a few thousand distinct n-grams at most out of 2**20 hashed dimensions, so vectors are kept sparse, as sorted NumPy arrays of dimensions and weights, and compared on the dimensions they share.
+"""
+
+import hashlib
+import random
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Set, Tuple
+
+import numpy as np
+
+from agentflow.prefix import dumps_canonical
+from agentflow.serialization import encode_functions
+from agentflow.trace import annotate
+
+NGRAM_SIZE = 3
+DIMENSIONS = 2**20
+
+Vector = Tuple[np.ndarray, np.ndarray]
+
+
+def normalize(text: str) -> str:
+    """
+    Normalizes text for comparison: case is folded and runs of whitespace become a single space.
+
+    :param text: The text.
+    :type text: str
+    :return: The normalized text.
+    :rtype: str
+    """
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def embed(text: str) -> Vector:
+    """
+    Embeds normalized text as a sparse, unit-length vector of hashed character n-gram counts.
+
+    :param text: The normalized text.
+    :type text: str
+    :return: The vector, as its sorted dimensions and their weights.
+    :rtype: Vector
+    """
+    hashes = np.fromiter(
+        (
+            zlib.crc32(text[index : index + NGRAM_SIZE].encode()) % DIMENSIONS
+            for index in range(max(len(text) - NGRAM_SIZE + 1, 1))
+        ),
+        dtype=np.int64,
+    )
+    dimensions, counts = np.unique(hashes, return_counts=True)
+    weights = counts.astype(np.float64)
+    return dimensions, weights / np.linalg.norm(weights)
+
+
+def cosine(a: Vector, b: Vector) -> float:
+    """
+    Returns the cosine similarity of two unit-length vectors.
+
+    :param a: The first vector.
+    :type a: Vector
+    :param b: The second vector.
+    :type b: Vector
+    :return: The similarity, between 0 and 1.
+    :rtype: float
+    """
+    _, a_indices, b_indices = np.intersect1d(
+        a[0], b[0], assume_unique=True, return_indices=True
+    )
+    return float(a[1][a_indices] @ b[1][b_indices])
+
+
+def message_text(message: Any) -> str:
+    """
+    Returns the text of a message or response for embedding: its role, content and function call.
+
+    :param message: The message, as a dict, a message or a response message.
+    :type message: Any
+    :return: The text.
+    :rtype: str
+    """
+    if hasattr(message, "get"):
+        get = message.get
+    else:
+        get = lambda key: getattr(message, key, None)  # noqa: E731
+    text = f"{get('role')}: {get('content') or ''}"
+    function_call = get("function_call")
+    if function_call:
+        text += f" {function_call['name']}({function_call['arguments']})"
+    return text
+
+
+@dataclass
+class Prompt:
+    """
+    This dataclass holds the keys of a request's prompt. Its vector is embedded on first use, so a lookup and the store that follows a miss share it.
+
+    :param partition: The digest of the request's model, settings, functions and message roles.
+    :type partition: str
+    :param digest: The digest of the normalized prompt.
+    :type digest: str
+    :param text: The normalized prompt.
+    :type text: str
+    """
+
+    partition: str
+    digest: str
+    text: str
+    _vector: Optional[Vector] = field(default=None, repr=False, compare=False)
+
+    @property
+    def vector(self) -> Vector:
+        """
+        The embedding of the prompt.
+        """
+        if self._vector is None:
+            self._vector = embed(self.text)
+        return self._vector
+
+
+@dataclass
+class _Entry:
+    """
+    This dataclass holds a cached response with the embedding of its prompt.
+    """
+
+    vector: Vector
+    response: Any
+
+
+class SemanticCache:
+    """
+    This class is responsible for caching responses by prompt similarity. Only requests with the same model, settings, functions and message roles are compared, and the least recently used entries are evicted.
+
+    A sample of hits is verified by sending the request anyway: a hit whose fresh response is less similar to the cached one than the threshold is counted as a false hit and replaced.
+
+    :param max_entries: The number of responses kept.
+    :type max_entries: int
+    :param verify_rate: The share of hits that are verified.
+    :type verify_rate: float
+    """
+
+    def __init__(self, max_entries: int = 1024, verify_rate: float = 0.02):
+        self.max_entries = max_entries
+        self.verify_rate = verify_rate
+        self.hits = 0
+        self.misses = 0
+        self.verified = 0
+        self.false_hits = 0
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._partitions: Dict[str, Set[Tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def prompt(openai_args: Dict[str, Any]) -> Prompt:
+        """
+        Returns the prompt of a request, to look it up and store its response.
+
+        :param openai_args: The arguments for the request.
+        :type openai_args: Dict[str, Any]
+        :return: The prompt.
+        :rtype: Prompt
+        """
+        messages = openai_args["messages"]
+        settings = {
+            key: value
+            for key, value in openai_args.items()
+            if key not in ("messages", "functions", "request_timeout")
+        }
+        settings["roles"] = [message["role"] for message in messages]
+        partition = hashlib.sha256(
+            dumps_canonical(settings).encode()
+            + encode_functions(openai_args.get("functions") or ())
+        ).hexdigest()
+        prompt = normalize("\n".join(message_text(message) for message in messages))
+        return Prompt(partition, hashlib.sha256(prompt.encode()).hexdigest(), prompt)
+
+    def lookup(self, prompt: Prompt, threshold: float) -> Optional[Tuple[Any, bool]]:
+        """
+        Looks up a response for a prompt and records a hit or a miss.
+
+        :param prompt: The prompt of the request.
+        :type prompt: Prompt
+        :param threshold: The minimum similarity of a cached prompt, between 0 and 1.
+        :type threshold: float
+        :return: The cached response and whether it should be verified, or None on a miss.
+        :rtype: Optional[Tuple[Any, bool]]
+        """
+        key, similarity = (prompt.partition, prompt.digest), 1.0
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            vector = prompt.vector
+            with self._lock:
+                for candidate in self._partitions.get(prompt.partition, ()):
+                    candidate_similarity = cosine(
+                        vector, self._entries[candidate].vector
+                    )
+                    if candidate_similarity >= threshold and (
+                        entry is None or candidate_similarity > similarity
+                    ):
+                        entry = self._entries[candidate]
+                        key, similarity = candidate, candidate_similarity
+        with self._lock:
+            if entry is None or key not in self._entries:
+                self.misses += 1
+                annotate(semantic_cache="miss")
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+        annotate(semantic_cache="hit", semantic_similarity=similarity)
+        return entry.response, random.random() < self.verify_rate
+
+    def store(
+        self,
+        prompt: Prompt,
+        response: Any,
+        cached_response: Any = None,
+        threshold: float = 1.0,
+    ) -> None:
+        """
+        Stores the response to a prompt. If it verifies a cached response, a false hit is recorded when the two responses differ by more than the threshold.
+
+        :param prompt: The prompt of the request, with the vector embedded by its lookup if any.
+        :type prompt: Prompt
+        :param response: The response from the language model.
+        :type response: Any
+        :param cached_response: The cached response being verified, if any.
+        :type cached_response: Any, optional
+        :param threshold: The similarity threshold of the task.
+        :type threshold: float, optional
+        """
+        if cached_response is not None:
+            false_hit = (
+                cosine(
+                    embed(normalize(message_text(response))),
+                    embed(normalize(message_text(cached_response))),
+                )
+                < threshold
+            )
+            annotate(semantic_cache_false_hit=false_hit)
+            with self._lock:
+                self.verified += 1
+                self.false_hits += int(false_hit)
+            if not false_hit:
+                return
+        entry = _Entry(prompt.vector, response)
+        with self._lock:
+            key = (prompt.partition, prompt.digest)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._partitions.setdefault(prompt.partition, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._partitions[evicted[0]].discard(evicted)
+                if not self._partitions[evicted[0]]:
+                    del self._partitions[evicted[0]]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Returns the cache's metrics.
+
+        :return: The numbers of entries, hits, misses, verified hits and false hits, with the hit rate and the false hit rate of verified hits.
+        :rtype: Dict[str, Any]
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "verified": self.verified,
+                "false_hits": self.false_hits,
+                "false_hit_rate": (
+                    self.false_hits / self.verified if self.verified else 0.0
+                ),
+            }
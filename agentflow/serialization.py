@@ -0,0 +1,130 @@
+"""
+This module provides an incremental serializer for chat completion requests. The encoded JSON of each message and of each function list is cached, so a request body is assembled by joining cached bytes instead of re-serializing the whole history on every call. orjson is used when it is installed.
+"""
+
+import json
+import threading
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+from agentflow.message import Conversation, Message
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+# Arguments used by the client rather than sent in the request body.
+CLIENT_ARGS = {"request_timeout"}
+
+_encoded_functions: Dict[int, Tuple[Sequence[dict], bytes]] = {}
+_encoded_functions_lock = threading.Lock()
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Serializes a value to compact JSON bytes.
+
+    :param value: The value to serialize.
+    :type value: Any
+    :return: The JSON bytes.
+    :rtype: bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def encode_message(message: Union[Message, Dict[str, Any]]) -> bytes:
+    """
+    Serializes a message. Messages are immutable, so their bytes are cached on first use; spilled contents are read back each time instead of being cached in memory.
+
+    :param message: The message, as a message or a dict.
+    :type message: Union[Message, Dict[str, Any]]
+    :return: The JSON bytes.
+    :rtype: bytes
+    """
+    if not isinstance(message, Message):
+        return dumps(message)
+    if message._encoded is None:
+        encoded = dumps(message.to_dict())
+        if message.spilled:
+            return encoded
+        message._encoded = encoded
+    return message._encoded
+
+
+def encode_messages(messages: Union[Conversation, List[Dict[str, Any]]]) -> bytes:
+    """
+    Serializes messages as the items of a JSON array. Conversations only grow, so their encoding is cached as runs of joined messages, with the messages whose content was spilled between them. Only spilled messages are encoded again on later calls.
+
+    :param messages: The messages.
+    :type messages: Union[Conversation, List[Dict[str, Any]]]
+    :return: The JSON bytes, without the enclosing brackets.
+    :rtype: bytes
+    """
+    if not isinstance(messages, Conversation):
+        return b",".join(encode_message(message) for message in messages)
+    cached_count, segments = messages._encoded or (0, [])
+    if cached_count < len(messages):
+        segments = list(segments)
+        run: List[bytes] = []
+        for message in messages[cached_count:]:
+            if message.spilled:
+                if run:
+                    segments.append(b",".join(run))
+                    run = []
+                segments.append(message)
+                continue
+            if not run and segments and isinstance(segments[-1], bytes):
+                run.append(segments.pop())
+            run.append(encode_message(message))
+        if run:
+            segments.append(b",".join(run))
+        messages._encoded = (len(messages), segments)
+    if len(segments) == 1 and isinstance(segments[0], bytes):
+        return segments[0]
+    return b",".join(
+        segment if isinstance(segment, bytes) else encode_message(segment)
+        for segment in segments
+    )
+
+
+def encode_functions(functions: Sequence[dict]) -> bytes:
+    """
+    Serializes function definitions. Tuples, such as the frozen definitions of a flow's prompt prefix, are cached for the life of the process.
+
+    :param functions: The function definitions.
+    :type functions: Sequence[dict]
+    :return: The JSON bytes.
+    :rtype: bytes
+    """
+    if not isinstance(functions, tuple):
+        return dumps(list(functions))
+    with _encoded_functions_lock:
+        cached = _encoded_functions.get(id(functions))
+        if cached is None or cached[0] is not functions:
+            cached = (functions, dumps(list(functions)))
+            _encoded_functions[id(functions)] = cached
+        return cached[1]
+
+
+def encode_request(openai_args: Dict[str, Any]) -> bytes:
+    """
+    Serializes the body of a chat completion request.
+
+    :param openai_args: The arguments for the request. "messages" may be a conversation or a list of dicts, and "functions" a tuple or list of definitions.
+    :type openai_args: Dict[str, Any]
+    :return: The JSON bytes of the request body.
+    :rtype: bytes
+    """
+    parts: List[bytes] = [b"{"]
+    for key, value in openai_args.items():
+        if key in CLIENT_ARGS or key in ("messages", "functions"):
+            continue
+        parts += [dumps(key), b":", dumps(value), b","]
+    parts += [b'"messages":[', encode_messages(openai_args["messages"]), b"]"]
+    if openai_args.get("functions"):
+        parts += [b',"functions":', encode_functions(openai_args["functions"])]
+    parts.append(b"}")
+    # Joining once copies the cached encodings a single time.
+    return b"".join(parts)
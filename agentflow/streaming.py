@@ -0,0 +1,296 @@
+"""
+This module provides helpers for streaming function calls. The arguments of a function call are parsed as they are streamed, so large string arguments can be written out piece by piece instead of being held, and parsed, as a whole.
+"""
+
+import json
+import re
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+Event = Tuple[str, Optional[str], Any]
+
+_PLAIN = re.compile(r'[^"\\]+')
+_WHITESPACE = " \t\n\r"
+
+
+class ArgumentParser:
+    """
+    This class is responsible for parsing the JSON object of a function call's arguments incrementally.
+
+    Feeding it fragments returns events: ("start", name, None) when a string argument starts, ("chunk", name, text) for each decoded piece of it, ("end", name, None) when it ends, and ("value", name, value) for other arguments once they are complete.
+    """
+
+    def __init__(self):
+        self._state = "start"
+        self._name: Optional[str] = None
+        self._name_parts: List[str] = []
+        self._escape = ""
+        self._raw: List[str] = []
+        self._raw_depth = 0
+        self._raw_in_string = False
+        self._raw_escaped = False
+
+    def feed(self, fragment: str) -> List[Event]:
+        """
+        Parses the next fragment of the arguments.
+
+        :param fragment: The fragment.
+        :type fragment: str
+        :raises ValueError: If the arguments are not a valid JSON object.
+        :return: The events for the fragment.
+        :rtype: List[Event]
+        """
+        events: List[Event] = []
+        position = 0
+        length = len(fragment)
+        while position < length:
+            state = self._state
+            if state in ("name", "string"):
+                parts: List[str] = []
+                position, finished = self._read_string(fragment, position, parts)
+                if state == "name":
+                    self._name_parts += parts
+                    if finished:
+                        self._name = "".join(self._name_parts)
+                        self._name_parts = []
+                        self._state = "colon"
+                    continue
+                text = "".join(parts)
+                if text:
+                    events.append(("chunk", self._name, text))
+                if finished:
+                    events.append(("end", self._name, None))
+                    self._state = "next"
+                continue
+            if state == "raw":
+                position = self._read_raw(fragment, position, events)
+                continue
+            char = fragment[position]
+            position += 1
+            if char in _WHITESPACE:
+                continue
+            if state == "start" and char == "{":
+                self._state = "first_name"
+            elif state in ("first_name", "name_start") and char == '"':
+                self._state = "name"
+            elif state in ("first_name", "next") and char == "}":
+                self._state = "done"
+            elif state == "colon" and char == ":":
+                self._state = "value"
+            elif state == "value" and char == '"':
+                events.append(("start", self._name, None))
+                self._state = "string"
+            elif state == "value":
+                self._state = "raw"
+                position -= 1
+            elif state == "next" and char == ",":
+                self._state = "name_start"
+            else:
+                raise ValueError(f"Unexpected {char!r} in function call arguments.")
+        return events
+
+    def close(self) -> None:
+        """
+        Checks that the arguments are complete.
+
+        :raises ValueError: If the arguments ended before the JSON object was closed.
+        """
+        if self._state != "done":
+            raise ValueError("Function call arguments ended before they were complete.")
+
+    def _read_string(
+        self, fragment: str, position: int, parts: List[str]
+    ) -> Tuple[int, bool]:
+        """
+        Decodes string characters up to the closing quote or the end of the fragment. Escape sequences split across fragments are kept until they are complete.
+
+        :return: The new position, and whether the string ended.
+        :rtype: Tuple[int, bool]
+        """
+        length = len(fragment)
+        while position < length:
+            if self._escape:
+                position = self._read_escape(fragment, position, parts)
+                continue
+            match = _PLAIN.match(fragment, position)
+            if match:
+                parts.append(match.group())
+                position = match.end()
+            elif fragment[position] == '"':
+                return position + 1, True
+            else:
+                self._escape = "\\"
+                position += 1
+        return position, False
+
+    def _read_escape(self, fragment: str, position: int, parts: List[str]) -> int:
+        """
+        Reads an escape sequence, joining a high surrogate with the low surrogate that follows it.
+
+        :return: The new position.
+        :rtype: int
+        """
+        while position < len(fragment):
+            escape = self._escape + fragment[position]
+            position += 1
+            if len(escape) == 2 and escape[1] != "u":
+                return self._decode_escape(escape, parts, position)
+            if len(escape) == 6 and not 0xD800 <= int(escape[2:], 16) < 0xDC00:
+                return self._decode_escape(escape, parts, position)
+            if len(escape) == 7 and escape[6] != "\\":
+                return self._decode_escape(escape[:6], parts, position - 1)
+            if len(escape) == 8 and escape[7] != "u":
+                self._decode_escape(escape[:6], parts, position)
+                return self._decode_escape(escape[6:], parts, position)
+            if len(escape) == 12:
+                return self._decode_escape(escape, parts, position)
+            self._escape = escape
+        return position
+
+    def _decode_escape(self, escape: str, parts: List[str], position: int) -> int:
+        """
+        Decodes a complete escape sequence.
+
+        :return: The position to continue from.
+        :rtype: int
+        """
+        parts.append(json.loads(f'"{escape}"'))
+        self._escape = ""
+        return position
+
+    def _read_raw(self, fragment: str, position: int, events: List[Event]) -> int:
+        """
+        Reads a value that is not a string, such as a number or a list, until it ends.
+
+        :return: The new position.
+        :rtype: int
+        """
+        start = position
+        length = len(fragment)
+        while position < length:
+            char = fragment[position]
+            if self._raw_in_string:
+                if self._raw_escaped:
+                    self._raw_escaped = False
+                elif char == "\\":
+                    self._raw_escaped = True
+                elif char == '"':
+                    self._raw_in_string = False
+            elif char == '"':
+                self._raw_in_string = True
+            elif char in "[{":
+                self._raw_depth += 1
+            elif char in "]}" and self._raw_depth:
+                self._raw_depth -= 1
+            elif not self._raw_depth and (char in ",}" or char in _WHITESPACE):
+                self._raw.append(fragment[start:position])
+                events.append(("value", self._name, json.loads("".join(self._raw))))
+                self._raw = []
+                self._state = "next"
+                return position
+            position += 1
+        self._raw.append(fragment[start:position])
+        return position
+
+
+class StreamedResponse:
+    """
+    This class is responsible for reading a streamed chat completion. The response is either content or a function call, whose arguments can be iterated over as they arrive. Fragments are kept for text only when asked, so arguments that are written out as they arrive are not also held in memory. If reading the stream fails, the error is kept in the error attribute.
+
+    :param chunks: The chunks of the streamed response.
+    :type chunks: Iterable[Any]
+    :param on_complete: Called with the number of characters in the response once it has been read.
+    :type on_complete: Callable[[int], None], optional
+    """
+
+    def __init__(
+        self,
+        chunks: Iterable[Any],
+        on_complete: Optional[Callable[[int], None]] = None,
+    ):
+        self._chunks = iter(chunks)
+        self._on_complete = on_complete
+        self._parts: List[str] = []
+        self._first = None
+        self.length = 0
+        self.function_name: Optional[str] = None
+        self.error: Optional[Exception] = None
+        for chunk in self._chunks:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            function_call = delta.get("function_call")
+            if function_call and function_call.get("name"):
+                self.function_name = function_call["name"]
+                self._first = function_call.get("arguments") or ""
+                break
+            if delta.get("content"):
+                self._first = delta["content"]
+                break
+
+    def fragments(self, keep: bool = True) -> Iterator[str]:
+        """
+        Yields the fragments of the content, or of the function call's arguments, as they arrive.
+
+        :param keep: Whether to keep the fragments for text.
+        :type keep: bool
+        :return: The fragments.
+        :rtype: Iterator[str]
+        """
+        try:
+            for fragment in self._read_fragments():
+                self.length += len(fragment)
+                if keep:
+                    self._parts.append(fragment)
+                yield fragment
+        except Exception as e:
+            self.error = e
+            raise
+        if self._on_complete is not None:
+            self._on_complete(self.length)
+            self._on_complete = None
+
+    def _read_fragments(self) -> Iterator[str]:
+        """
+        Yields the fragments that have not been read yet.
+
+        :return: The fragments.
+        :rtype: Iterator[str]
+        """
+        if self._first:
+            yield self._first
+        self._first = None
+        for chunk in self._chunks:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if self.function_name:
+                fragment = (delta.get("function_call") or {}).get("arguments")
+            else:
+                fragment = delta.get("content")
+            if fragment:
+                yield fragment
+
+    @property
+    def text(self) -> str:
+        """
+        Returns the content, or the function call's arguments, kept so far.
+        """
+        return "".join(self._parts)
+
+    def read(self) -> str:
+        """
+        Reads the rest of the response.
+
+        :return: The content, or the function call's arguments.
+        :rtype: str
+        """
+        for _ in self.fragments():
+            pass
+        return self.text
+
+    def skip(self) -> None:
+        """
+        Reads the rest of the response without keeping it.
+        """
+        for _ in self.fragments(keep=False):
+            pass
@@ -0,0 +1,90 @@
+"""
+This module provides templates for the messages of a flow. A template is compiled once into literal and placeholder segments, which gives its variables without another pass over the text and renders it with a single join. "{{" and "}}" are literal braces.
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Tuple
+
+
+class Template:
+    """
+    This class holds a compiled template.
+
+    :param source: The text of the template, with variables in single braces, such as "{name}".
+    :type source: str
+    :raises ValueError: If a brace is not closed, not escaped or encloses nothing.
+    """
+
+    __slots__ = ("source", "variables", "_parts", "_placeholders")
+
+    def __init__(self, source: str):
+        self.source = source
+        parts: List[str] = []
+        placeholders: List[Tuple[int, str]] = []
+        literal: List[str] = []
+        position = 0
+        length = len(source)
+        while position < length:
+            opening = source.find("{", position)
+            closing = source.find("}", position)
+            if opening == -1 and closing == -1:
+                literal.append(source[position:])
+                break
+            if closing != -1 and (opening == -1 or closing < opening):
+                if source.startswith("}}", closing):
+                    literal.append(source[position : closing + 1])
+                    position = closing + 2
+                    continue
+                raise ValueError(f"Single '}}' in template: {source!r}.")
+            literal.append(source[position:opening])
+            if source.startswith("{{", opening):
+                literal.append("{")
+                position = opening + 2
+                continue
+            end = source.find("}", opening + 1)
+            name = source[opening + 1 : end] if end != -1 else ""
+            if end == -1 or not name or "{" in name:
+                raise ValueError(f"Unclosed or empty '{{' in template: {source!r}.")
+            parts.append("".join(literal))
+            literal = []
+            placeholders.append((len(parts), name))
+            parts.append("")
+            position = end + 1
+        parts.append("".join(literal))
+        self._parts = tuple(parts)
+        self._placeholders = tuple(placeholders)
+        self.variables: FrozenSet[str] = frozenset(name for _, name in placeholders)
+
+    def render(self, variables: Dict[str, Any]) -> str:
+        """
+        Renders the template. Values are inserted as they are, so braces in them are kept.
+
+        :param variables: The values of the variables.
+        :type variables: Dict[str, Any]
+        :raises KeyError: If a variable has no value.
+        :return: The rendered text.
+        :rtype: str
+        """
+        if not self._placeholders:
+            return self._parts[0]
+        parts = list(self._parts)
+        for index, name in self._placeholders:
+            value = variables[name]
+            parts[index] = value if isinstance(value, str) else str(value)
+        return "".join(parts)
+
+    def __repr__(self) -> str:
+        return f"Template({self.source!r})"
+
+
+@lru_cache(maxsize=1024)
+def compile_template(source: str) -> Template:
+    """
+    Compiles a template, reusing the compiled template for text seen before.
+
+    :param source: The text of the template.
+    :type source: str
+    :return: The compiled template.
+    :rtype: Template
+    """
+    return Template(source)
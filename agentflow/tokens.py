@@ -0,0 +1,93 @@
+"""
+This module provides helpers for estimating token counts and costs of LLM requests without calling the API.
+"""
+
+from typing import Dict, List, Optional
+
+from agentflow.message import content_length
+from agentflow.serialization import encode_functions
+
+CHARS_PER_TOKEN = 4  # See https://help.openai.com/en/articles/4936856-what-are-tokens-and-how-to-count-them
+
+# USD per 1,000 tokens as (prompt, completion).
+MODEL_PRICES = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+}
+
+# The most prompt and completion tokens of a request.
+CONTEXT_WINDOWS = {
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+}
+
+
+def estimate_tokens(
+    messages: List[Dict[str, str]], functions: Optional[List[dict]] = None
+) -> int:
+    """
+    Estimates the number of prompt tokens for a request.
+
+    :param messages: The messages to be sent to the language model.
+    :type messages: List[Dict[str, str]]
+    :param functions: The function definitions to be sent with the messages.
+    :type functions: Optional[List[dict]]
+    :return: The estimated number of tokens.
+    :rtype: int
+    """
+    chars = sum(content_length(message) for message in messages)
+    if functions:
+        chars += len(encode_functions(functions))
+    return chars // CHARS_PER_TOKEN
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    Estimates the cost of a request in USD. Unknown models are assumed to cost nothing.
+
+    :param model: The name of the model.
+    :type model: str
+    :param prompt_tokens: The number of prompt tokens.
+    :type prompt_tokens: int
+    :param completion_tokens: The number of completion tokens.
+    :type completion_tokens: int
+    :return: The estimated cost in USD.
+    :rtype: float
+    """
+    prompt_price, completion_price = MODEL_PRICES.get(
+        _match_model(model, MODEL_PRICES), (0.0, 0.0)
+    )
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+def context_window(model: str) -> Optional[int]:
+    """
+    Returns the context window of a model.
+
+    :param model: The name of the model.
+    :type model: str
+    :return: The most prompt and completion tokens of a request, or None for unknown models.
+    :rtype: Optional[int]
+    """
+    return CONTEXT_WINDOWS.get(_match_model(model, CONTEXT_WINDOWS))
+
+
+def _match_model(model: str, table: dict) -> Optional[str]:
+    """
+    Finds the table entry for a model, falling back to the longest matching prefix so that dated snapshots such as gpt-4-0613 use the gpt-4 entry.
+
+    :param model: The name of the model.
+    :type model: str
+    :param table: A dictionary keyed by model name.
+    :type table: dict
+    :return: The matching key, or None if there is no match.
+    :rtype: Optional[str]
+    """
+    if model in table:
+        return model
+    prefixes = [name for name in table if model.startswith(f"{name}-")]
+    return max(prefixes, key=len) if prefixes else None
@@ -0,0 +1,75 @@
+"""
+This module provides a class for tracing the LLM calls made while running a flow. Each call gets a record that code further down the stack, such as the LLM or the router, can add details to.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+_current_record: ContextVar[Optional[Dict[str, Any]]] = ContextVar(
+    "agentflow_trace_record", default=None
+)
+
+
+def annotate(**fields: Any) -> None:
+    """
+    Adds fields to the record of the call in progress. Does nothing outside of a traced call.
+
+    :param fields: The fields to add.
+    :type fields: Any
+    """
+    record = _current_record.get()
+    if record is not None:
+        record.update(fields)
+
+
+def accumulate(**fields: float) -> None:
+    """
+    Adds numbers to fields of the record of the call in progress, such as the tokens of each request made by a cascade. Does nothing outside of a traced call.
+
+    :param fields: The numbers to add.
+    :type fields: float
+    """
+    record = _current_record.get()
+    if record is not None:
+        for name, value in fields.items():
+            record[name] = record.get(name, 0) + value
+
+
+class Trace:
+    """
+    This class is responsible for collecting a record for each LLM call made by a flow.
+    """
+
+    def __init__(self):
+        """
+        Initializes the Trace object with no records.
+        """
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def call(self, **fields: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Traces a call. The record holds the given fields, anything annotated during the call, its latency in seconds and, if it failed, the error.
+
+        :param fields: The fields to start the record with.
+        :type fields: Any
+        :return: The record of the call.
+        :rtype: Iterator[Dict[str, Any]]
+        """
+        record = dict(fields)
+        token = _current_record.set(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = repr(e)
+            raise
+        finally:
+            record["latency"] = time.perf_counter() - start
+            _current_record.reset(token)
+            with self._lock:
+                self.records.append(record)
@@ -0,0 +1,156 @@
+"""
+This module provides a pool of pre-initialized workers for running flows with low latency, such as in a server. The environment is loaded, function modules are imported, a connection to the API is opened and configured flows are parsed and compiled once at startup, so no run pays for them.
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Optional
+
+from agentflow.flow import Flow, load_flow_spec
+from agentflow.function import Function, import_functions
+from agentflow.llm import LLM
+from agentflow.template import compile_template
+
+
+def warm_flow(name: str, flows_path: Optional[str] = None) -> None:
+    """
+    Parses a flow's definition and compiles its messages and function definitions, so the next run of the flow finds them cached.
+
+    :param name: The name of the flow.
+    :type name: str
+    :param flows_path: The base path to the flows directory. If not set, will be agentflow/flows.
+    :type flows_path: str, optional
+    :raises FileNotFoundError: If the flow does not exist.
+    """
+    flows_path = flows_path or os.path.join(os.path.dirname(__file__), "flows")
+    data = load_flow_spec(f"{flows_path}/{name}.json")
+    if data.get("system_message"):
+        compile_template(data["system_message"])
+    tasks = list(data.get("tasks", []))
+    while tasks:
+        task = tasks.pop()
+        tasks += task.get("tasks", []) + task.get("else", [])
+        if "action" in task:
+            compile_template(task["action"])
+        function_name = task.get("settings", {}).get("function_call")
+        if function_name is not None:
+            _ = Function(function_name, None).definition
+
+
+class WarmPool:
+    """
+    This class is responsible for running flows on threads that share state initialized at startup.
+
+    .. code-block:: python
+
+        with WarmPool(["summarize_url"]) as pool:
+            flow = pool.run("summarize_url", {"url": url})
+
+    :param flows: The names of the flows to warm at startup.
+    :type flows: Iterable[str], optional
+    :param flows_path: The base path to the flows directory. If not set, will be agentflow/flows.
+    :type flows_path: str, optional
+    :param max_workers: The number of flows to run at once.
+    :type max_workers: int, optional
+    :param preconnect: Whether to open a connection to the API at startup.
+    :type preconnect: bool, optional
+    """
+
+    def __init__(
+        self,
+        flows: Iterable[str] = (),
+        flows_path: Optional[str] = None,
+        max_workers: int = 4,
+        preconnect: bool = True,
+    ):
+        self.flows = list(flows)
+        self.flows_path = flows_path
+        self.max_workers = max_workers
+        self.preconnect = preconnect
+        self.startup_seconds: Optional[float] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self) -> "WarmPool":
+        """
+        Initializes shared state and starts the worker threads.
+
+        :return: The pool.
+        :rtype: WarmPool
+        """
+        if self._executor is not None:
+            return self
+        start = time.perf_counter()
+        LLM.load_environment()
+        import_functions()
+        if self.preconnect:
+            LLM.preconnect()
+        for name in self.flows:
+            warm_flow(name, self.flows_path)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="agentflow-warm"
+        )
+        # Start every thread now rather than on the first runs.
+        wait([self._executor.submit(time.sleep, 0) for _ in range(self.max_workers)])
+        self.startup_seconds = time.perf_counter() - start
+        logging.info(f"Warm pool started in {self.startup_seconds:.3f}s.")
+        return self
+
+    def submit(self, flow_name: str, variables: dict = None) -> "Future[Flow]":
+        """
+        Submits a flow to run on the pool.
+
+        :param flow_name: The name of the flow.
+        :type flow_name: str
+        :param variables: Variables to be used in the flow.
+        :type variables: dict, optional
+        :return: A future for the flow, which holds the messages and output once it has run.
+        :rtype: Future[Flow]
+        """
+        self.start()
+        return self._executor.submit(self._run, flow_name, variables)
+
+    def run(self, flow_name: str, variables: dict = None) -> Flow:
+        """
+        Runs a flow on the pool and waits for it.
+
+        :param flow_name: The name of the flow.
+        :type flow_name: str
+        :param variables: Variables to be used in the flow.
+        :type variables: dict, optional
+        :return: The flow, after it has run.
+        :rtype: Flow
+        """
+        return self.submit(flow_name, variables).result()
+
+    def _run(self, flow_name: str, variables: Optional[dict]) -> Flow:
+        flow = Flow(flow_name, variables, self.flows_path)
+        flow.run()
+        return flow
+
+    def get_metrics(self) -> Dict[str, object]:
+        """
+        Returns the pool's startup time and warmed flows.
+
+        :return: The metrics.
+        :rtype: Dict[str, object]
+        """
+        return {"startup_seconds": self.startup_seconds, "flows": self.flows}
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stops the worker threads.
+
+        :param wait: Whether to wait for running flows to finish.
+        :type wait: bool
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def __enter__(self) -> "WarmPool":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
@@ -0,0 +1,119 @@
+"""
+This module benchmarks how throughput scales with the number of API keys. Each key gets its own local stub endpoint, which serves one request at a time, like a key at its rate limit. To run it, use the following command:
+
+.. code-block:: bash
+
+    python -m benchmarks.endpoints
+"""
+
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agentflow.endpoints import EndpointPool
+from agentflow.llm import LLM, Settings
+
+
+class SerialHandler(BaseHTTPRequestHandler):
+    """
+    Answers chat completion requests one at a time, after a fixed latency.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.lock:
+            time.sleep(self.server.latency)
+        body = json.dumps(
+            {
+                "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": "Hi."}}
+                ]
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(latency: float) -> ThreadingHTTPServer:
+    """
+    Starts a stub endpoint.
+
+    :param latency: The number of seconds each request takes.
+    :type latency: float
+    :return: The server.
+    :rtype: ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SerialHandler)
+    server.lock = threading.Lock()
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(servers: list, requests: int, concurrency: int) -> float:
+    """
+    Sends requests through a pool of the servers' endpoints.
+
+    :return: The throughput in requests per second.
+    :rtype: float
+    """
+    pool = EndpointPool.from_list(
+        [
+            {
+                "api_key": f"key-{number}",
+                "api_base": f"http://127.0.0.1:{server.server_port}",
+            }
+            for number, server in enumerate(servers)
+        ]
+    )
+    llm = LLM(pool)
+    settings = Settings(model="benchmark")
+    messages = [{"role": "user", "content": "Hello."}]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda _: llm.respond(settings, messages), range(requests)))
+    return requests / (time.perf_counter() - start)
+
+
+def main() -> None:
+    """
+    Runs the benchmark for increasing numbers of keys and prints the throughput.
+    """
+    parser = argparse.ArgumentParser(description="Endpoint balancing benchmark")
+    parser.add_argument("--keys", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    servers = [start_server(args.latency) for _ in range(args.keys)]
+    try:
+        keys = 1
+        while keys <= args.keys:
+            throughput = run(servers[:keys], args.requests, args.concurrency)
+            print(f"keys={keys:<3} throughput={throughput:.1f} requests/s")
+            keys *= 2
+    finally:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
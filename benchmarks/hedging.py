@@ -0,0 +1,96 @@
+"""
+This module benchmarks hedged requests against a fake backend with a heavy-tailed latency distribution. To run it, use the following command:
+
+.. code-block:: bash
+
+    python -m benchmarks.hedging --requests=300
+
+"""
+
+import argparse
+import random
+import statistics
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from agentflow.llm import LLM, LatencyTracker, Settings
+
+
+class HeavyTailedBackend:
+    """
+    A fake chat completion backend whose latencies follow a Pareto distribution, so most requests are fast and a few are very slow.
+
+    :param scale: The minimum latency in seconds.
+    :type scale: float
+    :param shape: The Pareto shape. Lower values give heavier tails.
+    :type shape: float
+    """
+
+    def __init__(self, scale: float = 0.01, shape: float = 1.5):
+        self.scale = scale
+        self.shape = shape
+        self.requests = 0
+
+    def create(self, openai_args: dict) -> SimpleNamespace:
+        """
+        Sleeps for a random latency and returns a response.
+        """
+        self.requests += 1
+        time.sleep(min(self.scale * random.paretovariate(self.shape), 2.0))
+        message = SimpleNamespace(role="assistant", content="Response.")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def run(requests: int, hedge: bool, seed: int) -> dict:
+    """
+    Sends requests to the fake backend and reports latency percentiles.
+
+    :param requests: The number of requests to send.
+    :type requests: int
+    :param hedge: Whether to hedge requests.
+    :type hedge: bool
+    :param seed: The random seed for the latency distribution.
+    :type seed: int
+    :return: The latency percentiles in milliseconds and the number of backend requests.
+    :rtype: dict
+    """
+    random.seed(seed)
+    backend = HeavyTailedBackend()
+    LLM.latencies = LatencyTracker()
+    llm = LLM()
+    settings = Settings(hedge=hedge)
+    latencies = []
+    with patch.object(LLM, "_create", side_effect=backend.create):
+        for _ in range(requests):
+            start = time.perf_counter()
+            llm.respond(settings, [])
+            latencies.append((time.perf_counter() - start) * 1000)
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "p50": quantiles[49],
+        "p95": quantiles[94],
+        "p99": quantiles[98],
+        "backend_requests": backend.requests,
+    }
+
+
+def main() -> None:
+    """
+    Runs the benchmark with and without hedging and prints the results.
+    """
+    parser = argparse.ArgumentParser(description="Hedged request benchmark")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for hedge in (False, True):
+        result = run(args.requests, hedge, args.seed)
+        print(
+            f"hedge={hedge!s:<5} p50={result['p50']:.1f}ms p95={result['p95']:.1f}ms "
+            f"p99={result['p99']:.1f}ms backend_requests={result['backend_requests']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+This module benchmarks the throughput of HTML-to-text conversion through the get_url function, with and without the process pool for its parsing. Pages are served from a saved corpus by a local HTTP server. To run it, use the following command:
+
+.. code-block:: bash
+
+    python -m benchmarks.html_to_text --corpus=<directory of .html files>
+
+Without --corpus, a synthetic corpus is generated.
+"""
+
+import argparse
+import functools
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from agentflow.function import Function, get_process_pool, shutdown_process_pool
+from agentflow.output import Output
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """
+    Serves files without logging each request.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+
+def generate_corpus(directory: str, pages: int) -> None:
+    """
+    Writes synthetic HTML pages to a directory.
+
+    :param directory: The directory to write to.
+    :type directory: str
+    :param pages: The number of pages.
+    :type pages: int
+    """
+    paragraph = "<p>Lorem <b>ipsum</b> dolor <a href='#'>sit</a> amet.</p>" * 400
+    for page in range(pages):
+        with open(os.path.join(directory, f"page_{page}.html"), "w") as file:
+            file.write(f"<html><body><h1>Page {page}</h1>{paragraph}</body></html>")
+
+
+def run(urls: list, workers: int, use_process_pool: bool, output: Output) -> float:
+    """
+    Converts every page to text with the given number of concurrent workers.
+
+    :return: The throughput in pages per second.
+    :rtype: float
+    """
+    Function.use_process_pool = use_process_pool
+    if use_process_pool:
+        shutdown_process_pool()
+        get_process_pool(workers)
+    function = Function("get_url", output)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(
+            executor.map(
+                lambda url: function.execute(f'{{"url": "{url}", "format": "text"}}'),
+                urls,
+            )
+        )
+    return len(urls) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    """
+    Runs the benchmark for increasing numbers of workers and prints the throughput.
+    """
+    parser = argparse.ArgumentParser(description="HTML-to-text benchmark")
+    parser.add_argument("--corpus", type=str, help="A directory of .html files.")
+    parser.add_argument("--pages", type=int, default=200)
+    args = parser.parse_args()
+    # Measure parsing, not the HTTP cache. Worker processes inherit this.
+    os.environ["AGENTFLOW_HTTP_CACHE"] = "off"
+
+    corpus = args.corpus or tempfile.mkdtemp()
+    if not args.corpus:
+        generate_corpus(corpus, args.pages)
+    handler = functools.partial(QuietHandler, directory=corpus)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [
+        f"http://127.0.0.1:{server.server_port}/{name}"
+        for name in sorted(os.listdir(corpus))
+        if name.endswith(".html")
+    ]
+
+    output = Output("benchmark_html_to_text")
+    worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    try:
+        for workers in worker_counts:
+            threads = run(urls, workers, False, output)
+            processes = run(urls, workers, True, output)
+            print(
+                f"workers={workers:<3} threads={threads:.1f} pages/s "
+                f"processes={processes:.1f} pages/s"
+            )
+    finally:
+        server.shutdown()
+        shutdown_process_pool()
+        shutil.rmtree(output.output_path)
+        if not args.corpus:
+            shutil.rmtree(corpus)
+
+
+if __name__ == "__main__":
+    main()
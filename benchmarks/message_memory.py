@@ -0,0 +1,77 @@
+"""
+This module benchmarks the memory held by the messages of a batch of in-flight flows, comparing plain dicts with conversations. To run it, use the following command:
+
+.. code-block:: bash
+
+    python -m benchmarks.message_memory --flows=1000
+
+"""
+
+import argparse
+import json
+import tracemalloc
+
+from agentflow.message import Conversation
+
+SYSTEM_MESSAGE = "You summarize URLs. " * 100
+FUNCTION_RESULT = "<html><body>" + "<p>Page text.</p>" * 10000 + "</body></html>"
+
+
+def build_messages(flow: int) -> list:
+    """
+    Builds the messages of one flow as dicts. Strings are decoded from JSON, as they are when flows are loaded, so equal strings are separate objects.
+
+    :param flow: The number of the flow.
+    :type flow: int
+    :return: The messages.
+    :rtype: list
+    """
+    system_message, function_result = json.loads(
+        json.dumps([SYSTEM_MESSAGE, FUNCTION_RESULT])
+    )
+    messages = [{"role": "system", "content": system_message}]
+    for task in range(5):
+        messages.append({"role": "user", "content": f"Task {task} of flow {flow}."})
+        messages.append({"role": "assistant", "content": "Answer. " * 100})
+    messages.append({"role": "function", "content": function_result, "name": "get_url"})
+    return messages
+
+
+def measure(flows: int, compact: bool) -> int:
+    """
+    Measures the memory held by the messages of a batch of flows.
+
+    :param flows: The number of flows.
+    :type flows: int
+    :param compact: Whether to hold messages in conversations.
+    :type compact: bool
+    :return: The number of bytes allocated.
+    :rtype: int
+    """
+    tracemalloc.start()
+    batch = [
+        Conversation(build_messages(flow)) if compact else build_messages(flow)
+        for flow in range(flows)
+    ]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del batch
+    return size
+
+
+def main() -> None:
+    """
+    Runs the benchmark and prints the memory per flow.
+    """
+    parser = argparse.ArgumentParser(description="Message memory benchmark")
+    parser.add_argument("--flows", type=int, default=1000)
+    args = parser.parse_args()
+
+    for compact in (False, True):
+        size = measure(args.flows, compact)
+        label = "conversations" if compact else "dicts"
+        print(f"{label:<13} {size / args.flows / 1024:.1f} KiB per flow")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+This module benchmarks planning a batch of flows, to check that a large batch can be scanned before it is launched. To run it, use the following command:
+
+.. code-block:: bash
+
+    python -m benchmarks.planner
+
+"""
+
+import argparse
+import time
+
+from agentflow.planner import History, Planner
+
+
+def main() -> None:
+    """
+    Plans a batch of the example flow with different variables and prints the time per flow and the batch's plan.
+    """
+    parser = argparse.ArgumentParser(description="Planner benchmark")
+    parser.add_argument("--flows", type=int, default=10_000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    history = History.from_outputs()
+    loaded = time.perf_counter() - start
+
+    jobs = [
+        (
+            "example_with_variables",
+            {"market": f"market {number}", "price_point": f"${number}"},
+        )
+        for number in range(args.flows)
+    ]
+    start = time.perf_counter()
+    plan = Planner(history).plan_batch(jobs, workers=8, requests_per_minute=500)
+    elapsed = time.perf_counter() - start
+    print(f"history={loaded * 1e3:.1f}ms flows={args.flows}")
+    print(f"total={elapsed:.2f}s per_flow={elapsed / args.flows * 1e3:.3f}ms")
+    print(
+        f"requests={plan.requests} cost=${plan.cost:.2f} "
+        f"wall={plan.seconds / 3600:.1f}h warnings={len(plan.warnings)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
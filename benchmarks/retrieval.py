@@ -0,0 +1,96 @@
+"""
+This module benchmarks local document retrieval: how long an index takes to open and to search, compared with loading its embeddings into memory and sorting every score. To run it, use the following command:
+
+.. code-block:: bash
+
+    python -m benchmarks.retrieval --chunks=1000000
+
+A synthetic index is built in a temporary directory first.
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from agentflow.retrieval import VectorIndex, build_index
+
+WORDS = [f"term{number}" for number in range(5000)]
+
+
+def generate_documents(chunks: int, seed: int = 0):
+    """
+    Yields synthetic documents of one chunk each.
+
+    :param chunks: The number of documents.
+    :type chunks: int
+    :param seed: The random seed.
+    :type seed: int
+    """
+    random = np.random.default_rng(seed)
+    for number in range(chunks):
+        words = random.choice(len(WORDS), 20)
+        yield f"{number}.txt", " ".join(WORDS[word] for word in words)
+
+
+def full_sort(index_path: str, index: VectorIndex, query: str, k: int) -> list:
+    """
+    Searches by reading all embeddings into memory and sorting every score.
+
+    :return: The rows of the top chunks.
+    :rtype: list
+    """
+    embeddings = np.fromfile(
+        os.path.join(index_path, "embeddings.f32"), dtype=np.float32
+    ).reshape(index.count, index.embedder.dimensions)
+    scores = embeddings @ index.embedder.embed([query])[0]
+    return list(np.argsort(-scores)[:k])
+
+
+def main() -> None:
+    """
+    Builds a synthetic index and prints open and search times.
+    """
+    parser = argparse.ArgumentParser(description="Retrieval benchmark")
+    parser.add_argument("--chunks", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    index_path = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        build_index(generate_documents(args.chunks), index_path)
+        print(f"build={time.perf_counter() - start:.1f} s chunks={args.chunks}")
+
+        start = time.perf_counter()
+        index = VectorIndex(index_path)
+        print(f"open={(time.perf_counter() - start) * 1000:.2f} ms")
+
+        queries = [" ".join(WORDS[number::997][:3]) for number in range(args.queries)]
+        for name, search in [
+            ("memmap top-k", lambda query: index.search(query, args.k)),
+            (
+                "load and sort",
+                lambda query: full_sort(index_path, index, query, args.k),
+            ),
+        ]:
+            times = []
+            for query in queries:
+                start = time.perf_counter()
+                search(query)
+                times.append(time.perf_counter() - start)
+            print(
+                f"{name:<14} p50={statistics.median(times) * 1000:.1f} ms "
+                f"max={max(times) * 1000:.1f} ms"
+            )
+    finally:
+        shutil.rmtree(index_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+This module benchmarks the time to serialize a chat completion request as the history grows, comparing full serialization with the incremental serializer. To run it, use the following command:
+
+.. code-block:: bash
+
+    python -m benchmarks.serialization
+
+"""
+
+import argparse
+import json
+import time
+
+from agentflow.message import Conversation, to_dicts
+from agentflow.prefix import canonicalize_functions
+from agentflow.serialization import encode_request
+
+FUNCTIONS = canonicalize_functions(
+    [
+        {
+            "name": f"function_{number}",
+            "description": "A function. " * 10,
+            "parameters": {
+                "type": "object",
+                "properties": {"argument": {"type": "string"}},
+            },
+        }
+        for number in range(5)
+    ]
+)
+
+
+def time_call(serialize, openai_args: dict, repeats: int) -> float:
+    """
+    Times a serializer.
+
+    :return: The mean time per call in microseconds.
+    :rtype: float
+    """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        serialize(openai_args)
+    return (time.perf_counter() - start) / repeats * 1e6
+
+
+def serialize_full(openai_args: dict) -> bytes:
+    """
+    Serializes the whole request, as the OpenAI client does.
+    """
+    return json.dumps(
+        {
+            **openai_args,
+            "messages": to_dicts(openai_args["messages"]),
+            "functions": list(openai_args["functions"]),
+        }
+    ).encode()
+
+
+def main() -> None:
+    """
+    Runs the benchmark for increasing history lengths and prints the time per call.
+    """
+    parser = argparse.ArgumentParser(description="Request serialization benchmark")
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    for length in (10, 100, 1000):
+        conversation = Conversation([{"role": "system", "content": "System. " * 50}])
+        for turn in range(length):
+            role = "user" if turn % 2 else "assistant"
+            conversation.append({"role": role, "content": f"Turn {turn}. " * 100})
+        openai_args = {"model": "gpt-4", "messages": conversation}
+        openai_args["functions"] = FUNCTIONS
+        encode_request(openai_args)  # Warm the caches, as earlier calls would.
+        full = time_call(serialize_full, openai_args, args.repeats)
+        incremental = time_call(encode_request, openai_args, args.repeats)
+        print(f"messages={length:<5} full={full:.0f}us incremental={incremental:.0f}us")
+
+
+if __name__ == "__main__":
+    main()
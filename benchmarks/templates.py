@@ -0,0 +1,74 @@
+"""
+This module benchmarks formatting flow messages with large variable values, comparing the regex and str.format approach with compiled templates. To run it, use the following command:
+
+.. code-block:: bash
+
+    python -m benchmarks.templates
+
+"""
+
+import argparse
+import re
+import time
+
+from agentflow.template import compile_template
+
+MESSAGE = (
+    "Summarize the document below for {audience} in {{bullet points}}.\n\n"
+    "Title: {title}\n\n{document}\n\nKeep it under {words} words."
+)
+
+
+def format_with_regex(message: str, variables: dict) -> str:
+    """
+    Finds the variables with a regex and formats the message with str.format, as flows did before templates.
+    """
+    names = set(re.findall(r"{([^{}]+)}", message.replace("{{", "").replace("}}", "")))
+    assert names == set(variables)
+    return message.format(**variables).replace("{{", "{").replace("}}", "}")
+
+
+def format_with_template(message: str, variables: dict) -> str:
+    """
+    Finds the variables and formats the message with a compiled template.
+    """
+    template = compile_template(message)
+    assert template.variables == set(variables)
+    return template.render(variables)
+
+
+def time_call(format_message, variables: dict, repeats: int) -> float:
+    """
+    Times a formatter.
+
+    :return: The mean time per call in microseconds.
+    :rtype: float
+    """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        format_message(MESSAGE, variables)
+    return (time.perf_counter() - start) / repeats * 1e6
+
+
+def main() -> None:
+    """
+    Runs the benchmark for increasing document sizes and prints the time per call.
+    """
+    parser = argparse.ArgumentParser(description="Message formatting benchmark")
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    for size in (1_000, 100_000, 1_000_000):
+        variables = {
+            "audience": "executives",
+            "title": "Report",
+            "document": ("Lorem ipsum dolor sit amet. " * size)[:size],
+            "words": 200,
+        }
+        regex = time_call(format_with_regex, variables, args.repeats)
+        template = time_call(format_with_template, variables, args.repeats)
+        print(f"chars={size:<8} regex={regex:.1f}us template={template:.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+This module benchmarks the latency of running a flow from a cold start, in a new process, against running it on a warm pool. Both run against a local stub of the chat completion API, so only the engine's own startup costs differ. To run it, use the following command:
+
+.. code-block:: bash
+
+    python -m benchmarks.warm_start --runs=20
+
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FLOW = {
+    "system_message": "You are a helpful assistant.",
+    "tasks": [
+        {"action": "Say hello to {name}."},
+        {
+            "action": "Save the greeting to hello.txt.",
+            "settings": {"function_call": "save_file"},
+        },
+    ],
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    A stub chat completion endpoint that answers at once, with a function call if one is requested.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        function_call = request.get("function_call")
+        if isinstance(function_call, dict):
+            arguments = json.dumps({"file_name": "hello.txt", "file_contents": "Hi!"})
+            message = {
+                "role": "assistant",
+                "content": None,
+                "function_call": {
+                    "name": function_call["name"],
+                    "arguments": arguments,
+                },
+            }
+        else:
+            message = {"role": "assistant", "content": "Hello!"}
+        body = json.dumps(
+            {
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 5},
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_once(flows_path: str) -> float:
+    """
+    Imports the engine and runs the benchmark flow once, as a new process would.
+
+    :return: The time from before the imports to the end of the run in milliseconds.
+    :rtype: float
+    """
+    start = time.perf_counter()
+    from agentflow.flow import Flow
+
+    flow = Flow("warm_start", {"name": "Ada"}, flows_path)
+    flow.run()
+    elapsed = (time.perf_counter() - start) * 1e3
+    shutil.rmtree(flow.output.output_path)
+    return elapsed
+
+
+def cold(flows_path: str, api_base: str, runs: int) -> list:
+    """
+    Runs the flow in a new process for each run.
+
+    :return: The latencies in milliseconds, measured inside each process.
+    :rtype: list
+    """
+    env = {**os.environ, "OPENAI_API_BASE": api_base, "OPENAI_API_KEY": "benchmark"}
+    latencies = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.warm_start", "--once", flows_path],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        latencies.append(float(output.strip().splitlines()[-1]))
+    return latencies
+
+
+def warm(flows_path: str, api_base: str, runs: int) -> tuple:
+    """
+    Runs the flow on a warm pool.
+
+    :return: The pool's startup time and the latencies in milliseconds.
+    :rtype: tuple
+    """
+    import openai
+
+    from agentflow.warm import WarmPool
+
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    openai.api_base = api_base
+    latencies = []
+    with WarmPool(["warm_start"], flows_path, max_workers=1) as pool:
+        for _ in range(runs):
+            start = time.perf_counter()
+            flow = pool.run("warm_start", {"name": "Ada"})
+            latencies.append((time.perf_counter() - start) * 1e3)
+            shutil.rmtree(flow.output.output_path)
+        return pool.startup_seconds * 1e3, latencies
+
+
+def main() -> None:
+    """
+    Runs the flow cold and warm and prints latency percentiles.
+    """
+    parser = argparse.ArgumentParser(description="Cold and warm start benchmark")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--once", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.once:
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            elapsed = run_once(args.once)
+            sys.stdout = stdout
+        print(elapsed)
+        return
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_base = f"http://127.0.0.1:{server.server_port}/v1"
+    flows_path = tempfile.mkdtemp()
+    with open(os.path.join(flows_path, "warm_start.json"), "w") as file:
+        json.dump(FLOW, file)
+
+    try:
+        cold_latencies = cold(flows_path, api_base, args.runs)
+        startup, warm_latencies = warm(flows_path, api_base, args.runs)
+    finally:
+        server.shutdown()
+        shutil.rmtree(flows_path)
+
+    print(f"Warm pool startup: {startup:.1f} ms")
+    for name, latencies in (("cold", cold_latencies), ("warm", warm_latencies)):
+        print(
+            f"{name}: median {statistics.median(latencies):.1f} ms, "
+            f"max {max(latencies):.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+This module is used to build the document indexes that the search_documents function searches. To build one from a directory of .txt, .md, .rst and .html files, use the following command:
+
+.. code-block:: bash
+
+    python -m index_documents --corpus=<path to documents> --index=<index name>
+
+The index is written to agentflow/indexes/<index name>. Use --embedder=openai to embed with OpenAI's embeddings API instead of offline hashed features.
+
+"""
+
+import argparse
+import os
+import time
+
+from agentflow.functions.search_documents import SearchDocuments
+from agentflow.retrieval import (
+    HashingEmbedder,
+    OpenAIEmbedder,
+    build_index,
+    read_corpus,
+)
+
+
+def main() -> None:
+    """
+    The main function that parses command line arguments and builds the index.
+    """
+    parser = argparse.ArgumentParser(description="AgentFlow document indexer")
+    parser.add_argument(
+        "--corpus",
+        type=str,
+        required=True,
+        help="The directory of the documents to index.",
+    )
+    parser.add_argument(
+        "--index",
+        type=str,
+        default="default",
+        help="The name of the index.",
+    )
+    parser.add_argument(
+        "--embedder",
+        choices=["hashing", "openai"],
+        default="hashing",
+        help="How to embed chunks: offline hashed features or OpenAI's API.",
+    )
+    parser.add_argument(
+        "--dimensions",
+        type=int,
+        default=256,
+        help="The dimensions of hashed embeddings.",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1000,
+        help="The maximum number of characters in a chunk.",
+        dest="chunk_size",
+    )
+    parser.add_argument(
+        "--overlap",
+        type=int,
+        default=200,
+        help="The number of characters repeated between chunks.",
+    )
+    args = parser.parse_args()
+
+    if args.embedder == "openai":
+        embedder = OpenAIEmbedder()
+    else:
+        embedder = HashingEmbedder(args.dimensions)
+    index_path = os.path.join(SearchDocuments.indexes_path, args.index)
+    start = time.perf_counter()
+    count = build_index(
+        read_corpus(args.corpus), index_path, embedder, args.chunk_size, args.overlap
+    )
+    elapsed = time.perf_counter() - start
+    print(f"Indexed {count} chunks in {elapsed:.1f}s: {os.path.abspath(index_path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,59 @@ This module is used to run Agentflow flows. To run one, use the following comman
 
     python -m run --flow=<flow name> --variables '<variable>=<value>' '<variable>=<value>'
 
-Optionally, use -v for verbose output.
+To run a batch of flows, pass a JSON Lines file where each line has a "flow" and optionally "variables", "tenant" and "priority":
+
+.. code-block:: bash
+
+    python -m run --batch=<path to .jsonl file> --workers=4 --requests-per-minute=200 --max-cost=10
+
+To record the HTTP requests of a run to a cassette file, or to rerun it offline from one, add --record or --replay:
+
+.. code-block:: bash
+
+    python -m run --flow=<flow name> --record=<path to cassette>
+    python -m run --flow=<flow name> --replay=<path to cassette> --realtime
+
+To run flows on several machines, point a batch and any number of workers at the same broker. The batch is enqueued and waited for, and each worker runs jobs until it is stopped:
+
+.. code-block:: bash
+
+    python -m run --batch=<path to .jsonl file> --broker=redis://<host>:6379/0
+    python -m run --worker --broker=redis://<host>:6379/0
+
+For large jobs that can wait, add --bulk to a batch to send each step of all its flows to OpenAI's Batch API as one batch, at batch prices:
+
+.. code-block:: bash
+
+    python -m run --batch=<path to .jsonl file> --bulk
+
+To estimate the requests, tokens, cost and time of a flow or batch without running it, add --plan. Batches are planned for their --workers and --requests-per-minute:
+
+.. code-block:: bash
+
+    python -m run --batch=<path to .jsonl file> --workers=8 --requests-per-minute=500 --plan
+
+To watch a long run, serve live metrics for Prometheus with --metrics-port, or use -v for verbose output, which includes a summary of the metrics every 10 seconds:
+
+.. code-block:: bash
+
+    python -m run --batch=<path to .jsonl file> --metrics-port=9100 -v
 
 """
 
 import argparse
+import json
 import logging
+from contextlib import ExitStack, nullcontext
 
+from agentflow.budget import Budget
+from agentflow.bulk import BaseBatchBackend, BulkRunner, OpenAIBatchBackend
+from agentflow.cassette import Recorder, Replayer
+from agentflow.distributed import BaseBroker, Coordinator, Worker, get_broker
 from agentflow.flow import Flow
+from agentflow.metrics import SummaryReporter, serve_metrics
+from agentflow.planner import Planner
+from agentflow.scheduler import Job, Scheduler
 
 
 def main() -> None:
@@ -20,13 +65,24 @@ def main() -> None:
     The main function that parses command line arguments and runs the specified flow.
     """
     parser = argparse.ArgumentParser(description="AgentFlow")
-    parser.add_argument(
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument(
         "--flow",
         type=str,
-        required=True,
         help="The name of the flow to run. (The part before .json.)",
         dest="flow_name",
     )
+    target.add_argument(
+        "--batch",
+        type=str,
+        help="The path to a JSON Lines file of flows to run, one per line.",
+        dest="batch_path",
+    )
+    target.add_argument(
+        "--worker",
+        action="store_true",
+        help="Run flows from the broker's queue until stopped.",
+    )
     parser.add_argument(
         "--variables",
         nargs="*",
@@ -34,7 +90,74 @@ def main() -> None:
         dest="variables",
     )
     parser.add_argument(
-        "-v", "--verbose", action="store_true", help="Show detailed output."
+        "--workers",
+        type=int,
+        default=4,
+        help="The number of flows to run at once in batch mode.",
+    )
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        help="The LLM rate budget shared by all flows in batch mode.",
+        dest="requests_per_minute",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        help="The token budget shared by all flows in batch mode. Not supported with --broker.",
+        dest="max_tokens",
+    )
+    parser.add_argument(
+        "--max-cost",
+        type=float,
+        help="The cost budget in USD shared by all flows in batch mode. Not supported with --broker.",
+        dest="max_cost",
+    )
+    parser.add_argument(
+        "--broker",
+        type=str,
+        help="The URL of a broker to run a batch through, or to work for: sqlite:///<path> or redis://<host>:<port>/<db>.",
+        dest="broker_url",
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Run a batch through OpenAI's Batch API, one batch per step of its flows.",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Estimate the requests, tokens, cost and time of the flow or batch without running it.",
+    )
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument(
+        "--record",
+        type=str,
+        help="The path of a cassette file to record the run's HTTP requests to.",
+        dest="record_path",
+    )
+    cassette.add_argument(
+        "--replay",
+        type=str,
+        help="The path of a cassette file to answer the run's HTTP requests from.",
+        dest="replay_path",
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="When replaying, wait for each request's recorded latency.",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Serve live metrics in Prometheus' format at http://127.0.0.1:<port>/metrics.",
+        dest="metrics_port",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Show detailed output, including a summary of metrics every 10 seconds.",
     )
 
     args = parser.parse_args()
@@ -43,8 +166,176 @@ def main() -> None:
         logging.basicConfig(level=logging.INFO)
         logging.info("Verbose mode enabled.")
 
-    flow = Flow(args.flow_name, variables)
-    flow.run()
+    if args.record_path:
+        cassette = Recorder(args.record_path)
+    elif args.replay_path:
+        cassette = Replayer(args.replay_path, realtime=args.realtime)
+    else:
+        cassette = nullcontext()
+
+    if args.worker and not args.broker_url:
+        parser.error("--worker requires --broker.")
+    if args.bulk and not args.batch_path:
+        parser.error("--bulk requires --batch.")
+    if args.plan and args.worker:
+        parser.error("--plan requires --flow or --batch.")
+    if args.broker_url and (args.max_tokens is not None or args.max_cost is not None):
+        parser.error("--max-tokens and --max-cost can't be used with --broker.")
+
+    if args.plan:
+        print_plan(
+            args.flow_name,
+            variables,
+            args.batch_path,
+            args.workers,
+            args.requests_per_minute,
+        )
+        return
+
+    with ExitStack() as stack:
+        stack.enter_context(cassette)
+        if args.metrics_port is not None:
+            server = serve_metrics(args.metrics_port)
+            stack.callback(server.shutdown)
+            logging.info(f"Serving metrics on port {server.server_port}.")
+        if args.verbose:
+            stack.callback(SummaryReporter().start().stop)
+
+        if args.worker:
+            Worker(get_broker(args.broker_url)).run()
+            return
+
+        if args.batch_path and args.broker_url:
+            submit_batch(args.batch_path, get_broker(args.broker_url))
+            return
+
+        if args.batch_path:
+            budget = Budget(args.max_tokens, args.max_cost, name="batch budget")
+            if args.bulk:
+                run_bulk(args.batch_path, OpenAIBatchBackend(), budget)
+                return
+            run_batch(args.batch_path, args.workers, args.requests_per_minute, budget)
+            return
+
+        flow = Flow(args.flow_name, variables)
+        flow.run()
+
+
+def run_batch(
+    batch_path: str,
+    workers: int,
+    requests_per_minute: float,
+    budget: Budget = None,
+) -> None:
+    """
+    Runs a batch of flows through the scheduler and prints per-tenant metrics and the batch's usage.
+
+    :param batch_path: The path to a JSON Lines file where each line describes a flow to run.
+    :type batch_path: str
+    :param workers: The number of flows to run at once.
+    :type workers: int
+    :param requests_per_minute: The LLM rate budget shared by all flows.
+    :type requests_per_minute: float
+    :param budget: The token and cost budget shared by all flows.
+    :type budget: Budget, optional
+    """
+    with open(batch_path, "r") as file:
+        jobs = [
+            Job(
+                line["flow"],
+                line.get("variables", {}),
+                tenant=line.get("tenant", "default"),
+                priority=line.get("priority", 0),
+                budget=budget,
+            )
+            for line in map(json.loads, filter(str.strip, file))
+        ]
+
+    scheduler = Scheduler(max_workers=workers, requests_per_minute=requests_per_minute)
+    scheduler.run(jobs)
+    for tenant, metrics in scheduler.get_metrics().items():
+        print(f"Tenant {tenant}: {metrics}")
+    if budget is not None:
+        print(f"Usage: {budget.to_dict()}")
+
+
+def print_plan(
+    flow_name: str,
+    variables: dict,
+    batch_path: str,
+    workers: int,
+    requests_per_minute: float,
+) -> None:
+    """
+    Prints the plan of a flow, or of a batch of flows at its concurrency and rate limit, as JSON.
+
+    :param flow_name: The name of the flow to plan, if not planning a batch.
+    :type flow_name: str
+    :param variables: The variables of the flow.
+    :type variables: dict
+    :param batch_path: The path to a JSON Lines file where each line describes a flow to plan.
+    :type batch_path: str
+    :param workers: The number of flows to run at once.
+    :type workers: int
+    :param requests_per_minute: The LLM rate budget shared by all flows.
+    :type requests_per_minute: float
+    """
+    planner = Planner()
+    if not batch_path:
+        print(json.dumps(planner.plan(flow_name, variables).to_dict(), indent=4))
+        return
+    with open(batch_path, "r") as file:
+        jobs = [
+            (line["flow"], line.get("variables", {}))
+            for line in map(json.loads, filter(str.strip, file))
+        ]
+    plan = planner.plan_batch(jobs, workers, requests_per_minute)
+    print(json.dumps(plan.to_dict(), indent=4))
+
+
+def run_bulk(batch_path: str, backend: BaseBatchBackend, budget: Budget = None) -> None:
+    """
+    Runs a batch of flows in bulk mode and prints each flow's outcome, the number of batches and the batch's usage.
+
+    :param batch_path: The path to a JSON Lines file where each line describes a flow to run.
+    :type batch_path: str
+    :param backend: The batch backend to submit requests to.
+    :type backend: BaseBatchBackend
+    :param budget: The token and cost budget shared by all flows.
+    :type budget: Budget, optional
+    """
+    with open(batch_path, "r") as file:
+        flows = [
+            Flow(line["flow"], line.get("variables", {}), budget=budget)
+            for line in map(json.loads, filter(str.strip, file))
+        ]
+    runner = BulkRunner(backend)
+    for flow in runner.run(flows):
+        print(f"Flow {flow.name}: {flow.error or flow.output.output_path}")
+    print(f"Batches: {runner.get_metrics()}")
+    if budget is not None:
+        print(f"Usage: {budget.to_dict()}")
+
+
+def submit_batch(batch_path: str, broker: BaseBroker) -> None:
+    """
+    Submits a batch of flows to a broker, waits for workers to run them and prints each job's status.
+
+    :param batch_path: The path to a JSON Lines file where each line describes a flow to run.
+    :type batch_path: str
+    :param broker: The broker the workers lease jobs from.
+    :type broker: BaseBroker
+    """
+    coordinator = Coordinator(broker)
+    with open(batch_path, "r") as file:
+        job_ids = [
+            coordinator.submit(
+                line["flow"], line.get("variables", {}), key=line.get("key")
+            )
+            for line in map(json.loads, filter(str.strip, file))
+        ]
+    for job_id, job in coordinator.wait(job_ids).items():
+        print(f"Job {job_id}: {job['status']} {job['result'] or job['error']}")
 
 
 def parse_variables(variables: list[str]) -> dict[str, str]:
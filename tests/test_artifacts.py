@@ -0,0 +1,70 @@
+"""
+This module contains tests for the ArtifactStore class.
+"""
+
+from agentflow.artifacts import PREVIEW_LENGTH, ArtifactStore
+
+
+def test_put_numbers_results_per_function():
+    """
+    Tests that each function's results get their own numbered handles.
+    """
+    store = ArtifactStore()
+    assert store.put("get_url", "first") == "@result:get_url:1"
+    assert store.put("get_url", "second") == "@result:get_url:2"
+    assert store.put("save_file", "third") == "@result:save_file:1"
+    assert store.get("@result:get_url:2") == "second"
+    assert store.get("@result:get_url:3") is None
+
+
+def test_resolve():
+    """
+    Tests that handles in strings, lists and dicts are replaced with their results, and that unknown handles are kept.
+    """
+    store = ArtifactStore()
+    handle = store.put("get_url", "Page text.")
+    arguments = {
+        "text": handle,
+        "note": f"From {handle} and @result:get_url:9.",
+        "parts": [handle, 1],
+        "count": 2,
+    }
+    assert store.resolve(arguments) == {
+        "text": "Page text.",
+        "note": "From Page text. and @result:get_url:9.",
+        "parts": ["Page text.", 1],
+        "count": 2,
+    }
+
+
+def test_reference_is_short():
+    """
+    Tests that the message for a large result holds its handle and a preview, not the result.
+    """
+    store = ArtifactStore()
+    content = "x" * 100000
+    message = store.reference("get_url", content)
+    assert "@result:get_url:1" in message
+    assert len(message) < PREVIEW_LENGTH + 200
+    assert store.get("@result:get_url:1") == content
+
+
+def test_dereference():
+    """
+    Tests that a reference message is looked up to its result, and that other content is kept.
+    """
+    store = ArtifactStore()
+    message = store.reference("get_url", "first\nsecond")
+    assert store.dereference(message) == "first\nsecond"
+    assert store.dereference("first\nsecond") == "first\nsecond"
+    unknown = message.replace("@result:get_url:1", "@result:get_url:9")
+    assert store.dereference(unknown) == unknown
+
+
+def test_restore():
+    """
+    Tests that a store restored from an earlier run's results keeps numbering after them.
+    """
+    store = ArtifactStore(ArtifactStore({"@result:get_url:2": "a"}).to_dict())
+    assert store.get("@result:get_url:2") == "a"
+    assert store.put("get_url", "b") == "@result:get_url:3"
@@ -0,0 +1,114 @@
+"""
+This module contains tests for the Budget class and budget enforcement.
+"""
+
+import json
+import os
+import shutil
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from agentflow.budget import (
+    Budget,
+    BudgetExceeded,
+    active_budgets,
+    enforce,
+    record_usage,
+    use_budgets,
+)
+from agentflow.flow import Flow
+from agentflow.llm import LLM, Settings
+
+
+def test_record_and_exceed():
+    """
+    Test that usage is recorded by model and checked against the limits.
+    """
+    budget = Budget(max_tokens=100, max_cost=0.01)
+    budget.record("gpt-4", 40, 10, 0.002)
+    budget.record("gpt-3.5-turbo", 20, 10, 0.001)
+    assert budget.to_dict()["total_tokens"] == 80
+    assert budget.to_dict()["by_model"]["gpt-4"]["calls"] == 1
+    assert budget.exceeded_by(20, 0.0) is None
+    assert "100 tokens" in budget.exceeded_by(21, 0.0)
+    assert "$0.01" in budget.exceeded_by(0, 0.008)
+
+
+def test_enforce_fail_and_downgrade():
+    """
+    Test that requests over a budget fail fast, or are downgraded if the budget allows it and the cheaper model fits.
+    """
+    assert enforce("gpt-4", 1000, 0) == "gpt-4"
+
+    with use_budgets(Budget(max_cost=0.01)):
+        assert enforce("gpt-4", 100, 0) == "gpt-4"
+        with pytest.raises(BudgetExceeded):
+            enforce("gpt-4", 1000, 0)
+
+    with use_budgets(Budget(max_cost=0.01, on_exceed="downgrade")):
+        assert enforce("gpt-4", 1000, 0) == "gpt-3.5-turbo"
+        with pytest.raises(BudgetExceeded):
+            enforce("gpt-4", 10000, 0)
+
+    with pytest.raises(ValueError):
+        Budget(on_exceed="ignore")
+
+
+def test_parent_budgets():
+    """
+    Test that a budget's parent is in effect with it and records the same usage once.
+    """
+    batch = Budget(max_tokens=50, name="batch budget")
+    first, second = Budget(parent=batch), Budget(parent=batch)
+    with use_budgets(first):
+        assert active_budgets() == [first, batch]
+        record_usage("gpt-4", {"prompt_tokens": 20, "completion_tokens": 10}, 0, "")
+    with use_budgets(second, batch):
+        assert active_budgets() == [second, batch]
+        usage = record_usage("gpt-4", None, 12, "12345678")
+        assert usage["completion_tokens"] == 2
+        with pytest.raises(BudgetExceeded, match="batch budget"):
+            enforce("gpt-4", 10, 0)
+    assert batch.total_tokens == 44
+    assert first.total_tokens == 30
+    assert second.total_tokens == 14
+
+
+def test_flow_budget():
+    """
+    Test that a flow records usage from responses, stops when its budget would be exceeded and saves its usage.
+    """
+    response = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="Response."))],
+        usage={"prompt_tokens": 10, "completion_tokens": 10},
+    )
+    flows_path = os.path.dirname(os.path.abspath(__file__))
+    batch = Budget()
+    with patch.object(LLM, "_create", return_value=response) as create:
+        flow = Flow("test_flow_with_budget", flows_path=flows_path, budget=batch)
+        flow.run()
+    assert create.call_count == 2
+    assert flow.budget.total_tokens == 40
+    assert batch.total_tokens == 40
+    assert flow.trace.records[0]["prompt_tokens"] == 10
+    assert "flow budget" in flow.trace.records[2]["error"]
+    with open(os.path.join(flow.output.output_path, "usage.json")) as file:
+        assert json.load(file)["calls"] == 2
+    shutil.rmtree(flow.output.output_path)
+
+
+def test_respond_fails_fast():
+    """
+    Test that a request over budget fails before it is sent.
+    """
+    response = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="Response."))],
+        usage={"prompt_tokens": 10, "completion_tokens": 10},
+    )
+    with patch.object(LLM, "_create", return_value=response) as create:
+        with use_budgets(Budget(max_tokens=5)):
+            with pytest.raises(BudgetExceeded):
+                LLM().respond(Settings(), [{"role": "user", "content": "Hi."}] * 10)
+        assert create.call_count == 0
@@ -0,0 +1,133 @@
+"""
+This module contains tests for running flows in bulk mode.
+"""
+
+import json
+import os
+import shutil
+
+import openai
+import pytest
+
+from agentflow.bulk import BatchFailed, BulkRunner, FileBatchBackend
+from agentflow.flow import Flow
+
+FLOWS_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def respond(body: dict) -> dict:
+    """
+    Answer a request body with a chat completion, calling the requested function if there is one.
+    """
+    if isinstance(body.get("function_call"), dict):
+        arguments = {"file_name": "bulk.txt", "file_contents": "Saved in bulk."}
+        message = {
+            "role": "assistant",
+            "content": None,
+            "function_call": {
+                "name": body["function_call"]["name"],
+                "arguments": json.dumps(arguments),
+            },
+        }
+    else:
+        last = body["messages"][-1]
+        if "fail" in (last["content"] or ""):
+            raise openai.error.InvalidRequestError(
+                "Bad request.", None, http_status=400
+            )
+        message = {"role": "assistant", "content": f"Answer to: {last['content']}"}
+    return {"choices": [{"index": 0, "message": message}]}
+
+
+def variable_flows(values: list) -> list:
+    """
+    Create flows from the test flow with variables.
+    """
+    return [
+        Flow(
+            "test_flow_with_variables",
+            {"system_message_variable": "bulk", "task_1_variable": value},
+            flows_path=FLOWS_PATH,
+        )
+        for value in values
+    ]
+
+
+def test_run(tmp_path):
+    """
+    Tests that each task of all flows is sent as one batch and that the answers go back to their flows.
+    """
+    bodies = []
+    backend = FileBatchBackend(
+        str(tmp_path), lambda body: bodies.append(body) or respond(body)
+    )
+    runner = BulkRunner(backend, poll_interval=0.01, linger=0.01)
+    flows = runner.run(variable_flows(["a", "b", "c"]))
+
+    assert runner.get_metrics() == {"batches": 2, "requests": 6, "largest_batch": 3}
+    assert len(os.listdir(tmp_path)) == 2
+    for flow, value in zip(flows, ["a", "b", "c"]):
+        assert flow.error is None
+        assert flow.messages[2].content == f"Answer to: Task 1 action with {value}."
+        assert flow.messages[4].content.startswith("Answer to: Task 2 action")
+        shutil.rmtree(flow.output.output_path)
+    assert all(body["model"] and body["messages"] for body in bodies)
+    assert "stream" not in bodies[0]
+
+
+def test_run_streamed_function_call(tmp_path):
+    """
+    Tests that a streamed function call is answered from a batch and that the function runs.
+    """
+    backend = FileBatchBackend(str(tmp_path), respond)
+    runner = BulkRunner(backend, poll_interval=0.01, linger=0.01)
+    flow = runner.run([Flow("test_flow_with_streaming", flows_path=FLOWS_PATH)])[0]
+
+    assert flow.error is None
+    assert runner.get_metrics()["batches"] == 2
+    with open(os.path.join(flow.output.output_path, "bulk.txt"), "r") as file:
+        assert file.read() == "Saved in bulk."
+    assert flow.messages[-1].content.startswith("Answer to: ")
+    shutil.rmtree(flow.output.output_path)
+
+
+def test_request_errors(tmp_path):
+    """
+    Tests that a request that fails in a batch fails its flow without holding up the others.
+    """
+    runner = BulkRunner(
+        FileBatchBackend(str(tmp_path), respond), poll_interval=0.01, linger=0.01
+    )
+    failing, passing = runner.run(variable_flows(["fail", "pass"]))
+
+    assert isinstance(failing.error, openai.error.InvalidRequestError)
+    assert passing.error is None
+    assert passing.messages[-1].content.startswith("Answer to: Task 2 action")
+    for flow in (failing, passing):
+        shutil.rmtree(flow.output.output_path)
+
+
+class FailingBackend(FileBatchBackend):
+    """
+    A file backend whose batches fail.
+    """
+
+    def submit(self, input_path: str) -> str:
+        batch_id = super().submit(input_path)
+        with open(os.path.join(self.directory, batch_id, "error.txt"), "w") as file:
+            file.write("Input file is invalid.")
+        return batch_id
+
+
+def test_failed_batch(tmp_path):
+    """
+    Tests that a failed batch fails the requests in it.
+    """
+    backend = FailingBackend(str(tmp_path))
+    with pytest.raises(BatchFailed):
+        backend.is_done(backend.submit(__file__))
+
+    runner = BulkRunner(backend, poll_interval=0.01, linger=0.01)
+    flow = runner.run(variable_flows(["a"]))[0]
+    assert isinstance(flow.error, BatchFailed)
+    shutil.rmtree(flow.output.output_path)
@@ -0,0 +1,186 @@
+"""
+This module contains tests for the Recorder and Replayer classes.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+import requests
+
+from agentflow.cassette import Recorder, Replayer, UnrecordedRequest
+from agentflow.flow import Flow
+from agentflow.function import Function
+from agentflow.functions.get_url import GetUrl
+from agentflow.output import Output
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    """
+    A stub server that counts requests, answers cacheable pages by path and answers chat completions by echoing the last message.
+    """
+
+    count = 0
+
+    def do_GET(self):
+        CountingHandler.count += 1
+        time.sleep(0.05)
+        self._send("text/plain", f"Page {self.path}.".encode(), "max-age=3600")
+
+    def do_POST(self):
+        CountingHandler.count += 1
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        content = f"Response to {body['messages'][-1]['content']}"
+        self._send(
+            "application/json",
+            json.dumps(
+                {
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                        }
+                    ],
+                }
+            ).encode(),
+        )
+
+    def _send(self, content_type: str, body: bytes, cache_control: str = "no-store"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", cache_control)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server_url(monkeypatch):
+    """
+    Serve the stub server and point the OpenAI API base at it.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CountingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(openai, "api_base", url)
+    monkeypatch.setenv("OPENAI_API_KEY", "test_key")
+    CountingHandler.count = 0
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def test_record_and_replay(server_url, tmp_path):
+    """
+    Test that replayed requests get the recorded responses without reaching the server.
+    """
+    path = str(tmp_path / "cassette.json")
+    with Recorder(path):
+        recorded = [requests.get(f"{server_url}/{page}").text for page in "aba"]
+    assert recorded == ["Page /a.", "Page /b.", "Page /a."]
+    assert CountingHandler.count == 3
+
+    with open(path, "r") as file:
+        interactions = json.load(file)["interactions"]
+    assert [interaction["url"] for interaction in interactions] == [
+        f"{server_url}/a",
+        f"{server_url}/b",
+        f"{server_url}/a",
+    ]
+    assert all(interaction["latency"] >= 0.05 for interaction in interactions)
+
+    with Replayer(path):
+        start = time.perf_counter()
+        replayed = [requests.get(f"{server_url}/{page}").text for page in "abaa"]
+        assert time.perf_counter() - start < 0.05
+        with pytest.raises(UnrecordedRequest):
+            requests.get(f"{server_url}/c")
+    assert replayed == recorded + ["Page /a."]
+    assert CountingHandler.count == 3
+
+
+def test_replay_realtime(server_url, tmp_path):
+    """
+    Test that a realtime replay waits for the recorded latency.
+    """
+    path = str(tmp_path / "cassette.json")
+    with Recorder(path):
+        requests.get(f"{server_url}/a")
+    with Replayer(path, realtime=True):
+        start = time.perf_counter()
+        requests.get(f"{server_url}/a")
+        assert time.perf_counter() - start >= 0.05
+
+
+def test_record_with_warm_http_cache(server_url, tmp_path, monkeypatch):
+    """
+    Test that pages in a warm HTTP cache are still recorded, so they replay with a cold one.
+    """
+    warm_cache = str(tmp_path / "warm")
+    monkeypatch.setenv("AGENTFLOW_HTTP_CACHE", warm_cache)
+    output = Output("test_cassette", str(tmp_path / "output"))
+    url = f"{server_url}/a"
+    GetUrl(output).execute(url=url)
+    assert CountingHandler.count == 1
+
+    path = str(tmp_path / "cassette.json")
+    with Recorder(path):
+        recorded = GetUrl(output).execute(url=url)
+    assert CountingHandler.count == 2
+    assert os.environ["AGENTFLOW_HTTP_CACHE"] == warm_cache
+
+    monkeypatch.setenv("AGENTFLOW_HTTP_CACHE", str(tmp_path / "cold"))
+    with Replayer(path):
+        assert GetUrl(output).execute(url=url) == recorded
+    assert CountingHandler.count == 2
+
+
+def test_cassette_restores_patches(server_url, tmp_path, monkeypatch):
+    """
+    Test that requests, the process pool and the HTTP cache are restored when a recording ends, and that recordings can't overlap.
+    """
+    monkeypatch.delenv("AGENTFLOW_HTTP_CACHE", raising=False)
+    original_request = requests.Session.request
+    path = str(tmp_path / "cassette.json")
+    with open(path, "w") as file:
+        json.dump({"version": 1, "interactions": []}, file)
+    replayer = Replayer(path)
+    with Recorder(path):
+        assert not Function.use_process_pool
+        assert os.environ["AGENTFLOW_HTTP_CACHE"] == "off"
+        with pytest.raises(RuntimeError):
+            with replayer:
+                pass
+    assert requests.Session.request is original_request
+    assert Function.use_process_pool
+    assert "AGENTFLOW_HTTP_CACHE" not in os.environ
+
+
+def test_replay_flow(server_url, tmp_path):
+    """
+    Test that a recorded flow replays to the same messages without the network.
+    """
+    flows_path = os.path.dirname(os.path.abspath(__file__))
+    path = str(tmp_path / "cassette.json")
+    with Recorder(path):
+        flow = Flow("test_flow_basic", flows_path=flows_path)
+        flow.run()
+    shutil.rmtree(flow.output.output_path)
+    assert CountingHandler.count == 3
+
+    with Replayer(path):
+        replayed_flow = Flow("test_flow_basic", flows_path=flows_path)
+        replayed_flow.run()
+    shutil.rmtree(replayed_flow.output.output_path)
+    assert CountingHandler.count == 3
+    assert replayed_flow.messages.to_dicts() == flow.messages.to_dicts()
+    assert replayed_flow.messages[-1]["content"] == "Response to Task 3 action."
@@ -0,0 +1,261 @@
+"""
+This module contains tests for the distributed coordinator, workers and brokers.
+"""
+
+import os
+import shutil
+import time
+from unittest.mock import patch
+
+import pytest
+
+from agentflow import distributed, output
+from agentflow.distributed import (
+    DONE,
+    FAILED,
+    QUEUED,
+    RUNNING,
+    Coordinator,
+    RedisBroker,
+    SQLiteBroker,
+    Worker,
+    get_broker,
+    run_flow_job,
+)
+from tests.test_flow import mock_llm_respond
+
+
+@pytest.fixture
+def redis_broker(monkeypatch):
+    """
+    Get a broker backed by fakeredis, an in-memory Redis server.
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        distributed.redis.Redis,
+        "from_url",
+        lambda url, decode_responses: fakeredis.FakeRedis(
+            server=server, decode_responses=decode_responses
+        ),
+    )
+    return RedisBroker("redis://localhost:6379/0", max_attempts=2)
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def broker(request, tmp_path):
+    """
+    Get a broker backed by a SQLite file in a temporary directory, or by fakeredis.
+    """
+    if request.param == "sqlite":
+        return SQLiteBroker(str(tmp_path / "jobs.db"), max_attempts=2)
+    return request.getfixturevalue("redis_broker")
+
+
+def test_submit_is_idempotent(broker):
+    """
+    Tests that submitting the same run twice enqueues it once.
+    """
+    coordinator = Coordinator(broker)
+    first = coordinator.submit("flow", {"a": "1"})
+    second = coordinator.submit("flow", {"a": "1"})
+    other = coordinator.submit("flow", {"a": "2"})
+    assert first == second != other
+    assert broker.get(first)["status"] == QUEUED
+    assert broker.lease("worker", 60).job_id == first
+    assert broker.lease("worker", 60).job_id == other
+    assert broker.lease("worker", 60) is None
+
+
+def test_worker_runs_jobs(broker):
+    """
+    Tests that a worker runs queued jobs and records their results and checkpoints.
+    """
+    checkpoints = []
+
+    def runner(payload, checkpoint, save_checkpoint):
+        checkpoints.append(checkpoint)
+        save_checkpoint({"tasks_done": 1})
+        return payload["variables"]["a"] * 2
+
+    coordinator = Coordinator(broker)
+    job_ids = [coordinator.submit("flow", {"a": str(i)}) for i in range(3)]
+    assert Worker(broker, runner=runner).run(stop_when_idle=True) == 3
+
+    jobs = coordinator.wait(job_ids, timeout=1)
+    assert [jobs[job_id]["result"] for job_id in job_ids] == ["00", "11", "22"]
+    assert all(job["status"] == DONE and job["attempts"] == 1 for job in jobs.values())
+    assert checkpoints == [None, None, None]
+
+
+def test_expired_lease_resumes_from_checkpoint(broker):
+    """
+    Tests that a job whose worker stopped renewing its lease is leased again with its checkpoint, and that the first worker can no longer record a result.
+    """
+    job_id = Coordinator(broker).submit("flow")
+    lease = broker.lease("first", 0.05)
+    assert broker.checkpoint(job_id, "first", {"tasks_done": 2})
+    time.sleep(0.1)
+
+    lease = broker.lease("second", 60)
+    assert lease.job_id == job_id
+    assert lease.attempts == 2
+    assert lease.checkpoint == {"tasks_done": 2}
+    assert broker.get(job_id)["status"] == RUNNING
+
+    assert not broker.heartbeat(job_id, "first", 60)
+    assert not broker.complete(job_id, "first", "stale")
+    assert broker.complete(job_id, "second", "fresh")
+    assert broker.get(job_id)["result"] == "fresh"
+
+
+def test_completion_is_idempotent(broker):
+    """
+    Tests that a job's result is recorded once, and that a finished job is not leased again.
+    """
+    job_id = Coordinator(broker).submit("flow")
+    assert broker.lease("worker", 60).job_id == job_id
+    assert broker.complete(job_id, "worker", "first")
+    assert not broker.complete(job_id, "worker", "second")
+    assert not broker.fail(job_id, "worker", "Failed.")
+    assert broker.get(job_id)["status"] == DONE
+    assert broker.get(job_id)["result"] == "first"
+    assert Coordinator(broker).submit("flow") == job_id
+    assert broker.lease("worker", 60) is None
+
+
+def test_expired_lease_fails_after_max_attempts(broker):
+    """
+    Tests that a job is marked as failed once its leases have expired max_attempts times.
+    """
+    job_id = Coordinator(broker).submit("flow")
+    for worker in ("first", "second"):
+        assert broker.lease(worker, 0.01).job_id == job_id
+        time.sleep(0.05)
+    assert broker.lease("third", 60) is None
+    assert broker.get(job_id)["status"] == FAILED
+
+
+def test_failed_job_is_retried(broker):
+    """
+    Tests that a failed job is queued again until it has used all its attempts.
+    """
+    calls = []
+
+    def runner(payload, checkpoint, save_checkpoint):
+        calls.append(payload)
+        raise ValueError("boom")
+
+    job_id = Coordinator(broker).submit("flow")
+    assert Worker(broker, runner=runner).run(stop_when_idle=True) == 2
+    job = broker.get(job_id)
+    assert len(calls) == 2
+    assert job["status"] == FAILED
+    assert "boom" in job["error"]
+
+
+def test_redis_worker_killed_while_leasing(redis_broker):
+    """
+    Tests that a job stays queued when its worker stops before the transaction that pops and leases it runs.
+    """
+    job_id = Coordinator(redis_broker).submit("flow")
+    with patch.object(
+        distributed.redis.client.Pipeline,
+        "execute",
+        side_effect=distributed.redis.ConnectionError("Worker killed."),
+    ):
+        with pytest.raises(distributed.redis.ConnectionError):
+            redis_broker.lease("first", 60)
+    assert redis_broker.get(job_id)["status"] == QUEUED
+    lease = redis_broker.lease("second", 60)
+    assert lease.job_id == job_id
+    assert lease.attempts == 1
+
+
+def test_redis_late_completion_is_not_requeued(redis_broker):
+    """
+    Tests that a job completed by its worker while its expired lease is being requeued stays done, and that queue entries of finished jobs are dropped.
+    """
+    job_id = Coordinator(redis_broker).submit("flow")
+    assert redis_broker.lease("first", 0.01).job_id == job_id
+    time.sleep(0.05)
+
+    multi = distributed.redis.client.Pipeline.multi
+    completed = []
+
+    def complete_before_multi(pipe):
+        if not completed:
+            completed.append(True)
+            assert redis_broker.complete(job_id, "first", "late")
+        return multi(pipe)
+
+    with patch.object(
+        distributed.redis.client.Pipeline, "multi", complete_before_multi
+    ):
+        assert redis_broker.lease("second", 60) is None
+    assert completed
+    assert redis_broker.get(job_id)["status"] == DONE
+    assert redis_broker.get(job_id)["result"] == "late"
+
+    redis_broker._client.lpush(redis_broker._queue, job_id)
+    assert redis_broker.lease("second", 60) is None
+    assert redis_broker.get(job_id)["attempts"] == 1
+
+
+def test_run_flow_job_resumes_from_checkpoint():
+    """
+    Tests that a flow job skips the tasks finished before its checkpoint and saves a checkpoint after each task.
+    """
+    flows_path = os.path.dirname(os.path.abspath(__file__))
+    payload = {"flow": "test_flow_basic", "flows_path": flows_path}
+    checkpoint = {
+        "tasks_done": 2,
+        "messages": [
+            {"role": "system", "content": "Test system message."},
+            {"role": "user", "content": "Task 1 action."},
+            {"role": "assistant", "content": "Done 1."},
+            {"role": "user", "content": "Task 2 action."},
+            {"role": "assistant", "content": "Done 2."},
+        ],
+    }
+    saved = []
+    with patch("agentflow.flow.LLM") as MockLLM:
+        MockLLM.return_value.respond.side_effect = mock_llm_respond
+        result = run_flow_job(payload, checkpoint, saved.append)
+
+    assert MockLLM.return_value.respond.call_count == 1
+    assert result["answer"] == "Response to user message Task 3 action.."
+    assert [data["tasks_done"] for data in saved] == [3]
+    assert len(saved[0]["messages"]) == 7
+    assert saved[0]["output_path"] == result["output_path"]
+    shutil.rmtree(result["output_path"])
+
+
+def test_run_flow_job_reuses_output_path(tmp_path):
+    """
+    Tests that a resumed flow job writes to the output directory of its checkpoint, which its messages refer to.
+    """
+    flows_path = os.path.dirname(os.path.abspath(__file__))
+    payload = {"flow": "test_flow_basic", "flows_path": flows_path}
+    output_path = str(tmp_path / "earlier_run")
+    checkpoint = {
+        "tasks_done": 3,
+        "messages": [{"role": "assistant", "content": "Done."}],
+        "output_path": output_path,
+    }
+    outputs_path = os.path.join(os.path.dirname(output.__file__), "outputs")
+    before = set(os.listdir(outputs_path))
+    with patch("agentflow.flow.LLM"):
+        result = run_flow_job(payload, checkpoint, lambda data: None)
+    assert result["output_path"] == output_path
+    assert os.path.exists(os.path.join(output_path, "messages.json"))
+    assert set(os.listdir(outputs_path)) == before
+
+
+def test_get_broker(tmp_path):
+    """
+    Tests that brokers are created from URLs.
+    """
+    assert isinstance(get_broker(f"sqlite:///{tmp_path / 'jobs.db'}"), SQLiteBroker)
+    with pytest.raises(ValueError):
+        get_broker("ftp://example.com")
@@ -0,0 +1,215 @@
+"""
+This module contains tests for balancing requests across API endpoints.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+from agentflow.endpoints import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    Endpoint,
+    EndpointPool,
+    EndpointsUnavailable,
+)
+from agentflow.llm import LLM, Settings
+
+
+def rate_limit_error() -> openai.error.RateLimitError:
+    """
+    Returns an error like the one raised for a 429 response.
+    """
+    return openai.error.RateLimitError("Rate limited.", http_status=429)
+
+
+def test_least_outstanding_by_weight():
+    """
+    Tests that requests go to the endpoint with the fewest requests in flight for its weight.
+    """
+    pool = EndpointPool([Endpoint("a", weight=2), Endpoint("b")])
+    chosen = [pool.acquire().name for _ in range(6)]
+    assert chosen.count("a") == 4 and chosen.count("b") == 2
+    b = next(endpoint for endpoint in pool.endpoints if endpoint.name == "b")
+    pool.release(b)
+    assert pool.acquire() is b
+    assert pool.acquire(exclude={b}).name == "a"
+
+
+def test_circuit_opens_and_recovers(monkeypatch):
+    """
+    Tests that repeated rate limits take an endpoint out of rotation, that one request tests it after the cooldown, and that a success puts it back.
+    """
+    now = [100.0]
+    monkeypatch.setattr("agentflow.endpoints.time.monotonic", lambda: now[0])
+    pool = EndpointPool([Endpoint("a"), Endpoint("b")], failure_threshold=2)
+    a, b = pool.endpoints
+
+    invalid = openai.error.InvalidRequestError("Bad request.", None)
+    assert pool.release(pool.acquire(exclude={b}), invalid) is False
+    for _ in range(2):
+        assert pool.release(pool.acquire(exclude={b}), rate_limit_error()) is True
+    assert a.state == OPEN
+    assert {pool.acquire().name for _ in range(3)} == {"b"}
+    with pytest.raises(EndpointsUnavailable):
+        pool.acquire(exclude={b})
+
+    now[0] += pool.cooldown
+    assert pool.acquire(exclude={b}) is a
+    assert a.state == HALF_OPEN
+    with pytest.raises(EndpointsUnavailable):
+        pool.acquire(exclude={b})
+    pool.release(a)
+    assert a.state == CLOSED
+    assert pool.get_metrics()["a"]["failures"] == 2
+
+
+def test_failed_test_request_doubles_cooldown(monkeypatch):
+    """
+    Tests that an endpoint whose test request fails is taken out of rotation for twice as long, or as long as Retry-After asks.
+    """
+    now = [0.0]
+    monkeypatch.setattr("agentflow.endpoints.time.monotonic", lambda: now[0])
+    pool = EndpointPool([Endpoint("a")], failure_threshold=1, cooldown=10)
+    pool.release(pool.acquire(), rate_limit_error())
+    assert pool.endpoints[0].open_until == 10
+    now[0] = 10
+    pool.release(pool.acquire(), rate_limit_error())
+    assert pool.endpoints[0].open_until == 30
+    now[0] = 30
+    error = openai.error.RateLimitError("Slow down.", headers={"retry-after": "120"})
+    error.http_status = 429
+    pool.release(pool.acquire(), error)
+    assert pool.endpoints[0].open_until == 150
+
+
+def test_send():
+    """
+    Tests that a single request gets an endpoint's key and base URL, and that its failure counts against the endpoint.
+    """
+    pool = EndpointPool.from_list(
+        [{"name": "only", "api_key": "key", "api_base": "http://localhost/v1"}],
+        failure_threshold=1,
+    )
+    assert pool.send(lambda endpoint: endpoint.get_api_key()) == "key"
+
+    def limited(endpoint: Endpoint) -> None:
+        raise rate_limit_error()
+
+    with pytest.raises(openai.error.RateLimitError):
+        pool.send(limited)
+    assert pool.get_metrics()["only"]["state"] == OPEN
+    assert pool.get_metrics()["only"]["outstanding"] == 0
+
+
+def test_from_environment(monkeypatch, tmp_path):
+    """
+    Tests that pools are configured from a JSON list, a JSON file or a list of keys.
+    """
+    monkeypatch.delenv("AGENTFLOW_ENDPOINTS", raising=False)
+    monkeypatch.delenv("OPENAI_API_KEYS", raising=False)
+    pool = EndpointPool.from_environment()
+    assert [endpoint.api_key for endpoint in pool.endpoints] == [None]
+
+    monkeypatch.setenv("OPENAI_API_KEYS", "key-1, key-2")
+    pool = EndpointPool.from_environment()
+    assert [endpoint.api_key for endpoint in pool.endpoints] == ["key-1", "key-2"]
+
+    monkeypatch.setenv("SECOND_KEY", "key-3")
+    definitions = [
+        {"api_key": "key-1", "weight": 3},
+        {"api_key_env": "SECOND_KEY", "api_base": "http://localhost/v1"},
+    ]
+    monkeypatch.setenv("AGENTFLOW_ENDPOINTS", json.dumps(definitions))
+    pool = EndpointPool.from_environment()
+    assert pool.endpoints[0].weight == 3
+    assert pool.endpoints[1].api_key == "key-3"
+    assert pool.get_api_bases()[1] == "http://localhost/v1"
+
+    path = tmp_path / "endpoints.json"
+    path.write_text(json.dumps(definitions[:1]))
+    monkeypatch.setenv("AGENTFLOW_ENDPOINTS", str(path))
+    assert len(EndpointPool.from_environment().endpoints) == 1
+
+    monkeypatch.setenv("AGENTFLOW_ENDPOINTS", json.dumps([{"api_key_env": "NO_KEY"}]))
+    with pytest.raises(ValueError):
+        EndpointPool.from_environment()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers chat completion requests, or rate limits them if the server is set to.
+    """
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.keys.append(self.headers["Authorization"])
+        if self.server.rate_limited:
+            body = {"error": {"message": "Rate limited.", "type": "requests"}}
+            self.send_response(429)
+        else:
+            message = {"role": "assistant", "content": self.server.name}
+            body = {"choices": [{"index": 0, "message": message}]}
+            self.send_response(200)
+        encoded = json.dumps(body).encode()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def servers():
+    """
+    Serve a healthy and a rate-limited stub endpoint.
+    """
+    servers = []
+    for name, rate_limited in [("healthy", False), ("limited", True)]:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        server.name, server.rate_limited, server.keys = name, rate_limited, []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    yield servers
+    for server in servers:
+        server.shutdown()
+
+
+def test_llm_balances_and_fails_over(servers):
+    """
+    Tests that an LLM sends each endpoint's own key, moves a rate-limited request to another endpoint, and stops using an endpoint once its circuit opens.
+    """
+    healthy, limited = servers
+    pool = EndpointPool.from_list(
+        [
+            {
+                "name": server.name,
+                "api_key": f"{server.name}-key",
+                "api_base": f"http://127.0.0.1:{server.server_port}",
+            }
+            for server in servers
+        ],
+        failure_threshold=2,
+    )
+    llm = LLM(pool)
+    settings = Settings(model="test_model", max_attempts=1)
+    for _ in range(6):
+        message = llm.respond(settings, [{"role": "user", "content": "Hi."}])
+        assert message.content == "healthy"
+
+    assert set(healthy.keys) == {"Bearer healthy-key"}
+    assert limited.keys == ["Bearer limited-key"] * 2
+    metrics = pool.get_metrics()
+    assert metrics["limited"]["state"] == OPEN
+    assert metrics["healthy"] == {
+        "requests": 6,
+        "failures": 0,
+        "outstanding": 0,
+        "state": CLOSED,
+    }
@@ -4,6 +4,7 @@ This module contains tests for the Flow class.
 
 import json
 import os
+import re
 import shutil
 from types import SimpleNamespace
 from typing import Dict, List, Optional
@@ -12,7 +13,9 @@ from unittest.mock import patch
 import pytest
 
 from agentflow.flow import Flow
+from agentflow.function import Function
 from agentflow.llm import Settings
+from agentflow.streaming import StreamedResponse
 
 
 def mock_llm_respond(
@@ -91,10 +94,7 @@ def test_flow_basic(flows_path):
         with open(os.path.join(flows_path, "test_flow_basic.json"), "r") as file:
             flow_json = json.load(file)
             flow_json_test_settings = flow_json["tasks"][0]["settings"]
-            flow_object_settings = [
-                s for s in flow.tasks[0].settings.__dict__ if s != "function_call"
-            ]
-            for setting in flow_object_settings:
+            for setting in flow_json_test_settings:
                 assert (
                     getattr(flow.tasks[0].settings, setting)
                     == flow_json_test_settings[setting]
@@ -108,6 +108,12 @@ def test_flow_basic(flows_path):
         assert MockLLM.call_count == 1
         assert mock_llm.respond.call_count > 0
 
+        # Test that every call is traced with the flow's prompt prefix
+        assert len(flow.trace.records) == mock_llm.respond.call_count
+        assert all(
+            record["prefix_hash"] == flow.prefix.hash for record in flow.trace.records
+        )
+
         last_call = mock_llm.respond.call_args
         last_messages = last_call[0][1]
         assert (
@@ -160,9 +166,10 @@ def test_flow_with_functions(flows_path):
     """
     with patch("agentflow.flow.Function") as MockFunction:
         with patch("agentflow.flow.LLM") as MockLLM:
-            mock_function = MockFunction.return_value
-            mock_function.definition.side_effect = mock_function_definition
-            mock_function.execute.side_effect = mock_function_execute
+            MockFunction.side_effect = lambda function_name, output, artifacts=None, **options: SimpleNamespace(
+                definition=mock_function_definition(function_name),
+                execute=mock_function_execute,
+            )
 
             mock_llm = MockLLM.return_value
             mock_llm.respond.side_effect = mock_llm_respond
@@ -195,3 +202,237 @@ def test_flow_with_functions(flows_path):
             )
 
             shutil.rmtree(flow.output.output_path)
+
+
+def test_flow_with_function_error(flows_path):
+    """
+    Test that a function that fails gives the assistant its error as the result, and that the flow goes on.
+    """
+
+    def fail(args_json: str) -> str:
+        raise TimeoutError("test_function_for_task_2 did not finish within 1 seconds.")
+
+    with patch("agentflow.flow.Function") as MockFunction:
+        with patch("agentflow.flow.LLM") as MockLLM:
+            MockFunction.side_effect = lambda function_name, output, artifacts=None, **options: SimpleNamespace(
+                definition=mock_function_definition(function_name),
+                execute=fail if function_name.endswith("2") else mock_function_execute,
+            )
+            MockLLM.return_value.respond.side_effect = mock_llm_respond
+
+            flow = Flow("test_flow_with_functions", flows_path=flows_path)
+            flow.run()
+
+            assert flow.error is None
+            results = [m for m in flow.messages if m.role == "function"]
+            assert json.loads(results[0].content) == {
+                "error": "TimeoutError",
+                "message": "test_function_for_task_2 did not finish within 1 seconds.",
+            }
+            assert results[1].content.startswith("Response to function call")
+            shutil.rmtree(flow.output.output_path)
+
+
+def test_flow_with_control_flow(flows_path):
+    """
+    Test that loops run their tasks for each item in scoped messages and that conditions pick a branch without calling the LLM.
+    """
+    with patch("agentflow.flow.Function") as MockFunction:
+        with patch("agentflow.flow.LLM") as MockLLM:
+            MockFunction.side_effect = lambda function_name, output, artifacts=None, **options: SimpleNamespace(
+                definition=mock_function_definition(function_name),
+                execute=mock_function_execute,
+            )
+
+            mock_llm = MockLLM.return_value
+            mock_llm.respond.side_effect = mock_llm_respond
+
+            variables = {"topics": '["cats", "dogs", "fish"]', "style": "long"}
+            flow = Flow("test_flow_with_control_flow", variables, flows_path)
+
+            assert len(flow.tasks) == 3
+            assert len(flow.functions) == 1
+
+            flow.run()
+
+            # One call for the first task, three for each item and one for the
+            # else branch of the last condition
+            assert mock_llm.respond.call_count == 1 + 3 * 3 + 1
+
+            # Each iteration only sees the system message and its own messages
+            iterations = {
+                id(call[0][1]): call[0][1]
+                for call in mock_llm.respond.call_args_list
+                if call[0][1] is not flow.messages
+            }
+            assert len(iterations) == 3
+            summaries = []
+            for messages in iterations.values():
+                assert [m["role"] for m in messages] == [
+                    "system",
+                    "user",
+                    "assistant",
+                    "function",
+                    "assistant",
+                    "user",
+                    "assistant",
+                ]
+                summaries.append(messages[5]["content"])
+            assert sorted(summaries) == [
+                "Summarize cats in long style.",
+                "Summarize dogs in long style.",
+                "Summarize fish in long style.",
+            ]
+
+            # The answers of the iterations are added to the flow's messages
+            messages = flow.messages.to_dicts()
+            assert messages[3]["role"] == "assistant"
+            assert messages[3]["content"].splitlines() == [
+                f"topic={topic}: Response to user message Summarize {topic} in long style.."
+                for topic in ["cats", "dogs", "fish"]
+            ]
+            assert messages[4]["content"] == "Write it up in long style."
+
+            shutil.rmtree(flow.output.output_path)
+
+
+def test_flow_with_control_flow_variables(flows_path):
+    """
+    Test that loop items are not treated as flow variables and that variables used by loops and conditions are required.
+    """
+    with pytest.raises(ValueError, match="Missing variable values for: {'topics'}."):
+        _ = Flow("test_flow_with_control_flow", {"style": "long"}, flows_path)
+
+    with patch("agentflow.flow.Function") as MockFunction:
+        MockFunction.side_effect = (
+            lambda function_name, output, artifacts=None, **options: SimpleNamespace(
+                definition=mock_function_definition(function_name)
+            )
+        )
+        flow = Flow(
+            "test_flow_with_control_flow",
+            {"topics": "cats\n\ndogs\n", "style": "short"},
+            flows_path,
+        )
+
+    assert flow.tasks[1].tasks[0].action == "Fetch {topic}."
+    assert flow._get_items(flow.variables["topics"]) == ["cats", "dogs"]
+    assert flow._get_items('[1, {"a": 2}]') == ["1", '{"a": 2}']
+
+    shutil.rmtree(flow.output.output_path)
+
+
+def test_flow_with_streaming(flows_path):
+    """
+    Test that a streamed function call runs the function on its arguments as they arrive and then responds to the result, and that the streamed contents are not recorded in the messages.
+    """
+    arguments = json.dumps({"file_name": "streamed.txt", "file_contents": "Hi." * 100})
+    chunks = [
+        SimpleNamespace(
+            choices=[
+                SimpleNamespace(
+                    delta={"function_call": {"name": "save_file", "arguments": ""}}
+                )
+            ]
+        )
+    ] + [
+        SimpleNamespace(
+            choices=[
+                SimpleNamespace(
+                    delta={"function_call": {"arguments": arguments[i : i + 10]}}
+                )
+            ]
+        )
+        for i in range(0, len(arguments), 10)
+    ]
+    with patch("agentflow.flow.LLM") as MockLLM:
+        mock_llm = MockLLM.return_value
+        mock_llm.respond.side_effect = mock_llm_respond
+        mock_llm.respond_stream.return_value = StreamedResponse(chunks)
+
+        flow = Flow("test_flow_with_streaming", flows_path=flows_path)
+        flow.run()
+
+        assert mock_llm.respond_stream.call_count == 1
+        assert mock_llm.respond.call_args[0][0].stream is False
+        messages = flow.messages.to_dicts()
+        path = os.path.join(flow.output.output_path, "streamed.txt")
+        assert messages[2]["function_call"] == {
+            "name": "save_file",
+            "arguments": json.dumps(
+                {
+                    "file_name": "streamed.txt",
+                    "file_contents": f"[300 characters streamed to {path}]",
+                }
+            ),
+        }
+        assert messages[3]["content"] == path
+        assert messages[4]["content"] == "Response to function call save_file."
+        with open(messages[3]["content"]) as file:
+            assert file.read() == "Hi." * 100
+        assert flow.trace.records[0]["streamed"]
+
+        shutil.rmtree(flow.output.output_path)
+
+
+def test_flow_with_references(flows_path, monkeypatch):
+    """
+    Test that a result passed by reference reaches the LLM as a handle and the next function as the full result.
+    """
+    page_text = "Page text. " * 10000
+    monkeypatch.setattr(Function, "use_process_pool", False)
+
+    def respond(settings, messages, functions=None):
+        if settings.function_call == {"name": "get_url"}:
+            arguments = {"url": "https://example.com"}
+        elif settings.function_call == {"name": "save_file"}:
+            handle = re.search(r"@result:get_url:\d+", messages[3]["content"]).group()
+            arguments = {"file_name": "page.txt", "file_contents": handle}
+        else:
+            return SimpleNamespace(role="assistant", content="Done.")
+        return SimpleNamespace(
+            role="assistant",
+            content=None,
+            function_call=SimpleNamespace(
+                name=settings.function_call["name"], arguments=json.dumps(arguments)
+            ),
+        )
+
+    with patch("agentflow.flow.LLM") as MockLLM, patch(
+        "agentflow.functions.get_url.GetUrl.execute", return_value=page_text
+    ):
+        MockLLM.return_value.respond.side_effect = respond
+        flow = Flow("test_flow_with_references", flows_path=flows_path)
+        flow.run()
+
+    assert flow.error is None
+    result = flow.messages[3]
+    assert result.role == "function"
+    assert "@result:get_url:1" in result.content
+    assert len(result.content) < 1000
+    with open(os.path.join(flow.output.output_path, "page.txt"), "r") as file:
+        assert file.read() == page_text
+
+    shutil.rmtree(flow.output.output_path)
+
+
+def test_flow_with_reference_loop(flows_path, monkeypatch):
+    """
+    Test that a loop over a result passed by reference runs over the result, not the message holding its handle.
+    """
+    monkeypatch.setattr(Function, "use_process_pool", False)
+    with patch("agentflow.flow.LLM") as MockLLM, patch(
+        "agentflow.functions.get_url.GetUrl.execute", return_value="first\nsecond"
+    ):
+        MockLLM.return_value.respond.side_effect = mock_llm_respond
+        flow = Flow("test_flow_with_reference_loop", flows_path=flows_path)
+        flow.run()
+
+    assert flow.error is None
+    assert "@result:get_url:1" in flow.messages[3].content
+    assert flow.messages[-1].content.splitlines() == [
+        "line=first: Response to user message Summarize first..",
+        "line=second: Response to user message Summarize second..",
+    ]
+
+    shutil.rmtree(flow.output.output_path)
@@ -2,9 +2,20 @@
 This module contains tests for the Function class.
 """
 
+import asyncio
+import json
+import os
 import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
 
-from agentflow.function import Function
+import pytest
+
+from agentflow import metrics
+from agentflow.artifacts import ArtifactStore
+from agentflow.function import Function, FunctionTimeout, format_error, run_cpu_bound
 from agentflow.output import Output
 
 
@@ -26,3 +37,162 @@ def test_function():
         result == f"{output.output_path}/test.txt"
     ), "File path returned by execute method is incorrect"
     shutil.rmtree(output.output_path)
+
+
+def test_function_in_process_pool():
+    """
+    Tests that CPU-bound functions are executed in the shared process pool.
+    """
+    output = Output("test_function_in_process_pool")
+    function = Function("save_file", output)
+    function.instance.cpu_bound = True
+    with patch.object(
+        function.instance, "execute", side_effect=AssertionError("Ran in process.")
+    ):
+        result = function.execute(
+            '{"file_name": "test.txt", "file_contents": "Hello, world!"}'
+        )
+    assert result == f"{output.output_path}/test.txt"
+    with open(result, "r") as f:
+        assert f.read() == "Hello, world!"
+    shutil.rmtree(output.output_path)
+
+
+def test_function_without_process_pool(monkeypatch):
+    """
+    Tests that CPU-bound functions run in the calling process when the pool is disabled.
+    """
+    monkeypatch.setattr(Function, "use_process_pool", False)
+    output = Output("test_function_without_process_pool")
+    function = Function("save_file", output)
+    function.instance.cpu_bound = True
+    with patch.object(function.instance, "execute", return_value="Ran locally."):
+        assert function.execute('{"file_name": "test.txt"}') == "Ran locally."
+    shutil.rmtree(output.output_path)
+
+
+def test_run_cpu_bound(monkeypatch):
+    """
+    Tests that a CPU-bound step runs in the shared process pool, or in the calling process when the pool is disabled.
+    """
+    assert run_cpu_bound(os.getpid) != os.getpid()
+    monkeypatch.setattr(Function, "use_process_pool", False)
+    assert run_cpu_bound(os.getpid) == os.getpid()
+
+
+def test_function_resolves_handles():
+    """
+    Tests that handles in the arguments are replaced with their results before the function runs.
+    """
+    artifacts = ArtifactStore()
+    handle = artifacts.put("get_url", "Page text.")
+    output = Output("test_function_resolves_handles")
+    function = Function("save_file", output, artifacts)
+    result = function.execute(
+        json.dumps({"file_name": "test.txt", "file_contents": handle})
+    )
+    with open(result, "r") as f:
+        assert f.read() == "Page text."
+    shutil.rmtree(output.output_path)
+
+
+def test_function_timeout():
+    """
+    Tests that a call that outlasts its timeout raises FunctionTimeout when it expires, and that the function is told to stop.
+    """
+    output = Output("test_function_timeout")
+    function = Function("save_file", output, timeout=0.2)
+    stopped = threading.Event()
+
+    def slow(**arguments):
+        while not function.instance.cancelled():
+            time.sleep(0.01)
+        stopped.set()
+        return "Stopped."
+
+    timeouts = metrics.FUNCTION_ERRORS.values().get(("save_file", "timeout"), 0)
+    with patch.object(function.instance, "execute", side_effect=slow):
+        start = time.monotonic()
+        with pytest.raises(FunctionTimeout, match="within 0.2 seconds"):
+            function.execute('{"file_name": "test.txt"}')
+        assert time.monotonic() - start < 0.5
+        assert stopped.wait(1)
+    assert metrics.FUNCTION_ERRORS.values()[("save_file", "timeout")] == timeouts + 1
+
+    with patch.object(function.instance, "execute", side_effect=ValueError("Bad.")):
+        with pytest.raises(ValueError, match="Bad."):
+            function.execute('{"file_name": "test.txt"}')
+    assert json.loads(format_error(ValueError("Bad."))) == {
+        "error": "ValueError",
+        "message": "Bad.",
+    }
+    shutil.rmtree(output.output_path)
+
+
+def test_function_timeout_async():
+    """
+    Tests that async functions are awaited, and cancelled when they outlast their timeout.
+    """
+    output = Output("test_function_timeout_async")
+    function = Function("save_file", output, timeout=0.2)
+    cancelled = []
+
+    async def execute(file_name: str, file_contents: str = "") -> str:
+        try:
+            await asyncio.sleep(float(file_contents))
+        except asyncio.CancelledError:
+            cancelled.append(file_name)
+            raise
+        return file_name
+
+    with patch.object(function.instance, "execute", new=execute):
+        assert function.execute('{"file_name": "fast", "file_contents": "0"}') == "fast"
+        with pytest.raises(FunctionTimeout):
+            function.execute('{"file_name": "slow", "file_contents": "5"}')
+    assert cancelled == ["slow"]
+    shutil.rmtree(output.output_path)
+
+
+class HangingHandler(BaseHTTPRequestHandler):
+    """
+    A host that accepts requests and never answers them.
+    """
+
+    def do_GET(self):
+        time.sleep(10)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_function_isolated(monkeypatch):
+    """
+    Tests that isolated functions, and CPU-bound functions with a timeout, run in a process of their own, which is killed when the call outlasts its timeout, and that their errors reach the caller.
+    """
+    monkeypatch.setenv("AGENTFLOW_HTTP_CACHE", "off")
+    output = Output("test_function_isolated")
+    function = Function("save_file", output, isolated=True)
+    with patch.object(function.instance, "execute", side_effect=AssertionError):
+        result = function.execute('{"file_name": "test.txt", "file_contents": "Hi."}')
+    with open(result, "r") as f:
+        assert f.read() == "Hi."
+    with pytest.raises(TypeError):
+        function.execute('{"file_contents": "Hi."}')
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), HangingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    function = Function("get_url", output, timeout=2, isolated=True)
+    start = time.monotonic()
+    with pytest.raises(FunctionTimeout):
+        function.execute(json.dumps({"url": f"http://127.0.0.1:{server.server_port}"}))
+    assert time.monotonic() - start < 4
+
+    function = Function("get_url", output, timeout=2)
+    function.instance.cpu_bound = True
+    start = time.monotonic()
+    with pytest.raises(FunctionTimeout):
+        function.execute(json.dumps({"url": f"http://127.0.0.1:{server.server_port}"}))
+    assert time.monotonic() - start < 4
+    assert run_cpu_bound(os.getpid) != os.getpid()
+    server.shutdown()
+    shutil.rmtree(output.output_path)
@@ -0,0 +1,128 @@
+"""
+This module contains tests for the CrawlSite function in the agentflow.functions.crawl_site module, against a local site.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from agentflow.functions.crawl_site import CrawlSite, normalize_url
+from agentflow.output import Output
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    """
+    Serves pages /0 to /199, where page n links to pages 2n+1 and 2n+2 with different spellings, and to an external site. Tracks the most requests in flight at once.
+    """
+
+    requests = []
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with SiteHandler.lock:
+            SiteHandler.requests.append(self.path)
+            SiteHandler.in_flight += 1
+            SiteHandler.max_in_flight = max(
+                SiteHandler.max_in_flight, SiteHandler.in_flight
+            )
+        time.sleep(0.01)
+        number = int(self.path.strip("/"))
+        links = "".join(
+            f'<a href="/{child}">{child}</a><a href="{child}#top">again</a>'
+            for child in (2 * number + 1, 2 * number + 2)
+            if child < 200
+        )
+        body = (
+            f"<html><head><title>Page {number}</title></head><body>"
+            f'<p>Text of page {number}.</p>{links}<a href="http://example.com/">x</a>'
+            "</body></html>"
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with SiteHandler.lock:
+            SiteHandler.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def site(monkeypatch):
+    """
+    Serve the site without the HTTP cache and reset its counts.
+    """
+    monkeypatch.setenv("AGENTFLOW_HTTP_CACHE", "off")
+    monkeypatch.setattr(CrawlSite, "delay", 0)
+    SiteHandler.requests = []
+    SiteHandler.max_in_flight = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SiteHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_normalize_url():
+    """
+    Tests that spellings of the same URL are normalized to one.
+    """
+    assert normalize_url("HTTP://Example.COM:80") == "http://example.com/"
+    assert (
+        normalize_url("b?z=1&a=2#section", "https://example.com:443/a/")
+        == "https://example.com/a/b?a=2&z=1"
+    )
+    assert normalize_url("../c", "http://example.com:8080/a/b") == (
+        "http://example.com:8080/c"
+    )
+    assert normalize_url("mailto:someone@example.com") is None
+
+
+def test_crawl_site(site):
+    """
+    Tests that a crawl follows links to the given depth on the same host, fetches each page once and saves each page's text.
+    """
+    output = Output("test_crawl_site")
+    index = json.loads(CrawlSite(output).execute(f"{site}/0", depth=3))
+
+    pages = index["pages"]
+    assert len(pages) == 1 + 2 + 4 + 8
+    assert sorted(SiteHandler.requests) == sorted(f"/{n}" for n in range(15))
+    assert pages[0] == {
+        "url": f"{site}/0",
+        "depth": 0,
+        "title": "Page 0",
+        "file": os.path.join("crawl", "0001.txt"),
+        "characters": len("Page 0Text of page 0.12againagainx"),
+    }
+    for page in pages:
+        with open(os.path.join(output.output_path, page["file"])) as file:
+            assert f"Text of page {page['url'].rsplit('/', 1)[1]}." in file.read()
+    assert os.path.exists(os.path.join(output.output_path, "crawl", "index.json"))
+
+    shutil.rmtree(output.output_path)
+
+
+def test_crawl_site_limits(site):
+    """
+    Tests that a crawl stops at its page limit and keeps to the per-host concurrency cap.
+    """
+    output = Output("test_crawl_site_limits")
+    start = time.perf_counter()
+    index = json.loads(CrawlSite(output).execute(f"{site}/0", depth=10, max_pages=200))
+    elapsed = time.perf_counter() - start
+
+    assert len(index["pages"]) == 200
+    assert len(SiteHandler.requests) == len(set(SiteHandler.requests)) == 200
+    assert SiteHandler.max_in_flight <= CrawlSite.max_per_host
+    assert elapsed < 10
+
+    shutil.rmtree(output.output_path)
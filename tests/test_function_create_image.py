@@ -7,6 +7,7 @@ import shutil
 from unittest.mock import MagicMock, patch
 
 from agentflow.functions.create_image import CreateImage
+from agentflow.llm import LLM
 from agentflow.output import Output
 
 
@@ -14,7 +15,7 @@ from agentflow.output import Output
 @patch("requests.get")
 def test_execute(mock_get, mock_create):
     """
-    Tests the execute method of the CreateImage class. It mocks the OpenAI and requests APIs, and checks that the image creation process works correctly.
+    Tests the execute method of the CreateImage class. It mocks the OpenAI and requests APIs, and checks that the image creation process works correctly and sends an endpoint's key.
     """
     # Mock the openai.Image.create call to return a mock response with a mock image URL
     mock_create.return_value = {"data": [{"url": "https://mockurl.com/mock_image.jpg"}]}
@@ -27,6 +28,9 @@ def test_execute(mock_get, mock_create):
     output = Output("test_create_image_execute")
     create_image = CreateImage(output)
     image_path = create_image.execute("a white siamese cat", 1, "1024x1024")
+    endpoint = LLM.get_default_endpoints().endpoints[0]
+    assert mock_create.call_args.kwargs["api_key"] == endpoint.get_api_key()
+    assert mock_create.call_args.kwargs["api_base"] == endpoint.get_api_base()
 
     # Check that the returned image name is a valid SHA-256 hash followed by ".png"
     image_file_name = image_path.split("/")[-1]
@@ -6,13 +6,16 @@ import shutil
 from unittest.mock import patch
 
 from agentflow.functions.get_url import GetUrl
+from agentflow.http_cache import FETCH_TIMEOUT
 from agentflow.output import Output
 
 
-def test_execute_html():
+def test_execute_html(monkeypatch):
     """
     Tests the execute method of the GetUrl function with format set to 'html'.
     """
+    # Fetch without the HTTP cache, so the mocked response is used
+    monkeypatch.setenv("AGENTFLOW_HTTP_CACHE", "off")
     output = Output("test_get_url_execute_html")
     get_url = GetUrl(output)
 
@@ -26,15 +29,18 @@ def test_execute_html():
 
         # Check that the returned content is correct
         assert result == "<html><body>Hello, world!</body></html>"
+        assert mocked_get.call_args.kwargs["timeout"] == FETCH_TIMEOUT
 
     # Clean up the test environment by removing the created directory
     shutil.rmtree(output.output_path)
 
 
-def test_execute_text():
+def test_execute_text(monkeypatch):
     """
     Tests the execute method of the GetUrl function with format set to 'text'.
     """
+    # Fetch without the HTTP cache, so the mocked response is used
+    monkeypatch.setenv("AGENTFLOW_HTTP_CACHE", "off")
     output = Output("test_get_url_execute_text")
     get_url = GetUrl(output)
 
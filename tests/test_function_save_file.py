@@ -2,8 +2,11 @@
 This module contains a test for the SaveFile class in the agentflow.functions.save_file module. It checks that the file saving process works correctly.
 """
 
+import json
 import shutil
+from unittest.mock import patch
 
+from agentflow.function import BaseFunction, Function
 from agentflow.functions.save_file import SaveFile
 from agentflow.output import Output
 
@@ -21,3 +24,49 @@ def test_execute():
 
     # Clean up the test environment by removing the created file and directory
     shutil.rmtree(output.output_path)
+
+
+def test_execute_stream():
+    """
+    Tests that streamed contents are written to the file as they arrive, and that contents that arrive before the file name are still saved.
+    """
+    output = Output("test_save_file_execute_stream")
+    function = Function("save_file", output)
+    contents = 'Line with "quotes" and \\u00e9 é.\n' * 100
+    arguments = json.dumps({"file_name": "streamed.txt", "file_contents": contents})
+
+    with patch.object(SaveFile, "execute", side_effect=AssertionError("Not streamed.")):
+        fragments = (arguments[i : i + 7] for i in range(0, len(arguments), 7))
+        result = function.execute_stream(fragments)
+    assert result == f"{output.output_path}/streamed.txt"
+    with open(result) as file:
+        assert file.read() == contents
+
+    arguments = json.dumps({"file_contents": contents, "file_name": "late.txt"})
+    result = function.execute_stream(iter([arguments[:50], arguments[50:]]))
+    with open(result) as file:
+        assert file.read() == contents
+
+    shutil.rmtree(output.output_path)
+
+
+def test_execute_stream_reads_back():
+    """
+    Tests that by default a function that opens streams gets its streamed arguments read back, and that the recorded arguments note where they were written instead.
+    """
+    output = Output("test_save_file_execute_stream_reads_back")
+    function = Function("save_file", output)
+    arguments = json.dumps({"file_name": "a.txt", "file_contents": "Hi." * 10})
+    path = f"{output.output_path}/a.txt"
+
+    with patch.object(SaveFile, "execute_streamed", BaseFunction.execute_streamed):
+        result = function.execute_stream(iter([arguments[:20], arguments[20:]]))
+    assert result == path
+    with open(path) as file:
+        assert file.read() == "Hi." * 10
+    assert json.loads(function.streamed_arguments) == {
+        "file_name": "a.txt",
+        "file_contents": f"[30 characters streamed to {path}]",
+    }
+
+    shutil.rmtree(output.output_path)
@@ -0,0 +1,37 @@
+"""
+This module contains tests for the SearchDocuments function in the agentflow.functions.search_documents module.
+"""
+
+import shutil
+
+import pytest
+
+from agentflow.functions.search_documents import SearchDocuments
+from agentflow.output import Output
+from agentflow.retrieval import build_index
+
+
+def test_execute(tmp_path, monkeypatch):
+    """
+    Tests that only the top passages are returned, with their sources, and that index names can't reach outside the indexes directory.
+    """
+    monkeypatch.setattr(SearchDocuments, "indexes_path", str(tmp_path))
+    documents = [
+        (f"{number}.txt", f"Document about topic{number}.") for number in range(50)
+    ]
+    build_index(documents, str(tmp_path / "docs"))
+    output = Output("test_search_documents_execute")
+    search_documents = SearchDocuments(output)
+
+    result = search_documents.execute("topic7", k=2, index="docs")
+    assert result.startswith("[1] 7.txt (score ")
+    assert "Document about topic7." in result
+    assert "[2]" in result and "[3]" not in result
+
+    with pytest.raises(FileNotFoundError):
+        search_documents.execute("topic7", index="missing")
+    for index in ("../docs", "docs/..", "/etc", "..", ""):
+        with pytest.raises(ValueError, match="Invalid index name"):
+            search_documents.execute("topic7", index=index)
+
+    shutil.rmtree(output.output_path)
@@ -0,0 +1,165 @@
+"""
+This module contains tests for the HTTP cache, against a local server that counts requests.
+"""
+
+import shutil
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from requests.structures import CaseInsensitiveDict
+
+from agentflow.functions.get_url import GetUrl
+from agentflow.http_cache import HttpCache
+from agentflow.output import Output
+
+LAST_MODIFIED = "Mon, 02 Jan 2023 00:00:00 GMT"
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    """
+    Serves a page whose caching headers depend on the path, and counts requests and 304 responses by path.
+    """
+
+    requests = Counter()
+    not_modified = Counter()
+    version = 1
+
+    def do_GET(self):
+        CountingHandler.requests[self.path] += 1
+        etag = f'"v{self.version}"'
+        headers = {
+            "/fresh": {"Cache-Control": "max-age=60", "ETag": etag},
+            "/etag": {"Cache-Control": "no-cache", "ETag": etag},
+            "/modified": {"Cache-Control": "max-age=0", "Last-Modified": LAST_MODIFIED},
+            "/no-store": {"Cache-Control": "no-store", "ETag": etag},
+        }[self.path]
+        if self.headers.get("If-None-Match") == headers.get("ETag", "") or (
+            self.headers.get("If-Modified-Since") == headers.get("Last-Modified", "")
+        ):
+            CountingHandler.not_modified[self.path] += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body = f"<html><body>Version {self.version}</body></html>".encode()
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    """
+    Serve the counting handler and reset its counts.
+    """
+    CountingHandler.requests = Counter()
+    CountingHandler.not_modified = Counter()
+    CountingHandler.version = 1
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CountingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_fresh_response_skips_network(base_url, tmp_path):
+    """
+    Tests that a response with a max-age is answered from the cache while it is fresh.
+    """
+    cache = HttpCache(str(tmp_path))
+    first = cache.get(f"{base_url}/fresh")
+    second = cache.get(f"{base_url}/fresh")
+    assert not first.from_cache
+    assert second.from_cache and not second.revalidated
+    assert second.text == first.text
+    assert CountingHandler.requests["/fresh"] == 1
+    assert cache.get_metrics() == {"hits": 1, "revalidations": 0, "misses": 1}
+
+
+@pytest.mark.parametrize("path", ["/etag", "/modified"])
+def test_stale_response_is_revalidated(base_url, tmp_path, path):
+    """
+    Tests that a stale response is revalidated with its ETag or Last-Modified date, and that its derived text is reused.
+    """
+    cache = HttpCache(str(tmp_path))
+    transforms = []
+
+    def transform(html):
+        transforms.append(html)
+        return html.upper()
+
+    first = cache.get(f"{base_url}{path}")
+    second = cache.get(f"{base_url}{path}")
+    assert second.revalidated
+    assert second.text == first.text
+    assert first.derive("text", transform) == second.derive("text", transform)
+    assert len(transforms) == 1
+    assert CountingHandler.requests[path] == 2
+    assert CountingHandler.not_modified[path] == 1
+
+
+def test_changed_response_replaces_derived_text(base_url, tmp_path):
+    """
+    Tests that a changed page replaces the cached page and its derived text.
+    """
+    cache = HttpCache(str(tmp_path))
+    assert "VERSION 1" in cache.get(f"{base_url}/etag").derive("text", str.upper)
+    CountingHandler.version = 2
+    response = cache.get(f"{base_url}/etag")
+    assert not response.from_cache
+    assert "VERSION 2" in response.derive("text", str.upper)
+
+
+def test_no_store(base_url, tmp_path):
+    """
+    Tests that responses with no-store are not cached.
+    """
+    cache = HttpCache(str(tmp_path))
+    cache.get(f"{base_url}/no-store")
+    assert not cache.get(f"{base_url}/no-store").from_cache
+    assert CountingHandler.requests["/no-store"] == 2
+    assert CountingHandler.not_modified["/no-store"] == 0
+
+
+def test_freshness_lifetime():
+    """
+    Tests that freshness comes from max-age, then Expires, then Last-Modified.
+    """
+    date = "Mon, 09 Jan 2023 00:00:00 GMT"
+    lifetime = HttpCache.freshness_lifetime
+    assert lifetime(CaseInsensitiveDict({"Cache-Control": "max-age=30"})) == 30
+    assert (
+        lifetime(
+            CaseInsensitiveDict(
+                {"Date": date, "Expires": "Mon, 09 Jan 2023 00:01:00 GMT"}
+            )
+        )
+        == 60
+    )
+    assert lifetime(CaseInsensitiveDict({"Date": date, "Expires": "0"})) == 0
+    assert (
+        lifetime(CaseInsensitiveDict({"Date": date, "Last-Modified": LAST_MODIFIED}))
+        == 7 * 24 * 60 * 60 * 0.1
+    )
+    assert lifetime(CaseInsensitiveDict()) == 0
+
+
+def test_get_url_uses_cache(base_url, tmp_path, monkeypatch):
+    """
+    Tests that the get_url function fetches and parses a fresh page only once.
+    """
+    monkeypatch.setenv("AGENTFLOW_HTTP_CACHE", str(tmp_path))
+    output = Output("test_get_url_uses_cache")
+    get_url = GetUrl(output)
+    assert get_url.execute(f"{base_url}/fresh", "text") == "Version 1"
+    assert get_url.execute(f"{base_url}/fresh", "text") == "Version 1"
+    assert CountingHandler.requests["/fresh"] == 1
+    shutil.rmtree(output.output_path)
@@ -2,10 +2,23 @@
 This module contains tests for the LLM class.
 """
 
+import json
 import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
-from agentflow.llm import Settings
+import openai
+import pytest
+from tenacity import wait_none
+
+from agentflow.endpoints import OPEN, Endpoint, EndpointPool
+from agentflow.llm import LLM, DeadlineExceeded, LatencyTracker, Settings, api_error
+from agentflow.message import Conversation
+from agentflow.semantic_cache import SemanticCache
+from agentflow.trace import Trace
 
 
 def test_settings(monkeypatch):
@@ -42,3 +55,331 @@ def test_respond(mock_llm_class):
     response = llm.respond(settings, messages)
     assert response is not None, "Response is None"
     mock_llm_instance.respond.assert_called_once_with(settings, messages)
+
+
+def mock_response(content: str) -> SimpleNamespace:
+    """
+    Mock a chat completion response.
+    """
+    message = SimpleNamespace(role="assistant", content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """
+    Get an LLM that does not wait between retries and has no recorded latencies.
+    """
+    monkeypatch.setattr(LLM, "retry_wait", wait_none())
+    monkeypatch.setattr(LLM, "latencies", LatencyTracker())
+    return LLM()
+
+
+def test_latency_tracker():
+    """
+    Tests that percentiles are only returned once there are enough samples.
+    """
+    tracker = LatencyTracker()
+    for latency in range(1, 20):
+        tracker.record("model", latency)
+    assert tracker.percentile("model", 0.95) is None
+    tracker.record("model", 20)
+    assert tracker.percentile("model", 0.95) == 20
+    assert tracker.percentile("model", 0.5) == 11
+
+
+def test_max_attempts(llm):
+    """
+    Tests that failed requests are retried up to the maximum number of attempts.
+    """
+    with patch.object(LLM, "_create", side_effect=ValueError("Failed.")) as create:
+        with pytest.raises(ValueError, match="Failed."):
+            llm.respond(Settings(max_attempts=3), [])
+        assert create.call_count == 3
+
+
+def test_deadline(llm):
+    """
+    Tests that a request that does not finish before the deadline raises DeadlineExceeded.
+    """
+
+    def slow_create(openai_args):
+        time.sleep(0.5)
+        return mock_response("Too late.")
+
+    with patch.object(LLM, "_create", side_effect=slow_create):
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            llm.respond(Settings(deadline=0.1, max_attempts=1), [])
+        assert time.monotonic() - start < 0.4
+
+
+def test_hedge(llm):
+    """
+    Tests that a duplicate request is sent once the first one is slower than the observed 95th percentile, and that the first response to arrive is used.
+    """
+    for _ in range(20):
+        LLM.latencies.record(Settings().model, 0.01)
+    delays = iter([1.0, 0.0])
+
+    def create(openai_args):
+        delay = next(delays)
+        time.sleep(delay)
+        return mock_response(f"Response after {delay} seconds.")
+
+    with patch.object(LLM, "_create", side_effect=create) as mock_create:
+        start = time.monotonic()
+        message = llm.respond(Settings(hedge=True), [])
+        assert message.content == "Response after 0.0 seconds."
+        assert mock_create.call_count == 2
+        assert time.monotonic() - start < 0.5
+
+
+class ChatCompletionHandler(BaseHTTPRequestHandler):
+    """
+    A stub chat completion endpoint that records request bodies.
+    """
+
+    bodies = []
+
+    def do_POST(self):
+        self.bodies.append(
+            json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        )
+        if self.bodies[-1].get("stream"):
+            self._stream()
+            return
+        body = json.dumps(
+            {
+                "object": "chat.completion",
+                "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": "Hi."}}
+                ],
+                "usage": {
+                    "prompt_tokens": 1,
+                    "completion_tokens": 1,
+                    "total_tokens": 2,
+                },
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        deltas = [
+            {
+                "role": "assistant",
+                "function_call": {"name": "save_file", "arguments": ""},
+            },
+            {"function_call": {"arguments": '{"file_name": "a.txt", '}},
+            {"function_call": {"arguments": '"file_contents": "Hi."}'}},
+        ]
+        for delta in deltas:
+            chunk = {"object": "chat.completion.chunk", "choices": [{"delta": delta}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def api_base(monkeypatch):
+    """
+    Serve the stub chat completion endpoint and point the OpenAI API base at it.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChatCompletionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(openai, "api_base", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setenv("OPENAI_API_KEY", "test_key")
+    monkeypatch.setattr(openai, "api_key", None)
+    ChatCompletionHandler.bodies = []
+    yield openai.api_base
+    server.shutdown()
+
+
+def test_respond_request_body(api_base):
+    """
+    Tests that the request body sent to the API holds the settings, messages and functions.
+    """
+    conversation = Conversation([{"role": "user", "content": "Hello."}])
+    functions = ({"name": "save_file"},)
+    message = LLM().respond(Settings(model="test_model"), conversation, functions)
+    assert message.content == "Hi."
+    assert ChatCompletionHandler.bodies == [
+        {
+            "model": "test_model",
+            "temperature": 1.0,
+            "messages": [{"role": "user", "content": "Hello."}],
+            "functions": [{"name": "save_file"}],
+        }
+    ]
+
+
+def test_api_error():
+    """
+    Tests that failed responses raise the OpenAI client's error for their status, with the API's message.
+    """
+    body = json.dumps({"error": {"message": "Bad n.", "param": "n"}})
+    error = api_error(400, body)
+    assert isinstance(error, openai.error.InvalidRequestError)
+    assert (error.user_message, error.param, error.http_status) == ("Bad n.", "n", 400)
+    error = api_error(429, body, {"Retry-After": "3"})
+    assert isinstance(error, openai.error.RateLimitError)
+    assert error.headers == {"Retry-After": "3"}
+    assert isinstance(
+        api_error(503, "Overloaded."), openai.error.ServiceUnavailableError
+    )
+    assert "Overloaded." in api_error(502, "Overloaded.").user_message
+
+
+def test_semantic_cache(llm, monkeypatch):
+    """
+    Tests that tasks with a semantic cache threshold reuse responses to similar requests, and that other tasks don't.
+    """
+    monkeypatch.setattr(LLM, "semantic_cache", SemanticCache(verify_rate=0.0))
+    with patch.object(
+        LLM, "_create", side_effect=lambda args: mock_response("Cached.")
+    ) as create:
+        settings = Settings(semantic_cache=0.9)
+        first = llm.respond(settings, [{"role": "user", "content": "Hello there."}])
+        second = llm.respond(settings, [{"role": "user", "content": "hello  there"}])
+        assert first is second
+        assert create.call_count == 1
+
+        llm.respond(Settings(), [{"role": "user", "content": "Hello there."}])
+        assert create.call_count == 2
+    assert LLM.semantic_cache.get_metrics()["hits"] == 1
+    assert "semantic_cache" not in Settings(semantic_cache=0.9).to_openai_args()
+
+
+def test_respond_stream(api_base):
+    """
+    Tests that a streamed function call is returned in fragments and that the request asks for a stream.
+    """
+    conversation = Conversation([{"role": "user", "content": "Save a file."}])
+    settings = Settings(model="test_model", stream=True)
+    response = LLM().respond_stream(settings, conversation)
+    assert response.function_name == "save_file"
+    assert list(response.fragments()) == [
+        '{"file_name": "a.txt", ',
+        '"file_contents": "Hi."}',
+    ]
+    assert ChatCompletionHandler.bodies[0]["stream"] is True
+    assert "request_timeout" not in ChatCompletionHandler.bodies[0]
+
+
+def test_stream_holds_endpoint():
+    """
+    Tests that a streamed response keeps its endpoint until it is read, and that an error while reading it counts against the endpoint.
+    """
+    endpoint = Endpoint("a")
+    llm = LLM(EndpointPool([endpoint], failure_threshold=1))
+
+    def chunks(fail: bool):
+        yield "first"
+        if fail:
+            raise openai.error.APIConnectionError("Connection reset.")
+
+    with patch.object(
+        LLM, "_create_at", side_effect=lambda endpoint, args: chunks(args["fail"])
+    ):
+        stream = llm._create({"model": "test_model", "stream": True, "fail": False})
+        assert endpoint.outstanding == 1
+        assert list(stream) == ["first"]
+        assert endpoint.outstanding == 0
+
+        stream = llm._create({"model": "test_model", "stream": True, "fail": True})
+        assert next(stream) == "first"
+        assert endpoint.outstanding == 1
+        with pytest.raises(openai.error.APIConnectionError):
+            next(stream)
+    assert endpoint.outstanding == 0
+    assert endpoint.failures == 1
+    assert endpoint.state == OPEN
+
+
+def mock_choices(*contents: str) -> SimpleNamespace:
+    """
+    Mock a chat completion response with a choice for each content.
+    """
+    return SimpleNamespace(
+        choices=[
+            SimpleNamespace(message=SimpleNamespace(role="assistant", content=content))
+            for content in contents
+        ]
+    )
+
+
+def test_best_of_n(llm):
+    """
+    Tests that n candidates come from one request, that the selector chooses between them, and that the choice is traced.
+    """
+    trace = Trace()
+    with patch.object(
+        LLM, "_create", return_value=mock_choices("Short.", "The longest one.", "Mid.")
+    ) as create:
+        with trace.call():
+            message = llm.respond(
+                Settings(model="n_model", n=3, selector="longest"),
+                [{"role": "user", "content": "Hello."}],
+            )
+    assert message.content == "The longest one."
+    assert create.call_count == 1
+    assert create.call_args.args[0]["n"] == 3
+    record = trace.records[0]
+    assert record["candidates"] == 3
+    assert record["selector"] == "longest"
+    assert record["selected"] == 1
+    assert record["selector_seconds"] >= 0
+    assert "selector" not in Settings(selector="longest").to_openai_args()
+
+
+def test_best_of_n_concurrent(llm, monkeypatch):
+    """
+    Tests that models that return one choice get concurrent requests for the other candidates, and then only concurrent requests.
+    """
+    monkeypatch.setattr(LLM, "_single_choice_models", set())
+    answers = iter(["B", "a", "A", "b", "b", "c"])
+
+    def create(openai_args):
+        time.sleep(0.1)
+        return mock_choices(next(answers))
+
+    settings = Settings(model="single_choice_model", n=3)
+    messages = [{"role": "user", "content": "Pick a letter."}]
+    with patch.object(LLM, "_create", side_effect=create) as mock_create:
+        start = time.monotonic()
+        assert llm.respond(settings, messages).content.lower() == "a"
+        assert LLM._single_choice_models == {"single_choice_model"}
+        assert llm.respond(settings, messages).content == "b"
+        elapsed = time.monotonic() - start
+    assert mock_create.call_count == 6
+    assert all("n" not in call.args[0] for call in mock_create.call_args_list[1:])
+    assert elapsed < 0.5
+
+
+def test_best_of_n_rejected(llm, monkeypatch):
+    """
+    Tests that a model that rejects n gets concurrent requests instead.
+    """
+    monkeypatch.setattr(LLM, "_single_choice_models", set())
+
+    def create(openai_args):
+        if "n" in openai_args:
+            raise openai.error.InvalidRequestError("n is not supported.", "n")
+        return mock_choices("Yes.")
+
+    with patch.object(LLM, "_create", side_effect=create) as mock_create:
+        message = llm.respond(
+            Settings(model="no_n_model", n=2), [{"role": "user", "content": "Hi."}]
+        )
+    assert message.content == "Yes."
+    assert mock_create.call_count == 3
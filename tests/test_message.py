@@ -0,0 +1,89 @@
+"""
+This module contains tests for the Message and Conversation classes.
+"""
+
+import os
+
+from agentflow.message import Conversation, Message, content_length
+
+
+def test_message():
+    """
+    Tests that messages can be read like dicts and converted to dicts.
+    """
+    message = Message(
+        "assistant", None, function_call={"name": "save_file", "arguments": "{}"}
+    )
+    assert message["role"] == "assistant"
+    assert message["content"] is None
+    assert message["function_call"] == {"name": "save_file", "arguments": "{}"}
+    assert message.get("name") is None
+    assert message.to_dict() == {
+        "role": "assistant",
+        "content": None,
+        "function_call": {"name": "save_file", "arguments": "{}"},
+    }
+    function_message = Message("function", "Result.", name="save_file")
+    assert function_message == {
+        "role": "function",
+        "content": "Result.",
+        "name": "save_file",
+    }
+
+
+def test_interned_system_message():
+    """
+    Tests that equal system messages share one string across conversations.
+    """
+    first = Message("system", "".join(["System ", "message."]))
+    second = Message("system", "".join(["System ", "message."]))
+    assert first.content is second.content
+
+
+def test_spilled_content():
+    """
+    Tests that large contents are spilled to disk and read back unchanged.
+    """
+    content = "Large function result é. " * 100
+    conversation = Conversation(spill_threshold=100)
+    conversation.append({"role": "function", "content": content, "name": "get_url"})
+    message = conversation[-1]
+    path = message._content.path
+    assert os.path.exists(path)
+    assert message.content == content
+    assert message.content_length == content_length(message.to_dict())
+
+    # Test that the file is removed once the message is gone
+    del conversation, message
+    assert not os.path.exists(path)
+
+
+def test_spilled_function_call_arguments():
+    """
+    Tests that large function call arguments, such as streamed file contents, are spilled to disk too.
+    """
+    arguments = '{"file_contents": "' + "x" * 100 + '"}'
+    function_call = {"name": "save_file", "arguments": arguments}
+    message = Message(
+        "assistant", None, function_call=function_call, spill_threshold=10
+    )
+    assert message.spilled
+    assert message.function_call == function_call
+    assert not Message("assistant", None, function_call=function_call).spilled
+
+
+def test_conversation():
+    """
+    Tests that conversations hold messages and materialize them as dicts.
+    """
+    conversation = Conversation([{"role": "system", "content": "System message."}])
+    conversation.append(Message("user", "User message."))
+    copy = conversation.copy()
+    copy.append({"role": "assistant", "content": "Assistant message."})
+    assert len(conversation) == 2
+    assert len(copy) == 3
+    assert [message["role"] for message in copy] == ["system", "user", "assistant"]
+    assert conversation.to_dicts() == [
+        {"role": "system", "content": "System message."},
+        {"role": "user", "content": "User message."},
+    ]
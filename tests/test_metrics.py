@@ -0,0 +1,183 @@
+"""
+This module contains tests for live metrics.
+"""
+
+import json
+import os
+import shutil
+import threading
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from tenacity import wait_none
+
+from agentflow import metrics
+from agentflow.flow import Flow
+from agentflow.function import Function
+from agentflow.llm import LLM, Settings
+from agentflow.metrics import Counter, Gauge, Histogram, Registry, serve_metrics
+from agentflow.output import Output
+
+
+def test_counter_across_threads():
+    """
+    Tests that updates from many threads are all counted, by label.
+    """
+    counter = Counter("test_total", "A test counter.", ["kind"])
+
+    def work():
+        for number in range(10000):
+            counter.inc(kind="even" if number % 2 == 0 else "odd")
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.values() == {("even",): 40000, ("odd",): 40000}
+    assert counter.total() == 80000
+
+    gauge = Gauge("test_in_flight", "A test gauge.")
+    gauge.inc(3)
+    gauge.dec()
+    assert gauge.total() == 2
+
+
+def test_histogram():
+    """
+    Tests that histograms count values in buckets and estimate quantiles.
+    """
+    histogram = Histogram("test_seconds", "A test histogram.", buckets=(1, 5))
+    assert histogram.quantile(0.5) is None
+    for value in (0.5, 0.7, 3, 10):
+        histogram.observe(value)
+    assert histogram.values() == {(): [2, 1, 1, 14.2]}
+    assert histogram.quantile(0.5) == 1
+    assert histogram.quantile(0.75) == 5
+    assert histogram.quantile(1) == float("inf")
+    with histogram.time():
+        pass
+    assert histogram.values()[()][0] == 3
+
+
+def test_shards_of_ended_threads_are_retired():
+    """
+    Tests that the shards of threads that have ended are folded into the totals, so many short-lived threads don't grow a metric.
+    """
+    counter = Counter("test_churn_total", "A test counter.", ["kind"])
+    histogram = Histogram("test_churn_seconds", "A test histogram.", buckets=(1,))
+    counter.inc(kind="main")
+
+    def work():
+        counter.inc(kind="thread")
+        histogram.observe(0.5)
+
+    for _ in range(100):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    assert len(counter._shards) == 1
+    assert len(histogram._shards) == 0
+    assert counter.values() == {("main",): 1, ("thread",): 100}
+    assert histogram.values() == {(): [100, 0, 50.0]}
+
+
+def test_render():
+    """
+    Tests that metrics are rendered in Prometheus' text format.
+    """
+    registry = Registry()
+    counter = Counter("test_requests_total", "Requests.", ["model"], registry)
+    histogram = Histogram(
+        "test_latency_seconds", "Latency.", ["model"], registry, buckets=(1,)
+    )
+    counter.inc(2, model='gpt-"4"')
+    histogram.observe(0.5, model="a")
+    histogram.observe(2.5, model="a")
+    assert registry.render() == (
+        "# HELP test_requests_total Requests.\n"
+        "# TYPE test_requests_total counter\n"
+        'test_requests_total{model="gpt-\\"4\\""} 2\n'
+        "# HELP test_latency_seconds Latency.\n"
+        "# TYPE test_latency_seconds histogram\n"
+        'test_latency_seconds_bucket{model="a",le="1"} 1\n'
+        'test_latency_seconds_bucket{model="a",le="+Inf"} 2\n'
+        'test_latency_seconds_sum{model="a"} 3\n'
+        'test_latency_seconds_count{model="a"} 2\n'
+    )
+    with pytest.raises(ValueError):
+        Counter("test_requests_total", "Again.", registry=registry)
+
+
+def test_serve_metrics():
+    """
+    Tests that metrics are served at /metrics.
+    """
+    registry = Registry()
+    Counter("test_served_total", "Served.", registry=registry).inc()
+    server = serve_metrics(0, registry=registry)
+    url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert "test_served_total 1" in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other")
+    finally:
+        server.shutdown()
+
+
+def observations(histogram: Histogram, label: str) -> int:
+    """
+    Count the values a histogram has observed for a label.
+    """
+    return sum(histogram.values().get((label,), [0])[:-1])
+
+
+def test_instrumentation(monkeypatch):
+    """
+    Tests that flows, tasks, LLM requests and retries, functions and output files are measured.
+    """
+    flows = metrics.FLOWS.values().get(("done",), 0)
+    tasks = metrics.TASKS.total()
+    output_bytes = metrics.OUTPUT_BYTES.total()
+
+    with patch("agentflow.flow.LLM") as MockLLM:
+        MockLLM.return_value.respond.return_value = SimpleNamespace(
+            role="assistant", content="Done."
+        )
+        flow = Flow(
+            "test_flow_basic", flows_path=os.path.dirname(os.path.abspath(__file__))
+        )
+        flow.run()
+    assert metrics.FLOWS.values()[("done",)] == flows + 1
+    assert metrics.TASKS.total() == tasks + 3
+    assert metrics.FLOWS_IN_FLIGHT.total() == 0
+    assert metrics.OUTPUT_BYTES.total() > output_bytes
+    shutil.rmtree(flow.output.output_path)
+
+    output = Output("test_metrics_function")
+    arguments = {"file_name": "a.txt", "file_contents": "12345"}
+    saves = observations(metrics.FUNCTION_SECONDS, "save_file")
+    output_bytes = metrics.OUTPUT_BYTES.total()
+    Function("save_file", output).execute(json.dumps(arguments))
+    assert metrics.OUTPUT_BYTES.total() == output_bytes + 5
+    assert observations(metrics.FUNCTION_SECONDS, "save_file") == saves + 1
+    shutil.rmtree(output.output_path)
+
+    monkeypatch.setattr(LLM, "retry_wait", wait_none())
+    retries = metrics.LLM_RETRIES.values().get(("metrics_model",), 0)
+    response = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="Hi."))]
+    )
+    with patch.object(LLM, "_create", side_effect=[ValueError("Failed."), response]):
+        LLM().respond(Settings(model="metrics_model"), [])
+    assert metrics.LLM_RETRIES.values()[("metrics_model",)] == retries + 1
+    assert observations(metrics.LLM_SECONDS, "metrics_model") == 1
+
+    summary = metrics.SummaryReporter().summary()
+    assert summary.startswith("flows_in_flight=0 tasks_per_second=")
+    assert "llm_retries=" in summary and "output_bytes=" in summary
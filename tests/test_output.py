@@ -44,3 +44,14 @@ def test_save():
         ], "JSON file content is incorrect"
 
     shutil.rmtree(output.output_path)
+
+
+def test_unique_output_path():
+    """
+    Tests that runs of the same flow started in the same second get different directories.
+    """
+    first = Output("test_unique_output_path")
+    second = Output("test_unique_output_path")
+    assert first.output_path != second.output_path
+    os.rmdir(first.output_path)
+    os.rmdir(second.output_path)
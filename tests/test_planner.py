@@ -0,0 +1,186 @@
+"""
+This module contains tests for the planner.
+"""
+
+import json
+import os
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from agentflow.planner import (
+    DEFAULT_COMPLETION_TOKENS,
+    DEFAULT_REQUEST_SECONDS,
+    DEFAULT_SECONDS_PER_TOKEN,
+    History,
+    PlannedFlow,
+    Planner,
+)
+from agentflow.serialization import encode_functions
+from agentflow.tokens import estimate_cost
+
+DEFAULT_SECONDS = (
+    DEFAULT_REQUEST_SECONDS + DEFAULT_COMPLETION_TOKENS * DEFAULT_SECONDS_PER_TOKEN
+)
+
+
+@pytest.fixture
+def flows_path(tmp_path):
+    """
+    Get a folder to write test flows to.
+    """
+    return str(tmp_path)
+
+
+def write_flow(flows_path: str, name: str, flow: dict) -> None:
+    """
+    Write a flow's JSON file.
+    """
+    with open(os.path.join(flows_path, f"{name}.json"), "w") as file:
+        json.dump(flow, file)
+
+
+def test_plan_prompt_growth(flows_path):
+    """
+    Tests that each request resends the messages of the tasks before it.
+    """
+    write_flow(
+        flows_path,
+        "growth",
+        {
+            "system_message": "You are helpful.",
+            "tasks": [{"action": "a" * 400, "settings": {"model": "gpt-4"}}] * 3,
+        },
+    )
+    plan = Planner(History(), flows_path).plan("growth")
+    growth = 400 // 4 + DEFAULT_COMPLETION_TOKENS
+    prompts = [(16 + 400) // 4 + growth * index for index in range(3)]
+    assert [task["prompt_tokens"] for task in plan.tasks] == prompts
+    assert plan.requests == 3
+    assert plan.prompt_tokens == sum(prompts)
+    assert plan.completion_tokens == 3 * DEFAULT_COMPLETION_TOKENS
+    assert plan.cost == pytest.approx(
+        estimate_cost("gpt-4", sum(prompts), 3 * DEFAULT_COMPLETION_TOKENS)
+    )
+    assert plan.seconds == pytest.approx(3 * DEFAULT_SECONDS)
+    assert plan.warnings == []
+
+
+def test_plan_function_call(flows_path):
+    """
+    Tests that function definitions are sent with each request, and that a function call adds its result and a second request.
+    """
+    task = {"action": "Save it.", "settings": {"function_call": "save_file"}}
+    write_flow(flows_path, "save", {"tasks": [task]})
+    history = History()
+    history.add_messages(
+        [{"role": "function", "name": "save_file", "content": "a" * 4000}]
+    )
+    planner = Planner(history, flows_path)
+    plan = planner.plan("save")
+    functions_chars = len(
+        encode_functions(PlannedFlow("save", {}, flows_path).functions)
+    )
+    assert plan.requests == 2
+    assert plan.tasks[0]["prompt_tokens"] == (8 + functions_chars) // 4
+    assert (
+        plan.max_prompt_tokens
+        == (8 + functions_chars + DEFAULT_COMPLETION_TOKENS * 4 + 4000) // 4
+    )
+
+    task["settings"]["by_reference"] = True
+    write_flow(flows_path, "save_by_reference", {"tasks": [task]})
+    assert (
+        planner.plan("save_by_reference").max_prompt_tokens
+        < plan.max_prompt_tokens - 500
+    )
+
+
+def test_plan_context_overflow(flows_path):
+    """
+    Tests that requests that don't fit in their model's context window are flagged.
+    """
+    write_flow(
+        flows_path,
+        "overflow",
+        {
+            "tasks": [
+                {"action": "{text}", "settings": {"model": "gpt-4", "max_tokens": 1000}}
+            ]
+        },
+    )
+    planner = Planner(History(), flows_path)
+    plan = planner.plan("overflow", {"text": "a" * 30000})
+    assert plan.warnings == [
+        "Task 1: 7500 prompt tokens and 1000 completion tokens overflow the 8192-token context window of gpt-4."
+    ]
+    assert planner.plan("overflow", {"text": "a" * 20000}).warnings == []
+
+
+def test_plan_control_flow():
+    """
+    Tests that loops over variables run once per item in rounds of their concurrency, that conditions on variables are checked, and that other conditions take their costlier branch.
+    """
+    with patch("agentflow.flow.Function") as MockFunction:
+        MockFunction.side_effect = lambda function_name, output: SimpleNamespace(
+            definition={"name": function_name}
+        )
+        plan = Planner(History(), os.path.dirname(__file__)).plan(
+            "test_flow_with_control_flow",
+            {"topics": '["cats", "dogs", "fish"]', "style": "long"},
+        )
+    assert plan.requests == 1 + 3 * 3 + 1
+    assert plan.seconds == pytest.approx((1 + 3 * 2 + 1) * DEFAULT_SECONDS)
+    runs = {task["task"]: task["runs"] for task in plan.tasks}
+    assert runs == {"1": 1, "2.1": 3, "2.2.1": 3, "3.else.1": 1}
+    assert plan.assumptions == [
+        "Condition 2.2 takes its costlier branch, as it is only known when the flow runs."
+    ]
+
+
+def test_history(tmp_path):
+    """
+    Tests that the history is loaded from earlier runs, by flow and then by model, leaving out failed calls.
+    """
+    run_path = tmp_path / "summarize_2023_01_01_00_00_00_2"
+    run_path.mkdir()
+    (run_path / "trace.json").write_text(
+        json.dumps(
+            [
+                {"model": "gpt-4", "latency": 2.0, "completion_tokens": 50},
+                {"model": "gpt-4", "latency": 4.0, "completion_tokens": 150},
+                {"model": "gpt-4", "latency": 60.0, "error": "Timeout()"},
+            ]
+        )
+    )
+    (run_path / "messages.json").write_text(
+        json.dumps([{"role": "function", "name": "get_url", "content": "a" * 1000}])
+    )
+    history = History.from_outputs(str(tmp_path))
+    assert history.completion_tokens("summarize", "gpt-4") == 100
+    assert history.completion_tokens("other", "gpt-4") == 100
+    assert history.completion_tokens("summarize", "gpt-3.5-turbo") is None
+    assert history.latency("summarize", "gpt-4", 100) == 3.0
+    assert history.latency("summarize", "gpt-4", 200) == pytest.approx(
+        3.0 + 100 * DEFAULT_SECONDS_PER_TOKEN
+    )
+    assert history.result_chars("get_url") == 1000
+
+
+def test_plan_batch(flows_path):
+    """
+    Tests that a batch's wall time is bounded by its workers and rate limit, and that flows that can't be planned are flagged.
+    """
+    write_flow(flows_path, "one", {"tasks": [{"action": "Say {word}."}]})
+    planner = Planner(History(), flows_path)
+    jobs = [("one", {"word": "hi"}), ("one", {"word": "bye"}), ("one", {})]
+    plan = planner.plan_batch(jobs, workers=2)
+    assert plan.flows == 2
+    assert plan.requests == 2
+    assert plan.flow_seconds == pytest.approx(2 * DEFAULT_SECONDS)
+    assert plan.seconds == pytest.approx(DEFAULT_SECONDS)
+    assert plan.warnings == [
+        "Line 3 (one): not planned: Missing variable values for: {'word'}."
+    ]
+    assert planner.plan_batch(jobs, 2, requests_per_minute=1).seconds == 120
@@ -0,0 +1,52 @@
+"""
+This module contains tests for the Prefix class.
+"""
+
+from agentflow.prefix import (
+    Prefix,
+    PrefixStats,
+    canonicalize_functions,
+    dumps_canonical,
+)
+
+
+def test_canonicalize_functions():
+    """
+    Tests that function definitions are deduplicated, ordered by name and shared between equal lists.
+    """
+    first = {"name": "b", "parameters": {"type": "object", "properties": {}}}
+    second = {"parameters": {"properties": {}, "type": "object"}, "name": "a"}
+    functions = canonicalize_functions([first, second, first])
+    assert [function["name"] for function in functions] == ["a", "b"]
+    assert canonicalize_functions([second, first]) is functions
+    assert list(functions[0]) == ["name", "parameters"]
+
+
+def test_prefix_hash():
+    """
+    Tests that the prefix hash only depends on the content of the prefix.
+    """
+    functions = [{"name": "a"}, {"name": "b"}]
+    prefix = Prefix("System message.", functions)
+    assert Prefix("System message.", functions[::-1]).hash == prefix.hash
+    assert Prefix("Other system message.", functions).hash != prefix.hash
+    assert Prefix("System message.", functions[:1]).hash != prefix.hash
+
+
+def test_dumps_canonical():
+    """
+    Tests that equal values serialize to identical bytes.
+    """
+    assert dumps_canonical({"b": 1, "a": [1, "é"]}) == '{"a":[1,"é"],"b":1}'
+
+
+def test_prefix_stats():
+    """
+    Tests that calls reusing a prefix are counted as hits.
+    """
+    stats = PrefixStats()
+    assert not stats.record("a")
+    assert stats.record("a")
+    assert not stats.record("b")
+    assert stats.hits == 1
+    assert stats.hit_rate == 1 / 3
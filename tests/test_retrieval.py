@@ -0,0 +1,140 @@
+"""
+This module contains tests for local document retrieval.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from agentflow.retrieval import (
+    HashingEmbedder,
+    VectorIndex,
+    build_index,
+    chunk_text,
+    get_embedder,
+    open_index,
+    read_corpus,
+)
+
+DOCUMENTS = {
+    "cats.txt": "Cats are small carnivorous mammals that purr and chase mice.",
+    "rockets.md": "Rockets burn propellant to produce thrust and reach orbit.",
+    "baking/bread.html": "<html><body><p>Bread dough rises with yeast before baking in an oven.</p></body></html>",
+}
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    """
+    Write a small corpus to a temporary directory.
+    """
+    for name, text in DOCUMENTS.items():
+        path = tmp_path / "corpus" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+    (tmp_path / "corpus" / "image.png").write_bytes(b"\x89PNG")
+    return str(tmp_path / "corpus")
+
+
+def test_chunk_text():
+    """
+    Tests that chunks are bounded, overlap and end at whitespace.
+    """
+    text = " ".join(f"word{number}" for number in range(300))
+    chunks = chunk_text(text, chunk_size=100, overlap=20)
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert all(chunk.startswith("word") for chunk in chunks)
+    assert chunks[0].split()[-1] in chunks[1]
+    assert "word299" in chunks[-1]
+    assert chunk_text("") == []
+
+
+def test_hashing_embedder():
+    """
+    Tests that hashed embeddings are unit length and similar for texts that share words.
+    """
+    embedder = HashingEmbedder(64)
+    vectors = embedder.embed(
+        ["cats purr", "cats purr loudly", "rockets reach orbit", ""]
+    )
+    assert vectors.shape == (4, 64) and vectors.dtype == np.float32
+    assert np.allclose(np.linalg.norm(vectors[:3], axis=1), 1)
+    assert not vectors[3].any()
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+    assert get_embedder(embedder.to_dict()).dimensions == 64
+    with pytest.raises(ValueError):
+        get_embedder({"name": "unknown"})
+
+
+def test_build_and_search(corpus, tmp_path):
+    """
+    Tests that an index is built from a corpus and that searches return the most relevant chunks with their sources.
+    """
+    index_path = str(tmp_path / "index")
+    assert build_index(read_corpus(corpus), index_path, batch_size=2) == 3
+
+    index = VectorIndex(index_path)
+    assert isinstance(index.embeddings, np.memmap)
+    assert index.embeddings.shape == (3, 256)
+
+    results = index.search("why do cats purr", k=2)
+    assert len(results) == 2
+    assert results[0]["source"] == "cats.txt"
+    assert results[0]["text"] == DOCUMENTS["cats.txt"]
+    assert results[0]["score"] > results[1]["score"]
+
+    bread = index.search("yeast dough", k=1)[0]
+    assert bread["source"] == "baking/bread.html"
+    assert bread["text"] == "Bread dough rises with yeast before baking in an oven."
+    assert len(index.search("anything", k=10)) == 3
+
+
+def test_search_across_blocks(tmp_path, monkeypatch):
+    """
+    Tests that the top chunks are found when the index is scored in several blocks.
+    """
+    monkeypatch.setattr("agentflow.retrieval.BLOCK_ROWS", 4)
+    documents = [
+        (f"{number}.txt", f"topic{number} filler text") for number in range(30)
+    ]
+    index_path = str(tmp_path / "index")
+    build_index(documents, index_path)
+    results = open_index(index_path).search("topic17", k=3)
+    assert results[0]["source"] == "17.txt"
+    assert len(results) == 3
+
+
+def test_open_index_is_cached_until_rebuilt(corpus, tmp_path):
+    """
+    Tests that an index is opened once and reopened after it is rebuilt.
+    """
+    index_path = str(tmp_path / "index")
+    build_index(read_corpus(corpus), index_path)
+    index = open_index(index_path)
+    assert open_index(index_path) is index
+    build_index([("one.txt", "Just one document.")], index_path)
+    assert open_index(index_path).count == 1
+
+
+def test_rebuild_keeps_open_index_readable(corpus, tmp_path):
+    """
+    Tests that rebuilding an index replaces its directory instead of truncating its files, so an index that is already open can still be searched, and that a failed build leaves the index as it was.
+    """
+    indexes_path = tmp_path / "indexes"
+    index_path = str(indexes_path / "index")
+    build_index(read_corpus(corpus), index_path)
+    index = open_index(index_path)
+    expected = index.search("cats", k=2)
+    build_index([("one.txt", "Just one document.")], index_path)
+    assert index.search("cats", k=2) == expected
+    assert os.listdir(indexes_path) == ["index"]
+
+    def failing_documents():
+        yield "two.txt", "Another document."
+        raise ValueError("Unreadable.")
+
+    with pytest.raises(ValueError):
+        build_index(failing_documents(), index_path)
+    assert open_index(index_path).count == 1
+    assert os.listdir(indexes_path) == ["index"]
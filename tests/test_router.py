@@ -0,0 +1,98 @@
+"""
+This module contains tests for the Router class.
+"""
+
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from agentflow.llm import Settings
+from agentflow.router import Router
+
+ROUTES = [
+    {"name": "fast", "models": ["fast_model"], "max_latency_slo": 2.0},
+    {"name": "tagged", "models": ["tagged_model"], "tags": ["extract"]},
+    {
+        "name": "cascade",
+        "models": ["small_model", "large_model"],
+        "max_prompt_tokens": 100,
+        "validator": "json",
+    },
+]
+
+
+def mock_llm(contents: dict) -> MagicMock:
+    """
+    Mock an LLM that answers with the content set for each model.
+    """
+    llm = MagicMock()
+    llm.respond.side_effect = lambda settings, messages, functions=None: (
+        SimpleNamespace(role="assistant", content=contents[settings.model])
+    )
+    return llm
+
+
+def test_select():
+    """
+    Tests that the first matching route is selected.
+    """
+    router = Router(ROUTES)
+    messages = [{"role": "user", "content": "a" * 40}]
+    assert router.select(Settings(latency_slo=1.0), messages).name == "fast"
+    assert router.select(Settings(latency_slo=5.0), messages).name == "cascade"
+    assert router.select(Settings(tags=["extract"]), messages).name == "tagged"
+
+    # Test that no route matches a large prompt without tags or SLO
+    messages = [{"role": "user", "content": "a" * 1000}]
+    assert router.select(Settings(), messages) is None
+
+
+def test_respond_without_routes():
+    """
+    Tests that tasks that match no route use their own settings.
+    """
+    llm = mock_llm({"own_model": "Answer."})
+    settings = Settings(model="own_model")
+    message = Router().respond(llm, settings, [])
+    assert message.content == "Answer."
+    llm.respond.assert_called_once_with(settings, [], None)
+
+
+def test_cascade():
+    """
+    Tests that the stronger model is only called when the validator rejects an answer.
+    """
+    messages = [{"role": "user", "content": "Return JSON."}]
+
+    router = Router(ROUTES)
+    llm = mock_llm({"small_model": '{"ok": true}', "large_model": "{}"})
+    assert router.respond(llm, Settings(), messages).content == '{"ok": true}'
+    assert llm.respond.call_count == 1
+
+    router = Router(ROUTES)
+    llm = mock_llm({"small_model": "Not JSON.", "large_model": "{}"})
+    assert router.respond(llm, Settings(), messages).content == "{}"
+    assert llm.respond.call_count == 2
+
+    metrics = router.get_metrics()["cascade"]
+    assert metrics["calls"] == 2
+    assert metrics["rejections"] == 1
+    assert metrics["escalations"] == 1
+    assert metrics["models"] == {"small_model": 1, "large_model": 1}
+
+
+def test_unknown_validator():
+    """
+    Tests that a ValueError is raised for a route with an unknown validator.
+    """
+    with pytest.raises(ValueError, match="Unknown validator: missing."):
+        Router([{"name": "route", "models": ["model"], "validator": "missing"}])
+
+
+def test_route_without_models():
+    """
+    Tests that a ValueError is raised for a route with no models.
+    """
+    with pytest.raises(ValueError, match="Route empty has no models."):
+        Router([{"name": "empty", "models": []}])
@@ -0,0 +1,170 @@
+"""
+This module contains tests for the Scheduler class.
+"""
+
+import os
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from agentflow.scheduler import Job, Scheduler, estimate_requests, run_flow
+
+
+def run_in_order(jobs: list, **kwargs) -> list:
+    """
+    Run jobs on a scheduler with a single worker, and return the order they ran in.
+    """
+    order = []
+    scheduler = Scheduler(max_workers=1, runner=order.append, **kwargs)
+    for job in jobs:
+        scheduler.submit(job)
+    scheduler.start()
+    scheduler.shutdown()
+    return order
+
+
+def test_priority():
+    """
+    Tests that higher priority jobs run first.
+    """
+    low = Job("low", cost=1)
+    high = Job("high", priority=10, cost=1)
+    assert run_in_order([low, high]) == [high, low]
+
+
+def test_fair_share():
+    """
+    Tests that tenants share the workers in proportion to their weights.
+    """
+    jobs = [Job(f"a{i}", tenant="a", cost=1) for i in range(4)]
+    jobs += [Job(f"b{i}", tenant="b", cost=1) for i in range(4)]
+
+    order = run_in_order(jobs)
+    assert [job.tenant for job in order] == ["a", "b"] * 4
+
+    order = run_in_order(jobs, tenant_weights={"a": 2})
+    assert [job.tenant for job in order][:6] == ["a", "b", "a", "a", "b", "a"]
+
+
+def test_tenant_limit():
+    """
+    Tests that a tenant never runs more than its limit of concurrent jobs.
+    """
+    running = {"a": 0, "b": 0}
+    peak = {"a": 0, "b": 0}
+    lock = threading.Lock()
+
+    def runner(job):
+        with lock:
+            running[job.tenant] += 1
+            peak[job.tenant] = max(peak[job.tenant], running[job.tenant])
+        time.sleep(0.01)
+        with lock:
+            running[job.tenant] -= 1
+
+    jobs = [Job("flow", tenant=tenant, cost=1) for tenant in "ab" * 5]
+    scheduler = Scheduler(max_workers=4, tenant_limits={"a": 1}, runner=runner)
+    scheduler.run(jobs)
+    assert peak["a"] == 1
+    assert peak["b"] > 1
+
+    metrics = scheduler.get_metrics()
+    assert metrics["a"]["completed"] == 5
+    assert metrics["a"]["queued"] == 0
+    assert metrics["a"]["max_wait"] >= metrics["a"]["mean_wait"] > 0
+    assert all(job.done.is_set() for job in jobs)
+
+
+def test_rate_budget():
+    """
+    Tests that jobs wait for the rate budget to cover their cost.
+    """
+    jobs = [Job("flow", cost=1) for _ in range(3)]
+    start = time.monotonic()
+    Scheduler(max_workers=3, requests_per_minute=120, runner=lambda job: None).run(jobs)
+    # The budget starts full at 120 requests, so no job should wait.
+    assert time.monotonic() - start < 0.5
+
+    jobs = [Job("flow", cost=120) for _ in range(2)]
+    scheduler = Scheduler(
+        max_workers=2, requests_per_minute=120, runner=lambda job: None
+    )
+    scheduler.start()
+    for job in jobs:
+        scheduler.submit(job)
+    jobs[0].done.wait()
+    time.sleep(0.2)
+    # The second job needs a full minute of budget, so it is still queued.
+    assert not jobs[1].done.is_set()
+    assert scheduler.get_metrics()["default"]["queued"] == 1
+    scheduler.shutdown(wait=False)
+
+
+def test_failed_job():
+    """
+    Tests that a failing job is recorded without stopping the scheduler.
+    """
+
+    def runner(job):
+        if job.flow_name == "failing":
+            raise ValueError("Failed.")
+
+    jobs = [Job("failing", cost=1), Job("working", cost=1)]
+    scheduler = Scheduler(runner=runner)
+    scheduler.run(jobs)
+    assert isinstance(jobs[0].error, ValueError)
+    assert jobs[1].error is None
+    assert scheduler.get_metrics()["default"]["failed"] == 1
+    assert scheduler.get_metrics()["default"]["completed"] == 1
+
+
+def test_run_flow_raises_flow_error():
+    """
+    Tests that a flow that fails fails its job, even though the flow keeps its error rather than raising it.
+    """
+    error = ValueError("Flow failed.")
+    with patch("agentflow.scheduler.Flow") as MockFlow:
+        MockFlow.return_value.error = error
+        jobs = [Job("failing", cost=1)]
+        scheduler = Scheduler(runner=run_flow)
+        scheduler.run(jobs)
+    assert MockFlow.return_value.run.call_count == 1
+    assert jobs[0].error is error
+    assert scheduler.get_metrics()["default"]["failed"] == 1
+
+
+@pytest.fixture
+def mock_functions():
+    """
+    Mock the functions of the test flows, which only exist as names.
+    """
+    with patch("agentflow.flow.Function") as MockFunction:
+        MockFunction.side_effect = lambda function_name, output: SimpleNamespace(
+            definition={"name": function_name}
+        )
+        yield
+
+
+def test_estimate_requests(mock_functions):
+    """
+    Tests that each task and each function call follow-up counts as a request.
+    """
+    flows_path = os.path.dirname(os.path.abspath(__file__))
+    assert estimate_requests("test_flow_basic", flows_path) == 3
+    assert estimate_requests("test_flow_with_functions", flows_path) == 5
+
+
+def test_estimate_requests_with_loop(mock_functions):
+    """
+    Tests that the tasks of a loop count once per item, and that a flow whose variables are missing counts as one request.
+    """
+    flows_path = os.path.dirname(os.path.abspath(__file__))
+    variables = {"topics": '["cats", "dogs", "fish"]', "style": "long"}
+    assert (
+        estimate_requests("test_flow_with_control_flow", flows_path, variables)
+        == 1 + 3 * 3 + 1
+    )
+    assert estimate_requests("test_flow_with_control_flow", flows_path) == 1
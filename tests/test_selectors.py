@@ -0,0 +1,111 @@
+"""
+This module contains tests for choosing between candidate responses.
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from agentflow.flow import Flow
+from agentflow.selectors import (
+    JudgeSelector,
+    LongestSelector,
+    MajoritySelector,
+    ValidatorSelector,
+    get_selector,
+)
+
+
+def candidates(*contents: str) -> list:
+    """
+    Mock candidate messages with the given contents.
+    """
+    return [SimpleNamespace(role="assistant", content=content) for content in contents]
+
+
+def is_json(text: str) -> bool:
+    """
+    A validator that checks whether text is valid JSON.
+    """
+    json.loads(text)
+    return True
+
+
+def test_longest():
+    """
+    Tests that the longest candidate is chosen, counting function call arguments.
+    """
+    function_call = SimpleNamespace(
+        role="assistant",
+        content=None,
+        function_call=SimpleNamespace(name="save_file", arguments='{"a": "long"}'),
+    )
+    assert LongestSelector().select(candidates("ab", "abcd", "abc"), [], None) == 1
+    assert LongestSelector().select(candidates("ab") + [function_call], [], None) == 1
+
+
+def test_majority():
+    """
+    Tests that the most common candidate is chosen, ignoring case and whitespace, and that ties go to the earliest.
+    """
+    selector = MajoritySelector()
+    assert selector.select(candidates("Paris", "Lyon", " paris "), [], None) == 0
+    assert selector.select(candidates("A", "B", "b", "a"), [], None) == 0
+    assert selector.select(candidates("x", "y", "Y"), [], None) == 1
+
+
+def test_validator():
+    """
+    Tests that the candidate the validator scores highest is chosen, and that validators are imported from their path.
+    """
+    selector = ValidatorSelector("tests.test_selectors:is_json")
+    assert selector.select(candidates("{oops", '{"a": 1}', "[]"), [], None) == 1
+    scored = ValidatorSelector(len)
+    assert scored.select(candidates("a", "abc"), [], None) == 1
+    with pytest.raises(ValueError):
+        ValidatorSelector("no_function")
+
+
+def test_judge():
+    """
+    Tests that the judge model is shown the request and the candidates, and that its answer chooses the candidate.
+    """
+    requests = []
+
+    class Judge:
+        def respond(self, settings, messages):
+            requests.append((settings, messages))
+            return SimpleNamespace(content=answer)
+
+    messages = [{"role": "user", "content": "Name a color."}]
+    selector = JudgeSelector(model="judge_model")
+    answer = "2"
+    assert selector.select(candidates("Red.", "Blue."), messages, Judge()) == 1
+    settings, judge_messages = requests[0]
+    assert settings.model == "judge_model"
+    assert "Name a color." in judge_messages[1]["content"]
+    assert "Candidate 2:\nBlue." in judge_messages[1]["content"]
+    answer = "Neither."
+    assert selector.select(candidates("Red.", "Blue."), messages, Judge()) == 0
+
+
+def test_get_selector(tmp_path):
+    """
+    Tests that selectors are created from names and dicts, and that flows with unknown selectors, or that stream several candidates, fail to load.
+    """
+    assert isinstance(get_selector("longest"), LongestSelector)
+    judge = get_selector({"name": "judge", "model": "cheap_model"})
+    assert judge.model == "cheap_model"
+    with pytest.raises(ValueError):
+        get_selector("unknown")
+
+    flow = {"tasks": [{"action": "Hi.", "settings": {"n": 3, "selector": "best"}}]}
+    (tmp_path / "bad_selector.json").write_text(json.dumps(flow))
+    with pytest.raises(ValueError):
+        Flow("bad_selector", flows_path=str(tmp_path))
+
+    flow = {"tasks": [{"action": "Hi.", "settings": {"n": 3, "stream": True}}]}
+    (tmp_path / "streamed_candidates.json").write_text(json.dumps(flow))
+    with pytest.raises(ValueError, match="can't stream and get 3 candidates"):
+        Flow("streamed_candidates", flows_path=str(tmp_path))
@@ -0,0 +1,130 @@
+"""
+This module contains tests for the SemanticCache class.
+"""
+
+from unittest.mock import patch
+
+from agentflow import semantic_cache
+from agentflow.semantic_cache import Prompt, SemanticCache, cosine, embed, normalize
+
+
+def request(content: str, model: str = "gpt-4") -> dict:
+    """
+    Get the arguments of a request with a system message and a user message.
+    """
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": "Summarize pages."},
+            {"role": "user", "content": content},
+        ],
+    }
+
+
+def prompt(content: str, model: str = "gpt-4") -> Prompt:
+    """
+    Get the prompt of a request with a system message and a user message.
+    """
+    return SemanticCache.prompt(request(content, model))
+
+
+def answer(content: str) -> dict:
+    """
+    Get a response message.
+    """
+    return {"role": "assistant", "content": content}
+
+
+def test_normalize_and_embed():
+    """
+    Test that trivial differences normalize away and that similar texts have similar vectors.
+    """
+    assert normalize("  Hello\n\tWORLD ") == "hello world"
+    a = embed(normalize("Summarize https://example.com/page?id=1"))
+    b = embed(normalize("Summarize https://example.com/page?id=1&utm_source=x"))
+    c = embed(normalize("Write a poem about the sea"))
+    assert abs(cosine(a, a) - 1.0) < 1e-9
+    assert cosine(a, b) > 0.8
+    assert cosine(a, c) < 0.3
+
+
+def test_lookup_and_store():
+    """
+    Test that near-duplicate requests hit, and that other requests or other settings miss.
+    """
+    cache = SemanticCache(verify_rate=0.0)
+    assert cache.lookup(prompt("Summarize https://example.com/a?x=1"), 0.8) is None
+    cache.store(prompt("Summarize https://example.com/a?x=1"), answer("Summary of a."))
+
+    assert cache.lookup(prompt("summarize  https://example.com/a?x=1"), 1.0) == (
+        answer("Summary of a."),
+        False,
+    )
+    assert cache.lookup(prompt("Summarize https://example.com/a?x=1&y=2"), 0.8) == (
+        answer("Summary of a."),
+        False,
+    )
+    assert cache.lookup(prompt("Summarize https://example.com/a?x=1&y=2"), 0.99) is None
+    assert (
+        cache.lookup(prompt("Summarize https://example.com/a?x=1", "other"), 0.8)
+        is None
+    )
+
+    metrics = cache.get_metrics()
+    assert metrics["hits"] == 2
+    assert metrics["misses"] == 3
+    assert metrics["entries"] == 1
+
+
+def test_eviction():
+    """
+    Test that the least recently used entries are evicted.
+    """
+    cache = SemanticCache(max_entries=2, verify_rate=0.0)
+    for content in ("first", "second", "third"):
+        cache.store(prompt(content), answer(content))
+    assert cache.lookup(prompt("first"), 1.0) is None
+    assert cache.lookup(prompt("third"), 1.0) == (answer("third"), False)
+    assert cache.get_metrics()["entries"] == 2
+
+
+def test_verification():
+    """
+    Test that verified hits record false hits and replace the cached response.
+    """
+    cache = SemanticCache(verify_rate=1.0)
+    cache.store(prompt("Summarize page a."), answer("Summary of a."))
+    response, verify = cache.lookup(prompt("Summarize page a!"), 0.8)
+    assert verify
+    cache.store(prompt("Summarize page a!"), answer("Summary of a."), response, 0.8)
+    assert cache.get_metrics()["false_hits"] == 0
+
+    response, _ = cache.lookup(prompt("Summarize page a."), 0.8)
+    cache.store(
+        prompt("Summarize page a."), answer("Completely unrelated."), response, 0.8
+    )
+    metrics = cache.get_metrics()
+    assert metrics["verified"] == 2
+    assert metrics["false_hits"] == 1
+    assert cache.lookup(prompt("Summarize page a."), 1.0)[0] == answer(
+        "Completely unrelated."
+    )
+
+
+def test_miss_embeds_once():
+    """
+    Test that the vector embedded to look up a prompt is reused to store its response.
+    """
+    cache = SemanticCache()
+    cache.store(prompt("Summarize page a."), answer("Summary of a."))
+    with patch.object(
+        semantic_cache, "embed", wraps=semantic_cache.embed
+    ) as mock_embed:
+        missed = prompt("Write a poem about the sea.")
+        assert cache.lookup(missed, 0.8) is None
+        cache.store(missed, answer("A poem."))
+    assert mock_embed.call_count == 1
+    assert cache.lookup(prompt("Write a poem about the sea!"), 0.8) == (
+        answer("A poem."),
+        False,
+    )
@@ -0,0 +1,80 @@
+"""
+This module contains tests for the request serializer.
+"""
+
+import json
+from unittest.mock import patch
+
+from agentflow.message import Conversation
+from agentflow.serialization import encode_functions, encode_message, encode_request
+
+
+def test_encode_request():
+    """
+    Tests that the encoded request matches the request serialized as a whole.
+    """
+    conversation = Conversation(
+        [
+            {"role": "system", "content": "System message é."},
+            {"role": "user", "content": "User message."},
+            {
+                "role": "assistant",
+                "content": None,
+                "function_call": {"name": "save_file", "arguments": "{}"},
+            },
+        ]
+    )
+    functions = ({"name": "save_file", "parameters": {"type": "object"}},)
+    openai_args = {
+        "model": "gpt-4",
+        "temperature": 0.5,
+        "request_timeout": 10,
+        "messages": conversation,
+        "functions": functions,
+    }
+    assert json.loads(encode_request(openai_args)) == {
+        "model": "gpt-4",
+        "temperature": 0.5,
+        "messages": conversation.to_dicts(),
+        "functions": list(functions),
+    }
+
+
+def test_cached_encodings():
+    """
+    Tests that message and function encodings are reused, except for spilled contents, including for messages after a spilled one.
+    """
+    conversation = Conversation(spill_threshold=100)
+    conversation.append({"role": "user", "content": "User message."})
+    conversation.append({"role": "function", "content": "a" * 200, "name": "f"})
+    conversation.append({"role": "assistant", "content": "Assistant message."})
+    encoded = encode_request({"model": "gpt-4", "messages": conversation})
+    assert conversation[0]._encoded is not None
+    assert conversation[1]._encoded is None
+    assert conversation._encoded[0] == 3
+    assert conversation._encoded[1][1] is conversation[1]
+
+    # Test that messages after a spilled one stay cached as the conversation grows
+    conversation.append({"role": "user", "content": "Another message."})
+    with patch(
+        "agentflow.serialization.encode_message", wraps=encode_message
+    ) as encode:
+        again = encode_request({"model": "gpt-4", "messages": conversation})
+    assert [call.args[0] for call in encode.call_args_list] == [
+        conversation[3],
+        conversation[1],
+    ]
+    assert json.loads(again)["messages"][:3] == json.loads(encoded)["messages"]
+    assert len(conversation._encoded[1]) == 3
+
+    # Test that the conversation's cache grows with it
+    conversation = Conversation([{"role": "user", "content": "User message."}])
+    first = encode_request({"model": "gpt-4", "messages": conversation})
+    conversation.append({"role": "assistant", "content": "Assistant message."})
+    second = encode_request({"model": "gpt-4", "messages": conversation})
+    assert conversation._encoded[0] == 2
+    assert json.loads(second)["messages"][:1] == json.loads(first)["messages"]
+
+    functions = ({"name": "f"},)
+    assert encode_functions(functions) is encode_functions(functions)
+    assert encode_functions([{"name": "f"}]) == encode_functions(functions)
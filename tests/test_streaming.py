@@ -0,0 +1,141 @@
+"""
+This module contains tests for the ArgumentParser and StreamedResponse classes.
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from agentflow.streaming import ArgumentParser, StreamedResponse
+
+ARGUMENTS = {
+    "text": 'Quotes " and \\ backslashes, \n newlines, é accents and 😀 emoji.',
+    "number": -12.5e3,
+    "flag": True,
+    "nothing": None,
+    "items": [1, "two", {"three": "}3,"}],
+}
+
+
+def parse(fragments):
+    """
+    Parse fragments and rebuild the arguments from the events.
+    """
+    parser = ArgumentParser()
+    arguments, strings = {}, {}
+    for fragment in fragments:
+        for event, name, value in parser.feed(fragment):
+            if event == "start":
+                strings[name] = []
+            elif event == "chunk":
+                strings[name].append(value)
+            elif event == "end":
+                arguments[name] = "".join(strings.pop(name))
+            else:
+                arguments[name] = value
+    parser.close()
+    return arguments
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 1000])
+def test_parse_fragments(ensure_ascii, size):
+    """
+    Test that arguments are parsed the same whatever their fragments, including escapes and surrogate pairs split across fragments.
+    """
+    text = json.dumps(ARGUMENTS, ensure_ascii=ensure_ascii, indent=1)
+    fragments = [text[i : i + size] for i in range(0, len(text), size)]
+    assert parse(fragments) == ARGUMENTS
+
+
+def test_parse_streams_strings():
+    """
+    Test that string arguments are returned in chunks before they are complete.
+    """
+    parser = ArgumentParser()
+    assert parser.feed('{"text": "Hello') == [
+        ("start", "text", None),
+        ("chunk", "text", "Hello"),
+    ]
+    assert parser.feed(' world"}') == [
+        ("chunk", "text", " world"),
+        ("end", "text", None),
+    ]
+    parser.close()
+
+
+@pytest.mark.parametrize("text", ['{"a" 1}', '["a"]', '{"a": 1} x', '{"a": tru}'])
+def test_parse_invalid(text):
+    """
+    Test that invalid arguments raise a ValueError.
+    """
+    with pytest.raises(ValueError):
+        parse([text])
+
+
+def test_parse_incomplete():
+    """
+    Test that closing incomplete arguments raises a ValueError.
+    """
+    parser = ArgumentParser()
+    parser.feed('{"a": "b"')
+    with pytest.raises(ValueError, match="complete"):
+        parser.close()
+
+
+def chunk(**delta):
+    """
+    Build a chunk of a streamed chat completion.
+    """
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+def test_streamed_response():
+    """
+    Test that a streamed function call is read in fragments and reported once complete, that chunks without choices are skipped and that fragments are only kept when asked.
+    """
+    completed = []
+    response = StreamedResponse(
+        [
+            SimpleNamespace(choices=[]),
+            chunk(role="assistant"),
+            chunk(function_call={"name": "save_file", "arguments": ""}),
+            chunk(function_call={"arguments": '{"a": '}),
+            chunk(function_call={"arguments": "1}"}),
+            chunk(),
+        ],
+        completed.append,
+    )
+    assert response.function_name == "save_file"
+    assert list(response.fragments()) == ['{"a": ', "1}"]
+    assert response.read() == '{"a": 1}'
+    assert completed == [8]
+
+    response = StreamedResponse(
+        [chunk(function_call={"name": "save_file", "arguments": '{"a": '})]
+    )
+    assert list(response.fragments(keep=False)) == ['{"a": ']
+    assert response.text == ""
+    assert response.length == 6
+
+    response = StreamedResponse(
+        [chunk(role="assistant"), chunk(content="Hi"), chunk(content=".")]
+    )
+    assert response.function_name is None
+    assert response.read() == "Hi."
+
+
+def test_streamed_response_error():
+    """
+    Test that an error that ends the stream is kept.
+    """
+
+    def chunks():
+        yield chunk(function_call={"name": "save_file", "arguments": '{"a": '})
+        raise ConnectionError("Stream closed.")
+
+    response = StreamedResponse(chunks())
+    with pytest.raises(ConnectionError):
+        list(response.fragments())
+    assert isinstance(response.error, ConnectionError)
@@ -0,0 +1,66 @@
+"""
+This module contains tests for the Template class.
+"""
+
+import pytest
+
+from agentflow.template import Template, compile_template
+
+
+def test_template_variables_and_render():
+    """
+    Test that a template finds its variables and renders them in place.
+    """
+    template = Template("Hello {name}, you are {age}. {name}!")
+    assert template.variables == {"name", "age"}
+    assert template.render({"name": "Ada", "age": 36}) == "Hello Ada, you are 36. Ada!"
+
+
+def test_template_escapes():
+    """
+    Test that doubled braces are literal braces, and that braces in values are kept.
+    """
+    template = Template("{{literal}} and {{{name}}} in }}{{")
+    assert template.variables == {"name"}
+    assert template.render({"name": "{{value}}"}) == "{literal} and {{{value}}} in }{"
+
+
+def test_template_without_variables():
+    """
+    Test that a template without variables renders to its text.
+    """
+    assert Template("").render({}) == ""
+    assert Template("Plain text.").render({"unused": "value"}) == "Plain text."
+
+
+def test_template_matches_str_format():
+    """
+    Test that templates render as str.format does for the flows' syntax.
+    """
+    source = "System {a} with {{b}} and {c}{a}."
+    variables = {"a": "1", "c": "3"}
+    assert Template(source).render(variables) == source.format(**variables)
+
+
+@pytest.mark.parametrize("source", ["{", "}", "a {b", "a } b", "{}", "{a{b}"])
+def test_template_invalid(source):
+    """
+    Test that unbalanced or empty braces are rejected when compiling.
+    """
+    with pytest.raises(ValueError):
+        Template(source)
+
+
+def test_template_missing_variable():
+    """
+    Test that rendering without a variable's value raises a KeyError.
+    """
+    with pytest.raises(KeyError):
+        Template("{name}").render({})
+
+
+def test_compile_template_is_cached():
+    """
+    Test that compiling the same text twice returns the same template.
+    """
+    assert compile_template("Cached {value}.") is compile_template("Cached {value}.")
@@ -0,0 +1,33 @@
+"""
+This module contains tests for the token estimation helpers.
+"""
+
+from agentflow.tokens import context_window, estimate_cost, estimate_tokens
+
+
+def test_estimate_tokens():
+    """
+    Tests that prompt tokens include messages and function definitions.
+    """
+    messages = [{"role": "user", "content": "a" * 400}, {"role": "assistant"}]
+    assert estimate_tokens(messages) == 100
+    assert estimate_tokens(messages, [{"name": "f"}]) > 100
+
+
+def test_estimate_cost():
+    """
+    Tests that costs use the model's prices, including for dated snapshots.
+    """
+    assert estimate_cost("gpt-4", 1000, 1000) == 0.09
+    assert estimate_cost("gpt-4-0613", 1000, 1000) == 0.09
+    assert estimate_cost("gpt-4-32k-0613", 1000, 0) == 0.06
+    assert estimate_cost("unknown_model", 1000, 1000) == 0.0
+
+
+def test_context_window():
+    """
+    Tests that context windows match dated snapshots, and that unknown models have none.
+    """
+    assert context_window("gpt-4-0613") == 8192
+    assert context_window("gpt-3.5-turbo-16k-0613") == 16384
+    assert context_window("unknown_model") is None
@@ -0,0 +1,34 @@
+"""
+This module contains tests for the Trace class.
+"""
+
+import pytest
+
+from agentflow.trace import Trace, annotate
+
+
+def test_call():
+    """
+    Tests that calls are recorded with their fields, annotations and latency.
+    """
+    trace = Trace()
+    with trace.call(model="model"):
+        annotate(route="route")
+    annotate(ignored=True)
+    assert len(trace.records) == 1
+    record = trace.records[0]
+    assert record["model"] == "model"
+    assert record["route"] == "route"
+    assert record["latency"] >= 0
+    assert "ignored" not in record
+
+
+def test_failed_call():
+    """
+    Tests that failed calls are recorded with their error.
+    """
+    trace = Trace()
+    with pytest.raises(ValueError):
+        with trace.call(model="model"):
+            raise ValueError("Failed.")
+    assert trace.records[0]["error"] == "ValueError('Failed.')"
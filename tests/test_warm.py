@@ -0,0 +1,69 @@
+"""
+This module contains tests for the warm pool and flow definition caching.
+"""
+
+import json
+import os
+import shutil
+from unittest.mock import patch
+
+from agentflow.flow import load_flow_spec
+from agentflow.llm import LLM
+from agentflow.template import compile_template
+from agentflow.warm import WarmPool, warm_flow
+from tests.test_flow import mock_llm_respond
+
+FLOWS_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_load_flow_spec_is_cached_until_changed(tmp_path):
+    """
+    Tests that a flow's definition is parsed once, and again after its file changes.
+    """
+    file_path = str(tmp_path / "flow.json")
+    with open(file_path, "w") as file:
+        json.dump({"tasks": [{"action": "First."}]}, file)
+    first = load_flow_spec(file_path)
+    assert load_flow_spec(file_path) is first
+
+    with open(file_path, "w") as file:
+        json.dump({"tasks": [{"action": "Second."}]}, file)
+    os.utime(file_path, ns=(0, os.stat(file_path).st_mtime_ns + 1))
+    assert load_flow_spec(file_path)["tasks"][0]["action"] == "Second."
+
+
+def test_load_environment_once(monkeypatch):
+    """
+    Tests that the .env file is only read for the first LLM instance.
+    """
+    monkeypatch.setattr(LLM, "_environment_loaded", False)
+    with patch("agentflow.llm.load_dotenv") as load_dotenv:
+        LLM()
+        LLM()
+    assert load_dotenv.call_count == 1
+
+
+def test_warm_flow_compiles_messages():
+    """
+    Tests that warming a flow compiles the templates of its messages.
+    """
+    compile_template.cache_clear()
+    warm_flow("test_flow_with_variables", FLOWS_PATH)
+    assert compile_template.cache_info().currsize == 3
+
+
+def test_warm_pool_runs_flows():
+    """
+    Tests that a warm pool runs flows on its threads.
+    """
+    with patch("agentflow.flow.LLM") as MockLLM:
+        MockLLM.return_value.respond.side_effect = mock_llm_respond
+        with WarmPool(["test_flow_basic"], FLOWS_PATH, preconnect=False) as pool:
+            assert pool.get_metrics()["startup_seconds"] is not None
+            flows = [pool.submit("test_flow_basic") for _ in range(3)]
+            flows = [future.result() for future in flows]
+
+    for flow in flows:
+        assert flow.error is None
+        assert flow.messages[-1].content == "Response to user message Task 3 action.."
+        shutil.rmtree(flow.output.output_path)